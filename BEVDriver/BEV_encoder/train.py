@@ -1383,31 +1383,6 @@ def retransform(data):
     return data
 
 
-def traffic_iou(output, target):
-    ''' Args: 
-    Excpecting shapes torch.Size([1,20,20])
-
-    output: Prediction, clip(output[0][0],0,1).view(1,20,20,7)[:,:,:,0]
-    target: Ground Truth, target[1][0]
-    
-    Returns float (IoU value)
-    '''
-
-    # convert probabilities to binary values
-    prediction = (output > 0.5).bool()
-    target = (target > 0.5).bool()
-
-    intersection = torch.sum(prediction & target).float()
-    union = torch.sum(prediction | target).float()
-
-    if union == 0.0:
-        return 0.0
-    
-    iou = intersection / union 
-
-    return iou.item()
-
-
 def semantic_iou(output, target):
     ''' Args: 
     Excpecting shapes torch.Size([1,224,224])
@@ -1429,13 +1404,6 @@ def semantic_iou(output, target):
     iou_per_class = torch.zeros(num_classes, dtype=torch.float32)
     weighted_classes = torch.zeros(num_classes, dtype=torch.float32)
 
-
-    #print("\nClass distribution:")
-    for c in range(num_classes):
-        pred_count = (pred == c).sum().item()
-        target_count = (target == c).sum().item()
-
-
     # iterate over classes
     for c in range(1, num_classes+1):
         pred_c = (pred == c)
@@ -1516,16 +1484,28 @@ def train_one_epoch(
     second_order = hasattr(optimizer, "is_second_order") and optimizer.is_second_order
     batch_time_m = AverageMeter()
     data_time_m = AverageMeter()
-    losses_m = AverageMeter()
-    losses_traffic = AverageMeter()
-    losses_velocity = AverageMeter()
-    losses_seg = AverageMeter()
-    losses_embeddings = AverageMeter()
-    losses_traffic_light_state = AverageMeter()
-    traffic_iou_m = AverageMeter()
-    semantic_iou_m = AverageMeter() #averaged over all classes (old version)
-    semantic_iou_m_valid = AverageMeter() #only classes with valid pixels, unweighted (excluding not present classes)
-    semantic_iou_m_weighted = AverageMeter() #weighted by number of pixels in each class
+    # losses and IoUs are summed on the device and read once per log interval (sync_meters)
+    losses_m = DeviceAverageMeter()
+    losses_traffic = DeviceAverageMeter()
+    losses_velocity = DeviceAverageMeter()
+    losses_seg = DeviceAverageMeter()
+    losses_embeddings = DeviceAverageMeter()
+    losses_traffic_light_state = DeviceAverageMeter()
+    traffic_iou_m = DeviceAverageMeter()
+    semantic_iou_m = DeviceAverageMeter() #averaged over all classes (old version)
+    semantic_iou_m_valid = DeviceAverageMeter() #only classes with valid pixels, unweighted (excluding not present classes)
+    semantic_iou_m_weighted = DeviceAverageMeter() #weighted by number of pixels in each class
+    device_meters = [
+        losses_m,
+        losses_traffic,
+        losses_seg,
+        losses_embeddings,
+        losses_traffic_light_state,
+        traffic_iou_m,
+        semantic_iou_m,
+        semantic_iou_m_valid,
+        semantic_iou_m_weighted,
+    ]
 
     with open('BEV_encoder/cityscapes_dict.json', 'r') as f:
         cityscapes_dict = json.load(f)
@@ -1614,30 +1594,19 @@ def train_one_epoch(
 
             traffic_pred = torch.clip(output[0][0], 0, 1).view(1, 20, 20, 7)[:, :, :, 0]
             traffic_target = target[1][0].view(1, 20, 20, 7)[:, :, :, 0]
-            batch_traffic_iou = traffic_iou(traffic_pred, traffic_target)
-            traffic_iou_m.update(batch_traffic_iou, batch_size)
-
-            if valid_mask.sum() > 0:  
-                batch_semantic_ious, batch_weighted_classes = semantic_iou(semantic_pred, semantic_target)
-                semantic_iou_m.update(batch_semantic_ious.mean().item(), batch_size)
+            traffic_iou_m.update(binary_iou(traffic_pred, traffic_target), batch_size)
 
-                valid_classes = batch_weighted_classes > 0 
-                if valid_classes.sum() > 0:  
-                    valid_ious = batch_semantic_ious[valid_classes]
-                    semantic_iou_m_valid.update(valid_ious.mean().item(), batch_size)
-                else:
-                    semantic_iou_m_valid.update(0.0, batch_size)  
-                
-                if batch_weighted_classes.sum() > 0:
-                    weighted_mean = (batch_semantic_ious * batch_weighted_classes).sum() / batch_weighted_classes.sum()
-                    semantic_iou_m_weighted.update(weighted_mean.item(), batch_size)
-                else:
-                    semantic_iou_m_weighted.update(0.0, batch_size) 
+            # mean, valid and weighted semantic IoU of the batch, the values of semantic_iou
+            batch_semantic_ious = semantic_iou_stats(semantic_pred, semantic_target, output[6].size(1))
+            has_embeddings = valid_mask.any()
+            semantic_iou_m.update(batch_semantic_ious[0], batch_size, valid=has_embeddings)
+            semantic_iou_m_valid.update(batch_semantic_ious[1], batch_size, valid=has_embeddings)
+            semantic_iou_m_weighted.update(batch_semantic_ious[2], batch_size, valid=has_embeddings)
 
 
         if not args.distributed:
-            losses_traffic.update(loss_traffic.item(), batch_size)
-            losses_m.update(loss.item(), batch_size)
+            losses_traffic.update(loss_traffic, batch_size)
+            losses_m.update(loss, batch_size)
 
         optimizer.zero_grad()
         if loss_scaler is not None:
@@ -1664,33 +1633,40 @@ def train_one_epoch(
         if model_ema is not None:
             model_ema.update(model)
 
-        torch.cuda.synchronize()
         num_updates += 1
+        log_step = last_batch or batch_idx % args.log_interval == 0
+        if log_step:
+            # the steps in between only queue their work, the wait for it is timed here
+            torch.cuda.synchronize()
         batch_time_m.update(time.time() - end)
-        if last_batch or batch_idx % args.log_interval == 0:
+        if log_step:
             lrl = [param_group["lr"] for param_group in optimizer.param_groups]
             lr = sum(lrl) / len(lrl)
 
             if args.distributed:
                 reduced_loss = reduce_tensor(loss.data, args.world_size)
-                losses_m.update(reduced_loss.item(), batch_size)
+                losses_m.update(reduced_loss, batch_size)
                 reduced_loss_traffic = reduce_tensor(loss_traffic.data, args.world_size)
-                losses_traffic.update(reduced_loss_traffic.item(), batch_size)
+                losses_traffic.update(reduced_loss_traffic, batch_size)
         
                 reduced_loss_seg = reduce_tensor(
                     loss_semantic.data, args.world_size
                 )
-                losses_seg.update(reduced_loss_seg.item(), batch_size)
+                losses_seg.update(reduced_loss_seg, batch_size)
             
-                losses_embeddings.update(loss_embeddings.item(), batch_size)
+                losses_embeddings.update(loss_embeddings, batch_size)
                 reduced_losses_embeddings = reduce_tensor(loss_embeddings.data, args.world_size)
                 
                 reduced_loss_traffic_light_state = reduce_tensor(
                     loss_traffic_light_state.data, args.world_size
                 )
                 losses_traffic_light_state.update(
-                    reduced_loss_traffic_light_state.item(), batch_size
+                    reduced_loss_traffic_light_state, batch_size
                 )
+
+            sync_meters(*device_meters)
+
+            if args.distributed:
                 if writer and args.local_rank == 0:
                     writer.add_scalar("train/loss", reduced_loss.item(), num_updates)
                     writer.add_scalar(
@@ -1852,6 +1828,7 @@ def train_one_epoch(
             saver.save_recovery(epoch, batch_idx=batch_idx)
 
         if lr_scheduler is not None:
+            # losses_m.avg as of the last log step, step_update only stores the metric
             lr_scheduler.step_update(num_updates=num_updates, metric=losses_m.avg)
 
         end = time.time()
@@ -1963,7 +1940,7 @@ def validate(
 
             traffic_pred = torch.clip(output[0][0], 0, 1).view(1, 20, 20, 7)[:, :, :, 0]
             traffic_target = target[1][0].view(1, 20, 20, 7)[:, :, :, 0]
-            batch_traffic_iou = traffic_iou(traffic_pred, traffic_target)
+            batch_traffic_iou = binary_iou(traffic_pred, traffic_target).item()
             traffic_iou_m.update(batch_traffic_iou, batch_size)
 
 
@@ -21,13 +21,7 @@ from lavis.common.optims import (
     LinearWarmupStepLRScheduler,
 )
 from lavis.common.utils import now
-
-# imports modules for registration
-from lavis.datasets.builders import *
-from lavis.models import *
-from lavis.processors import *
 from lavis.runners.runner_base import RunnerBase
-from lavis.tasks import *
 
 
 def parse_args():
@@ -0,0 +1,82 @@
+"""
+Waypoint error, memory and LLM throughput of the weight-only quantized LLM against the floating point model.
+
+Loads the model of a deploy file (export_deploy_model.py, LoRA merged) once as the reference and once per
+weight format with quantize_llm, runs them on the same held-out clips of a carla_voice dataset root and
+prints per model the mean waypoint L1 to the ground truth and to the reference, the size of the model and
+of its LLM and the LLM tokens/s (prefill of the clip's frames and instruction).
+
+python evaluate_quantization.py --deploy-model bevdriver.safetensors --dataset-root /path/to/val_root --clips 100
+"""
+
+import random
+import argparse
+
+import numpy as np
+import torch
+
+from lavis.datasets.datasets.carla_dataset_llm import CarlaVoiceDataset
+from lavis.models.drive_models.deploy import load_deploy_model
+from lavis.models.drive_models.quantize import WEIGHT_FORMATS, compare_waypoints, quantize_llm
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Quantized LLM evaluation")
+
+    parser.add_argument("--deploy-model", required=True, help="deploy file of export_deploy_model.py")
+    parser.add_argument("--dataset-root", required=True, help="carla_voice dataset root of held-out routes")
+    parser.add_argument("--towns", type=int, nargs="+", default=None)
+    parser.add_argument("--weathers", type=int, nargs="+", default=None)
+    parser.add_argument("--clips", type=int, default=100, help="clips evenly spaced over the dataset")
+    parser.add_argument("--formats", nargs="+", default=list(WEIGHT_FORMATS), choices=list(WEIGHT_FORMATS))
+    parser.add_argument("--group-size", type=int, default=None, help="input channels per scale, the format's default if not set")
+    parser.add_argument("--clip-search", action="store_true", help="search the clipping ratio of every group")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--dtype", choices=["float16", "float32"], default=None,
+                        help="dtype of the LLM, float16 on a GPU and float32 on the CPU by default")
+
+    return parser.parse_args()
+
+
+def load_model(args, dtype, weight_format=None):
+    model = load_deploy_model(args.deploy_model)
+    model.llm_model.to(dtype)
+    summary = None
+    if weight_format is not None:
+        summary = quantize_llm(model, weight_format, args.group_size, args.clip_search)
+    return model.to(args.device), summary
+
+
+def main():
+    args = parse_args()
+    dtype = getattr(torch, args.dtype or ("float16" if args.device.startswith("cuda") else "float32"))
+
+    random.seed(0)
+    np.random.seed(0)
+    dataset = CarlaVoiceDataset(args.dataset_root, towns=args.towns, weathers=args.weathers)
+    indices = np.unique(np.linspace(0, len(dataset) - 1, min(args.clips, len(dataset))).astype(int))
+    clips = []
+    for index in indices:
+        clip = dataset.collater([dataset[int(index)]])
+        clips.append({key: value.to(args.device) if isinstance(value, torch.Tensor) else value for key, value in clip.items()})
+    print("%d clips of %s" % (len(clips), args.dataset_root))
+
+    model, _ = load_model(args, dtype)
+    reference = compare_waypoints(model, clips)
+    del model
+    rows = [(str(dtype).replace("torch.", ""), reference)]
+    for weight_format in args.formats:
+        model, summary = load_model(args, dtype, weight_format)
+        rows.append(("%s g%d" % (weight_format, summary["group_size"]) if summary["group_size"] else weight_format,
+                     compare_waypoints(model, clips, reference["predictions"])))
+        del model
+
+    print("%-10s %10s %12s %10s %10s %10s" % ("model", "L1", "L1 to ref", "model MB", "LLM MB", "tokens/s"))
+    for name, result in rows:
+        print("%-10s %10.4f %12.4f %10.1f %10.1f %10.1f" % (
+            name, result["l1"], result.get("l1_reference", 0.0), result["model_bytes"] / 2 ** 20,
+            result["llm_bytes"] / 2 ** 20, result["tokens_per_second"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Precompute the outputs of the frozen bev encoder for LLM-stage training.
+
+Runs the encoder of a training config once over every frame of every route used by the carla_voice
+splits and writes <route>/<name>.npy (see lavis/datasets/datasets/bev_embedding_store.py).
+Afterwards set `bev_embedding_cache: <name>` for the splits in the config; this is only valid while
+the encoder stays frozen (freeze_vit: True) and its checkpoint does not change, which the model and
+CarlaVoiceDataset check (with the <name>.json written next to every store).
+
+python extract_bev_embeddings.py --cfg-path lavis/projects/bevdriver/train_modular.yaml
+"""
+
+import os
+import argparse
+import logging
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from lavis.common.config import Config
+from lavis.common.logger import setup_logger
+from lavis.datasets.datasets.bev_embedding_store import (
+    BEV_EMBEDDING_NAME,
+    bev_embedding_path,
+    extract_route_embeddings,
+)
+from lavis.datasets.datasets.carla_dataset_llm import CarlaVoiceDataset
+from timm import create_model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="BEV embedding extraction")
+
+    parser.add_argument("--cfg-path", required=True, help="path to the training configuration file.")
+    parser.add_argument("--options", nargs="+", help="override some settings in the config, xxx=yyy format.")
+    parser.add_argument("--splits", nargs="+", default=["train", "val"])
+    parser.add_argument("--name", default=BEV_EMBEDDING_NAME, help="name of the store inside every route")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--float32", action="store_true", help="store float32 instead of float16")
+    parser.add_argument("--overwrite", action="store_true", help="recompute routes that already have a store")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cfg = Config(args)
+    setup_logger()
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    model_cfg = cfg.model_cfg
+    encoder = create_model(model_cfg.encoder_model)
+    if model_cfg.get("load_pretrained", True):
+        pretrain_weights = torch.load(model_cfg.encoder_model_ckpt, map_location=torch.device('cpu'))['state_dict']
+        encoder.load_state_dict(pretrain_weights, strict=False)
+    encoder = encoder.eval().to(device)
+
+    routes = {}
+    annotations = cfg.datasets_cfg.carla_voice.build_info.annotations
+    for split in args.splits:
+        ann = annotations.get(split)
+        dataset = CarlaVoiceDataset(
+            dataset_root=ann.storage,
+            towns=ann.towns,
+            weathers=ann.weathers,
+            scale=ann.scale,
+            token_max_length=ann.token_max_length,
+            input_keys=getattr(encoder, "input_keys", None),
+        )
+        for info in dataset.scenario_infos:
+            routes.setdefault(info['route_path'], (dataset, int(info['route_frames'])))
+
+    # checked by CarlaVoiceDataset against the model it trains
+    meta = {
+        "encoder_model": model_cfg.get("encoder_model", ""),
+        "encoder_model_ckpt": model_cfg.get("encoder_model_ckpt", ""),
+    }
+    skipped = 0
+    for route_path, (dataset, route_frames) in tqdm(sorted(routes.items())):
+        if not args.overwrite and os.path.exists(bev_embedding_path(route_path, args.name)):
+            skipped += 1
+            continue
+        extract_route_embeddings(
+            encoder, dataset, route_path, route_frames,
+            batch_size=args.batch_size,
+            device=device,
+            name=args.name,
+            dtype=np.float32 if args.float32 else np.float16,
+            meta=meta,
+            autocast=device == "cuda",
+        )
+    logging.info("Extracted %d routes, skipped %d existing" % (len(routes) - skipped, skipped))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,11 +11,13 @@ import sys
 from omegaconf import OmegaConf
 
 from lavis.common.registry import registry
+from lavis.common.registry_index import REGISTRY_INDEX
 
-from lavis.datasets.builders import *
-from lavis.models import *
-from lavis.processors import *
-from lavis.tasks import *
+# the builders, models, processors and tasks are imported on their first lookup in the registry
+for kind, modules in REGISTRY_INDEX.items():
+    for module, names in modules.items():
+        for name in names:
+            registry.register_lazy(kind, name, module)
 
 
 root_dir = os.path.dirname(os.path.abspath(__file__))
@@ -5,6 +5,9 @@
  For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
 """
 
+import sys
+import importlib
+
 
 class Registry:
     mapping = {
@@ -17,6 +20,15 @@ class Registry:
         "state": {},
         "paths": {},
     }
+    # names of the *_name_mapping registered by module path, imported on their first lookup
+    lazy_mapping = {
+        "builder_name_mapping": {},
+        "task_name_mapping": {},
+        "processor_name_mapping": {},
+        "model_name_mapping": {},
+        "lr_scheduler_name_mapping": {},
+        "runner_name_mapping": {},
+    }
 
     @classmethod
     def register_builder(cls, name):
@@ -224,57 +236,83 @@ class Registry:
 
         current[path[-1]] = obj
 
+    @classmethod
+    def register_lazy(cls, kind, name, module):
+        r"""Register a name of kind (builder, task, processor, model, lr_scheduler or runner) to be
+        registered by importing module on its first lookup.
+
+        Usage::
+
+            from lavis.common.registry import registry
+
+            registry.register_lazy("model", "vicuna_drive", "lavis.models.drive_models.drive")
+        """
+        cls.lazy_mapping[kind + "_name_mapping"][name] = module
+
+    @classmethod
+    def _get_class(cls, mapping_name, name):
+        mapping = cls.mapping[mapping_name]
+        if name not in mapping and name in cls.lazy_mapping[mapping_name]:
+            importlib.import_module(cls.lazy_mapping[mapping_name][name])
+        return mapping.get(name, None)
+
+    @classmethod
+    def _list_names(cls, mapping_name):
+        for module in sorted(set(cls.lazy_mapping[mapping_name].values())):
+            importlib.import_module(module)
+        return sorted(cls.mapping[mapping_name].keys())
+
     # @classmethod
     # def get_trainer_class(cls, name):
     #     return cls.mapping["trainer_name_mapping"].get(name, None)
 
     @classmethod
     def get_builder_class(cls, name):
-        return cls.mapping["builder_name_mapping"].get(name, None)
+        return cls._get_class("builder_name_mapping", name)
 
     @classmethod
     def get_model_class(cls, name):
-        return cls.mapping["model_name_mapping"].get(name, None)
+        return cls._get_class("model_name_mapping", name)
 
     @classmethod
     def get_task_class(cls, name):
-        return cls.mapping["task_name_mapping"].get(name, None)
+        return cls._get_class("task_name_mapping", name)
 
     @classmethod
     def get_processor_class(cls, name):
-        return cls.mapping["processor_name_mapping"].get(name, None)
+        return cls._get_class("processor_name_mapping", name)
 
     @classmethod
     def get_lr_scheduler_class(cls, name):
-        return cls.mapping["lr_scheduler_name_mapping"].get(name, None)
+        return cls._get_class("lr_scheduler_name_mapping", name)
 
     @classmethod
     def get_runner_class(cls, name):
-        return cls.mapping["runner_name_mapping"].get(name, None)
+        return cls._get_class("runner_name_mapping", name)
 
     @classmethod
     def list_runners(cls):
-        return sorted(cls.mapping["runner_name_mapping"].keys())
+        return cls._list_names("runner_name_mapping")
 
     @classmethod
     def list_models(cls):
-        return sorted(cls.mapping["model_name_mapping"].keys())
+        return cls._list_names("model_name_mapping")
 
     @classmethod
     def list_tasks(cls):
-        return sorted(cls.mapping["task_name_mapping"].keys())
+        return cls._list_names("task_name_mapping")
 
     @classmethod
     def list_processors(cls):
-        return sorted(cls.mapping["processor_name_mapping"].keys())
+        return cls._list_names("processor_name_mapping")
 
     @classmethod
     def list_lr_schedulers(cls):
-        return sorted(cls.mapping["lr_scheduler_name_mapping"].keys())
+        return cls._list_names("lr_scheduler_name_mapping")
 
     @classmethod
     def list_datasets(cls):
-        return sorted(cls.mapping["builder_name_mapping"].keys())
+        return cls._list_names("builder_name_mapping")
 
     @classmethod
     def get_path(cls, name):
@@ -327,3 +365,19 @@ class Registry:
 
 
 registry = Registry()
+
+
+def lazy_module_getattr(package, module_of_name):
+    """
+    Module __getattr__ of a package that imports the module of a name (a dict of name to module path)
+    on first access, in place of importing them all in the package's __init__.
+    """
+
+    def __getattr__(name):
+        if name not in module_of_name:
+            raise AttributeError("module {!r} has no attribute {!r}".format(package, name))
+        value = getattr(importlib.import_module(module_of_name[name]), name)
+        setattr(sys.modules[package], name, value)
+        return value
+
+    return __getattr__
@@ -0,0 +1,92 @@
+"""
+ Copyright (c) 2022, salesforce.com, inc.
+ All rights reserved.
+ SPDX-License-Identifier: BSD-3-Clause
+ For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
+"""
+
+# The modules that register the builders, tasks, processors, models, lr schedulers and runners of the
+# registry, by kind: lavis/__init__.py registers their names with registry.register_lazy, so that a module
+# is imported on the first lookup of one of its names. Add the names of a new registered class here.
+REGISTRY_INDEX = {
+    "builder": {
+        "lavis.datasets.builders.caption_builder": (
+            "coco_caption", "msrvtt_caption", "msvd_caption", "nocaps", "vatex_caption",
+        ),
+        "lavis.datasets.builders.carla_dataset_builder": ("carla_voice",),
+        "lavis.datasets.builders.classification_builder": ("nlvr", "snli_ve"),
+        "lavis.datasets.builders.dialogue_builder": ("avsd_dialogue",),
+        "lavis.datasets.builders.image_text_pair_builder": (
+            "conceptual_caption_12m", "conceptual_caption_3m", "laion2B_multi", "sbu_caption", "vg_caption",
+        ),
+        "lavis.datasets.builders.imagefolder_builder": ("imagenet",),
+        "lavis.datasets.builders.retrieval_builder": (
+            "coco_retrieval", "didemo_retrieval", "flickr30k", "msrvtt_retrieval",
+        ),
+        "lavis.datasets.builders.text_to_image_generation_builder": ("blip_diffusion_finetune",),
+        "lavis.datasets.builders.video_qa_builder": ("msrvtt_qa", "msvd_qa"),
+        "lavis.datasets.builders.vqa_builder": ("aok_vqa", "coco_vqa", "gqa", "ok_vqa", "vg_vqa"),
+    },
+    "task": {
+        "lavis.tasks.captioning": ("captioning",),
+        "lavis.tasks.dialogue": ("dialogue",),
+        "lavis.tasks.drive": ("carla_drive",),
+        "lavis.tasks.image_text_pretrain": ("image_text_pretrain",),
+        "lavis.tasks.multimodal_classification": ("multimodal_classification",),
+        "lavis.tasks.retrieval": ("retrieval",),
+        "lavis.tasks.text_to_image_generation": ("text-to-image-generation",),
+        "lavis.tasks.vqa": ("aok_vqa", "gqa", "vqa"),
+        "lavis.tasks.vqa_reading_comprehension": ("gqa_reading_comprehension", "vqa_reading_comprehension"),
+    },
+    "processor": {
+        "lavis.processors.alpro_processors": ("alpro_video_eval", "alpro_video_train"),
+        "lavis.processors.blip_diffusion_processors": (
+            "blip_diffusion_inp_image_eval",
+            "blip_diffusion_inp_image_train",
+            "blip_diffusion_tgt_image_train",
+        ),
+        "lavis.processors.blip_processors": (
+            "blip2_image_train", "blip_caption", "blip_image_eval", "blip_image_train", "blip_question",
+        ),
+        "lavis.processors.clip_processors": ("clip_image_eval", "clip_image_train"),
+        "lavis.processors.gpt_processors": ("gpt_dialogue", "gpt_video_ft"),
+    },
+    "model": {
+        "lavis.models.albef_models.albef_classification": ("albef_classification",),
+        "lavis.models.albef_models.albef_feature_extractor": ("albef_feature_extractor",),
+        "lavis.models.albef_models.albef_nlvr": ("albef_nlvr",),
+        "lavis.models.albef_models.albef_pretrain": ("albef_pretrain",),
+        "lavis.models.albef_models.albef_retrieval": ("albef_retrieval",),
+        "lavis.models.albef_models.albef_vqa": ("albef_vqa",),
+        "lavis.models.alpro_models.alpro_qa": ("alpro_qa",),
+        "lavis.models.alpro_models.alpro_retrieval": ("alpro_retrieval",),
+        "lavis.models.blip2_models.blip2_image_text_matching": ("blip2_image_text_matching",),
+        "lavis.models.blip2_models.blip2_opt": ("blip2_opt",),
+        "lavis.models.blip2_models.blip2_qformer": ("blip2", "blip2_feature_extractor"),
+        "lavis.models.blip2_models.blip2_t5": ("blip2_t5",),
+        "lavis.models.blip2_models.blip2_t5_instruct": ("blip2_t5_instruct",),
+        "lavis.models.blip2_models.blip2_vicuna_instruct": ("blip2_vicuna_instruct",),
+        "lavis.models.blip_diffusion_models.blip_diffusion": ("blip_diffusion",),
+        "lavis.models.blip_models.blip_caption": ("blip_caption",),
+        "lavis.models.blip_models.blip_classification": ("blip_classification",),
+        "lavis.models.blip_models.blip_feature_extractor": ("blip_feature_extractor",),
+        "lavis.models.blip_models.blip_image_text_matching": ("blip_image_text_matching",),
+        "lavis.models.blip_models.blip_nlvr": ("blip_nlvr",),
+        "lavis.models.blip_models.blip_pretrain": ("blip_pretrain",),
+        "lavis.models.blip_models.blip_retrieval": ("blip_retrieval",),
+        "lavis.models.blip_models.blip_vqa": ("blip_vqa",),
+        "lavis.models.clip_models.model": ("clip", "clip_feature_extractor"),
+        "lavis.models.drive_models.drive": ("vicuna_drive",),
+        "lavis.models.gpt_models.gpt_dialogue": ("gpt_dialogue",),
+        "lavis.models.img2prompt_models.img2prompt_vqa": ("img2prompt_vqa",),
+        "lavis.models.pnp_vqa_models.pnp_unifiedqav2_fid": ("pnp_unifiedqav2_fid",),
+        "lavis.models.pnp_vqa_models.pnp_vqa": ("pnp_vqa",),
+    },
+    "lr_scheduler": {
+        "lavis.common.optims": ("constant_lr", "linear_warmup_cosine_lr", "linear_warmup_step_lr"),
+    },
+    "runner": {
+        "lavis.runners.runner_base": ("runner_base",),
+        "lavis.runners.runner_iter": ("runner_iter",),
+    },
+}
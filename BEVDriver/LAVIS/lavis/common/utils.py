@@ -27,11 +27,6 @@ from iopath.common.file_io import file_lock, g_pathmgr
 from lavis.common.dist_utils import download_cached_file
 from lavis.common.registry import registry
 from torch.utils.model_zoo import tqdm
-from torchvision.datasets.utils import (
-    check_integrity,
-    download_file_from_google_drive,
-    extract_archive,
-)
 
 
 def now():
@@ -180,6 +175,9 @@ def download_url(
                                   If None, use the basename of the URL.
         md5 (str, optional): MD5 checksum of the download. If None, do not check
     """
+    # torchvision is imported by the downloads only, it takes seconds to import
+    from torchvision.datasets.utils import check_integrity, download_file_from_google_drive
+
     root = os.path.expanduser(root)
     if not filename:
         filename = os.path.basename(url)
@@ -228,6 +226,8 @@ def download_and_extract_archive(
     md5: Optional[str] = None,
     remove_finished: bool = False,
 ) -> None:
+    from torchvision.datasets.utils import extract_archive
+
     download_root = os.path.expanduser(download_root)
     if extract_root is None:
         extract_root = download_root
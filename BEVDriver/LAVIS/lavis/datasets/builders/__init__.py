@@ -6,41 +6,36 @@
 """
 
 from lavis.datasets.builders.base_dataset_builder import load_dataset_config
-from lavis.datasets.builders.caption_builder import (
-    COCOCapBuilder,
-    MSRVTTCapBuilder,
-    MSVDCapBuilder,
-    VATEXCapBuilder,
-)
-from lavis.datasets.builders.image_text_pair_builder import (
-    ConceptualCaption12MBuilder,
-    ConceptualCaption3MBuilder,
-    VGCaptionBuilder,
-    SBUCaptionBuilder,
-)
-from lavis.datasets.builders.classification_builder import (
-    NLVRBuilder,
-    SNLIVisualEntailmentBuilder,
-)
-from lavis.datasets.builders.imagefolder_builder import ImageNetBuilder
-from lavis.datasets.builders.video_qa_builder import MSRVTTQABuilder, MSVDQABuilder
-from lavis.datasets.builders.vqa_builder import (
-    COCOVQABuilder,
-    OKVQABuilder,
-    VGVQABuilder,
-    GQABuilder,
-)
-from lavis.datasets.builders.retrieval_builder import (
-    MSRVTTRetrievalBuilder,
-    DiDeMoRetrievalBuilder,
-    COCORetrievalBuilder,
-    Flickr30kBuilder,
-)
-from lavis.datasets.builders.dialogue_builder import AVSDDialBuilder
-from lavis.datasets.builders.text_to_image_generation_builder import BlipDiffusionFinetuneBuilder
-from lavis.datasets.builders.carla_dataset_builder import CarlaDatasetBuilder
-
-from lavis.common.registry import registry
+from lavis.common.registry import lazy_module_getattr, registry
+
+# the builders, imported on first use (the registry imports a builder on its first lookup)
+_module_of_name = {
+    "COCOCapBuilder": "lavis.datasets.builders.caption_builder",
+    "MSRVTTCapBuilder": "lavis.datasets.builders.caption_builder",
+    "MSVDCapBuilder": "lavis.datasets.builders.caption_builder",
+    "VATEXCapBuilder": "lavis.datasets.builders.caption_builder",
+    "ConceptualCaption12MBuilder": "lavis.datasets.builders.image_text_pair_builder",
+    "ConceptualCaption3MBuilder": "lavis.datasets.builders.image_text_pair_builder",
+    "VGCaptionBuilder": "lavis.datasets.builders.image_text_pair_builder",
+    "SBUCaptionBuilder": "lavis.datasets.builders.image_text_pair_builder",
+    "NLVRBuilder": "lavis.datasets.builders.classification_builder",
+    "SNLIVisualEntailmentBuilder": "lavis.datasets.builders.classification_builder",
+    "ImageNetBuilder": "lavis.datasets.builders.imagefolder_builder",
+    "MSRVTTQABuilder": "lavis.datasets.builders.video_qa_builder",
+    "MSVDQABuilder": "lavis.datasets.builders.video_qa_builder",
+    "COCOVQABuilder": "lavis.datasets.builders.vqa_builder",
+    "OKVQABuilder": "lavis.datasets.builders.vqa_builder",
+    "VGVQABuilder": "lavis.datasets.builders.vqa_builder",
+    "GQABuilder": "lavis.datasets.builders.vqa_builder",
+    "MSRVTTRetrievalBuilder": "lavis.datasets.builders.retrieval_builder",
+    "DiDeMoRetrievalBuilder": "lavis.datasets.builders.retrieval_builder",
+    "COCORetrievalBuilder": "lavis.datasets.builders.retrieval_builder",
+    "Flickr30kBuilder": "lavis.datasets.builders.retrieval_builder",
+    "AVSDDialBuilder": "lavis.datasets.builders.dialogue_builder",
+    "BlipDiffusionFinetuneBuilder": "lavis.datasets.builders.text_to_image_generation_builder",
+    "CarlaDatasetBuilder": "lavis.datasets.builders.carla_dataset_builder",
+}
+__getattr__ = lazy_module_getattr(__name__, _module_of_name)
 
 __all__ = [
     "BlipDiffusionFinetuneBuilder",
@@ -110,10 +105,17 @@ def load_dataset(name, cfg_path=None, vis_path=None, data_type=None):
 
 class DatasetZoo:
     def __init__(self) -> None:
-        self.dataset_zoo = {
-            k: list(v.DATASET_CONFIG_DICT.keys())
-            for k, v in sorted(registry.mapping["builder_name_mapping"].items())
-        }
+        self._dataset_zoo = None
+
+    @property
+    def dataset_zoo(self):
+        # imports all builders, on first use
+        if self._dataset_zoo is None:
+            self._dataset_zoo = {
+                k: list(registry.get_builder_class(k).DATASET_CONFIG_DICT.keys())
+                for k in registry.list_datasets()
+            }
+        return self._dataset_zoo
 
     def get_names(self):
         return list(self.dataset_zoo.keys())
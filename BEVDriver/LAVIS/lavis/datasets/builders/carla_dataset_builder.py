@@ -18,6 +18,11 @@ from lavis.datasets.datasets.carla_dataset_llm import CarlaVoiceDataset
 @registry.register_builder("carla_voice")
 class CarlaDatasetBuilder(BaseDatasetBuilder):
     DATASET_CONFIG_DICT = {"default": "configs/datasets/carla/defaults.yaml"}
+    # sensor fields to load, set by DriveTask to the input_keys of the bev encoder (None loads all)
+    input_keys = None
+    # encoder_model and encoder_model_ckpt of the model, set by DriveTask, checked against the bev_embedding_cache
+    bev_embedding_encoder = None
+
     def __init__(self, cfg=None):
         #super().__init__()
         self.config = cfg
@@ -52,6 +57,10 @@ class CarlaDatasetBuilder(BaseDatasetBuilder):
             scale = ann_info.get(split).scale
             enable_start_frame_augment = ann_info.get(split).enable_start_frame_augment
             token_max_length = ann_info.get(split).token_max_length
+            # embeddings precomputed by extract_bev_embeddings.py, only valid with freeze_vit: True
+            bev_embedding_cache = ann_info.get(split).get("bev_embedding_cache", None)
+            # uint8 camera views, resized and normalized on the training device
+            device_preprocessing = ann_info.get(split).get("device_preprocessing", False)
 
             # create datasets
             datasets[split] = CarlaVoiceDataset(
@@ -61,6 +70,10 @@ class CarlaDatasetBuilder(BaseDatasetBuilder):
                 scale=scale,
                 enable_start_frame_augment=enable_start_frame_augment,
                 token_max_length=token_max_length,
+                bev_embedding_cache=bev_embedding_cache,
+                bev_embedding_encoder=self.bev_embedding_encoder,
+                input_keys=self.input_keys,
+                device_preprocessing=device_preprocessing,
             )
 
         return datasets
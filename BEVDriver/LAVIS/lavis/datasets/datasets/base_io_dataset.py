@@ -5,6 +5,7 @@ import logging
 import numpy as np
 from PIL import Image
 import torch
+from timm.data.frame_shard import open_frame_shard
 
 _logger = logging.getLogger(__name__)
 
@@ -53,3 +54,16 @@ class BaseIODataset(torch.utils.data.Dataset):
             new_path = path[:-8] + "%04d.npy" % (int(n) - 1)
             array = np.load(self.root_path + new_path, allow_pickle=True)
         return array
+
+    def _load_rgb_full(self, route_path, frame_id):
+        # served from the route's frames.shard when it has been packed (see timm/data/frame_shard.py)
+        shard = open_frame_shard(self.root_path + route_path)
+        if shard is not None:
+            return shard.image(frame_id)
+        return self._load_image(os.path.join(route_path, "rgb_full", "%04d.jpg" % frame_id))
+
+    def _load_lidar(self, route_path, frame_id):
+        shard = open_frame_shard(self.root_path + route_path)
+        if shard is not None:
+            return shard.lidar(frame_id)
+        return self._load_npy(os.path.join(route_path, "lidar", "%04d.npy" % frame_id))
@@ -0,0 +1,111 @@
+"""
+Per-route store of precomputed BEV encoder outputs for LLM-stage training.
+
+With a frozen bev encoder (freeze_vit=True), its output for a frame never changes, but
+Blip2VicunaDrive.forward recomputes it for every frame of every clip in every epoch, and clips of
+the same route overlap heavily. extract_bev_embeddings.py runs the encoder once per (route, frame)
+and writes <route>/<name>.npy, a [frames, tokens, embed_dim] float16 array, next to a <name>.json
+with the encoder it was computed with. CarlaVoiceDataset(bev_embedding_cache=<name>) then serves
+memory-mapped slices of it instead of camera images and LiDAR.
+"""
+
+import os
+import json
+import logging
+import functools
+
+import numpy as np
+import torch
+
+BEV_EMBEDDING_NAME = "bev_embeddings"
+BEV_EMBEDDING_CACHE_SIZE = 64
+
+
+def bev_embedding_path(route_path, name=BEV_EMBEDDING_NAME):
+    return os.path.join(route_path, name + ".npy")
+
+
+def bev_embedding_meta_path(route_path, name=BEV_EMBEDDING_NAME):
+    return os.path.join(route_path, name + ".json")
+
+
+def check_bev_embeddings(route_path, name, embeddings, route_frames=None, encoder=None):
+    """
+    Raise ValueError unless the store of a route was computed over its route_frames frames with the
+    encoder ((key, value) pairs of its encoder_model and encoder_model_ckpt), as its meta json records.
+    """
+    meta_path = bev_embedding_meta_path(route_path, name)
+    if not os.path.exists(meta_path):
+        raise ValueError("%s has no %s, rerun extract_bev_embeddings.py --overwrite" % (route_path, meta_path))
+    with open(meta_path) as f:
+        meta = json.load(f)
+    mismatches = ["%s %r (expected %r)" % (key, meta.get(key), value) for key, value in encoder or ()
+                  if meta.get(key) != value]
+    if route_frames is not None and not meta.get("frames") == len(embeddings) == route_frames:
+        mismatches.append("frames %r of %d (expected %d)" % (meta.get("frames"), len(embeddings), route_frames))
+    if mismatches:
+        raise ValueError("%s of %s was computed with %s, rerun extract_bev_embeddings.py --overwrite" % (
+            name, route_path, ", ".join(mismatches)))
+
+
+@functools.lru_cache(maxsize=BEV_EMBEDDING_CACHE_SIZE)
+def load_bev_embeddings(route_path, name=BEV_EMBEDDING_NAME, route_frames=None, encoder=None):
+    """
+    Memory-mapped [frames, tokens, embed_dim] embeddings of a route (per-process cache), checked on
+    their first load against the route frames and the encoder if given (see check_bev_embeddings)
+    """
+    embeddings = np.load(bev_embedding_path(route_path, name), mmap_mode="r")
+    if route_frames is not None or encoder is not None:
+        check_bev_embeddings(route_path, name, embeddings, route_frames, encoder)
+    return embeddings
+
+
+def frame_encoder_inputs(dataset, route_path, frame_id, measurements):
+    """
+    Inputs of the bev encoder for a single frame, as CarlaVoiceDataset.__getitem__ builds them
+    """
+    sensor_data = dataset._extract_data_item(route_path, frame_id, measurements[frame_id])
+    inputs = {key: sensor_data[key] for key in ["rgb", "rgb_left", "rgb_right", "rgb_rear", "rgb_center"] if key in sensor_data}
+    if "lidar" in sensor_data:
+        inputs["lidar"] = torch.from_numpy(sensor_data["lidar"])
+    return inputs
+
+
+@torch.no_grad()
+def extract_route_embeddings(encoder, dataset, route_path, route_frames, batch_size=32, device="cpu",
+                             name=BEV_EMBEDDING_NAME, dtype=np.float16, meta=None, autocast=False):
+    """
+    Run the (frozen, eval mode) encoder over every frame of a route and write the store atomically.
+
+    Encoder inputs come from dataset._extract_data_item, so the dataset has to be built with the same
+    transforms as the training dataset. Returns the path of the written array.
+    """
+    from timm.data.carla_measurements import build_clip_labels, load_route_measurements
+
+    measurements = load_route_measurements(route_path)
+    labels = build_clip_labels(measurements, np.arange(route_frames), route_frames, route_frames)
+    path = bev_embedding_path(route_path, name)
+    tmp_path = path + ".tmp.npy"
+    store = None
+    for start in range(0, route_frames, batch_size):
+        frame_ids = range(start, min(route_frames, start + batch_size))
+        frames = [frame_encoder_inputs(dataset, route_path, i, measurements) for i in frame_ids]
+        inputs = {key: torch.stack([f[key] for f in frames]).to(device) for key in frames[0]}
+        inputs["measurements"] = torch.from_numpy(labels["measurements"][frame_ids]).to(device)
+        inputs["target_point"] = torch.from_numpy(labels["target_points"][frame_ids]).float().to(device)
+        with torch.cuda.amp.autocast(enabled=autocast):
+            embeddings = encoder(inputs).float().cpu().numpy()
+        if store is None:
+            store = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=dtype, shape=(route_frames,) + embeddings.shape[1:]
+            )
+        store[start:start + len(embeddings)] = embeddings
+    store.flush()
+    del store
+    os.replace(tmp_path, path)
+
+    meta = dict(meta or {}, frames=route_frames, dtype=np.dtype(dtype).name)
+    with open(bev_embedding_meta_path(route_path, name), "w") as f:
+        json.dump(meta, f)
+    logging.info("Wrote %s" % path)
+    return path
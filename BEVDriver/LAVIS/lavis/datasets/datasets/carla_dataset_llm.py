@@ -13,8 +13,11 @@ from PIL import Image
 from torchvision import transforms
 from torch.utils.data.dataloader import default_collate
 
+from timm.data.carla_measurements import build_clip_labels, load_route_measurements
+from timm.data.lidar_bev import lidar_to_histogram_features, transform_2d_points
 from .base_io_dataset import BaseIODataset
-from .transforms_carla_factory import create_carla_rgb_transform
+from .bev_embedding_store import load_bev_embeddings
+from .transforms_carla_factory import CarlaRgbDeviceTransform, Resize2FixedSize, create_carla_rgb_transform
 
 
 # Taken from the LMDrive Project (OpenDILab)
@@ -27,6 +30,28 @@ INSTRUCTION_DICT = json.load(open(instruction_json))
 
 _logger = logging.getLogger(__name__)
 
+# fields of a sample with one row per frame, padded to the longest clip of a batch by CarlaVoiceDataset.collater
+FRAME_KEYS = [
+    'rgb', 'rgb_left', 'rgb_right', 'rgb_rear', 'rgb_center', 'lidar', 'bev_embeddings',
+    'measurements', 'target_point', 'velocity', 'local_positions', 'local_future_waypoints',
+    'ego_throttles', 'ego_steers', 'ego_brakes',
+]
+
+# sensor fields _extract_data_item can produce, in the order their transforms run
+SENSOR_KEYS = ['lidar', 'rgb', 'rgb_center', 'rgb_left', 'rgb_right', 'rgb_rear']
+
+# views of the rgb_full image, stacked from top to bottom
+RGB_FULL_VIEWS = ['rgb', 'rgb_left', 'rgb_right', 'rgb_rear']
+
+
+def decode_size(transform):
+    """ Smallest (w, h) of a view that transform still downscales, None if it needs the full resolution"""
+    if isinstance(transform, CarlaRgbDeviceTransform):
+        return transform.resize_size
+    if transform is None or not isinstance(transform.transforms[0], Resize2FixedSize):
+        return None
+    return transform.transforms[0].size
+
 def get_yaw_angle(forward_vector):
     forward_vector = forward_vector / np.linalg.norm(forward_vector)
     yaw = math.acos(forward_vector[0])
@@ -44,61 +69,6 @@ def rotate_lidar(lidar, angle):
         [0,0,0,1]
     ]
 
-def lidar_to_histogram_features(lidar, crop=256):
-    """
-    Convert LiDAR point cloud into 2-bin histogram over 256x256 grid
-    """
-
-    def splat_points(point_cloud):
-        # 256 x 256 grid
-        pixels_per_meter = 8
-        hist_max_per_pixel = 5
-        x_meters_max = 14
-        y_meters_max = 28
-        xbins = np.linspace(
-            -2 * x_meters_max,
-            2 * x_meters_max + 1,
-            2 * x_meters_max * pixels_per_meter + 1,
-        )
-        ybins = np.linspace(-y_meters_max, 0, y_meters_max * pixels_per_meter + 1)
-        hist = np.histogramdd(point_cloud[..., :2], bins=(xbins, ybins))[0]
-        hist[hist > hist_max_per_pixel] = hist_max_per_pixel
-        overhead_splat = hist / hist_max_per_pixel
-        return overhead_splat
-
-    below = lidar[lidar[..., 2] <= -2.0]
-    above = lidar[lidar[..., 2] > -2.0]
-    below_features = splat_points(below)
-    above_features = splat_points(above)
-    total_features = below_features + above_features
-    features = np.stack([below_features, above_features, total_features], axis=-1)
-    features = np.transpose(features, (2, 0, 1)).astype(np.float32)
-    return features
-
-def transform_2d_points(xyz, r1, t1_x, t1_y, r2, t2_x, t2_y):
-    """
-    Build a rotation matrix and take the dot product.
-    """
-    # z value to 1 for rotation
-    xy1 = xyz.copy()
-    xy1[:, 2] = 1
-
-    c, s = np.cos(r1), np.sin(r1)
-    r1_to_world = np.matrix([[c, s, t1_x], [-s, c, t1_y], [0, 0, 1]])
-
-    # np.dot converts to a matrix, so we explicitly change it back to an array
-    world = np.asarray(r1_to_world @ xy1.T)
-
-    c, s = np.cos(r2), np.sin(r2)
-    r2_to_world = np.matrix([[c, s, t2_x], [-s, c, t2_y], [0, 0, 1]])
-    world_to_r2 = np.linalg.inv(r2_to_world)
-
-    out = np.asarray(world_to_r2 @ world).T
-    # reset z-coordinate
-    out[:, 2] = xyz[:, 2]
-
-    return out
-
 def lidar_to_raw_features(lidar):
     def preprocess(lidar_xyzr, lidar_painted=None):
 
@@ -163,25 +133,35 @@ class CarlaVoiceDataset(BaseIODataset):
         sample_interval=2,
         enable_start_frame_augment=False,
         enable_notice=False,
+        bev_embedding_cache=None,
+        bev_embedding_encoder=None,
+        input_keys=None,
+        device_preprocessing=False,
         **kwargs,
     ):
         super().__init__()
 
+        # sensor fields of a sample, the ones the bev encoder reads (its input_keys); None loads all of them
+        self.input_keys = [key for key in SENSOR_KEYS if input_keys is None or key in input_keys]
+
         self.input_lidar_size = input_lidar_size
 
         self.token_max_length = token_max_length
-        self.rgb_transform = create_carla_rgb_transform(
+        # uint8 views, resized and normalized as a batch by Blip2VicunaDrive.forward (see CarlaRgbDeviceTransform)
+        self.device_preprocessing = device_preprocessing
+        create_transform = CarlaRgbDeviceTransform if device_preprocessing else create_carla_rgb_transform
+        self.rgb_transform = create_transform(
             input_rgb_size,
             is_training=is_training,
             scale=scale,
         )
-        self.rgb_center_transform = create_carla_rgb_transform(
+        self.rgb_center_transform = create_transform(
             128,
             scale=None,
             is_training=is_training,
             need_scale=False,
         )
-        self.multi_view_transform = create_carla_rgb_transform(
+        self.multi_view_transform = create_transform(
             input_multi_view_size,
             scale=scale,
             is_training=is_training,
@@ -193,6 +173,10 @@ class CarlaVoiceDataset(BaseIODataset):
         self.sample_interval = sample_interval
         self.enable_start_frame_augment = enable_start_frame_augment
         self.enable_notice = enable_notice
+        # name of the per-route embedding store written by extract_bev_embeddings.py, see bev_embedding_store.py
+        self.bev_embedding_cache = bev_embedding_cache
+        # encoder_model and encoder_model_ckpt of the model, the stores have to be computed with them
+        self.bev_embedding_encoder = tuple(sorted(bev_embedding_encoder.items())) if bev_embedding_encoder else None
         if self.enable_notice:
             raw_notice_data = self._load_json(os.path.join(dataset_root, 'notice_instruction_list.json'))
             self.notice_data = {}
@@ -200,7 +184,33 @@ class CarlaVoiceDataset(BaseIODataset):
                 self.notice_data[os.path.join(dataset_root, key)] = raw_notice_data[key]
 
     def collater(self, samples):
-        return default_collate(samples)
+        # pad the frames to the longest clip of the batch instead of token_max_length, the model masks
+        # every frame past valid_frames
+        length = max(sample['valid_frames'] for sample in samples)
+        samples = [
+            {key: self.pad_and_stack(value, length) if key in FRAME_KEYS else value for key, value in sample.items()}
+            for sample in samples
+        ]
+        batch = default_collate(samples)
+        if self.device_preprocessing and self.bev_embedding_cache is None:
+            batch['device_transforms'] = {
+                key: transform for key, transform in self._view_transforms().items() if key in self.input_keys
+            }
+        return batch
+
+    def clip_lengths(self):
+        """
+        valid_frames of every clip without the random start offset of __getitem__ (which shortens a
+        clip by at most one frame, or lengthens it with enable_start_frame_augment), for length grouped
+        batching (LengthGroupedBatchSampler).
+        """
+        lengths = []
+        for info in self.scenario_infos:
+            end_frame = info['end_frame']
+            if 'Turn' in info['instruction']:
+                end_frame = min(int(info['route_frames']) - 1, end_frame + 12)
+            lengths.append(min((end_frame - info['start_frame']) // self.sample_interval + 1, self.token_max_length))
+        return lengths
 
     def _get_scenario_paths(self, dataset_root, weathers, towns):
         scenario_infos = []
@@ -239,22 +249,13 @@ class CarlaVoiceDataset(BaseIODataset):
         return data
     '''
 
-    def pad_and_stack(self, data):
-        if isinstance(data[0], np.ndarray):
-            first_elem_shape = data[0].shape
-            for _ in range(self.token_max_length - len(data)):
-                data.append(np.zeros(first_elem_shape, dtype=data[0].dtype))
-            data = np.stack(data, 0)
-        elif torch.is_tensor(data[0]):
-            first_elem_shape = data[0].shape
-            for _ in range(self.token_max_length - len(data)):
-                data.append(torch.zeros_like(data[0]))
-            data = torch.stack(data, 0)
-        else:
-            for _ in range(self.token_max_length - len(data)):
-                data.append(0)
-            data = np.array(data).reshape(-1)
-        return data
+    def pad_and_stack(self, data, length):
+        # frames of one field of a sample ([frames, ...] array or tensor), zero padded or cut to length
+        if len(data) >= length:
+            return data[:length]
+        if torch.is_tensor(data):
+            return torch.cat([data, data.new_zeros((length - len(data),) + tuple(data.shape[1:]))])
+        return np.concatenate([data, np.zeros((length - len(data),) + data.shape[1:], dtype=data.dtype)])
 
 
     def __getitem__(self, idx):
@@ -296,124 +297,35 @@ class CarlaVoiceDataset(BaseIODataset):
                 notice_frame_id = -1
                 notice_text = ''
 
-        measurements = self._load_json(os.path.join(route_path, "measurements_all.json"))
-        ego_theta = measurements[start_frame_id]['theta']
+        # structured array with one row per frame, cached per worker (see timm/data/carla_measurements.py)
+        measurements = load_route_measurements(route_path)
         processed_data = {}
 
-        if np.isnan(ego_theta):
-            ego_theta = 0
-        R = np.array(
-            [[np.cos(np.pi / 2 + ego_theta), -np.sin(np.pi / 2 + ego_theta)],
-            [np.sin(np.pi / 2 + ego_theta), np.cos(np.pi / 2 + ego_theta)]])
-        origin_x = measurements[start_frame_id]['gps_x']
-        origin_y = measurements[start_frame_id]['gps_y']
-
-
-        ego_throttles = []
-        ego_steers = []
-        ego_brakes = []
-        ego_velocitys = []
-        ego_xs = []
-        ego_ys = []
-        local_positions = []
-        local_future_waypoints = []
-        text_before_img = []
-        text_after_img = []
-        target_points = []
-
-        for frame_id in range(start_frame_id, end_frame_id, sample_interval):
-            ego_x = measurements[frame_id]['gps_x']
-            ego_y = measurements[frame_id]['gps_y']
-            velocity = measurements[frame_id]['speed']
-            local_position = np.array([ego_x - origin_x, ego_y - origin_y])
-            local_position = R.T.dot(local_position)
-            text_before_img.append('<frame %.1f,%.1f>' % (local_position[0], local_position[1]))
-            # text_before_img.append('<frame=%d;x=%.1f;y=%.1f;speed=%.1f>' % (frame_id-start_frame_id, local_position[0], local_position[1], velocity))
-            text_after_img.append('</frame>')
-
-            ego_xs.append(ego_x)
-            ego_ys.append(ego_y)
-            ego_throttles.append(measurements[frame_id]['throttle'])
-            ego_steers.append(measurements[frame_id]['steer'])
-            ego_brakes.append(int(measurements[frame_id]['brake']))
-            ego_velocitys.append(velocity)
-            local_positions.append(local_position.reshape(-1))
-            local_ego_theta = measurements[frame_id]['theta']
-            if np.isnan(local_ego_theta):
-                local_ego_theta = 0
-            local_R = np.array(
-                [[np.cos(np.pi / 2 + local_ego_theta), -np.sin(np.pi / 2 + local_ego_theta)],
-                [np.sin(np.pi / 2 + local_ego_theta), np.cos(np.pi / 2 + local_ego_theta)]])
-
-            x_command = measurements[frame_id]["x_command"]
-            y_command = measurements[frame_id]["y_command"]
-            local_command_point = np.array([x_command - ego_x, y_command - ego_y])
-            local_command_point = local_R.T.dot(local_command_point)
-            if any(np.isnan(local_command_point)):
-                local_command_point[np.isnan(local_command_point)] = np.mean(
-                    local_command_point
-                )
-            local_command_point = local_command_point.reshape(-1)
-            target_points.append(local_command_point)
-
-            local_future_waypoints_temp = []
-            for future_frame_delta in range(1, 6):
-                future_frame_id = min(frame_id + future_frame_delta * 5, route_frames-1)
-                future_ego_x = measurements[future_frame_id]['gps_x']
-                future_ego_y = measurements[future_frame_id]['gps_y']
-                future_waypoint = np.array([future_ego_x - ego_x, future_ego_y - ego_y])
-                future_waypoint = local_R.T.dot(future_waypoint)
-                local_future_waypoints_temp.append(future_waypoint.reshape(1, 2))
-            local_future_waypoints.append(np.concatenate(local_future_waypoints_temp, axis=0).reshape(-1))
-
-        valid_frames = len(ego_xs)
-        ego_throttles = self.pad_and_stack(ego_throttles)
-        ego_steers = self.pad_and_stack(ego_steers)
-        ego_brakes = self.pad_and_stack(ego_brakes)
-        ego_velocitys = self.pad_and_stack(ego_velocitys)
-        ego_xs = self.pad_and_stack(ego_xs)
-        ego_ys = self.pad_and_stack(ego_ys)
-        target_points = self.pad_and_stack(target_points)
-        local_positions = self.pad_and_stack(local_positions)
-        local_future_waypoints = self.pad_and_stack(local_future_waypoints)
-
-        lidar_data = []
-        #lidar_num_points = []
-        rgb = []
-        rgb_center = []
-        rgb_left = []
-        rgb_right = []
-        rgb_rear = []
-        measurements_data = []
-        
-        for frame_id in range(start_frame_id, end_frame_id, sample_interval):
-            sensor_data = self._extract_data_item(route_path, frame_id, measurements[frame_id])
-            lidar_data.append(sensor_data['lidar'])
-            #lidar_num_points.append(sensor_data['num_points'])
-            rgb.append(sensor_data['rgb'])
-            rgb_center.append(sensor_data['rgb_center'])
-            rgb_left.append(sensor_data['rgb_left'])
-            rgb_right.append(sensor_data['rgb_right'])
-            rgb_rear.append(sensor_data['rgb_rear'])
-
-            measurement = measurements[frame_id]
-            cmd_one_hot = [0, 0, 0, 0, 0, 0]
-            cmd = measurement["command"] - 1
-            if cmd < 0:
-                cmd = 3
-            cmd_one_hot[cmd] = 1
-            cmd_one_hot.append(measurement["speed"])
-            mes = np.array(cmd_one_hot, dtype=np.float32)
-            measurements_data.append(mes)
-            
-
-        processed_data['lidar'] = torch.stack([torch.from_numpy(x) for x in self.pad_and_stack(lidar_data)], dim=0)
-        #processed_data['num_points'] = torch.tensor(lidar_num_points)
-        processed_data['rgb'] = self.pad_and_stack(rgb)
-        processed_data['rgb_left'] = self.pad_and_stack(rgb_left)
-        processed_data['rgb_right'] = self.pad_and_stack(rgb_right)
-        processed_data['rgb_rear'] = self.pad_and_stack(rgb_rear)
-        processed_data['rgb_center'] = self.pad_and_stack(rgb_center)
+        frame_ids = np.arange(start_frame_id, end_frame_id, sample_interval)
+        labels = build_clip_labels(measurements, frame_ids, route_frames, self.token_max_length)
+        valid_frames = len(frame_ids)
+        local_positions = labels['local_positions']
+        text_before_img = ['<frame %.1f,%.1f>' % (x, y) for x, y in local_positions[:valid_frames].tolist()]
+        text_after_img = ['</frame>'] * valid_frames
+
+        if self.bev_embedding_cache is not None:
+            # precomputed outputs of the frozen bev encoder instead of camera images and LiDAR
+            embeddings = load_bev_embeddings(route_path, self.bev_embedding_cache, route_frames,
+                                             self.bev_embedding_encoder)
+            processed_data['bev_embeddings'] = torch.from_numpy(embeddings[frame_ids])
+        else:
+            sensor_frames = {key: [] for key in self.input_keys}
+            for frame_id in frame_ids.tolist():
+                sensor_data = self._extract_data_item(route_path, frame_id, measurements[frame_id])
+                for key in self.input_keys:
+                    sensor_frames[key].append(sensor_data[key])
+
+            # only the valid frames, collater pads them to the longest clip of the batch
+            for key, frames in sensor_frames.items():
+                if key == 'lidar':
+                    processed_data[key] = torch.from_numpy(np.stack(frames, 0))
+                else:
+                    processed_data[key] = torch.stack(frames, 0)
 
         instruction_text = np.random.choice(self.instruction_dict[str(info['instruction_id'])])
         try:
@@ -429,21 +341,21 @@ class CarlaVoiceDataset(BaseIODataset):
             _logger.info(instruction_text)
 
 
-        processed_data['measurements'] = self.pad_and_stack(measurements_data)
+        processed_data['measurements'] = labels['measurements']
 
        
         
-        processed_data['target_point'] = torch.from_numpy(target_points).float()
+        processed_data['target_point'] = torch.from_numpy(labels['target_points']).float()
         processed_data['valid_frames'] = valid_frames
         processed_data['text_input'] = instruction_text
         processed_data['text_before_img'] = '|'.join(text_before_img)
         processed_data['text_after_img'] = '|'.join(text_after_img)
-        processed_data['ego_throttles'] = ego_throttles
-        processed_data['ego_steers'] = ego_steers
-        processed_data['ego_brakes'] = ego_brakes
-        processed_data['velocity'] = torch.from_numpy(np.array(ego_velocitys)).float()
+        processed_data['ego_throttles'] = labels['ego_throttles']
+        processed_data['ego_steers'] = labels['ego_steers']
+        processed_data['ego_brakes'] = labels['ego_brakes']
+        processed_data['velocity'] = torch.from_numpy(labels['ego_velocitys']).float()
         processed_data['local_positions'] = local_positions
-        processed_data['local_future_waypoints'] = local_future_waypoints
+        processed_data['local_future_waypoints'] = labels['local_future_waypoints']
         if self.enable_notice:
             processed_data['notice_frame_id'] = notice_frame_id
             processed_data['notice_text'] = notice_text
@@ -451,16 +363,42 @@ class CarlaVoiceDataset(BaseIODataset):
         return processed_data
     
 
+    def _view_transforms(self):
+        return {
+            'rgb': self.rgb_transform,
+            'rgb_center': self.rgb_center_transform,
+            'rgb_left': self.multi_view_transform,
+            'rgb_right': self.multi_view_transform,
+            'rgb_rear': self.multi_view_transform,
+        }
+
+    def _rgb_full_decode_size(self):
+        """
+        Size to ask the JPEG decoder of rgb_full for: every view of input_keys has to stay at least as
+        large as the first resize of its transform. None if one of them needs the full resolution
+        (rgb_center is a crop of the full resolution front view).
+        """
+        transforms = self._view_transforms()
+        sizes = [decode_size(transforms[key]) for key in self.input_keys if key in transforms]
+        if len(sizes) == 0 or None in sizes:
+            return None
+        return max(w for w, _ in sizes), max(h for _, h in sizes) * len(RGB_FULL_VIEWS)
+
     def _extract_data_item(self, route_path, frame_id, measurements):
         data = {}
-        # You can use tools/data/batch_merge_data.py to generate FULL image (including front, left, right) for reducing io cost
-        rgb_full_image = self._load_image(
-            os.path.join(route_path, "rgb_full", "%04d.jpg" % frame_id)
-        )
-        rgb_image = rgb_full_image.crop((0, 0, 800, 600))
-        rgb_left_image = rgb_full_image.crop((0, 600, 800, 1200))
-        rgb_right_image = rgb_full_image.crop((0, 1200, 800, 1800))
-        rgb_rear_image = rgb_full_image.crop((0, 1800, 800, 2400))
+        if any(key.startswith('rgb') for key in self.input_keys):
+            # You can use tools/data/batch_merge_data.py to generate FULL image (including front, left, right) for reducing io cost
+            rgb_full_image = self._load_rgb_full(route_path, frame_id)
+            size = self._rgb_full_decode_size()
+            if size is not None:
+                # libjpeg decodes at 1/2, 1/4 or 1/8 of the size (DCT scaling) while the result is not smaller
+                rgb_full_image.draft('RGB', size)
+            # 800 x 600 per view at full resolution
+            view_w, view_h = rgb_full_image.size[0], rgb_full_image.size[1] // len(RGB_FULL_VIEWS)
+            views = {}
+            for i, key in enumerate(RGB_FULL_VIEWS):
+                if key in self.input_keys or (key == 'rgb' and 'rgb_center' in self.input_keys):
+                    views[key] = rgb_full_image.crop((0, i * view_h, view_w, (i + 1) * view_h))
 
         '''
         rgb_image = self._load_image(
@@ -474,23 +412,22 @@ class CarlaVoiceDataset(BaseIODataset):
         )
         '''
 
-     
-        lidar_unprocessed = self._load_npy(
-            os.path.join(route_path, "lidar", "%04d.npy" % frame_id)
-        )[..., :3]
-        lidar_unprocessed[:, 1] *= -1
-        full_lidar = transform_2d_points(
-            lidar_unprocessed,
-            np.pi / 2 - measurements["theta"],
-            -measurements["gps_x"],
-            -measurements["gps_y"],
-            np.pi / 2 - measurements["theta"],
-            -measurements["gps_x"],
-            -measurements["gps_y"],
-        )
-        lidar_processed = lidar_to_histogram_features(
-            full_lidar, crop=self.input_lidar_size
-        )
+        if 'lidar' in self.input_keys:
+            lidar_unprocessed = self._load_lidar(route_path, frame_id)[..., :3]
+            lidar_unprocessed[:, 1] *= -1
+            full_lidar = transform_2d_points(
+                lidar_unprocessed,
+                np.pi / 2 - measurements["theta"],
+                -measurements["gps_x"],
+                -measurements["gps_y"],
+                np.pi / 2 - measurements["theta"],
+                -measurements["gps_x"],
+                -measurements["gps_y"],
+            )
+            lidar_processed = lidar_to_histogram_features(
+                full_lidar, crop=self.input_lidar_size
+            )
+            data['lidar'] = lidar_processed
 
         '''
         lidar_unprocessed_front = self._load_npy(
@@ -502,23 +439,23 @@ class CarlaVoiceDataset(BaseIODataset):
         lidar_unprocessed = np.concatenate([lidar_unprocessed_front, lidar_unprocessed_back])
         lidar_processed, num_points= lidar_to_raw_features(lidar_unprocessed)
         '''
-        data['lidar'] = lidar_processed
-
-        if self.rgb_transform is not None:
-            rgb_main_image = self.rgb_transform(rgb_image)
-        data["rgb"] = rgb_main_image
-
-        if self.rgb_center_transform is not None:
-            rgb_center_image = self.rgb_center_transform(rgb_image)
-        data["rgb_center"] = rgb_center_image
-
-        if self.multi_view_transform is not None:
-            rgb_left_image = self.multi_view_transform(rgb_left_image)
-            rgb_right_image = self.multi_view_transform(rgb_right_image)
-            rgb_rear_image = self.multi_view_transform(rgb_rear_image)
-        data["rgb_left"] = rgb_left_image
-        data["rgb_right"] = rgb_right_image
-        data["rgb_rear"] = rgb_rear_image
+
+        # same transform order as with all views, so the random augmentations of a view do not change
+        if 'rgb' in self.input_keys:
+            data["rgb"] = views['rgb']
+            if self.rgb_transform is not None:
+                data["rgb"] = self.rgb_transform(views['rgb'])
+
+        if 'rgb_center' in self.input_keys:
+            data["rgb_center"] = views['rgb']
+            if self.rgb_center_transform is not None:
+                data["rgb_center"] = self.rgb_center_transform(views['rgb'])
+
+        for key in ['rgb_left', 'rgb_right', 'rgb_rear']:
+            if key in self.input_keys:
+                data[key] = views[key]
+                if self.multi_view_transform is not None:
+                    data[key] = self.multi_view_transform(views[key])
 
         data = check_data(data, info=route_path+str(frame_id))
         return data
@@ -7,9 +7,10 @@
 
 import time
 import random
+import numpy as np
 import torch
 from lavis.datasets.data_utils import move_to_cuda
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Sampler
 
 
 class MultiIterLoader:
@@ -43,6 +44,73 @@ class MultiIterLoader:
         return next(self.loaders[loader_idx])
 
 
+class LengthGroupedBatchSampler(Sampler):
+    """
+    Batch sampler that puts samples of similar length (e.g. CarlaVoiceDataset.clip_lengths) into the
+    same batch, so a collater padding to the longest sample of the batch adds few padding frames.
+
+    Drop-in for a DistributedSampler with batch_size: every epoch the indices are shuffled with
+    seed + epoch (the same permutation on every rank), cut into groups of group_batches global batches
+    (batch_size * num_replicas samples) and sorted by length within a group. The global batches are
+    shuffled and each rank takes its batch_size slice, so all ranks see the same number of batches and
+    similar lengths in a step.
+
+    Args:
+        lengths (list): length of every sample of the dataset.
+        batch_size (int): samples per batch and rank.
+        group_batches (int): global batches sorted together, larger groups pad less and shuffle less.
+    """
+
+    def __init__(self, lengths, batch_size, num_replicas=1, rank=0, shuffle=True, seed=0,
+                 drop_last=False, group_batches=50):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.group_batches = group_batches
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        global_size = self.batch_size * self.num_replicas
+        if self.drop_last:
+            return len(self.lengths) // global_size
+        return (len(self.lengths) + global_size - 1) // global_size
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        if self.shuffle:
+            indices = torch.randperm(len(self.lengths), generator=generator).numpy()
+        else:
+            indices = np.arange(len(self.lengths))
+
+        global_size = self.batch_size * self.num_replicas
+        group_size = global_size * self.group_batches
+        batches = []
+        for lo in range(0, len(indices), group_size):
+            group = indices[lo:lo + group_size]
+            group = group[np.argsort(-self.lengths[group], kind="stable")]
+            batches += [group[i:i + global_size] for i in range(0, len(group), global_size)]
+        if len(batches) and len(batches[-1]) < global_size:
+            if self.drop_last:
+                batches.pop()
+            else:
+                # fill the last batch up from the start, as DistributedSampler pads its indices
+                batches[-1] = np.resize(np.concatenate([batches[-1], indices]), global_size)
+
+        if self.shuffle:
+            order = torch.randperm(len(batches), generator=generator).tolist()
+            batches = [batches[i] for i in order]
+        for batch in batches:
+            yield batch[self.rank * self.batch_size:(self.rank + 1) * self.batch_size].tolist()
+
+
 class PrefetchLoader(object):
     """
     Modified from https://github.com/ChenRocks/UNITER.
@@ -149,6 +217,8 @@ class IterLoader:
             self._epoch += 1
             if hasattr(self._dataloader.sampler, "set_epoch") and self._use_distributed:
                 self._dataloader.sampler.set_epoch(self._epoch)
+            if hasattr(self._dataloader.batch_sampler, "set_epoch"):
+                self._dataloader.batch_sampler.set_epoch(self._epoch)
             time.sleep(2)  # Prevent possible deadlock during epoch transition
             self.iter_loader = iter(self._dataloader)
             data = next(self.iter_loader)
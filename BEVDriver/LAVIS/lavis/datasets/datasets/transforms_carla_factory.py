@@ -6,6 +6,7 @@ Hacked together by / Copyright 2020 Ross Wightman
 import math
 import random
 import torch
+import torch.nn.functional as F
 import numpy as np
 from torchvision import transforms
 
@@ -57,6 +58,19 @@ class SegConvert:
         return out
 
 
+def fixed_resize_size(input_size_num):
+    """ (w, h) the views are resized to before the center crop of input_size_num"""
+    if input_size_num == 112:
+        return (170, 128)
+    elif input_size_num == 128:
+        return (195, 146)
+    elif input_size_num == 224:
+        return (341, 256)
+    elif input_size_num == 256:
+        return (340, 288)
+    return (int((input_size_num + 32) / 3.0 * 4.0), input_size_num + 32)
+
+
 def create_carla_rgb_transform(
     input_size,
     crop_size=None,
@@ -81,20 +95,7 @@ def create_carla_rgb_transform(
         input_size_num = input_size
 
     if need_scale:
-        if input_size_num == 112:
-            tfl.append(Resize2FixedSize((170, 128)))
-        elif input_size_num == 128:
-            tfl.append(Resize2FixedSize((195, 146)))
-        elif input_size_num == 224:
-            tfl.append(Resize2FixedSize((341, 256)))
-        elif input_size_num == 256:
-            tfl.append(Resize2FixedSize((340, 288)))
-        else:
-            tfl.append(
-                Resize2FixedSize(
-                    (int((input_size_num + 32) / 3.0 * 4.0), input_size_num + 32)
-                )
-            )
+        tfl.append(Resize2FixedSize(fixed_resize_size(input_size_num)))
     if is_training:
         if scale:
             tfl.append(RandomResize(scale))
@@ -105,6 +106,89 @@ def create_carla_rgb_transform(
     return transforms.Compose(tfl)
 
 
+class CarlaRgbDeviceTransform:
+    """
+    create_carla_rgb_transform split at the host to device copy, for batches of uint8 images.
+
+    Called on a PIL view (in the dataset workers) it only box-reduces the image by the largest integer
+    factor that keeps it at least as large as the fixed resize, or center crops it when there is
+    neither a resize nor a random scale, and returns it as a uint8 [3, H, W] tensor. `batch` runs the
+    resize (antialiased bicubic, PIL's default), random scale, center crop and normalization on a
+    [N, 3, H, W] batch of those, on the device the batch is on.
+    """
+
+    def __init__(
+        self,
+        input_size,
+        crop_size=None,
+        use_prefetcher=False,
+        scale=None,
+        need_scale=True,
+        interpolation="bilinear",
+        is_training=False,
+        mean=IMAGENET_DEFAULT_MEAN,
+        std=IMAGENET_DEFAULT_STD,
+    ):
+        if isinstance(input_size, (tuple, list)):
+            self.crop_size = tuple(input_size[-2:])
+            input_size_num = input_size[-1]
+        else:
+            self.crop_size = (input_size, input_size)
+            input_size_num = input_size
+        self.resize_size = fixed_resize_size(input_size_num) if need_scale else None
+        self.scale = scale if is_training and scale else None
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, pil_img):
+        if self.resize_size is not None:
+            factor = min(pil_img.size[0] // self.resize_size[0], pil_img.size[1] // self.resize_size[1])
+            if factor > 1:
+                pil_img = pil_img.reduce(factor)
+        elif self.scale is None:
+            pil_img = transforms.CenterCrop(self.crop_size)(pil_img)
+        return torch.from_numpy(np.array(pil_img)).permute(2, 0, 1)
+
+    def batch(self, images, scales=None):
+        """
+        Args:
+            images: uint8 [N, 3, H, W] from __call__.
+            scales: [N] factors of the random scale, drawn (as RandomResize does) when None.
+
+        Returns:
+            normalized float [N, 3, crop_h, crop_w] images.
+        """
+        x = images.float() / 255
+        if self.resize_size is not None:
+            w, h = self.resize_size
+            x = F.interpolate(x, size=(h, w), mode="bicubic", align_corners=False, antialias=True)
+        if self.scale is not None:
+            if scales is None:
+                scales = torch.rand(len(x), device=x.device) * (self.scale[1] - self.scale[0]) + self.scale[0]
+            x = self._scale_and_crop(x, scales.to(x.device, torch.float64))
+        else:
+            top = int(round((x.size(2) - self.crop_size[0]) / 2.0))
+            left = int(round((x.size(3) - self.crop_size[1]) / 2.0))
+            x = x[:, :, top:top + self.crop_size[0], left:left + self.crop_size[1]]
+        mean = torch.tensor(self.mean, dtype=x.dtype, device=x.device).view(1, -1, 1, 1)
+        std = torch.tensor(self.std, dtype=x.dtype, device=x.device).view(1, -1, 1, 1)
+        return (x - mean) / std
+
+    def _scale_and_crop(self, x, scales):
+        # center crop of every image resized to int(size * scale), sampled from x in one grid_sample
+        h, w = x.shape[2:]
+        scaled_h, scaled_w = (h * scales).floor(), (w * scales).floor()
+        crop_h, crop_w = self.crop_size
+        top, left = torch.round((scaled_h - crop_h) / 2), torch.round((scaled_w - crop_w) / 2)
+        rows = torch.arange(crop_h, device=x.device, dtype=torch.float64)
+        columns = torch.arange(crop_w, device=x.device, dtype=torch.float64)
+        # pixel centers of the crop in the scaled image, in grid_sample coordinates (align_corners=False)
+        grid_y = (2 * (top[:, None] + rows) + 1) / scaled_h[:, None] - 1
+        grid_x = (2 * (left[:, None] + columns) + 1) / scaled_w[:, None] - 1
+        grid = torch.stack(torch.broadcast_tensors(grid_x[:, None, :], grid_y[:, :, None]), -1)
+        return F.grid_sample(x, grid.to(x.dtype), mode="bicubic", padding_mode="border", align_corners=False)
+
+
 def create_carla_seg_transform(
     input_size,
     crop_size=None,
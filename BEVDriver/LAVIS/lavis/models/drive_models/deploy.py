@@ -0,0 +1,192 @@
+"""
+Single-file deploy artifact of Blip2VicunaDrive for the driving agents.
+
+Building the model for evaluation loads the LLM with from_pretrained, the bev encoder from its own
+checkpoint, wraps the LLM with PEFT LoRA and then applies the BEVDriver checkpoint on top, in every
+evaluation process. `export_deploy_model` merges the LoRA deltas into the LLM weights and writes all
+weights of the model (bev encoder, Q-Former, projections, LLM and heads) and the LLM tokenizer into
+one safetensors file, with a JSON manifest of the configs needed to rebuild the modules in its header.
+`load_deploy_model` builds the modules with empty weights and assigns the tensors of the file, which
+safetensors memory-maps on the CPU; PEFT and the original checkpoints are not involved.
+"""
+
+import os
+import json
+import itertools
+import tempfile
+
+import peft
+import torch
+import torch.nn as nn
+import transformers
+from accelerate import init_empty_weights
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+from lavis.models.bevllm_models.Qformer import BertConfig, BertLMHeadModel
+from lavis.models.blip2_models.modeling_llama import LlamaForCausalLM
+from lavis.models.blip2_models.modeling_opt import OPTForCausalLM
+from lavis.models.drive_models.drive import Blip2VicunaDrive, LayerNorm
+from timm import create_model
+
+DEPLOY_FORMAT = "bevdriver_deploy"
+DEPLOY_VERSION = 1
+# files of the LLM tokenizer are stored as uint8 tensors under this prefix
+TOKENIZER_PREFIX = "tokenizer/"
+# attributes of Blip2VicunaDrive read by its forward and streaming code
+MODEL_ARGS = ["use_extra_prompt", "freeze_decoder_of_bev_encoder", "has_qformer", "has_gru_decoder",
+              "split_section_num_for_bev_encoder", "max_txt_len"]
+LLM_CLASSES = {"LlamaForCausalLM": LlamaForCausalLM, "OPTForCausalLM": OPTForCausalLM}
+
+
+def lora_layers(model):
+    """ (name, module) of the PEFT LoRA layers of a model"""
+    return [(name, module) for name, module in model.named_modules() if isinstance(module, peft.tuners.lora.LoraLayer)]
+
+
+def merged_llm_state_dict(llm_model):
+    """
+    State dict of the LLM under the keys of the plain model, with the LoRA deltas of a PEFT model
+    (scaling * B @ A) added to the weights they adapt. The sums are computed in float32 and cast back
+    to the dtype of the weight.
+    """
+    if not isinstance(llm_model, peft.PeftModel):
+        return llm_model.state_dict()
+    base_model = llm_model.get_base_model()
+    state = {key: value for key, value in base_model.state_dict().items() if "lora_" not in key}
+    for name, module in lora_layers(base_model):
+        if module.merged:
+            continue
+        adapter = module.active_adapter
+        delta = module.lora_B[adapter].weight.float() @ module.lora_A[adapter].weight.float() * module.scaling[adapter]
+        if module.fan_in_fan_out:
+            delta = delta.T
+        weight = state[name + ".weight"]
+        state[name + ".weight"] = (weight.float() + delta).to(weight.dtype)
+    return state
+
+
+def deploy_manifest(model, encoder_model, source=None):
+    llm_model = model.llm_model
+    lora = None
+    if isinstance(llm_model, peft.PeftModel):
+        config = llm_model.peft_config[llm_model.active_adapter]
+        lora = {"r": config.r, "lora_alpha": config.lora_alpha, "target_modules": sorted(config.target_modules),
+                "merged_layers": len(lora_layers(llm_model))}
+        llm_model = llm_model.get_base_model()
+    manifest = {
+        "format": DEPLOY_FORMAT,
+        "version": DEPLOY_VERSION,
+        "model_args": {name: getattr(model, name) for name in MODEL_ARGS},
+        "encoder_model": encoder_model,
+        "llm_class": type(llm_model).__name__,
+        "llm_config": llm_model.config.to_dict(),
+        "tokenizer_class": type(model.llm_tokenizer).__name__,
+        "lora": lora,
+        "source": source or {},
+    }
+    if model.has_qformer:
+        manifest["qformer_config"] = model.Qformer.config.to_dict()
+        manifest["num_query_token"] = model.query_tokens.size(1)
+    return manifest
+
+
+def export_deploy_model(model, path, encoder_model, source=None):
+    """
+    Write the deploy file of a built (and checkpoint loaded) Blip2VicunaDrive.
+
+    Args:
+        model (Blip2VicunaDrive): model as used for evaluation, with or without PEFT LoRA.
+        path (str): output .safetensors file.
+        encoder_model (str): timm name of the bev encoder, which is rebuilt from it.
+        source (dict): paths of the checkpoints, recorded in the manifest.
+
+    Returns:
+        the manifest.
+    """
+    manifest = deploy_manifest(model, encoder_model, source)
+    tensors = {key: value for key, value in model.state_dict().items() if not key.startswith("llm_model.")}
+    tensors.update({"llm_model." + key: value for key, value in merged_llm_state_dict(model.llm_model).items()})
+    tensors = {key: value.detach().cpu().contiguous() for key, value in tensors.items()}
+    with tempfile.TemporaryDirectory() as tokenizer_dir:
+        model.llm_tokenizer.save_pretrained(tokenizer_dir)
+        for name in sorted(os.listdir(tokenizer_dir)):
+            with open(os.path.join(tokenizer_dir, name), "rb") as f:
+                tensors[TOKENIZER_PREFIX + name] = torch.frombuffer(bytearray(f.read()), dtype=torch.uint8)
+
+    save_file(tensors, path + ".tmp", metadata={"format": "pt", "manifest": json.dumps(manifest)})
+    os.replace(path + ".tmp", path)
+    return manifest
+
+
+def read_deploy_manifest(path):
+    with safe_open(path, framework="pt") as f:
+        metadata = f.metadata() or {}
+    if "manifest" not in metadata:
+        raise ValueError("%s is not a deploy file of export_deploy_model" % path)
+    manifest = json.loads(metadata["manifest"])
+    if manifest.get("format") != DEPLOY_FORMAT or manifest.get("version") != DEPLOY_VERSION:
+        raise ValueError("unsupported deploy file %s: %s version %s" % (path, manifest.get("format"), manifest.get("version")))
+    return manifest
+
+
+def build_empty_model(manifest):
+    """ the modules of Blip2VicunaDrive described by a deploy manifest, their weights on the meta device"""
+    model = Blip2VicunaDrive.__new__(Blip2VicunaDrive)
+    nn.Module.__init__(model)
+    for name, value in manifest["model_args"].items():
+        setattr(model, name, value)
+    # the LoRA deltas are part of the LLM weights
+    model.has_lora = False
+
+    llm_config = transformers.AutoConfig.for_model(**manifest["llm_config"])
+    # the patch embeddings of the encoder run the backbone once to find its output size, so all of its
+    # tensors are created on the meta device
+    with torch.device("meta"):
+        model.bev_encoder = create_model(manifest["encoder_model"], pretrained_backbone=False)
+    # buffers stay on the CPU, the LLM has non-persistent ones (rotary tables) that are not in the file
+    with init_empty_weights():
+        model.ln_vision = LayerNorm(model.bev_encoder.embed_dim)
+        model.llm_model = LLM_CLASSES[manifest["llm_class"]](llm_config)
+        model.init_heads(llm_config.hidden_size)
+        if model.has_qformer:
+            qformer_config = BertConfig.from_dict(manifest["qformer_config"])
+            model.Qformer = BertLMHeadModel(qformer_config)
+            model.Qformer.cls = None
+            model.query_tokens = nn.Parameter(torch.zeros(1, manifest["num_query_token"], qformer_config.hidden_size))
+        model.llm_proj = nn.Linear(model.Qformer.config.hidden_size, llm_config.hidden_size)
+
+    model.waypoints_loss = torch.nn.L1Loss()
+    model.end_loss = torch.nn.CrossEntropyLoss()
+    model.reset_stream()
+    return model
+
+
+def load_deploy_model(path, device="cpu"):
+    """
+    Blip2VicunaDrive of a deploy file, in eval mode and without gradients. On the CPU the weights are
+    memory-mapped from the file, on a GPU they are read into device memory directly.
+    """
+    manifest = read_deploy_manifest(path)
+    model = build_empty_model(manifest)
+
+    tensors, tokenizer_files = {}, {}
+    with safe_open(path, framework="pt", device=str(device)) as f:
+        for key in f.keys():
+            if key.startswith(TOKENIZER_PREFIX):
+                tokenizer_files[key[len(TOKENIZER_PREFIX):]] = f.get_tensor(key).cpu().numpy().tobytes()
+            else:
+                tensors[key] = f.get_tensor(key)
+    model.load_state_dict(tensors, strict=True, assign=True)
+    empty = [name for name, tensor in itertools.chain(model.named_parameters(), model.named_buffers()) if tensor.is_meta]
+    if empty:
+        raise ValueError("%s does not hold %s" % (path, ", ".join(empty)))
+
+    with tempfile.TemporaryDirectory() as tokenizer_dir:
+        for name, data in tokenizer_files.items():
+            with open(os.path.join(tokenizer_dir, name), "wb") as f:
+                f.write(data)
+        model.llm_tokenizer = getattr(transformers, manifest["tokenizer_class"]).from_pretrained(tokenizer_dir)
+
+    # non-persistent buffers (e.g. rotary tables) were created on the CPU
+    return model.to(device).eval().requires_grad_(False)
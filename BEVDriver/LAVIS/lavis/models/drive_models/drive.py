@@ -25,6 +25,29 @@ class LayerNorm(nn.LayerNorm):
         ret = super().forward(x.type(torch.float32))
         return ret.type(orig_type)
 
+def segment_index(starts, lengths, total=None, strides=None):
+    """
+    Row indices of consecutive segments, segment k reads lengths[k] rows from starts[k] on (the row
+    starts[k] lengths[k] times where strides[k] is 0). starts, lengths and strides are flattened in
+    order; total is lengths.sum(), known in advance it saves a device sync.
+    """
+    starts, lengths = starts.reshape(-1), lengths.reshape(-1)
+    segment = torch.repeat_interleave(torch.arange(len(lengths), device=lengths.device), lengths, output_size=total)
+    offsets = torch.arange(len(segment), device=lengths.device) - (torch.cumsum(lengths, 0) - lengths)[segment]
+    if strides is not None:
+        offsets = offsets * strides.reshape(-1)[segment]
+    return starts[segment] + offsets
+
+
+def flatten_end_flags(end_flag_pos_list, device):
+    # (sample, position, frame) of every end flag of end_flag_pos_list, a list of positions per sample
+    counts = torch.tensor([len(x) for x in end_flag_pos_list], dtype=torch.long)
+    batch_index = torch.repeat_interleave(torch.arange(len(end_flag_pos_list)), counts)
+    frame_index = torch.arange(len(batch_index)) - (torch.cumsum(counts, 0) - counts)[batch_index]
+    end_flag_pos = torch.tensor([int(j) for x in end_flag_pos_list for j in x], dtype=torch.long)
+    return batch_index.to(device), end_flag_pos.to(device), frame_index.to(device)
+
+
 @registry.register_model("vicuna_drive")
 class Blip2VicunaDrive(Blip2Base):
     """
@@ -112,26 +135,8 @@ class Blip2VicunaDrive(Blip2Base):
 
         self.llm_model.resize_token_embeddings(len(self.llm_tokenizer))
 
-        if self.has_gru_decoder:
-            self.waypoints_fc = nn.Sequential(
-                        nn.Linear(self.llm_model.config.hidden_size, self.llm_model.config.hidden_size),
-                        nn.ReLU(),
-                        nn.Linear(self.llm_model.config.hidden_size, 64)
-            )
-            self.waypoints_predictor = nn.GRUCell(input_size=2, hidden_size=64)
-            self.waypoints_output = nn.Linear(64, 2)
-        else:
-            self.waypoints_predictor = nn.Sequential(
-                            nn.Linear(self.llm_model.config.hidden_size, self.llm_model.config.hidden_size),
-                            nn.ReLU(),
-                            nn.Linear(self.llm_model.config.hidden_size, 10)
-            )
-        self.end_predictor = nn.Sequential(
-            nn.Linear(self.llm_model.config.hidden_size, self.llm_model.config.hidden_size),
-            nn.ReLU(),
-            nn.Linear(self.llm_model.config.hidden_size, 2)
-        )
-        
+        self.init_heads(self.llm_model.config.hidden_size)
+
 
         if self.has_qformer:
             print('Loading Q-Former')
@@ -166,64 +171,64 @@ class Blip2VicunaDrive(Blip2Base):
         self.waypoints_loss = torch.nn.L1Loss()
         self.end_loss = torch.nn.CrossEntropyLoss()
 
-    def concat_text_image_input(self, input_embeds, input_atts, input_embeds, image_nums, end_flag_pos_list, image_atts=None):
+        self._stream_cache = None
+
+    def init_heads(self, hidden_size):
+        """ waypoint and end-of-instruction heads on the LLM hidden states"""
+        if self.has_gru_decoder:
+            self.waypoints_fc = nn.Sequential(
+                        nn.Linear(hidden_size, hidden_size),
+                        nn.ReLU(),
+                        nn.Linear(hidden_size, 64)
+            )
+            self.waypoints_predictor = nn.GRUCell(input_size=2, hidden_size=64)
+            self.waypoints_output = nn.Linear(64, 2)
+        else:
+            self.waypoints_predictor = nn.Sequential(
+                            nn.Linear(hidden_size, hidden_size),
+                            nn.ReLU(),
+                            nn.Linear(hidden_size, 10)
+            )
+        self.end_predictor = nn.Sequential(
+            nn.Linear(hidden_size, hidden_size),
+            nn.ReLU(),
+            nn.Linear(hidden_size, 2)
+        )
+
+    def concat_text_image_input(self, input_embeds, input_atts, image_embeds, image_nums, end_flag_pos_list, image_atts=None):
         '''
+        Every sample is [instruction tokens, frame tokens, instruction padding], gathered for the
+        whole batch at once from a table of the instruction and frame rows.
+
         attention_mask:
             - 1 for tokens that are **not masked**,
             - 0 for tokens that are **masked**.
         '''
-        input_part_targets_len = []
-        llm_inputs = []
-        llm_attention_mask = []
-        wp_target_index = []
-        bs = input_embeds.size()[0]
-        for i in range(bs):
-            this_input_ones = input_atts[i].sum()
-            input_part_targets_len.append(this_input_ones)
-            if image_atts is None:
-                bs, t, n, dim = input_embeds.size()
-                llm_inputs.append(
-                    torch.cat([
-                        input_embeds[i][:this_input_ones],
-                        input_embeds[i].view(t*n, -1),
-                        input_embeds[i][this_input_ones:]
-                    ])
-                )
-            else:
-                llm_inputs.append(
-                    torch.cat([
-                        input_embeds[i][:this_input_ones],
-                        input_embeds[i],
-                        input_embeds[i][this_input_ones:]
-                    ])
-                )
-            if image_atts is None:
-                bs, t, n, dim = input_embeds.size()
-                llm_attention_mask.append(
-                    torch.cat([
-                        input_atts[i][:this_input_ones],
-                        torch.ones((image_nums[i]*n), device=input_embeds.device, dtype=torch.long),
-                        torch.zeros(((t-image_nums[i])*n), device=input_embeds.device, dtype=torch.long),
-                        input_atts[i][this_input_ones:]
-                    ])
-                )
-            else:
-                llm_attention_mask.append(
-                    torch.cat([
-                        input_atts[i][:this_input_ones],
-                        image_atts[i],
-                        input_atts[i][this_input_ones:]
-                    ])
-                )
-            sub_target_index = []
-            for j in end_flag_pos_list[i]:
-                sub_target_index.append([i, j + this_input_ones])
-            wp_target_index.extend(sub_target_index)
-        llm_inputs = torch.stack(llm_inputs, 0)
-        llm_attention_mask = torch.stack(llm_attention_mask, 0)
-        return llm_inputs, llm_attention_mask, input_part_targets_len, wp_target_index
-
-    def concat_text_image_input_with_notice(self, input_embeds, input_atts, input_embeds, image_nums,
+        device = input_embeds.device
+        bs, n_text = input_atts.size()
+        if image_atts is None:
+            _, t, n, _ = image_embeds.size()
+            image_embeds = image_embeds.reshape(bs, t*n, -1)
+            image_nums = torch.as_tensor(image_nums, device=device)
+            image_atts = (torch.arange(t, device=device) < image_nums[:, None]).long().repeat_interleave(n, dim=1)
+        n_image = image_embeds.size(1)
+        dtype = torch.promote_types(input_embeds.dtype, image_embeds.dtype)
+        table = torch.cat([input_embeds.reshape(bs*n_text, -1).to(dtype), image_embeds.reshape(bs*n_image, -1).to(dtype)])
+        atts_table = torch.cat([input_atts.reshape(-1), image_atts.reshape(-1).to(input_atts.dtype)])
+
+        input_part_targets_len = input_atts.sum(1)
+        rows = torch.arange(bs, device=device)
+        starts = torch.stack([rows*n_text, bs*n_text + rows*n_image, rows*n_text + input_part_targets_len], 1)
+        lengths = torch.stack([
+            input_part_targets_len, torch.full_like(input_part_targets_len, n_image), n_text - input_part_targets_len
+        ], 1)
+        index = segment_index(starts, lengths, bs*(n_text + n_image)).view(bs, -1)
+
+        batch_index, end_flag_pos, _ = flatten_end_flags(end_flag_pos_list, device)
+        wp_target_index = torch.stack([batch_index, end_flag_pos + input_part_targets_len[batch_index]], 1)
+        return table[index], atts_table[index], input_part_targets_len, wp_target_index
+
+    def concat_text_image_input_with_notice(self, input_embeds, input_atts, image_embeds, image_nums,
                                             end_flag_pos_list, notice_frame_id, notice_text, image_atts=None):
         '''
         the function is made for processing data with [inserted] notice text
@@ -232,11 +237,9 @@ class Blip2VicunaDrive(Blip2Base):
             - 1 for tokens that are **not masked**,
             - 0 for tokens that are **masked**.
         '''
-        input_part_targets_len = []
-        llm_inputs = []
-        llm_attention_mask = []
-        wp_target_index = []
-        bs = input_embeds.size()[0]
+        device = image_embeds.device
+        bs, n_text = input_atts.size()
+        _, t, n, _ = image_embeds.size()
 
         self.llm_tokenizer.padding_side = "right"
         self.llm_tokenizer.truncation_side = 'left'
@@ -246,73 +249,67 @@ class Blip2VicunaDrive(Blip2Base):
             padding="longest",
             truncation=True,
             max_length=self.max_txt_len,
-        ).to(input_embeds.device)
+        ).to(image_embeds.device)
         input_notice_atts = text_input_tokens.attention_mask
         notice_embeds = self.llm_model.get_input_embeddings()(text_input_tokens.input_ids)
-
-        for i in range(bs):
-            this_input_ones = input_atts[i].sum()
-            input_part_targets_len.append(this_input_ones)
-
-            this_notice_input_ones = input_notice_atts[i].sum()
-            if image_atts is None:
-                bs, t, n, dim = input_embeds.size()
-                if notice_frame_id[i] <= 0: # which means the scenario do not include any notice
-                    llm_inputs.append(
-                        torch.cat([
-                            input_embeds[i][:this_input_ones],
-                            input_embeds[i].view(t*n, -1),
-                            input_embeds[i][this_input_ones:],
-                            notice_embeds[i][:],
-                        ])
-                    )
-                else:
-                    llm_inputs.append(
-                        torch.cat([
-                            input_embeds[i][:this_input_ones],
-                            input_embeds[i, :notice_frame_id[i]].view(notice_frame_id[i]*n, -1),
-                            notice_embeds[i][:this_notice_input_ones],
-                            input_embeds[i, notice_frame_id[i]:].view((t-notice_frame_id[i])*n, -1),
-                            input_embeds[i][this_input_ones:],
-                            notice_embeds[i][this_notice_input_ones:],
-                        ])
-                    )
-            else:
-                pass 
-            if image_atts is None:
-                bs, t, n, dim = input_embeds.size()
-                if notice_frame_id[i] < 0: # which means the scenario do not include any notice
-                    llm_attention_mask.append(
-                        torch.cat([
-                            input_atts[i][:this_input_ones],
-                            torch.ones((image_nums[i]*n), device=input_embeds.device, dtype=torch.long),
-                            torch.zeros(((t-image_nums[i])*n), device=input_embeds.device, dtype=torch.long),
-                            torch.zeros((input_notice_atts.size(1)), device=input_embeds.device, dtype=torch.long),
-                            input_atts[i][this_input_ones:]
-                        ])
-                    )
-                else:
-                    llm_attention_mask.append(
-                        torch.cat([
-                            input_atts[i][:this_input_ones],
-                            torch.ones((image_nums[i]*n), device=input_embeds.device, dtype=torch.long),
-                            input_notice_atts[i][:this_notice_input_ones],
-                            torch.zeros(((t-image_nums[i])*n), device=input_embeds.device, dtype=torch.long),
-                            input_atts[i][this_input_ones:],
-                            input_notice_atts[i][this_notice_input_ones:],
-                        ])
-                    )
-            else:
-                pass
-            sub_target_index = []
-            for j in range(len(end_flag_pos_list[i])):
-                if j < notice_frame_id[i] or notice_frame_id[i] < 0: # when notice is '', the input_ones is 1, not ZERO
-                    sub_target_index.append([i, end_flag_pos_list[i][j] + this_input_ones])
-                else:
-                    sub_target_index.append([i, end_flag_pos_list[i][j] + this_input_ones + this_notice_input_ones])
-            wp_target_index.extend(sub_target_index)
-        llm_inputs = torch.stack(llm_inputs, 0)
-        llm_attention_mask = torch.stack(llm_attention_mask, 0)
+        n_notice = input_notice_atts.size(1)
+
+        input_part_targets_len = input_atts.sum(1)
+        notice_lengths = input_notice_atts.sum(1)
+        notice_frame_id = torch.as_tensor(notice_frame_id, device=device).long()
+        image_nums = torch.as_tensor(image_nums, device=device)
+        rows = torch.arange(bs, device=device)
+        text_start, image_start, notice_start = rows*n_text, bs*n_text + rows*t*n, bs*(n_text + t*n) + rows*n_notice
+
+        # [instruction, frames before the notice, notice, the other frames, instruction padding, notice padding],
+        # a sample without notice (notice_frame_id <= 0) has all its frames before an empty notice
+        with_notice = notice_frame_id > 0
+        frames_before = torch.where(with_notice, notice_frame_id, torch.full_like(notice_frame_id, t))
+        notice_before = torch.where(with_notice, notice_lengths, torch.zeros_like(notice_lengths))
+        starts = torch.stack([
+            text_start, image_start, notice_start, image_start + frames_before*n,
+            text_start + input_part_targets_len, notice_start + notice_before,
+        ], 1)
+        lengths = torch.stack([
+            input_part_targets_len, frames_before*n, notice_before, (t - frames_before)*n,
+            n_text - input_part_targets_len, n_notice - notice_before,
+        ], 1)
+        dtype = torch.promote_types(torch.promote_types(input_embeds.dtype, image_embeds.dtype), notice_embeds.dtype)
+        table = torch.cat([
+            input_embeds.reshape(bs*n_text, -1).to(dtype),
+            image_embeds.reshape(bs*t*n, -1).to(dtype),
+            notice_embeds.reshape(bs*n_notice, -1).to(dtype),
+        ])
+        llm_inputs = table[segment_index(starts, lengths, bs*(n_text + t*n + n_notice)).view(bs, -1)]
+
+        # the mask keeps the valid frames together and the notice after them; without notice
+        # (notice_frame_id < 0) the notice is masked out
+        has_notice = notice_frame_id >= 0
+        atts_table = torch.cat([
+            input_atts.reshape(-1), input_notice_atts.reshape(-1).to(input_atts.dtype),
+            torch.tensor([1, 0], dtype=input_atts.dtype, device=device),
+        ])
+        one, zero = bs*(n_text + n_notice), bs*(n_text + n_notice) + 1
+        notice_start = bs*n_text + rows*n_notice
+        notice_atts_before = torch.where(has_notice, notice_lengths, torch.zeros_like(notice_lengths))
+        notice_atts_after = torch.where(has_notice, n_notice - notice_lengths, torch.zeros_like(notice_lengths))
+        starts = torch.stack([
+            text_start, torch.full_like(rows, one), notice_start, torch.full_like(rows, zero),
+            text_start + input_part_targets_len, notice_start + notice_atts_before,
+        ], 1)
+        lengths = torch.stack([
+            input_part_targets_len, image_nums*n, notice_atts_before,
+            (t - image_nums)*n + torch.where(has_notice, torch.zeros_like(notice_lengths), torch.full_like(notice_lengths, n_notice)),
+            n_text - input_part_targets_len, notice_atts_after,
+        ], 1)
+        strides = torch.tensor([1, 0, 1, 0, 1, 1], device=device).expand(bs, -1)
+        llm_attention_mask = atts_table[segment_index(starts, lengths, bs*(n_text + t*n + n_notice), strides).view(bs, -1)]
+
+        batch_index, end_flag_pos, frame_index = flatten_end_flags(end_flag_pos_list, device)
+        # frames from the notice on come after its tokens (always, for notice_frame_id 0)
+        after_notice = (frame_index >= notice_frame_id[batch_index]) & has_notice[batch_index]
+        end_flag_pos = end_flag_pos + input_part_targets_len[batch_index] + after_notice.long() * notice_lengths[batch_index]
+        wp_target_index = torch.stack([batch_index, end_flag_pos], 1)
         return llm_inputs, llm_attention_mask, input_part_targets_len, wp_target_index
 
     def build_gt_waypoints(self, waypoints, valid_frames):
@@ -331,31 +328,48 @@ class Blip2VicunaDrive(Blip2Base):
         return gt_end_flags
 
     def prompt_wrap(self, input_embeds, text_before_img, text_after_img, valid_frames):
+        """
+        Wrap every valid frame into the tokens of its text_before_img prompt (on both sides, as the
+        per-frame implementation this replaces did) and right-pad the samples with the pad token.
+        The distinct prompts of the batch are tokenized in one tokenizer call.
+        """
         bs, t, n, dim = input_embeds.size()
-        emb_list = []
-        end_flag_pos_list = []
-        for i in range(bs):
-            before_texts = text_before_img[i].split('|')
-            after_texts = text_after_img[i].split('|')
-            temp_embeds = []
-            temp_end_flag_pos_list = []
-            for j in range(valid_frames[i]):
-                p_before_tokens = self.llm_tokenizer(before_texts[j], return_tensors="pt", add_special_tokens=False).to(input_embeds.device)
-                p_after_tokens = self.llm_tokenizer(before_texts[j], return_tensors="pt", add_special_tokens=False).to(input_embeds.device)
-                p_before_embed = self.llm_model.get_input_embeddings()(p_before_tokens.input_ids)
-                p_after_embed = self.llm_model.get_input_embeddings()(p_after_tokens.input_ids)
-                p_embed = torch.cat([p_before_embed, input_embeds[i][j][None], p_after_embed], dim=1)
-                temp_embeds.append(p_embed)
-                temp_end_flag_pos_list.append(p_embed.size(1)-1)
-            end_flag_pos_list.append(temp_end_flag_pos_list)
-            emb_list.append(torch.cat(temp_embeds, dim=1)) # 1 * m * d_dim
-        emb_lens = [emb.shape[1] for emb in emb_list]
-        pad_emb = self.llm_model.get_input_embeddings()(torch.tensor(self.llm_tokenizer.pad_token_id, device=input_embeds.device))
-        wrapped_embs = pad_emb.expand(len(emb_lens), max(emb_lens), -1).clone()
-        wrapped_atts = torch.zeros([len(emb_lens), max(emb_lens)], dtype=torch.long, device=input_embeds.device)
-        for i, emb in enumerate(emb_list):
-            wrapped_embs[i, :emb_lens[i]] = emb
-            wrapped_atts[i, :emb_lens[i]] = 1
+        device = input_embeds.device
+        valid_frames = torch.as_tensor(valid_frames).tolist()
+        frame_prompts = [texts.split('|')[:valid_frames[i]] for i, texts in enumerate(text_before_img)]
+        prompt_ids = {}
+        for prompts in frame_prompts:
+            for prompt in prompts:
+                prompt_ids.setdefault(prompt, len(prompt_ids))
+        tokens = self.llm_tokenizer(list(prompt_ids), add_special_tokens=False)['input_ids'] if prompt_ids else []
+        prompt_lengths = torch.tensor([len(x) for x in tokens], dtype=torch.long)
+        # table rows: pad token, the tokens of every distinct prompt, the frame tokens
+        prompt_starts = 1 + torch.cumsum(prompt_lengths, 0) - prompt_lengths
+        token_ids = torch.tensor([self.llm_tokenizer.pad_token_id] + [i for x in tokens for i in x], dtype=torch.long)
+        token_embeds = self.llm_model.get_input_embeddings()(token_ids.to(device))
+        table = torch.cat([token_embeds, input_embeds.reshape(bs*t*n, dim).to(token_embeds.dtype)])
+
+        # three segments (prompt, frame, prompt) per valid frame, in sample and frame order
+        frame_prompt = torch.tensor([prompt_ids[p] for prompts in frame_prompts for p in prompts], dtype=torch.long)
+        frame_rows = torch.tensor([i*t + j for i in range(bs) for j in range(valid_frames[i])], dtype=torch.long)
+        prompt_start, prompt_length = prompt_starts[frame_prompt], prompt_lengths[frame_prompt]
+        starts = torch.stack([prompt_start, len(token_ids) + frame_rows*n, prompt_start], 1)
+        lengths = torch.stack([prompt_length, torch.full_like(prompt_length, n), prompt_length], 1)
+        src = segment_index(starts, lengths)
+
+        frame_lengths = lengths.sum(1)
+        frame_sample = torch.repeat_interleave(torch.arange(bs), torch.tensor(valid_frames, dtype=torch.long))
+        emb_lens = torch.zeros(bs, dtype=torch.long).index_add_(0, frame_sample, frame_lengths)
+        sample = torch.repeat_interleave(torch.arange(bs), emb_lens)
+        position = torch.arange(len(src)) - (torch.cumsum(emb_lens, 0) - emb_lens)[sample]
+        index = torch.zeros((bs, int(emb_lens.max())), dtype=torch.long)
+        index[sample, position] = src
+        wrapped_embs = table[index.to(device)]
+        wrapped_atts = (torch.arange(index.size(1)) < emb_lens[:, None]).long().to(device)
+
+        # the end flag of a frame is the last position of its own segment, counted from the segment
+        # start and not from the sample start (kept from the per-frame implementation)
+        end_flag_pos_list = [x.tolist() for x in torch.split(frame_lengths - 1, valid_frames)]
         return wrapped_embs, wrapped_atts, end_flag_pos_list
 
     def split_data(self, samples):
@@ -363,23 +377,35 @@ class Blip2VicunaDrive(Blip2Base):
         splited_samples = {}
         split_size = samples['rgb'].size(0) // self.split_section_num_for_bev_encoder
         for key in ['rgb', 'rgb_left', 'rgb_right', 'rgb_rear', 'rgb_center', 'lidar', 'target_point','measurements']:
-            splited_samples[key] = torch.split(samples[key], split_size_or_sections=split_size, dim=0)
+            if key in samples:
+                splited_samples[key] = torch.split(samples[key], split_size_or_sections=split_size, dim=0)
         for i in range(self.split_section_num_for_bev_encoder):
             new_samples = {}
-            for key in ['rgb', 'rgb_left', 'rgb_right', 'rgb_rear', 'rgb_center', 'lidar', 'target_point', 'measurements']:
+            for key in splited_samples:
                 new_samples[key] = splited_samples[key][i]
             res.append(new_samples)
         return res
 
     def forward(self, samples, inference_mode=False, input_embeds=None):
+        if input_embeds is None and 'bev_embeddings' in samples:
+            # precomputed outputs of the frozen bev encoder (CarlaVoiceDataset with bev_embedding_cache)
+            if any(param.requires_grad for param in self.bev_encoder.parameters()):
+                raise ValueError("bev_embeddings of extract_bev_embeddings.py need a frozen bev encoder "
+                                 "(freeze_vit: True), its trainable parameters would get no gradients")
+            input_embeds = samples['bev_embeddings'].float()
         if input_embeds is None: # train mode
             device = samples["rgb"].device
             bs = samples['rgb'].size(0)
             t = samples['rgb'].size(1)
 
             for key in ['rgb', 'rgb_left', 'rgb_right', 'rgb_rear', 'rgb_center', 'lidar', 'target_point', 'measurements']:
+                if key not in samples: # views the bev encoder does not read are not loaded
+                    continue
                 shapz = samples[key].size()
                 samples[key] = samples[key].view(bs*t, *shapz[2:])
+            # uint8 views of CarlaVoiceDataset(device_preprocessing=True), preprocessed as one batch per view
+            for key, transform in samples.get('device_transforms', {}).items():
+                samples[key] = transform.batch(samples[key])
 
             if self.freeze_decoder_of_bev_encoder:
                 with torch.no_grad():
@@ -394,7 +420,7 @@ class Blip2VicunaDrive(Blip2Base):
             else:
                 with self.maybe_autocast():
                     input_embeds = self.bev_encoder(samples)
-        else: # inference mode
+        else: # inference mode or cached bev embeddings
             device = input_embeds.device
             bs = input_embeds.size(0)
             t = input_embeds.size(1)
@@ -456,7 +482,6 @@ class Blip2VicunaDrive(Blip2Base):
      
         llm_inputs, llm_attention_mask, input_part_targets_len, wp_target_index = self.concat_text_image_input(inputs_embeds, text_input_tokens.attention_mask,
                                                                                                                    input_embeds, samples['valid_frames'], end_flag_pos_list, image_atts)
-        wp_target_index = torch.tensor(wp_target_index, device=device).long()
 
         with self.maybe_autocast():
             hidden_states = self.llm_model(
@@ -512,16 +537,8 @@ class Blip2VicunaDrive(Blip2Base):
         end_loss = self.end_loss(predicted_end_prob, gt_end_flags)
 
         predicted_end = torch.argmax(predicted_end_prob, dim=1)
-        end_acc = (predicted_end == gt_end_flags).float().mean().item()
-
-        #TODO: Implement training logic
-        stage2_full = False  
-        threshold = 0.2
-        target_acc = 0.8
-
-        if waypoints_loss < threshold and end_acc > target_acc:
-            stage2_full = True
-
+        # a tensor, the training loop reads the logged values once per log interval
+        end_acc = (predicted_end == gt_end_flags).float().mean()
 
         total_loss = waypoints_loss + end_loss * 0.2
      
@@ -531,6 +548,231 @@ class Blip2VicunaDrive(Blip2Base):
 
         return {"loss": total_loss, 'waypoints_loss': waypoints_loss, 'end_loss': end_loss, 'end_acc': end_acc}
 
+    def decode_waypoints(self, hidden_states):
+        """Apply the waypoint head to hidden states of shape [..., hidden_size]."""
+        if not self.has_gru_decoder:
+            return self.waypoints_predictor(hidden_states)
+        shape = hidden_states.size()[:-1]
+        waypoints_feature = self.waypoints_fc(hidden_states.reshape(-1, self.llm_model.config.hidden_size))
+        x = torch.zeros(size=(waypoints_feature.size(0), 2), dtype=hidden_states.dtype, device=hidden_states.device)
+        output_wp = []
+        for _ in range(5):
+            waypoints_feature = self.waypoints_predictor(x, waypoints_feature)
+            x = self.waypoints_output(waypoints_feature) + x
+            output_wp.append(x)
+        return torch.cat(output_wp, dim=1).view(*shape, 10)
+
+    def reset_stream(self):
+        """Drop the cached instruction prefix and frame history used by `stream_step`."""
+        self._stream_cache = None
+
+    def _init_stream(self, text_input, device):
+        self._stream_cache = self._build_stream_cache(text_input, device)
+
+    def _build_stream_cache(self, text_input, device):
+        self.llm_tokenizer.padding_side = "right"
+        self.llm_tokenizer.truncation_side = 'left'
+        text_input_tokens = self.llm_tokenizer(
+            text_input,
+            return_tensors="pt",
+            padding="longest",
+            truncation=True,
+            max_length=self.max_txt_len,
+        ).to(device)
+        bs, n_text = text_input_tokens.input_ids.size()
+        inputs_embeds = self.llm_model.get_input_embeddings()(text_input_tokens.input_ids)
+        position_ids = torch.arange(n_text, device=device).unsqueeze(0).expand(bs, -1)
+
+        with self.maybe_autocast():
+            outputs = self.llm_model.get_decoder()(
+                inputs_embeds=inputs_embeds,
+                attention_mask=text_input_tokens.attention_mask,
+                position_ids=position_ids,
+                use_cache=True,
+                return_dict=True,
+            )
+
+        return {
+            'text_input': list(text_input),
+            'text_tokens': text_input_tokens,
+            'past_key_values': outputs.past_key_values,
+            'attention_mask': text_input_tokens.attention_mask,
+            # frames are placed right after the unpadded instruction, as in concat_text_image_input
+            'next_position': text_input_tokens.attention_mask.sum(1),
+            'num_frames': 0,
+        }
+
+    def _stream_frame_embeds(self, text_tokens, input_embeds):
+        # Q-Former + projection of one frame per sample, [bs, num_query_token, llm hidden size]
+        device = input_embeds.device
+        input_embeds = self.ln_vision(input_embeds)
+        query_tokens = self.query_tokens.expand(input_embeds.size(0), -1, -1)
+        query_atts = torch.ones(query_tokens.size()[:-1], dtype=torch.long).to(device)
+        Qformer_atts = torch.cat([query_atts, text_tokens.attention_mask], dim=1)
+        image_atts = torch.ones(input_embeds.size()[:-1], dtype=torch.long).to(device)
+        query_output = self.Qformer.bert(
+            text_tokens.input_ids,
+            attention_mask=Qformer_atts,
+            query_embeds=query_tokens,
+            encoder_hidden_states=input_embeds,
+            encoder_attention_mask=image_atts,
+            return_dict=True,
+        )
+        return self.llm_proj(query_output.last_hidden_state[:, :query_tokens.size(1), :])
+
+    @torch.no_grad()
+    def stream_step(self, samples, input_embeds, commit=True):
+        """
+        Incremental counterpart of ``forward(samples, inference_mode=True, input_embeds=...)``
+        for closed-loop driving.
+
+        The LLM key/value cache of the instruction prefix and of every committed frame is kept
+        between calls, so only the newest frame goes through the Q-Former and the LLM. The cache
+        is rebuilt when ``samples['text_input']`` changes; call `reset_stream` to start a new
+        history for the same instruction (e.g. after the end flag fired).
+
+        Args:
+            samples (dict): must contain ``text_input``, a list of instructions (one per sample).
+            input_embeds (Tensor): bev encoder output of the newest frame, [bs, n_tokens, embed_dim].
+            commit (bool): keep the frame in the cached history. Pass False for a frame that is
+                only evaluated once and replaced by the next one (see `update_and_collect` of the agent).
+
+        Returns:
+            predicted_waypoints [bs, 10] and predicted_end_prob [bs, 2] for the newest frame.
+
+        The cached history holds the instruction and the frames only: models with ``use_extra_prompt``
+        go through `forward`. Like `forward`, it does not consume ``notice_text`` / ``notice_frame_id``.
+        """
+        assert not self.use_extra_prompt, "stream_step does not wrap the frames in the extra prompt, use forward"
+        device = input_embeds.device
+        text_input = list(samples['text_input'])
+        if self._stream_cache is None or self._stream_cache['text_input'] != text_input:
+            self._init_stream(text_input, device)
+        cache = self._stream_cache
+
+        bs = input_embeds.size(0)
+        frame_embeds = self._stream_frame_embeds(cache['text_tokens'], input_embeds)
+
+        n = frame_embeds.size(1)
+        position_ids = cache['next_position'].unsqueeze(1) + torch.arange(n, device=device)
+        attention_mask = torch.cat(
+            [cache['attention_mask'], torch.ones((bs, n), dtype=cache['attention_mask'].dtype, device=device)], dim=1
+        )
+        with self.maybe_autocast():
+            outputs = self.llm_model.get_decoder()(
+                inputs_embeds=frame_embeds,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=cache['past_key_values'],
+                use_cache=True,
+                return_dict=True,
+            )
+
+        hidden_states = outputs.last_hidden_state[:, -1]
+        predicted_waypoints = self.decode_waypoints(hidden_states)
+        predicted_end_prob = self.end_predictor(hidden_states)
+
+        if commit:
+            cache['past_key_values'] = outputs.past_key_values
+            cache['attention_mask'] = attention_mask
+            cache['next_position'] = cache['next_position'] + n
+            cache['num_frames'] += 1
+
+        return predicted_waypoints, predicted_end_prob
+
+    @torch.no_grad()
+    def stream_step_batch(self, caches, text_input, input_embeds, commit):
+        """
+        `stream_step` for independent streams evaluated as one batch, e.g. the agents of
+        leaderboard/team_code/inference_server.py.
+
+        Every stream has its own cache (instruction and number of committed frames). For the LLM
+        call the cached keys/values are left-padded to the longest stream and the padding is
+        masked out, so each stream gets the result of running `stream_step` on it alone.
+
+        Args:
+            caches (list): cache of each stream as returned by the previous call, None to start a new one.
+                A stream whose instruction changed is restarted as in `stream_step`.
+            text_input (list): instruction of each stream.
+            input_embeds (Tensor): bev encoder output of the newest frame of each stream, [bs, n_tokens, embed_dim].
+            commit (list): per stream, keep the frame in its cached history.
+
+        Returns:
+            predicted_waypoints [bs, 10], predicted_end_prob [bs, 2] and the updated caches.
+        """
+        assert not self.use_extra_prompt, "stream_step_batch does not wrap the frames in the extra prompt, use forward"
+        device = input_embeds.device
+        text_input = list(text_input)
+        caches = [
+            cache if cache is not None and cache['text_input'] == [text] else self._build_stream_cache([text], device)
+            for cache, text in zip(caches, text_input)
+        ]
+
+        bs = input_embeds.size(0)
+        self.llm_tokenizer.padding_side = "right"
+        self.llm_tokenizer.truncation_side = 'left'
+        text_tokens = self.llm_tokenizer(
+            text_input,
+            return_tensors="pt",
+            padding="longest",
+            truncation=True,
+            max_length=self.max_txt_len,
+        ).to(device)
+        frame_embeds = self._stream_frame_embeds(text_tokens, input_embeds)
+
+        n = frame_embeds.size(1)
+        lengths = [cache['attention_mask'].size(1) for cache in caches]
+        past_length = max(lengths)
+        past_key_values = []
+        for layer in range(len(caches[0]['past_key_values'])):
+            # keys/values of a layer are [1, heads, length, head_dim] per stream
+            past_key_values.append(tuple(
+                torch.cat([
+                    nn.functional.pad(cache['past_key_values'][layer][k], (0, 0, past_length - length, 0))
+                    for cache, length in zip(caches, lengths)
+                ])
+                for k in range(2)
+            ))
+        attention_mask = torch.cat([
+            nn.functional.pad(cache['attention_mask'], (past_length - length, 0))
+            for cache, length in zip(caches, lengths)
+        ])
+        attention_mask = torch.cat(
+            [attention_mask, torch.ones((bs, n), dtype=attention_mask.dtype, device=device)], dim=1
+        )
+        next_position = torch.cat([cache['next_position'] for cache in caches])
+        position_ids = next_position.unsqueeze(1) + torch.arange(n, device=device)
+        with self.maybe_autocast():
+            outputs = self.llm_model.get_decoder()(
+                inputs_embeds=frame_embeds,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=tuple(past_key_values),
+                use_cache=True,
+                return_dict=True,
+            )
+
+        hidden_states = outputs.last_hidden_state[:, -1]
+        predicted_waypoints = self.decode_waypoints(hidden_states)
+        predicted_end_prob = self.end_predictor(hidden_states)
+
+        for i, cache in enumerate(caches):
+            if not commit[i]:
+                continue
+            length = lengths[i] + n
+            # clone so a stream does not keep the keys/values of the whole batch alive
+            caches[i] = dict(
+                cache,
+                past_key_values=tuple(
+                    tuple(t[i:i+1, :, -length:].clone() for t in layer) for layer in outputs.past_key_values
+                ),
+                attention_mask=attention_mask[i:i+1, -length:],
+                next_position=cache['next_position'] + n,
+                num_frames=cache['num_frames'] + 1,
+            )
+
+        return predicted_waypoints, predicted_end_prob, caches
+
     def get_optimizer_params(self, weight_decay, lr_scale=1):
         parameter_group_names = {}
         parameter_group_vars = {}
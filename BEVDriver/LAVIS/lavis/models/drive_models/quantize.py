@@ -0,0 +1,248 @@
+"""
+Weight-only quantization of the LLM of Blip2VicunaDrive for closed-loop inference.
+
+The linear layers of the LLM (attention and MLP projections, after the LoRA deltas are merged) are
+replaced by `QuantizedLinear`, which keeps the weight as int8 with one scale per output channel, or as
+int4 (two values per byte) with one scale per group of `group_size` input channels. The quantization is
+symmetric round-to-nearest and needs no calibration data; with `clip_search` the range of every group
+is shrunk to the clipping ratio with the smallest weight error, still without data. The weights are
+dequantized layer by layer in forward, so only the quantized weights stay in memory; activations,
+embeddings, norms, the heads of the driving model and the bev encoder are unchanged.
+
+`compare_waypoints` runs a quantized model and its floating point reference on the same clips, see
+LAVIS/evaluate_quantization.py.
+"""
+
+import time
+
+import peft
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# bits and default group size (None: one group per output channel) of the weight formats
+WEIGHT_FORMATS = {"int8": (8, None), "int4": (4, 128)}
+# clipping ratios tried per group with clip_search
+CLIP_RATIOS = (1.0, 0.95, 0.9, 0.85, 0.8, 0.75)
+
+
+def quantize_weight(weight, bits, group_size, clip_search=False):
+    """
+    Symmetric round-to-nearest quantization of a [out_features, in_features] weight.
+
+    Returns:
+        (int8 tensor [out_features, in_features] of the values, scales [out_features, groups] in the
+        dtype of weight).
+    """
+    out_features, in_features = weight.shape
+    group_size = min(group_size or in_features, in_features)
+    if in_features % group_size:
+        raise ValueError("in_features %d is not a multiple of the group size %d" % (in_features, group_size))
+    qmax = 2 ** (bits - 1) - 1
+    groups = weight.float().view(out_features, in_features // group_size, group_size)
+    absmax = groups.abs().amax(dim=2, keepdim=True).clamp(min=1e-8)
+
+    best_scale, best_error = None, None
+    for ratio in CLIP_RATIOS if clip_search else CLIP_RATIOS[:1]:
+        scale = absmax * ratio / qmax
+        error = ((groups / scale).round().clamp(-qmax - 1, qmax) * scale - groups).pow(2).sum(dim=2, keepdim=True)
+        if best_scale is None:
+            best_scale, best_error = scale, error
+        else:
+            better = error < best_error
+            best_scale = torch.where(better, scale, best_scale)
+            best_error = torch.where(better, error, best_error)
+    # the values of the scales as stored, in the dtype of the weight
+    scale = best_scale.to(weight.dtype).float()
+    values = (groups / scale).round().clamp(-qmax - 1, qmax).to(torch.int8)
+    return values.view(out_features, in_features), scale.squeeze(2).to(weight.dtype)
+
+
+def pack_int4(values):
+    """ int8 values in [-8, 7] as uint8 [..., n / 2], the even columns in the low nibbles"""
+    values = (values + 8).to(torch.uint8)
+    return values[..., 0::2] | (values[..., 1::2] << 4)
+
+
+def unpack_int4(packed):
+    low = (packed & 0x0F).to(torch.int8) - 8
+    high = (packed >> 4).to(torch.int8) - 8
+    return torch.stack([low, high], dim=-1).view(*packed.shape[:-1], packed.size(-1) * 2)
+
+
+class QuantizedLinear(nn.Module):
+    """
+    nn.Linear with a weight-only int8 or grouped int4 weight. forward dequantizes the weight into the
+    dtype of the scales (that of the original weight) and computes the linear layer in the dtype of the
+    input, as nn.Linear under autocast does.
+    """
+
+    def __init__(self, in_features, out_features, bits=8, group_size=None, bias=True, dtype=torch.float32, device=None):
+        super().__init__()
+        if bits not in (4, 8):
+            raise ValueError("bits must be 8 or 4, got %s" % bits)
+        self.in_features = in_features
+        self.out_features = out_features
+        self.bits = bits
+        # layers narrower than a group have one group per output channel
+        self.group_size = min(group_size or in_features, in_features)
+        columns = in_features if bits == 8 else in_features // 2
+        self.register_buffer("qweight", torch.zeros(out_features, columns, dtype=torch.int8 if bits == 8 else torch.uint8, device=device))
+        self.register_buffer("scales", torch.ones(out_features, in_features // self.group_size, dtype=dtype, device=device))
+        self.bias = nn.Parameter(torch.zeros(out_features, dtype=dtype, device=device), requires_grad=False) if bias else None
+
+    @classmethod
+    def from_linear(cls, linear, bits=8, group_size=None, clip_search=False):
+        weight = linear.weight.detach()
+        module = cls(linear.in_features, linear.out_features, bits, group_size, linear.bias is not None,
+                     dtype=weight.dtype, device=weight.device)
+        values, scales = quantize_weight(weight, bits, module.group_size, clip_search)
+        module.qweight.copy_(values if bits == 8 else pack_int4(values))
+        module.scales.copy_(scales)
+        if linear.bias is not None:
+            module.bias.data.copy_(linear.bias.detach())
+        return module
+
+    def dequantize(self):
+        values = self.qweight if self.bits == 8 else unpack_int4(self.qweight)
+        groups = values.view(self.out_features, -1, self.group_size) * self.scales.unsqueeze(2)
+        return groups.view(self.out_features, self.in_features)
+
+    @property
+    def weight(self):
+        # the code paths that slice the weight (pretraining_tp > 1 of LLaMA)
+        return self.dequantize()
+
+    def forward(self, x):
+        bias = self.bias.to(x.dtype) if self.bias is not None else None
+        return F.linear(x, self.dequantize().to(x.dtype), bias)
+
+    def extra_repr(self):
+        return "in_features=%d, out_features=%d, bits=%d, group_size=%d, bias=%s" % (
+            self.in_features, self.out_features, self.bits, self.group_size, self.bias is not None)
+
+
+def module_nbytes(module):
+    """ bytes of the parameters and buffers of a module, shared tensors counted once"""
+    seen, total = set(), 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        if tensor.data_ptr() in seen:
+            continue
+        seen.add(tensor.data_ptr())
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def quantize_llm(model, weight_format="int8", group_size=None, clip_search=False, skip_modules=("lm_head",)):
+    """
+    Replaces the linear layers of the LLM of a Blip2VicunaDrive with QuantizedLinear, in place. A PEFT
+    LoRA model is merged first (a model of load_deploy_model already is).
+
+    Args:
+        weight_format (str): "int8" (one scale per output channel) or "int4" (grouped).
+        group_size (int): input channels per scale, the default of the format if None.
+        clip_search (bool): search the clipping ratio of every group that minimizes the weight error.
+        skip_modules (tuple): names of linear layers kept in floating point, the output head by default.
+
+    Returns:
+        dict of the format, the number of quantized layers and the bytes of the LLM before and after.
+    """
+    if weight_format not in WEIGHT_FORMATS:
+        raise ValueError("unknown weight format %s, expected one of %s" % (weight_format, ", ".join(WEIGHT_FORMATS)))
+    bits, default_group_size = WEIGHT_FORMATS[weight_format]
+    group_size = group_size or default_group_size
+    if isinstance(model.llm_model, peft.PeftModel):
+        model.llm_model = model.llm_model.merge_and_unload()
+        model.has_lora = False
+
+    llm_model = model.llm_model
+    nbytes = module_nbytes(llm_model)
+    linears = [(name, module) for name, module in llm_model.named_modules()
+               if isinstance(module, nn.Linear) and name.split(".")[-1] not in skip_modules]
+    for name, linear in linears:
+        parent_name, _, child = name.rpartition(".")
+        parent = llm_model.get_submodule(parent_name) if parent_name else llm_model
+        setattr(parent, child, QuantizedLinear.from_linear(linear, bits, group_size, clip_search))
+    return {
+        "format": weight_format,
+        "group_size": group_size,
+        "layers": len(linears),
+        "llm_bytes": nbytes,
+        "quantized_llm_bytes": module_nbytes(llm_model),
+    }
+
+
+class LLMTimer:
+    """ wall time and number of input tokens of the forward passes of an LLM"""
+
+    def __init__(self, llm_model):
+        self.seconds = 0.0
+        self.tokens = 0
+        self._start = None
+        self._handles = [
+            llm_model.register_forward_pre_hook(self._before, with_kwargs=True),
+            llm_model.register_forward_hook(self._after),
+        ]
+
+    def _sync(self, tensor):
+        if tensor.is_cuda:
+            torch.cuda.synchronize(tensor.device)
+
+    def _before(self, module, args, kwargs):
+        embeds = kwargs.get("inputs_embeds")
+        if embeds is None:
+            embeds = kwargs.get("input_ids", args[0] if args else None)
+        self._sync(embeds)
+        self.tokens += embeds.shape[0] * embeds.shape[1]
+        self._start = time.perf_counter()
+
+    def _after(self, module, args, output):
+        hidden_states = output[0] if isinstance(output, (tuple, list)) else output
+        self._sync(hidden_states)
+        self.seconds += time.perf_counter() - self._start
+
+    def remove(self):
+        for handle in self._handles:
+            handle.remove()
+
+
+def compare_waypoints(model, clips, reference=None):
+    """
+    Waypoint errors of a model on collated clips (e.g. CarlaVoiceDataset.collater of single samples).
+
+    Args:
+        model (Blip2VicunaDrive): the model to evaluate.
+        clips (list): collated samples with local_future_waypoints, left unchanged.
+        reference (list): predicted waypoints per clip of the reference model (the "predictions" of an
+            earlier call), to compare with.
+
+    Returns:
+        dict: predictions, mean L1 to the ground truth (l1), to the reference (l1_reference, if given),
+        LLM tokens/s and bytes of the model and of its LLM.
+    """
+    timer = LLMTimer(model.llm_model)
+    predictions, errors, reference_errors = [], [], []
+    try:
+        with torch.no_grad():
+            for i, clip in enumerate(clips):
+                # forward reshapes the tensors of the samples dict in place
+                samples = dict(clip)
+                waypoints, _ = model(samples, inference_mode=True)
+                waypoints = waypoints.float()
+                target = model.build_gt_waypoints(clip["local_future_waypoints"], clip["valid_frames"]).to(waypoints)
+                predictions.append(waypoints.cpu())
+                errors.append((waypoints - target).abs().mean().item())
+                if reference is not None:
+                    reference_errors.append((waypoints.cpu() - reference[i]).abs().mean().item())
+    finally:
+        timer.remove()
+    result = {
+        "predictions": predictions,
+        "l1": sum(errors) / len(errors),
+        "tokens_per_second": timer.tokens / timer.seconds if timer.seconds else 0.0,
+        "model_bytes": module_nbytes(model),
+        "llm_bytes": module_nbytes(model.llm_model),
+    }
+    if reference is not None:
+        result["l1_reference"] = sum(reference_errors) / len(reference_errors)
+    return result
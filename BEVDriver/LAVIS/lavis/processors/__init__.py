@@ -7,27 +7,23 @@
 
 from lavis.processors.base_processor import BaseProcessor
 
-from lavis.processors.alpro_processors import (
-    AlproVideoTrainProcessor,
-    AlproVideoEvalProcessor,
-)
-from lavis.processors.blip_processors import (
-    BlipImageTrainProcessor,
-    Blip2ImageTrainProcessor,
-    BlipImageEvalProcessor,
-    BlipCaptionProcessor,
-)
-from lavis.processors.blip_diffusion_processors import (
-    BlipDiffusionInputImageProcessor,
-    BlipDiffusionTargetImageProcessor,
-)
-from lavis.processors.gpt_processors import (
-    GPTVideoFeatureProcessor,
-    GPTDialogueProcessor,
-)
-from lavis.processors.clip_processors import ClipImageTrainProcessor
-
-from lavis.common.registry import registry
+from lavis.common.registry import lazy_module_getattr, registry
+
+# the processors, imported on first use (the registry imports a processor on its first lookup)
+_module_of_name = {
+    "AlproVideoTrainProcessor": "lavis.processors.alpro_processors",
+    "AlproVideoEvalProcessor": "lavis.processors.alpro_processors",
+    "BlipImageTrainProcessor": "lavis.processors.blip_processors",
+    "Blip2ImageTrainProcessor": "lavis.processors.blip_processors",
+    "BlipImageEvalProcessor": "lavis.processors.blip_processors",
+    "BlipCaptionProcessor": "lavis.processors.blip_processors",
+    "BlipDiffusionInputImageProcessor": "lavis.processors.blip_diffusion_processors",
+    "BlipDiffusionTargetImageProcessor": "lavis.processors.blip_diffusion_processors",
+    "GPTVideoFeatureProcessor": "lavis.processors.gpt_processors",
+    "GPTDialogueProcessor": "lavis.processors.gpt_processors",
+    "ClipImageTrainProcessor": "lavis.processors.clip_processors",
+}
+__getattr__ = lazy_module_getattr(__name__, _module_of_name)
 
 __all__ = [
     "BaseProcessor",
@@ -28,6 +28,7 @@ from lavis.common.utils import is_url
 from lavis.datasets.data_utils import concat_datasets, reorg_datasets_by_split
 from lavis.datasets.datasets.dataloader_utils import (
     IterLoader,
+    LengthGroupedBatchSampler,
     MultiIterLoader,
     PrefetchLoader,
 )
@@ -325,6 +326,11 @@ class RunnerBase:
     def use_dist_eval_sampler(self):
         return self.config.run_cfg.get("use_dist_eval_sampler", True)
 
+    @property
+    def group_by_length(self):
+        # batch training samples of similar length, for datasets with clip_lengths()
+        return self.config.run_cfg.get("group_by_length", False)
+
     @property
     def resume_ckpt_path(self):
         return self.config.run_cfg.get("resume_ckpt_path", None)
@@ -518,6 +524,22 @@ class RunnerBase:
                         pin_memory=True,
                     )
                 )
+            elif is_train and self.group_by_length and hasattr(dataset, "clip_lengths"):
+                batch_sampler = LengthGroupedBatchSampler(
+                    dataset.clip_lengths(),
+                    batch_size=bsz,
+                    num_replicas=get_world_size() if self.use_distributed else 1,
+                    rank=get_rank() if self.use_distributed else 0,
+                    drop_last=True,
+                )
+                loader = DataLoader(
+                    dataset,
+                    batch_sampler=batch_sampler,
+                    num_workers=num_workers,
+                    pin_memory=True,
+                    collate_fn=collate_fn,
+                )
+                loader = IterLoader(PrefetchLoader(loader), use_distributed=self.use_distributed)
             else:
                 # map-style dataset are concatenated together
                 # setup distributed sampler
@@ -5,19 +5,25 @@
  For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
 """
 
-from lavis.common.registry import registry
+from lavis.common.registry import lazy_module_getattr, registry
 from lavis.tasks.base_task import BaseTask
-from lavis.tasks.captioning import CaptionTask
-from lavis.tasks.image_text_pretrain import ImageTextPretrainTask
-from lavis.tasks.multimodal_classification import (
-    MultimodalClassificationTask,
-)
-from lavis.tasks.retrieval import RetrievalTask
-from lavis.tasks.vqa import VQATask, GQATask, AOKVQATask
-from lavis.tasks.vqa_reading_comprehension import VQARCTask, GQARCTask
-from lavis.tasks.dialogue import DialogueTask
-from lavis.tasks.text_to_image_generation import TextToImageGenerationTask
-from lavis.tasks.drive import DriveTask
+
+# the tasks, imported on first use (the registry imports a task on its first lookup)
+_module_of_name = {
+    "CaptionTask": "lavis.tasks.captioning",
+    "ImageTextPretrainTask": "lavis.tasks.image_text_pretrain",
+    "MultimodalClassificationTask": "lavis.tasks.multimodal_classification",
+    "RetrievalTask": "lavis.tasks.retrieval",
+    "VQATask": "lavis.tasks.vqa",
+    "GQATask": "lavis.tasks.vqa",
+    "AOKVQATask": "lavis.tasks.vqa",
+    "VQARCTask": "lavis.tasks.vqa_reading_comprehension",
+    "GQARCTask": "lavis.tasks.vqa_reading_comprehension",
+    "DialogueTask": "lavis.tasks.dialogue",
+    "TextToImageGenerationTask": "lavis.tasks.text_to_image_generation",
+    "DriveTask": "lavis.tasks.drive",
+}
+__getattr__ = lazy_module_getattr(__name__, _module_of_name)
 
 
 def setup_task(cfg):
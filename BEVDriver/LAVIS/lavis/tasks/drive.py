@@ -15,6 +15,8 @@ from lavis.common.logger import MetricLogger, SmoothedValue
 from lavis.common.registry import registry
 from lavis.datasets.data_utils import prepare_sample
 from lavis.tasks.base_task import BaseTask
+from timm.models import get_model_default_value
+from timm.utils import DeviceScalars
 
 
 @registry.register_task("carla_drive")
@@ -52,10 +54,22 @@ class DriveTask(BaseTask):
 
         assert len(datasets_config) > 0, "At least one dataset has to be specified."
 
+        # sensors read by the bev encoder, the datasets skip loading the others
+        input_keys = get_model_default_value(cfg.model_cfg.get("encoder_model", ""), "input_keys")
+        # the encoder the precomputed bev embeddings have to come from, as extract_bev_embeddings.py records it
+        bev_embedding_encoder = {
+            "encoder_model": cfg.model_cfg.get("encoder_model", ""),
+            "encoder_model_ckpt": cfg.model_cfg.get("encoder_model_ckpt", ""),
+        }
+
         for name in datasets_config:
             dataset_config = datasets_config[name]
 
             builder = registry.get_builder_class(name)(dataset_config)
+            if hasattr(builder, "input_keys"):
+                builder.input_keys = input_keys
+            if hasattr(builder, "bev_embedding_encoder"):
+                builder.bev_embedding_encoder = bev_embedding_encoder
             dataset = builder.build_datasets()
 
             datasets[name] = dataset
@@ -220,6 +234,8 @@ class DriveTask(BaseTask):
             )
         )
         header = "Train: data epoch: [{}]".format(epoch)
+        # loss_dict and lr of every iteration, written to tensorboard and the metric logger on the log steps
+        pending = DeviceScalars()
         if start_iters is None:
             # epoch-based runner
             inner_epoch = epoch
@@ -250,12 +266,7 @@ class DriveTask(BaseTask):
                 loss, loss_dict = self.train_step(model=model, samples=samples)
                 loss /= accum_grad_iters #TODO: not affect loss_dict values for logging
 
-            if is_main_process():
-                for key in loss_dict:
-                    if isinstance(loss_dict[key], float) or isinstance(loss_dict[key], int):
-                        writer.add_scalar('train/%s_iter' % key, loss_dict[key], epoch*iters_per_epoch+i)
-                    else:
-                        writer.add_scalar('train/%s_iter' % key, loss_dict[key].item(), epoch*iters_per_epoch+i)
+            pending.append(i, dict(loss_dict, lr=optimizer.param_groups[0]["lr"]))
 
             # after_train_step()
             if use_amp:
@@ -272,8 +283,15 @@ class DriveTask(BaseTask):
                     optimizer.step()
                 optimizer.zero_grad()
 
-            metric_logger.update(**loss_dict)
-            metric_logger.update(lr=optimizer.param_groups[0]["lr"])
+            # the iterations log_every prints after, one copy to the host for all pending values
+            if i % log_freq == 0 or i == iters_per_epoch - 1:
+                for step, values in pending.flush():
+                    lr = values.pop("lr")
+                    if is_main_process():
+                        for key in values:
+                            writer.add_scalar('train/%s_iter' % key, values[key], epoch*iters_per_epoch+step)
+                    metric_logger.update(**values)
+                    metric_logger.update(lr=lr)
 
         # after train_epoch()
         # gather the stats from all processes
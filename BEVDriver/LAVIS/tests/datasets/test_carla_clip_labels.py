@@ -0,0 +1,125 @@
+"""
+Parity tests for the vectorized clip label builder used by CarlaVoiceDataset.
+"""
+
+import numpy as np
+import pytest
+
+from timm.data.carla_measurements import MEASUREMENT_DTYPE, build_clip_labels, measurement_features
+
+TOKEN_MAX_LENGTH = 40
+
+
+def make_route(frames, seed=0):
+    rng = np.random.default_rng(seed)
+    route = np.zeros(frames, dtype=MEASUREMENT_DTYPE)
+    route["theta"] = np.cumsum(rng.normal(0, 0.05, frames))
+    route["theta"][rng.random(frames) < 0.05] = np.nan
+    route["speed"] = np.abs(rng.normal(5, 1, frames))
+    route["gps_x"] = np.cumsum(np.cos(route["theta"]) * 0.3)
+    route["gps_y"] = np.cumsum(np.sin(route["theta"]) * 0.3)
+    route["gps_x"][np.isnan(route["gps_x"])] = 0
+    route["gps_y"][np.isnan(route["gps_y"])] = 0
+    route["x_command"] = route["gps_x"] + rng.normal(0, 20, frames)
+    route["y_command"] = route["gps_y"] + rng.normal(0, 20, frames)
+    route["command"] = rng.integers(-1, 7, frames)
+    route["throttle"] = rng.uniform(0, 0.75, frames)
+    route["steer"] = rng.normal(0, 0.1, frames)
+    route["brake"] = rng.random(frames) < 0.1
+    return route
+
+
+def reference_clip_labels(measurements, start_frame_id, end_frame_id, sample_interval, route_frames):
+    # the per-frame loop CarlaVoiceDataset.__getitem__ used before build_clip_labels
+    def pad_and_stack(data):
+        if isinstance(data[0], np.ndarray):
+            for _ in range(TOKEN_MAX_LENGTH - len(data)):
+                data.append(np.zeros(data[0].shape, dtype=data[0].dtype))
+            return np.stack(data, 0)
+        for _ in range(TOKEN_MAX_LENGTH - len(data)):
+            data.append(0)
+        return np.array(data).reshape(-1)
+
+    ego_theta = measurements[start_frame_id]['theta']
+    if np.isnan(ego_theta):
+        ego_theta = 0
+    R = np.array(
+        [[np.cos(np.pi / 2 + ego_theta), -np.sin(np.pi / 2 + ego_theta)],
+        [np.sin(np.pi / 2 + ego_theta), np.cos(np.pi / 2 + ego_theta)]])
+    origin_x = measurements[start_frame_id]['gps_x']
+    origin_y = measurements[start_frame_id]['gps_y']
+
+    labels = {k: [] for k in [
+        'ego_throttles', 'ego_steers', 'ego_brakes', 'ego_velocitys', 'local_positions',
+        'local_future_waypoints', 'target_points', 'measurements', 'text_before_img',
+    ]}
+    for frame_id in range(start_frame_id, end_frame_id, sample_interval):
+        ego_x = measurements[frame_id]['gps_x']
+        ego_y = measurements[frame_id]['gps_y']
+        local_position = R.T.dot(np.array([ego_x - origin_x, ego_y - origin_y]))
+        labels['text_before_img'].append('<frame %.1f,%.1f>' % (local_position[0], local_position[1]))
+        labels['ego_throttles'].append(measurements[frame_id]['throttle'])
+        labels['ego_steers'].append(measurements[frame_id]['steer'])
+        labels['ego_brakes'].append(int(measurements[frame_id]['brake']))
+        labels['ego_velocitys'].append(measurements[frame_id]['speed'])
+        labels['local_positions'].append(local_position.reshape(-1))
+        local_ego_theta = measurements[frame_id]['theta']
+        if np.isnan(local_ego_theta):
+            local_ego_theta = 0
+        local_R = np.array(
+            [[np.cos(np.pi / 2 + local_ego_theta), -np.sin(np.pi / 2 + local_ego_theta)],
+            [np.sin(np.pi / 2 + local_ego_theta), np.cos(np.pi / 2 + local_ego_theta)]])
+        x_command = measurements[frame_id]["x_command"]
+        y_command = measurements[frame_id]["y_command"]
+        labels['target_points'].append(local_R.T.dot(np.array([x_command - ego_x, y_command - ego_y])))
+
+        future = []
+        for future_frame_delta in range(1, 6):
+            future_frame_id = min(frame_id + future_frame_delta * 5, route_frames - 1)
+            future_waypoint = np.array([
+                measurements[future_frame_id]['gps_x'] - ego_x,
+                measurements[future_frame_id]['gps_y'] - ego_y,
+            ])
+            future.append(local_R.T.dot(future_waypoint).reshape(1, 2))
+        labels['local_future_waypoints'].append(np.concatenate(future, axis=0).reshape(-1))
+
+        cmd_one_hot = [0, 0, 0, 0, 0, 0]
+        cmd = measurements[frame_id]["command"] - 1
+        if cmd < 0:
+            cmd = 3
+        cmd_one_hot[cmd] = 1
+        cmd_one_hot.append(measurements[frame_id]["speed"])
+        labels['measurements'].append(np.array(cmd_one_hot, dtype=np.float32))
+
+    for key in labels:
+        if key != 'text_before_img':
+            labels[key] = pad_and_stack(labels[key])
+    return labels
+
+
+class TestCarlaClipLabels:
+    @pytest.mark.parametrize("sample_interval", [1, 2, 3])
+    def test_matches_reference_loop(self, sample_interval):
+        route_frames = 300
+        route = make_route(route_frames)
+        rng = np.random.default_rng(sample_interval)
+        for _ in range(50):
+            start = int(rng.integers(0, route_frames - 2))
+            end = min(route_frames, start + int(rng.integers(1, TOKEN_MAX_LENGTH * sample_interval)))
+            frame_ids = np.arange(start, end, sample_interval)
+
+            expected = reference_clip_labels(route, start, end, sample_interval, route_frames)
+            labels = build_clip_labels(route, frame_ids, route_frames, TOKEN_MAX_LENGTH)
+
+            for key, value in labels.items():
+                assert value.shape == expected[key].shape, key
+                assert value.dtype == expected[key].dtype, key
+                np.testing.assert_allclose(value, expected[key], rtol=0, atol=1e-9, err_msg=key)
+            text = ['<frame %.1f,%.1f>' % (x, y) for x, y in labels['local_positions'][:len(frame_ids)].tolist()]
+            assert text == expected['text_before_img']
+
+    def test_measurement_features_command_mapping(self):
+        features = measurement_features(np.array([-1, 0, 1, 4, 6]), np.array([1.0, 2.0, 3.0, 4.0, 5.0]))
+        assert features.dtype == np.float32
+        np.testing.assert_array_equal(features[:, :6].argmax(1), [3, 3, 0, 3, 5])
+        np.testing.assert_array_equal(features[:, 6], [1, 2, 3, 4, 5])
@@ -0,0 +1,254 @@
+"""
+Parity tests for the detection targets of the CARLA datasets (timm/data/heatmap_utils.py generate_heatmap,
+timm/data/det_utils.py generate_det_data).
+"""
+
+import copy
+import math
+
+import cv2
+import numpy as np
+import pytest
+from skimage.measure import block_reduce
+
+from timm.data.det_utils import generate_det_data
+from timm.data.heatmap_utils import ActorArrays, generate_heatmap
+
+
+def reference_get_yaw_angle(forward_vector):
+    forward_vector = forward_vector / np.linalg.norm(forward_vector)
+    yaw = math.acos(forward_vector[0])
+    if forward_vector[1] < 0:
+        yaw = 2 * np.pi - yaw
+    return yaw
+
+
+def reference_add_rect(img, loc, ori, box, value, pixels_per_meter, max_distance, color):
+    vet_ori = np.array([-ori[1], ori[0]])
+    hor_offset = box[0] * ori
+    vet_offset = box[1] * vet_ori
+    left_up = (loc + hor_offset + vet_offset + max_distance) * pixels_per_meter
+    left_down = (loc + hor_offset - vet_offset + max_distance) * pixels_per_meter
+    right_up = (loc - hor_offset + vet_offset + max_distance) * pixels_per_meter
+    right_down = (loc - hor_offset - vet_offset + max_distance) * pixels_per_meter
+    left_up = list(np.around(left_up).astype(int))
+    left_down = list(np.around(left_down).astype(int))
+    right_down = list(np.around(right_down).astype(int))
+    right_up = list(np.around(right_up).astype(int))
+    color = [int(x) for x in value * color]
+    cv2.fillConvexPoly(img, np.array([left_up, left_down, right_down, right_up]), color)
+    return img
+
+
+def reference_generate_heatmap(measurements, actors_data, pixels_per_meter=5, max_distance=18):
+    # the per-actor implementation the datasets used before ActorArrays (mutates its arguments)
+    img_size = max_distance * pixels_per_meter * 2
+    img = np.zeros((img_size, img_size, 3), int)
+    ego_x = measurements["x"]
+    ego_y = measurements["y"]
+    ego_theta = measurements["theta"]
+    R = np.array([[np.cos(ego_theta), -np.sin(ego_theta)], [np.sin(ego_theta), np.cos(ego_theta)]])
+    ego_id = None
+    for _id in actors_data:
+        color = np.array([1, 1, 1])
+        if actors_data[_id]["tpe"] == 2:
+            if int(_id) == int(measurements["affected_light_id"]):
+                if actors_data[_id]["sta"] == 0:
+                    color = np.array([1, 1, 1])
+                else:
+                    color = np.array([0, 0, 0])
+                yaw = reference_get_yaw_angle(actors_data[_id]["ori"])
+                TR = np.array([[np.cos(yaw), np.sin(yaw)], [-np.sin(yaw), np.cos(yaw)]])
+                actors_data[_id]["loc"] = np.array(actors_data[_id]["loc"][:2]) + TR.T.dot(
+                    np.array(actors_data[_id]["taigger_loc"])[:2]
+                )
+                actors_data[_id]["ori"] = np.array(actors_data[_id]["ori"])
+                actors_data[_id]["box"] = np.array(actors_data[_id]["trigger_box"]) * 2
+            else:
+                continue
+        raw_loc = actors_data[_id]["loc"]
+        if (raw_loc[0] - ego_x) ** 2 + (raw_loc[1] - ego_y) ** 2 <= 1:
+            ego_id = _id
+            color = np.array([0, 1, 1])
+        new_loc = R.T.dot(np.array([raw_loc[0] - ego_x, raw_loc[1] - ego_y]))
+        actors_data[_id]["loc"] = np.array(new_loc)
+        raw_ori = actors_data[_id]["ori"]
+        new_ori = R.T.dot(np.array([raw_ori[0], raw_ori[1]]))
+        actors_data[_id]["ori"] = np.array(new_ori)
+        actors_data[_id]["box"] = np.array(actors_data[_id]["box"])
+        if int(_id) in measurements["is_vehicle_present"]:
+            color = np.array([1, 1, 1])
+        elif int(_id) in measurements["is_bike_present"]:
+            color = np.array([1, 1, 1])
+        elif int(_id) in measurements["is_junction_vehicle_present"]:
+            color = np.array([1, 1, 1])
+        elif int(_id) in measurements["is_pedestrian_present"]:
+            color = np.array([1, 1, 1])
+        actors_data[_id]["color"] = color
+
+    if ego_id is not None and ego_id in actors_data:
+        del actors_data[ego_id]
+    for _id in actors_data:
+        if actors_data[_id]["tpe"] == 2:
+            continue
+        act_img = np.zeros((img_size, img_size, 3), np.uint8)
+        box = actors_data[_id]["box"]
+        if box[0] < 1.5:
+            box = box * 1.5
+        act_img = reference_add_rect(
+            act_img, actors_data[_id]["loc"][:2], actors_data[_id]["ori"][:2], box + 0, 255,
+            pixels_per_meter, max_distance, actors_data[_id]["color"],
+        )
+        act_img = np.clip(act_img, 0, 255)
+        img = img + act_img
+    img = np.clip(img, 0, 255)
+    return img.astype(np.uint8)[:, :, 0]
+
+
+def reference_generate_det_data(heatmap, measurements, actors_data, pixels_per_meter=5, max_distance=18):
+    # the per-cell implementation the datasets used before ActorArrays (mutates its arguments)
+    traffic_heatmap = block_reduce(heatmap, block_size=(5, 5), func=np.mean)
+    traffic_heatmap = np.clip(traffic_heatmap, 0.0, 255.0)
+    traffic_heatmap = traffic_heatmap[:20, 8:28]
+    det_data = np.zeros((20, 20, 7))
+    ego_x = measurements["x"]
+    ego_y = measurements["y"]
+    ego_theta = measurements["theta"]
+    R = np.array([[np.cos(ego_theta), -np.sin(ego_theta)], [np.sin(ego_theta), np.cos(ego_theta)]])
+    need_deleted_ids = []
+    for _id in actors_data:
+        raw_loc = actors_data[_id]["loc"]
+        new_loc = R.T.dot(np.array([raw_loc[0] - ego_x, raw_loc[1] - ego_y]))
+        new_loc[1] = -new_loc[1]
+        actors_data[_id]["loc"] = np.array(new_loc)
+        raw_ori = actors_data[_id]["ori"]
+        new_ori = R.T.dot(np.array([raw_ori[0], raw_ori[1]]))
+        dis = new_loc[0] ** 2 + new_loc[1] ** 2
+        if dis <= 1 or dis >= (max_distance + 3) ** 2 * 2 or "box" not in actors_data[_id]:
+            need_deleted_ids.append(_id)
+            continue
+        actors_data[_id]["ori"] = np.array(new_ori)
+        actors_data[_id]["box"] = np.array(actors_data[_id]["box"])
+    for _id in need_deleted_ids:
+        del actors_data[_id]
+
+    for i in range(20):
+        for j in range(20):
+            if traffic_heatmap[i][j] < 0.05 * 255.0:
+                continue
+            center_x, center_y = j - 9.5, 17.5 - i
+            min_dis = 1000
+            min_id = None
+            for _id in actors_data:
+                loc = actors_data[_id]["loc"][:2]
+                dis = (loc[0] - center_x) ** 2 + (loc[1] - center_y) ** 2
+                if dis < min_dis:
+                    min_dis = dis
+                    min_id = _id
+            loc = actors_data[min_id]["loc"][:2]
+            ori = actors_data[min_id]["ori"][:2]
+            box = actors_data[min_id]["box"]
+            theta = (reference_get_yaw_angle(ori) / np.pi + 2) % 2
+            speed = np.linalg.norm(actors_data[min_id]["vel"])
+            prob = np.power(0.5 / max(0.5, np.sqrt(min_dis)), 0.5)
+            det_data[i][j] = np.array([
+                prob, (loc[0] - center_x) / 3.5, (loc[1] - center_y) / 3.5, theta / 2.0,
+                box[0] / 3.5, box[1] / 2.0, speed / 8.0,
+            ])
+    return det_data
+
+
+def make_frame(num_actors, seed=0):
+    """
+    measurements and actors_data of a frame as written by auto_pilot.collect_actor_data: vehicles and
+    walkers around the ego vehicle (which is one of the actors), hazards and traffic lights
+    """
+    rng = np.random.default_rng(seed)
+    ego = rng.uniform(-200, 200, 2)
+    theta = float(rng.uniform(-np.pi, np.pi))
+    actors_data = {}
+    ids = rng.choice(100000, num_actors + 4, replace=False)
+    for k, _id in enumerate(ids[:num_actors]):
+        walker = rng.random() < 0.3
+        ori = rng.normal(size=3)
+        ori[2] *= 0.05
+        actors_data[str(_id)] = {
+            "loc": [*(ego + rng.uniform(-30, 30, 2)), 0.5],
+            "ori": list(ori / np.linalg.norm(ori)),
+            "box": [0.4, 0.4] if walker else list(rng.uniform([1.5, 0.8], [3.0, 1.3])),
+            "vel": list(rng.normal(size=3) * 5),
+            "tpe": 1 if walker else 0,
+        }
+    # the ego vehicle and a parked actor next to it
+    ego_id = str(ids[num_actors])
+    actors_data[ego_id] = {
+        "loc": [*ego, 0.5], "ori": [np.cos(theta), np.sin(theta), 0.0], "box": [2.4, 1.0],
+        "vel": [1.0, 0.0, 0.0], "tpe": 0,
+    }
+    actors_data[str(ids[num_actors + 1])] = {
+        "loc": [*(ego + 0.5), 0.5], "ori": [0.0, 1.0, 0.0], "box": [2.0, 1.0], "vel": [0.0, 0.0, 0.0], "tpe": 0,
+    }
+    for _id in ids[num_actors + 2:]:
+        actors_data[str(_id)] = {
+            "loc": [*(ego + rng.uniform(-20, 20, 2)), 3.0], "ori": list(rng.normal(size=3)), "sta": int(rng.integers(0, 3)),
+            "tpe": 2, "taigger_loc": list(rng.uniform(-5, 5, 3)), "trigger_ori": [1.0, 0.0, 0.0],
+            "trigger_box": [1.5, 2.0],
+        }
+    keys = list(actors_data)
+    rng.shuffle(keys)
+    actors_data = {key: actors_data[key] for key in keys}
+
+    present = [int(_id) for _id in rng.choice(ids[:num_actors], min(3, num_actors), replace=False)]
+    measurements = {
+        "x": float(ego[0]), "y": float(ego[1]), "theta": theta, "affected_light_id": int(ids[-1]),
+        "is_vehicle_present": present[:1], "is_bike_present": present[1:2],
+        "is_junction_vehicle_present": [], "is_pedestrian_present": present[2:],
+    }
+    return measurements, actors_data
+
+
+def assert_det_data_equal(actual, expected):
+    # same cells; yaw, speed and prob can differ in the last bit (np.arccos / np.linalg.norm over rows)
+    np.testing.assert_array_equal(actual[..., 0] > 0, expected[..., 0] > 0)
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-12)
+
+
+class TestDetTargets:
+    @pytest.mark.parametrize("num_actors", [0, 1, 10, 50, 200])
+    @pytest.mark.parametrize("seed", range(5))
+    def test_matches_reference(self, num_actors, seed):
+        measurements, actors_data = make_frame(num_actors, seed)
+        untouched = copy.deepcopy((measurements, actors_data))
+        expected_heatmap = reference_generate_heatmap(*copy.deepcopy((measurements, actors_data)))
+
+        actors = ActorArrays(actors_data)
+        heatmap = generate_heatmap(measurements, actors)
+        np.testing.assert_array_equal(heatmap, expected_heatmap)
+        det_data = generate_det_data(heatmap, measurements, actors)
+        if num_actors >= 50:
+            assert det_data[..., 0].any()
+        assert_det_data_equal(det_data, reference_generate_det_data(heatmap, *copy.deepcopy((measurements, actors_data))))
+        # plain dicts are accepted as well and nothing is modified
+        np.testing.assert_array_equal(generate_heatmap(measurements, actors_data), heatmap)
+        assert (measurements, actors_data) == untouched
+
+    def test_ego_vehicle_is_not_drawn(self):
+        measurements, actors_data = make_frame(0)
+        # the last actor within 1m of the ego position is taken as the ego vehicle
+        ego_id = [_id for _id in actors_data if actors_data[_id].get("box") == [2.4, 1.0]][0]
+        actors_data[ego_id] = actors_data.pop(ego_id)
+        heatmap = generate_heatmap(measurements, actors_data)
+        # the actor next to the ego vehicle is within 1m as well: not a hazard, so it is not drawn either
+        assert not heatmap.any()
+        near_id = [_id for _id in actors_data if actors_data[_id]["ori"] == [0.0, 1.0, 0.0]][0]
+        measurements["is_vehicle_present"] = [int(near_id)]
+        assert generate_heatmap(measurements, actors_data).any()
+
+    def test_object_ids(self):
+        measurements, actors_data = make_frame(20, seed=3)
+        heatmap = generate_heatmap(measurements, actors_data)
+        det_data, object_ids = generate_det_data(heatmap, measurements, actors_data, return_object_ids=True)
+        occupied = det_data[..., 0] > 0
+        assert occupied.any()
+        assert (object_ids[~occupied] == -1).all()
+        assert set(object_ids[occupied].tolist()) <= {int(_id) for _id in actors_data}
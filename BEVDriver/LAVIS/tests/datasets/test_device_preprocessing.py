@@ -0,0 +1,84 @@
+"""
+Tests for the batched device-side camera preprocessing (CarlaRgbDeviceTransform) against the PIL
+transforms of create_carla_rgb_transform.
+"""
+
+import random
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from lavis.datasets.datasets.carla_dataset_llm import CarlaVoiceDataset
+from lavis.datasets.datasets.transforms_carla_factory import CarlaRgbDeviceTransform, create_carla_rgb_transform
+from test_sensor_loading import dataset_root
+
+
+def make_view(seed=0):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 255, size=(600 // 16, 800 // 16, 3), dtype=np.uint8)).resize((800, 600))
+
+
+def assert_close(actual, expected, mean, max):
+    difference = (actual - expected).abs()
+    assert difference.mean() < mean and difference.max() < max, (difference.mean(), difference.max())
+
+
+class TestCarlaRgbDeviceTransform:
+    @pytest.mark.parametrize("input_size, reduced_size", [(224, (400, 300)), (128, (200, 150))])
+    def test_resize_matches_pil(self, input_size, reduced_size):
+        views = [make_view(seed) for seed in range(3)]
+        transform = CarlaRgbDeviceTransform(input_size)
+        images = torch.stack([transform(view) for view in views])
+        assert images.dtype == torch.uint8 and images.shape[2:] == reduced_size[::-1]
+        output = transform.batch(images)
+        for view, image in zip(views, output):
+            # PIL on the same box-reduced view, up to its rounding to uint8 (0.017 per gray level)
+            reduced = view.reduce(800 // reduced_size[0])
+            assert_close(image, create_carla_rgb_transform(input_size)(reduced), mean=0.01, max=0.06)
+            # and on the full view
+            assert_close(image, create_carla_rgb_transform(input_size)(view), mean=0.03, max=0.15)
+
+    def test_center_view_is_exact(self):
+        view = make_view()
+        transform = CarlaRgbDeviceTransform(128, need_scale=False)
+        image = transform(view)
+        assert image.shape == (3, 128, 128)
+        expected = create_carla_rgb_transform(128, need_scale=False)(view)
+        assert torch.allclose(transform.batch(image[None])[0], expected, atol=1e-6)
+
+    def test_random_scale_matches_pil(self):
+        view = make_view()
+        kwargs = dict(input_size=224, scale=[0.95, 1.05], is_training=True)
+        random.seed(0)
+        scales = [0.1 * random.random() + 0.95 for _ in range(4)]
+        random.seed(0)
+        pil_transform = create_carla_rgb_transform(**kwargs)
+        expected = [pil_transform(view.reduce(2)) for _ in scales]
+
+        transform = CarlaRgbDeviceTransform(**kwargs)
+        output = transform.batch(torch.stack([transform(view)] * len(scales)), torch.tensor(scales))
+        assert output.shape == (4, 3, 224, 224)
+        for image, pil_image in zip(output, expected):
+            assert_close(image, pil_image, mean=0.02, max=0.1)
+        # drawn per image without scales
+        drawn = transform.batch(torch.stack([transform(view)] * 2))
+        assert not torch.equal(drawn[0], drawn[1])
+
+
+class TestDatasetDevicePreprocessing:
+    def test_views_match_pil_dataset(self, dataset_root):
+        random.seed(0)
+        expected = CarlaVoiceDataset(dataset_root, token_max_length=4, sample_interval=1)[0]
+        random.seed(0)
+        dataset = CarlaVoiceDataset(dataset_root, token_max_length=4, sample_interval=1, device_preprocessing=True)
+        sample = dataset[0]
+        batch = dataset.collater([sample])
+        assert set(batch["device_transforms"]) == {"rgb", "rgb_left", "rgb_right", "rgb_rear", "rgb_center"}
+        for key, transform in batch["device_transforms"].items():
+            assert sample[key].dtype == torch.uint8
+            # the uint8 views are smaller than the float32 tensors they replace
+            assert sample[key].nelement() < 4 * expected[key].nelement()
+            assert_close(transform.batch(batch[key][0]), expected[key], mean=0.03, max=0.2)
+        assert torch.equal(batch["lidar"][0], expected["lidar"])
@@ -0,0 +1,149 @@
+"""
+Tests for the packed per-route frame store (timm/data/frame_shard.py) and its use by the datasets.
+"""
+
+import os
+import sys
+import random
+import shutil
+import tracemalloc
+
+import numpy as np
+import pytest
+import torch
+
+from timm.data.frame_shard import open_frame_shard, write_frame_shard
+from lavis.datasets.datasets.base_io_dataset import BaseIODataset
+from lavis.datasets.datasets.carla_dataset_llm import CarlaVoiceDataset
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../tools/benchmarks"))
+from synthetic_routes import instruction_line, make_route, write_instruction_list
+
+FRAMES = 6
+LIDAR_POINTS = 2000
+
+
+@pytest.fixture
+def route(tmp_path):
+    route_path = str(tmp_path / "sub-0" / "data" / "routes_town01_0_w1")
+    make_route(route_path, FRAMES, missing=(3,), lidar_points=LIDAR_POINTS)
+    open_frame_shard.cache_clear()
+    yield route_path
+    open_frame_shard.cache_clear()
+
+
+class TestFrameShard:
+    def test_roundtrip(self, route):
+        write_frame_shard(route, FRAMES)
+        shard = open_frame_shard(route)
+        assert len(shard) == FRAMES
+        for i in range(FRAMES):
+            source = i - 1 if i == 3 else i
+            with open(os.path.join(route, "rgb_full", "%04d.jpg" % source), "rb") as f:
+                assert shard.image_bytes(i).tobytes() == f.read()
+            lidar = shard.lidar(i)
+            assert lidar.dtype == np.float32 and lidar.flags.writeable
+            np.testing.assert_array_equal(lidar, np.load(os.path.join(route, "lidar", "%04d.npy" % source)))
+
+    def test_float16_points(self, route):
+        full_size = os.path.getsize(write_frame_shard(route, FRAMES))
+        half_size = os.path.getsize(write_frame_shard(route, FRAMES, lidar_dtype="float16"))
+        open_frame_shard.cache_clear()
+        lidar = open_frame_shard(route).lidar(0)
+        expected = np.load(os.path.join(route, "lidar", "0000.npy"))
+        np.testing.assert_allclose(lidar, expected, rtol=0, atol=0.02)
+        lidar_bytes = sum(len(np.load(os.path.join(route, "lidar", "%04d.npy" % i))) * 16 for i in (0, 1, 2, 4, 5))
+        assert full_size - half_size >= lidar_bytes // 2 - 64 * FRAMES
+
+    def test_write_streams_the_frames(self, route):
+        # only one frame at a time is read into memory
+        sources = [os.path.join(route, folder, name) for folder in ("rgb_full", "lidar")
+                   for name in os.listdir(os.path.join(route, folder))]
+        tracemalloc.start()
+        write_frame_shard(route, FRAMES)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert peak < sum(os.path.getsize(path) for path in sources) / 2
+        assert max(os.path.getsize(path) for path in sources) < peak
+
+    def test_stale_shard(self, route):
+        dataset = BaseIODataset()
+        write_frame_shard(route, FRAMES)
+        assert open_frame_shard(route) is not None
+
+        # a frame added to the route: the loaders read the files of the route, not the shard
+        lidar = np.load(os.path.join(route, "lidar", "0002.npy"))[:50]
+        np.save(os.path.join(route, "lidar", "0003.npy"), lidar)
+        open_frame_shard.cache_clear()
+        assert open_frame_shard(route) is None
+        np.testing.assert_array_equal(dataset._load_lidar(route, 3), lidar)
+
+        # as a frame replaced by a new file
+        write_frame_shard(route, FRAMES)
+        open_frame_shard.cache_clear()
+        assert open_frame_shard(route) is not None
+        os.remove(os.path.join(route, "lidar", "0002.npy"))
+        np.save(os.path.join(route, "lidar", "0002.npy"), lidar)
+        open_frame_shard.cache_clear()
+        assert open_frame_shard(route) is None
+
+    def test_open_stats_the_folders(self, route, monkeypatch):
+        # opening a shard stats the two source folders, not the frame files
+        write_frame_shard(route, FRAMES)
+        stat = os.stat
+        paths = []
+
+        def counted_stat(path, *args, **kwargs):
+            paths.append(str(path))
+            return stat(path, *args, **kwargs)
+
+        monkeypatch.setattr(os, "stat", counted_stat)
+        assert open_frame_shard(route) is not None
+        monkeypatch.undo()
+        assert not [path for path in paths if path.endswith((".jpg", ".npy"))]
+        assert {os.path.join(route, "rgb_full"), os.path.join(route, "lidar")} <= set(paths)
+
+    def test_sources_deleted_after_packing(self, route):
+        dataset = BaseIODataset()
+        plain_image = np.asarray(dataset._load_rgb_full(route, 2))
+        plain_lidar = dataset._load_lidar(route, 2)
+        write_frame_shard(route, FRAMES)
+        for name in os.listdir(os.path.join(route, "rgb_full")):
+            os.remove(os.path.join(route, "rgb_full", name))
+        shutil.rmtree(os.path.join(route, "lidar"))
+        open_frame_shard.cache_clear()
+        np.testing.assert_array_equal(np.asarray(dataset._load_rgb_full(route, 2)), plain_image)
+        np.testing.assert_array_equal(dataset._load_lidar(route, 2), plain_lidar)
+
+    def test_shard_packed_after_a_miss(self, route):
+        assert open_frame_shard(route) is None
+        write_frame_shard(route, FRAMES)
+        assert open_frame_shard(route) is not None
+
+    def test_base_io_dataset_uses_shard(self, route):
+        dataset = BaseIODataset()
+        plain_image = np.asarray(dataset._load_rgb_full(route, 2))
+        plain_lidar = dataset._load_lidar(route, 2)
+
+        write_frame_shard(route, FRAMES)
+        open_frame_shard.cache_clear()
+        np.testing.assert_array_equal(np.asarray(dataset._load_rgb_full(route, 2)), plain_image)
+        np.testing.assert_array_equal(dataset._load_lidar(route, 2), plain_lidar)
+        assert open_frame_shard(route) is not None
+
+    def test_dataset_sample_is_unchanged(self, route, tmp_path):
+        write_instruction_list(str(tmp_path), [instruction_line(os.path.relpath(route, tmp_path), 0, 4, FRAMES)])
+        dataset = CarlaVoiceDataset(str(tmp_path), token_max_length=4, sample_interval=1)
+
+        def sample():
+            random.seed(0)
+            np.random.seed(0)
+            return dataset[0]
+
+        plain = sample()
+        write_frame_shard(route, FRAMES)
+        open_frame_shard.cache_clear()
+        packed = sample()
+        for key in ("rgb", "rgb_left", "rgb_right", "rgb_rear", "rgb_center", "lidar", "target_point"):
+            assert torch.equal(packed[key], plain[key]), key
@@ -0,0 +1,200 @@
+"""
+Golden-output tests for the navigation instruction rules of tools/data_parsing (turn_rules.py,
+follow_rules.py, other_rules.py) on synthetic routes.
+
+data/instruction_rules_golden.json holds the clips the per-frame rule implementations produced on
+these routes; regenerate it with `python tests/datasets/test_instruction_rules.py` only when a rule is
+meant to change its output.
+"""
+
+import os
+import sys
+import json
+import math
+import zlib
+import random
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../tools/data_parsing"))
+from parse_instruction import processing_rules, registered_class
+from frame_table import FrameTable
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "instruction_rules_golden.json")
+TOWN_IDS = [1, 2, 3, 4, 5, 6, 7, 10]
+ROUTE_FRAMES = 2500
+
+
+def town_points(town_id):
+    """ Junctions, roundabout and highway entries the rules look for, as (in, out) legs of a route"""
+    town = str(town_id)
+    points = []
+    if town_id == 3:
+        island = registered_class["Turn-05-1"]
+        points += [[island.island_in[i], island.island_out[(i + k) % 4]] for i in range(4) for k in (1, 2, 3)]
+    for direction, locs in registered_class["Follow-04-L"].townid_loc_mapping.items():
+        points += [[loc["in"], loc["out"]] for loc in locs[town] or []]
+    for x0, x1, y0, y1 in registered_class["Follow-02-s2"].highway_range.get(town, []):
+        (x0, x1), (y0, y1) = sorted([x0, x1]), sorted([y0, y1])
+        if x1 - x0 > y1 - y0:
+            points += [[[x0 + 5, (y0 + y1) / 2], [min(x0 + 125, x1 - 5), (y0 + y1) / 2]]]
+        else:
+            points += [[[(x0 + x1) / 2, y0 + 5], [(x0 + x1) / 2, min(y0 + 125, y1 - 5)]]]
+    points += [[loc[:2]] for loc in registered_class["Turn-04-L"].townid_loc_mapping[town]]
+    points += [[loc] for loc in registered_class["Turn-02-L"].townid_loc_mapping[town] or []]
+    return points
+
+
+def entry_commands(town_id):
+    """ Commands the Follow-04 highway entries expect at their "in" point"""
+    follow04 = registered_class["Follow-04-L"]
+    return [(loc["in"], follow04.direction_command_mapping[direction])
+            for direction, locs in follow04.townid_loc_mapping.items() for loc in locs[str(town_id)] or []]
+
+
+def make_corners(town_id, rng, num_legs=40):
+    legs = town_points(town_id)
+    # visit every leg once, roundabout and highway legs and then the nearest junction first
+    order, remaining = [0], list(range(1, len(legs)))
+    while remaining:
+        last = np.asarray(legs[order[-1]][-1])
+        order.append(min(remaining, key=lambda i: (len(legs[i]) == 1, np.hypot(*(np.asarray(legs[i][0]) - last)))))
+        remaining.remove(order[-1])
+    order += list(rng.integers(len(legs), size=num_legs))
+    corners = [np.asarray(legs[0][0], dtype=np.float64) + [40.0, 0.0]]
+    for leg in order:
+        for target in legs[leg]:
+            target = np.asarray(target, dtype=np.float64) + rng.normal(0, 1.0, 2)
+            # Manhattan approach with an occasional diagonal leg and straight-through junction
+            if rng.random() < 0.8:
+                bend = [target[0], corners[-1][1]] if rng.random() < 0.5 else [corners[-1][0], target[1]]
+                if rng.random() < 0.3:
+                    corners.append((corners[-1] + np.asarray(bend)) / 2)
+                corners.append(np.asarray(bend))
+            corners.append(target)
+        if len(legs[leg]) == 1 and rng.random() < 0.4:
+            # drive straight through the junction
+            heading = corners[-1] - corners[-2]
+            corners.append(corners[-1] + 30 * heading / np.hypot(*heading))
+    corners = [c for i, c in enumerate(corners) if i == 0 or np.hypot(*(c - corners[i - 1])) > 1.0]
+    return np.array(corners)
+
+
+def make_route(town_id, frames=ROUTE_FRAMES, seed=3):
+    """
+    Measurements of a vehicle driving along corners of the town at 3-9 m/s (10 Hz): turn commands around
+    corners, lane changes on long legs, braking and waiting in front of (some) lights.
+    """
+    rng = np.random.default_rng(seed + town_id)
+    corners = make_corners(town_id, rng)
+    segments = np.diff(corners, axis=0)
+    lengths = np.hypot(segments[:, 0], segments[:, 1])
+    arc = np.concatenate([[0.0], np.cumsum(lengths)])
+    headings = np.arctan2(segments[:, 1], segments[:, 0])
+    turns = np.diff(np.unwrap(headings))
+    turn_commands = np.where(np.abs(turns) < 0.3, 3, np.where(turns > 0, 1, 2))
+    for loc, command in entry_commands(town_id):
+        turn_commands[np.hypot(*(corners[1:-1] - loc).T) < 5] = command
+    cruise_speeds = rng.uniform(3.0, 9.0, len(lengths))
+    lights = rng.random(len(turns)) < 0.6
+    stops = rng.random(len(turns)) < 0.4
+    lane_changes = {k: (rng.uniform(20, lengths[k] - 35), 5 + rng.integers(2))
+                    for k in range(len(lengths)) if lengths[k] > 70 and rng.random() < 0.6}
+
+    measurements = []
+    s, speed, wait, stopped_at = 0.0, cruise_speeds[0], 0, set()
+    for frame_id in range(frames):
+        k = min(np.searchsorted(arc, s, side="right") - 1, len(lengths) - 1)
+        position = corners[k] + segments[k] * (s - arc[k]) / lengths[k]
+        theta = headings[k]
+        command = 4
+        # the upcoming or just passed corner (corner j is the end of segment j)
+        j = k if arc[k + 1] - s < s - arc[k] or k == 0 else k - 1
+        j = min(j, len(turns) - 1)
+        to_corner = arc[j + 1] - s
+        if -6 < to_corner < 25:
+            command = int(turn_commands[j])
+            if abs(to_corner) < 5:
+                theta = headings[j] + turns[j] * (5 - to_corner) / 10
+        elif k in lane_changes and 0 <= s - arc[k] - lane_changes[k][0] < 12:
+            command = int(lane_changes[k][1])
+            progress = (s - arc[k] - lane_changes[k][0]) / 12
+            offset = 3.5 * progress * (1 if command == 5 else -1)
+            normal = np.array([-segments[k][1], segments[k][0]]) / lengths[k]
+            position = position + offset * normal
+            theta = theta + 0.12 * math.sin(math.pi * progress) * (1 if command == 5 else -1)
+
+        brake = False
+        if wait > 0:
+            wait -= 1
+            brake, step = True, 0.0
+        elif stops[j] and lights[j] and 8 < to_corner < 14 and j not in stopped_at:
+            speed = max(speed * 0.8, 0.5)
+            brake, step = True, speed / 10
+            if speed <= 0.5:
+                stopped_at.add(j)
+                wait = int(rng.integers(20, 600))
+        else:
+            speed = min(speed + 0.3, cruise_speeds[k] + rng.normal(0, 0.2))
+            step = speed / 10
+            brake = bool(rng.random() < 0.01)
+        light_id = 1000 + j if lights[j] and 0 < to_corner < 45 else -1
+        actors_data = {}
+        if light_id != -1 and j % 7:
+            corner = corners[j + 1]
+            actors_data[str(light_id)] = {"loc": [corner[0] + 4.0, corner[1] - 4.0, 0.0], "tpe": 2, "sta": 0}
+        target = corners[min(j + 1, len(corners) - 1)]
+
+        measurements.append({
+            "x": float(position[0]), "y": float(position[1]), "theta": float(theta % (2 * math.pi)),
+            "gps_x": float(position[0]), "gps_y": float(position[1]), "speed": float(step * 10),
+            "command": command, "brake": brake, "x_command": float(target[0]), "y_command": float(target[1]),
+            "affected_light_id": light_id, "actors_data": actors_data,
+        })
+        s = min(s + step, arc[-1] - 1e-3)
+    return measurements
+
+
+def run_rules(town_id, frames, table=None):
+    clips = {}
+    for rule in processing_rules:
+        # the rules draw distances from `random`, seed per (route, rule) so every rule can be checked alone
+        random.seed(zlib.crc32(("%d/%s" % (town_id, rule)).encode()))
+        data = {"data": frames, "town_id": town_id, "weather_id": 1}
+        if table is not None:
+            data["table"] = table
+        results = registered_class[rule].process(data)
+        clips[rule] = [[r["start_frame"], r["end_frame"], r["instruction_args"]] for r in results]
+    return clips
+
+
+@pytest.fixture(scope="module")
+def golden():
+    with open(GOLDEN_PATH, "r") as f:
+        return json.load(f)
+
+
+class TestInstructionRules:
+    @pytest.mark.parametrize("town_id", TOWN_IDS)
+    def test_rules_match_golden_clips(self, golden, town_id):
+        frames = make_route(town_id)
+        clips = json.loads(json.dumps(run_rules(town_id, frames)))
+        for rule in processing_rules:
+            assert clips[rule] == golden[str(town_id)][rule], rule
+
+    @pytest.mark.parametrize("town_id", [3, 4])
+    def test_shared_table_matches_golden_clips(self, golden, town_id):
+        frames = make_route(town_id)
+        clips = json.loads(json.dumps(run_rules(town_id, frames, table=FrameTable(frames))))
+        assert clips == golden[str(town_id)]
+
+    def test_routes_cover_the_rules(self, golden):
+        produced = {rule for town in golden.values() for rule, clips in town.items() if clips}
+        assert sorted(set(processing_rules) - produced) == []
+
+
+if __name__ == "__main__":
+    os.makedirs(os.path.dirname(GOLDEN_PATH), exist_ok=True)
+    with open(GOLDEN_PATH, "w") as f:
+        json.dump({str(town_id): run_rules(town_id, make_route(town_id)) for town_id in TOWN_IDS}, f)
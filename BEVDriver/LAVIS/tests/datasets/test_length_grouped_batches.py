@@ -0,0 +1,56 @@
+"""
+Tests for LengthGroupedBatchSampler (lavis/datasets/datasets/dataloader_utils.py).
+"""
+
+import numpy as np
+import pytest
+
+from lavis.datasets.datasets.dataloader_utils import LengthGroupedBatchSampler
+
+
+def padded_frames(batches, lengths):
+    return sum(len(batch) * max(lengths[i] for i in batch) for batch in batches)
+
+
+class TestLengthGroupedBatchSampler:
+    @pytest.mark.parametrize("num_replicas", [1, 3])
+    def test_ranks_split_every_index_once(self, num_replicas):
+        lengths = np.random.default_rng(0).integers(1, 41, size=1003)
+        per_rank = []
+        for rank in range(num_replicas):
+            sampler = LengthGroupedBatchSampler(lengths, batch_size=4, num_replicas=num_replicas, rank=rank,
+                                                drop_last=True, group_batches=10)
+            sampler.set_epoch(2)
+            per_rank.append(list(sampler))
+            assert len(per_rank[-1]) == len(sampler) == 1003 // (4 * num_replicas)
+            assert all(len(batch) == 4 for batch in per_rank[-1])
+        indices = [i for batches in per_rank for batch in batches for i in batch]
+        assert len(indices) == len(set(indices)) == len(sampler) * 4 * num_replicas
+
+        # the ranks of a step get batches of the same length group
+        for step in zip(*per_rank):
+            assert max(lengths[i] for batch in step for i in batch) - min(lengths[i] for batch in step for i in batch) < 20
+
+    def test_last_batch_is_filled_without_drop_last(self):
+        lengths = np.arange(10)
+        sampler = LengthGroupedBatchSampler(lengths, batch_size=4, shuffle=False)
+        batches = list(sampler)
+        assert len(batches) == len(sampler) == 3
+        assert all(len(batch) == 4 for batch in batches)
+        assert sorted(set(i for batch in batches for i in batch)) == list(range(10))
+
+    def test_batches_pad_less_than_random_batches(self):
+        rng = np.random.default_rng(1)
+        lengths = rng.integers(1, 41, size=2000)
+        sampler = LengthGroupedBatchSampler(lengths, batch_size=4, drop_last=True)
+        random_batches = rng.permutation(2000).reshape(-1, 4)
+        grouped = padded_frames(list(sampler), lengths)
+        assert grouped < 0.8 * padded_frames(random_batches, lengths)
+        assert grouped < 1.05 * lengths.sum()
+
+    def test_epochs_shuffle_differently(self):
+        sampler = LengthGroupedBatchSampler(np.ones(64), batch_size=4)
+        first = list(sampler)
+        assert list(sampler) == first
+        sampler.set_epoch(1)
+        assert list(sampler) != first
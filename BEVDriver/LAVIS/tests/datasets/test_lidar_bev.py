@@ -0,0 +1,102 @@
+"""
+Parity tests for the shared LiDAR BEV histogram (timm/data/lidar_bev.py).
+"""
+
+import numpy as np
+import pytest
+
+from timm.data.lidar_bev import (
+    X_EDGES,
+    Y_EDGES,
+    lidar_to_histogram_features,
+    lidar_to_histogram_features_batch,
+    transform_2d_points,
+)
+
+
+def reference_lidar_to_histogram_features(lidar, crop=256):
+    # the np.histogramdd implementation the datasets and the agent used before lidar_bev
+    def splat_points(point_cloud):
+        pixels_per_meter = 8
+        hist_max_per_pixel = 5
+        x_meters_max = 14
+        y_meters_max = 28
+        xbins = np.linspace(-2*x_meters_max, 2*x_meters_max+1, 2*x_meters_max*pixels_per_meter+1)
+        ybins = np.linspace(-y_meters_max, 0, y_meters_max*pixels_per_meter+1)
+        hist = np.histogramdd(point_cloud[...,:2], bins=(xbins, ybins))[0]
+        hist[hist>hist_max_per_pixel] = hist_max_per_pixel
+        overhead_splat = hist/hist_max_per_pixel
+        return overhead_splat
+
+    below = lidar[lidar[...,2]<=-2.0]
+    above = lidar[lidar[...,2]>-2.0]
+    below_features = splat_points(below)
+    above_features = splat_points(above)
+    total_features = below_features + above_features
+    features = np.stack([below_features, above_features, total_features], axis=-1)
+    features = np.transpose(features, (2, 0, 1)).astype(np.float32)
+    return features
+
+
+def reference_transform_2d_points(xyz, r1, t1_x, t1_y, r2, t2_x, t2_y):
+    xy1 = xyz.copy()
+    xy1[:,2] = 1
+
+    c, s = np.cos(r1), np.sin(r1)
+    r1_to_world = np.matrix([[c, s, t1_x], [-s, c, t1_y], [0, 0, 1]])
+    world = np.asarray(r1_to_world @ xy1.T)
+
+    c, s = np.cos(r2), np.sin(r2)
+    r2_to_world = np.matrix([[c, s, t2_x], [-s, c, t2_y], [0, 0, 1]])
+    world_to_r2 = np.linalg.inv(r2_to_world)
+
+    out = np.asarray(world_to_r2 @ world).T
+    out[:,2] = xyz[:,2]
+    return out
+
+
+def make_lidar(rng, points, dtype=np.float32):
+    xyz = rng.uniform([-35, -35, -3.0], [35, 5, 2.0], size=(points, 3))
+    # dense clusters so that cells saturate at HIST_MAX_PER_PIXEL
+    xyz[: points // 10, :2] = rng.normal([2.0, -5.0], 0.2, size=(points // 10, 2))
+    return xyz.astype(dtype)
+
+
+class TestLidarBev:
+    @pytest.mark.parametrize("dtype", [np.float32, np.float64])
+    def test_histogram_matches_reference(self, dtype):
+        rng = np.random.default_rng(0)
+        lidar = make_lidar(rng, 40000, dtype)
+        np.testing.assert_array_equal(
+            lidar_to_histogram_features(lidar), reference_lidar_to_histogram_features(lidar)
+        )
+
+    def test_histogram_edges(self):
+        # points exactly on every bin edge, on the outer edges, just outside the grid and NaN
+        xs = np.concatenate([X_EDGES, [X_EDGES[0] - 1e-9, X_EDGES[-1] + 1e-9, np.nan]])
+        ys = np.concatenate([Y_EDGES, [Y_EDGES[0] - 1e-9, Y_EDGES[-1] + 1e-9, np.nan]])
+        grid = np.stack(np.meshgrid(xs, ys, indexing="ij"), -1).reshape(-1, 2)
+        z = np.resize([-2.5, -2.0, 0.0, np.nan], len(grid))[:, None]
+        lidar = np.concatenate([grid, z], 1)
+        np.testing.assert_array_equal(
+            lidar_to_histogram_features(lidar), reference_lidar_to_histogram_features(lidar)
+        )
+
+    def test_batch_matches_single(self):
+        rng = np.random.default_rng(1)
+        lidars = [make_lidar(rng, n) for n in (1000, 0, 5000)]
+        batch = lidar_to_histogram_features_batch(lidars)
+        assert batch.shape == (3, 3, len(X_EDGES) - 1, len(Y_EDGES) - 1)
+        for features, lidar in zip(batch, lidars):
+            np.testing.assert_array_equal(features, reference_lidar_to_histogram_features(lidar))
+
+    def test_transform_matches_reference(self):
+        rng = np.random.default_rng(2)
+        xyz = make_lidar(rng, 1000)
+        for r1, t1_x, t1_y, r2, t2_x, t2_y in rng.uniform(-50, 50, size=(10, 6)):
+            np.testing.assert_allclose(
+                transform_2d_points(xyz, r1, t1_x, t1_y, r2, t2_x, t2_y),
+                reference_transform_2d_points(xyz, r1, t1_x, t1_y, r2, t2_x, t2_y),
+                rtol=0,
+                atol=1e-9,
+            )
@@ -0,0 +1,81 @@
+"""
+Tests for loading only the sensors the bev encoder reads (CarlaVoiceDataset input_keys) and the
+reduced size JPEG decoding of rgb_full that it allows.
+"""
+
+import os
+import random
+
+import numpy as np
+import pytest
+import torch
+
+from timm.models import get_model_default_value
+from timm.models.bevdriver_encoder import interfuser_input_keys
+from lavis.datasets.datasets.carla_dataset_llm import SENSOR_KEYS, CarlaVoiceDataset
+from test_frame_shard import FRAMES, LIDAR_POINTS
+from synthetic_routes import instruction_line, make_route, write_instruction_list
+
+
+@pytest.fixture
+def dataset_root(tmp_path):
+    route = str(tmp_path / "sub-0" / "data" / "routes_town01_0_w1")
+    # smooth enough for the reduced size decoding to stay within a few gray levels
+    make_route(route, FRAMES, lidar_points=LIDAR_POINTS, image_block=16)
+    write_instruction_list(str(tmp_path), [instruction_line(os.path.relpath(route, tmp_path), 0, 4, FRAMES)])
+    return str(tmp_path)
+
+
+def sample(dataset_root, input_keys=None):
+    dataset = CarlaVoiceDataset(dataset_root, token_max_length=4, sample_interval=1, input_keys=input_keys)
+    random.seed(0)
+    np.random.seed(0)
+    return dataset, dataset[0]
+
+
+class TestEncoderInputKeys:
+    def test_bevdriver_encoder_skips_rear_view(self):
+        input_keys = get_model_default_value("bevdriver_encoder", "input_keys")
+        assert set(input_keys) == {"rgb", "rgb_left", "rgb_right", "rgb_center", "lidar"}
+
+    def test_flags(self):
+        assert interfuser_input_keys(with_lidar=False, with_right_left_sensors=False, with_center_sensor=False) == ["rgb"]
+        assert interfuser_input_keys(with_right_left_sensors=False, with_center_sensor=False, direct_concat=True) == \
+            ["rgb", "rgb_left", "rgb_right", "rgb_center", "lidar"]
+
+
+class TestSensorLoading:
+    def test_encoder_views_are_unchanged(self, dataset_root):
+        _, full = sample(dataset_root)
+        input_keys = get_model_default_value("bevdriver_encoder", "input_keys")
+        dataset, loaded = sample(dataset_root, input_keys)
+        # rgb_center is a crop of the full resolution front view, so the image is decoded as before
+        assert dataset._rgb_full_decode_size() is None
+        assert "rgb_rear" not in loaded
+        for key in input_keys:
+            assert torch.equal(loaded[key], full[key]), key
+
+    @pytest.mark.parametrize("input_keys, size", [
+        (["rgb", "rgb_left", "rgb_right", "lidar"], (341, 1024)),
+        (["rgb_left", "rgb_right"], (195, 584)),
+    ])
+    def test_reduced_size_decoding(self, dataset_root, input_keys, size):
+        _, full = sample(dataset_root)
+        dataset, loaded = sample(dataset_root, input_keys)
+        assert dataset._rgb_full_decode_size() == size
+        assert set(SENSOR_KEYS) & set(loaded) == set(input_keys)
+        for key in input_keys:
+            assert loaded[key].shape == full[key].shape, key
+            if key == "lidar":
+                assert torch.equal(loaded[key], full[key])
+                continue
+            # normalized images, one gray level is about 0.017
+            difference = (loaded[key] - full[key]).abs()
+            assert difference.mean() < 0.03 and difference.max() < 0.25, key
+
+    def test_collater_without_rear_view(self, dataset_root):
+        dataset = CarlaVoiceDataset(dataset_root, token_max_length=4, sample_interval=1,
+                                    input_keys=["rgb", "rgb_left", "rgb_right", "lidar"])
+        batch = dataset.collater([dataset[0], dataset[0]])
+        assert "rgb_rear" not in batch and "rgb_center" not in batch
+        assert batch["rgb_left"].shape[:2] == (2, batch["valid_frames"].max())
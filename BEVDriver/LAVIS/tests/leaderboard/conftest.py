@@ -0,0 +1,17 @@
+"""
+Path setup of the tests of the leaderboard, team_code and scenario runner code (BEVDriver/leaderboard and
+BEVDriver/scenario_runner): the leaderboard and team_code packages, and the drive model helpers of
+tests/models that the agent replay builds its model with.
+
+The folder is a package so this conftest is not the `conftest` module of tests/models, which its tests
+import their helpers from.
+"""
+
+import os
+import sys
+
+BEVDRIVER_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+
+for path in [os.path.join(BEVDRIVER_ROOT, "LAVIS", "tests", "models"), os.path.join(BEVDRIVER_ROOT, "leaderboard")]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
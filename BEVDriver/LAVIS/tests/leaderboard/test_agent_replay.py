@@ -0,0 +1,144 @@
+"""
+Tests for the record and replay of BEVDriverAgent (leaderboard/team_code/agent_replay.py): a synthetic log
+replayed through the agent with a tiny model on the CPU, without CARLA.
+"""
+
+import os
+import types
+
+import numpy as np
+import pytest
+
+from test_drive_deploy import build_lora_model
+from test_sensor_pipeline import CAMERAS, make_frame
+from lavis.models.drive_models.deploy import export_deploy_model
+from team_code.agent_replay import PLANNER_METHODS, AgentLog, AgentRecorder, RoadOption, install_simulator_stubs, replay
+from team_code.stage_timer import STAGES, StageTimer
+
+AGENT_CONFIG = """
+from team_code.bevdriver_config import GlobalConfig as BaseConfig
+
+
+class GlobalConfig(BaseConfig):
+    deploy_model = {deploy_model!r}
+    encoder_model = 'tiny_bev_encoder'
+    device = 'cpu'
+    use_kv_cache = {use_kv_cache!r}
+"""
+
+
+def write_agent_config(workdir, use_kv_cache=True):
+    # agent config of a tiny random model on the CPU
+    deploy_model = os.path.join(workdir, "model.safetensors")
+    if not os.path.exists(deploy_model):
+        export_deploy_model(build_lora_model(), deploy_model, "tiny_bev_encoder")
+    path = os.path.join(workdir, "agent_config_%s.py" % use_kv_cache)
+    with open(path, "w") as f:
+        f.write(AGENT_CONFIG.format(deploy_model=deploy_model, use_kv_cache=use_kv_cache))
+    return path
+
+
+def is_model_step(step):
+    return step >= 20 and step % 2 == 0
+
+
+def make_sensor_frame(rng, step):
+    # the speedometer of the leaderboard gives a numpy float
+    frame = make_frame(rng, step)
+    frame["speed"] = (step, {"speed": np.float64(3.0)})
+    return frame
+
+
+def write_synthetic_log(path, ticks, seed=0):
+    # a log as AgentRecorder writes it in the simulator, the planner results of a route with one turn
+    rng = np.random.default_rng(seed)
+    recorder = AgentRecorder(path)
+    global_plan = [({"lat": 48.99 + 1e-4 * i, "lon": 8.0, "z": 0.0}, RoadOption.LANEFOLLOW) for i in range(6)]
+    recorder.write_header([{"type": "sensor.camera.rgb", "id": sensor} for sensor in CAMERAS], global_plan,
+                          "Town05", "RouteScenario_0")
+    for step in range(ticks):
+        recorder.record_inputs(step, make_sensor_frame(rng, step), 0.05 * step, cameras=is_model_step(step))
+        if is_model_step(step):
+            instruction = "Follow the current lane." if step < 20 + ticks // 2 else "Turn left at the next intersection."
+            for method, result in zip(PLANNER_METHODS, [instruction, "", "", ""]):
+                recorder.record_planner(method, result)
+        recorder.record_control(types.SimpleNamespace(steer=0.0, throttle=0.0, brake=1.0))
+    recorder.close()
+
+
+class TestAgentLog:
+    def test_round_trip(self, tmp_path):
+        write_synthetic_log(str(tmp_path), 24)
+        log = AgentLog(str(tmp_path))
+        assert len(log) == 24
+        assert log.global_plan()[0] == ({"lat": 48.99, "lon": 8.0, "z": 0.0}, RoadOption.LANEFOLLOW)
+        rng = np.random.default_rng(0)
+        for step, (tick, input_data) in enumerate(log):
+            frame = make_sensor_frame(rng, step)
+            # the camera images only on the steps of the model, all losslessly
+            expected = set(frame) if is_model_step(step) else set(frame) - set(CAMERAS)
+            assert set(input_data) == expected
+            for sensor in expected:
+                recorded_frame, data = input_data[sensor]
+                assert recorded_frame == step
+                if isinstance(data, np.ndarray):
+                    assert data.dtype == frame[sensor][1].dtype and np.array_equal(data, frame[sensor][1]), sensor
+                else:
+                    assert data == frame[sensor][1] and type(data["speed"]) is np.float64
+            assert tick["timestamp"] == 0.05 * step
+            assert set(tick["planner"]) == (set(PLANNER_METHODS) if is_model_step(step) else set())
+
+    def test_stage_timer(self):
+        timer = StageTimer(["a", "b"])
+        for step in range(10):
+            timer.start()
+            timer.lap("a")
+            if step % 2 == 0:
+                timer.lap("b")
+            timer.stop(record=step % 2 == 0)
+        # the stages of the steps that are not recorded are dropped with their total
+        assert [timer.percentiles(stage)[0] for stage in ["a", "b", "total"]] == [5, 5, 5]
+        assert sum(timer.samples["a"]) + sum(timer.samples["b"]) <= sum(timer.samples["total"])
+        assert timer.summary().splitlines()[0].startswith("a ")
+
+
+class TestAgentReplay:
+    @pytest.fixture(autouse=True)
+    def stubs(self):
+        install_simulator_stubs()
+
+    @pytest.mark.parametrize("use_kv_cache", [True, False])
+    def test_replay_is_deterministic(self, tmp_path, use_kv_cache):
+        config = write_agent_config(str(tmp_path), use_kv_cache)
+        write_synthetic_log(str(tmp_path / "log"), 36)
+        _, controls, recorded = replay(config, str(tmp_path / "log"))
+        assert len(controls) == len(recorded) == 36
+        # braking during the first 20 steps, the control of the previous step on the odd steps
+        assert controls[:20] == recorded[:20]
+        assert all(controls[step] == controls[step - 1] for step in range(21, 36, 2))
+        agent, again, _ = replay(config, str(tmp_path / "log"))
+        assert again == controls
+        summary = agent.timer.summary()
+        for stage in STAGES + ["total"]:
+            assert (stage in summary) == (stage != "save"), stage
+        assert agent.timer.percentiles("total")[0] == agent.timer.percentiles("tick")[0] == \
+            agent.timer.percentiles("llm")[0] == 8
+        # no recorder without RECORD_PATH, no device sync on the CPU
+        assert agent.recorder is None and agent.timer.sync is None
+
+    def test_replay_of_a_recorded_replay(self, tmp_path, monkeypatch):
+        config = write_agent_config(str(tmp_path))
+        write_synthetic_log(str(tmp_path / "log"), 30)
+        monkeypatch.setenv("ROUTES", "routes_replay.xml")
+        agent, controls, _ = replay(config, str(tmp_path / "log"), record_path=str(tmp_path / "recorded"),
+                                    save_path=str(tmp_path / "save"))
+        assert agent.timer.percentiles("save")[0] == 5
+        assert len(os.listdir(agent.save_path / "meta")) == 5
+
+        recorded_log = AgentLog(str(tmp_path / "recorded"))
+        original_log = AgentLog(str(tmp_path / "log"))
+        assert recorded_log.header["global_plan"] == original_log.header["global_plan"]
+        assert [tick["planner"] for tick in recorded_log.ticks] == [tick["planner"] for tick in original_log.ticks]
+        # the recorded controls are those of the replay and replaying the new log gives them again
+        _, replayed, recorded = replay(config, str(tmp_path / "recorded"))
+        assert recorded == controls and replayed == controls
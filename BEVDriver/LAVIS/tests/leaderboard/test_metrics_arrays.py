@@ -0,0 +1,492 @@
+"""
+Tests for the recorder arrays of the metrics module of the scenario runner
+(srunner/metrics/tools/metrics_arrays.py): every getter of MetricsLog, served from the arrays, against the
+dictionaries MetricsLog was served from before the arrays (legacy_parse_recorder_info) on a synthetic recorder dump, the range queries and the
+cache file. Without the CARLA PythonAPI, the parsers build the value classes of this file.
+"""
+
+import os
+import sys
+import enum
+import types
+import importlib
+import contextlib
+
+import numpy as np
+import pytest
+
+SCENARIO_RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../scenario_runner")
+
+
+class _Value:
+    fields = ()
+
+    def __init__(self, *args, **kwargs):
+        for name, value in zip(self.fields, args):
+            setattr(self, name, value)
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join("%s=%r" % item for item in vars(self).items()))
+
+
+class _Vector(_Value):
+    fields = ("x", "y", "z")
+
+    def __sub__(self, other):
+        return type(self)(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __truediv__(self, value):
+        return type(self)(self.x / value, self.y / value, self.z / value)
+
+
+def value_carla():
+    """ the carla classes the metrics parsers build, as plain values"""
+    carla = types.ModuleType("carla")
+    carla.Location = type("Location", (_Vector,), {})
+    carla.Vector3D = type("Vector3D", (_Vector,), {})
+    carla.Vector2D = type("Vector2D", (_Value,), {"fields": ("x", "y")})
+    carla.Rotation = type("Rotation", (_Value,), {"fields": ("pitch", "yaw", "roll")})
+    carla.Transform = type("Transform", (_Value,), {"fields": ("location", "rotation")})
+    carla.BoundingBox = type("BoundingBox", (_Value,), {"fields": ("location", "extent")})
+    carla.Color = type("Color", (_Value,), {"fields": ("r", "g", "b")})
+    carla.LightState = type("LightState", (_Value,), {"fields": ("intensity", "color", "group", "active")})
+    carla.VehicleControl = type("VehicleControl", (_Value,), {"fields": (
+        "throttle", "steer", "brake", "hand_brake", "reverse", "manual_gear_shift", "gear")})
+    carla.VehiclePhysicsControl = type("VehiclePhysicsControl", (_Value,), {})
+    carla.GearPhysicsControl = type("GearPhysicsControl", (_Value,), {"fields": ("ratio", "down_ratio", "up_ratio")})
+    carla.WheelPhysicsControl = type("WheelPhysicsControl", (_Value,), {"fields": (
+        "tire_friction", "damping_rate", "max_steer_angle", "radius", "max_brake_torque", "max_handbrake_torque",
+        "position")})
+    carla.TrafficLightState = enum.Enum("TrafficLightState", "Red Yellow Green Off Unknown", start=0)
+    carla.VehicleLightState = enum.Flag("VehicleLightState", "Position LowBeam HighBeam Brake RightBlinker LeftBlinker "
+                                        "Reverse Fog Interior Special1 Special2")
+    carla.VehicleLightState.NONE = carla.VehicleLightState(0)
+    carla.LightGroup = types.SimpleNamespace(NONE=0)
+    return carla
+
+
+METRICS_MODULES = {}
+
+
+def import_metrics():
+    # the metrics modules with the installed carla or the value classes in place of it, and with the stubs of
+    # agent_replay.install_simulator_stubs of carla and srunner put aside while they import
+    try:
+        import carla
+        installed = hasattr(carla, "__file__")
+    except ImportError:
+        installed = False
+    saved_modules = {name: module for name, module in sys.modules.items() if name.split(".")[0] in ("carla", "srunner")}
+    saved_meta_path = list(sys.meta_path)
+    for name in saved_modules:
+        del sys.modules[name]
+    sys.meta_path[:] = [finder for finder in sys.meta_path if type(finder).__name__ != "_SimulatorStubFinder"]
+    sys.path.insert(0, SCENARIO_RUNNER)
+    if not installed:
+        sys.modules["carla"] = value_carla()
+    try:
+        return [importlib.import_module("srunner.metrics.tools." + name)
+                for name in ("metrics_parser", "metrics_arrays", "metrics_log")]
+    finally:
+        for name in [name for name in sys.modules if name.split(".")[0] in ("carla", "srunner")]:
+            METRICS_MODULES[name] = sys.modules.pop(name)
+        sys.modules.update(saved_modules)
+        sys.meta_path[:] = saved_meta_path
+        sys.path.remove(SCENARIO_RUNNER)
+
+
+metrics_parser, metrics_arrays, metrics_log = import_metrics()
+
+
+@contextlib.contextmanager
+def metrics_modules():
+    # the modules of import_metrics in sys.modules again, for pickle to find the classes of the cache file
+    saved_modules = {name: sys.modules.pop(name) for name in list(sys.modules) if name in METRICS_MODULES}
+    sys.modules.update(METRICS_MODULES)
+    try:
+        yield
+    finally:
+        for name in METRICS_MODULES:
+            del sys.modules[name]
+        sys.modules.update(saved_modules)
+carla = metrics_log.carla
+
+
+def vector(values):
+    return "(%s)" % ", ".join("%.3f" % value for value in values)
+
+
+def synthetic_recorder(frames=60, vehicles=6, walkers=2, traffic_lights=3, seed=0):
+    """
+    The string of client.show_recorder_file_info(log, True) of a recording of frames frames at 20 FPS: the ego
+    vehicle (role_name hero), a scenario vehicle and other vehicles driving, walkers, traffic lights, a sensor
+    on the ego vehicle, a vehicle destroyed halfway, collisions, scene light changes, physics controls and
+    traffic light time events.
+    """
+    rng = np.random.default_rng(seed)
+    vehicle_ids = list(range(100, 100 + vehicles))
+    walker_ids = list(range(300, 300 + walkers))
+    light_ids = list(range(500, 500 + traffic_lights))
+    destroyed = vehicle_ids[-1]
+    position = rng.uniform(-10000, 10000, (vehicles + walkers, 3))
+    lines = ["Version: 1", "Map: Town05", "Date: 02/18/21 14:30:21", ""]
+
+    for frame in range(1, frames + 1):
+        lines.append("Frame %d at %g seconds" % (frame, (frame - 1) * 0.05))
+        alive = [v for v in vehicle_ids if frame <= frames // 2 or v != destroyed]
+        if frame == 1:
+            for i, actor_id in enumerate(vehicle_ids):
+                lines.append(" Create %d: vehicle.lincoln.mkz2017 (%d) at %s" % (actor_id, i, vector(position[i])))
+                role_name = "hero" if i == 0 else "scenario" if i == 1 else "autopilot"
+                lines += ["  number_of_wheels = 4", "  role_name = %s" % role_name, "  sticky_control = true"]
+            for i, actor_id in enumerate(walker_ids):
+                lines.append(" Create %d: walker.pedestrian.0001 (%d) at %s" % (
+                    actor_id, 40 + i, vector(position[vehicles + i])))
+                lines.append("  role_name = pedestrian")
+            for i, actor_id in enumerate(light_ids):
+                lines.append(" Create %d: traffic.traffic_light (%d) at (%d.000, 1.000, 0.000)" % (actor_id, 60 + i, i))
+            lines.append(" Create 900: sensor.other.collision (70) at (0.000, 0.000, 0.000)")
+        if frame == frames // 2 + 1:
+            lines.append(" Destroy %d" % destroyed)
+        if frame % 17 == 0:
+            lines.append(" Collision id %d between %d with %d" % (frame, vehicle_ids[0], vehicle_ids[1]))
+            lines.append(" Collision id %d between %d with %d" % (frame + 1, vehicle_ids[0], walker_ids[0]))
+        if frame == 1:
+            lines.append(" Parenting 900 with %d (parent)" % vehicle_ids[0])
+
+        moving = alive + walker_ids
+        lines.append(" Positions: %d" % len(moving))
+        for actor_id in moving:
+            i = vehicle_ids.index(actor_id) if actor_id in vehicle_ids else vehicles + walker_ids.index(actor_id)
+            position[i] += rng.normal(0, 50, 3)
+            rotation = rng.uniform(-180, 180, 3)
+            lines.append("  Id: %d Location: %s Rotation %s" % (actor_id, vector(position[i]), vector(rotation)))
+        lines.append(" State traffic lights: %d" % len(light_ids))
+        for actor_id in light_ids:
+            lines.append("  Id: %d state: %d frozen: %d elapsedTime: %.3f" % (
+                actor_id, (frame // 10 + actor_id) % 5, frame > frames - 5, rng.uniform(0, 10)))
+        lines.append(" Vehicle animations: %d" % len(alive))
+        for actor_id in alive:
+            lines.append("  Id: %d Steering: %.3f Throttle: %.3f Brake: %.3f Handbrake: %d Gear: %d" % (
+                actor_id, rng.uniform(-1, 1), rng.uniform(0, 1), rng.uniform(0, 1), rng.integers(2),
+                rng.integers(-1, 5)))
+        lines.append(" Walker animations: %d" % len(walker_ids))
+        for actor_id in walker_ids:
+            lines.append("  Id: %d speed: %.3f" % (actor_id, rng.uniform(0, 2)))
+        lines.append(" Vehicle light animations: %d" % len(alive))
+        for actor_id in alive:
+            lines.append("  Id: %d %s" % (actor_id, ["None", "Position LowBeam", "Brake"][frame % 3]))
+        if frame % 20 == 1:
+            lines.append(" Scene light changes: 1")
+            lines.append("  Id: 7 enabled: true intensity: %.1f color: (1.000, 0.500, 0.200)" % frame)
+        lines.append(" Dynamic actors: %d" % len(moving))
+        for actor_id in moving:
+            lines.append("  Id: %d linear_velocity: %s angular_velocity: %s" % (
+                actor_id, vector(rng.normal(0, 5, 3)), vector(rng.normal(0, 1, 3))))
+        if frame == 1:
+            lines.append(" Actor bounding boxes: %d" % len(vehicle_ids))
+            for actor_id in vehicle_ids:
+                lines.append("  Id: %d Location: (0.000, 0.000, 70.000) Extent: (240.000, 100.000, 70.000)" % actor_id)
+            lines.append(" Actor trigger volumes: %d" % len(light_ids))
+            for actor_id in light_ids:
+                lines.append("  Id: %d Location: (100.000, 0.000, 0.000) Extent: (50.000, 200.000, 100.000)" % actor_id)
+        lines.append(" Current platform time: %.3f" % (12.0 + frame * 0.051))
+        if frame in (1, frames // 2):
+            lines += [
+                " Physics Control: 1",
+                "  Id: %d" % vehicle_ids[0],
+                "   max_rpm = %d" % (5800 + frame),
+                "   center_of_mass = (0.100, 0.000, -0.300)",
+                "   torque_curve = (0.000, 400.000) (1890.000, 500.000) (5729.000, 400.000)",
+                "   use_gear_auto_box = true",
+                "   forward_gears",
+                "    gear 0: ratio: 5.000 down_ratio: 0.500 up_ratio: 0.650",
+                "    gear 1: ratio: 3.000 down_ratio: 0.500 up_ratio: 0.650",
+                "   wheels",
+                "    wheel 0: tire_friction: 3.500 damping_rate: 0.250 max_steer_angle: 70.000 radius: 37.000 "
+                "max_brake_torque: 700.000 max_handbrake_torque: 0.000",
+            ]
+        if frame % 25 == 1:
+            lines.append(" Traffic Light time events: %d" % len(light_ids))
+            for actor_id in light_ids:
+                lines.append("  Id: %d green_time: %d yellow_time: 3 red_time: 2" % (actor_id, 10 + frame))
+
+    lines += ["", "Frames: %d" % frames, "Duration: %g seconds" % (frames * 0.05), ""]
+    return "\n".join(lines)
+
+
+def plain(value):
+    # the attributes of the carla values, to compare them whatever carla they were built with
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if hasattr(value, "__dict__") and not isinstance(value, enum.Enum):
+        return {key: plain(item) for key, item in vars(value).items()}
+    return value
+
+
+def legacy_state(frames, actor_id, state, frame):
+    # MetricsLog._get_actor_state on the dictionaries of legacy_parse_recorder_info
+    frame_state = frames[frame - 1]["actors"]
+    if actor_id in frame_state:
+        return frame_state[actor_id].get(state)
+    return None
+
+
+def legacy_last_event(frames, event, actor_id, frame):
+    for i in range(frame - 1, -1, -1):
+        if actor_id in frames[i]["events"][event]:
+            return frames[i]["events"][event][actor_id]
+    return None
+
+
+def legacy_parse_recorder_info(recorder_info):
+    """
+    The (simulation, actors, frames) dictionaries of MetricsParser.parse_recorder_info, which MetricsLog parsed
+    the recorder into before the arrays: a dictionary of carla values per frame, with the acceleration of an
+    actor its velocity compared to itself, always zero.
+    """
+    p = metrics_parser
+    recorder_list = recorder_info.split("Frame")
+    header = recorder_list[0].split("\n")
+    annex = recorder_list[-1].split("\n")
+    simulation_info = {"map": header[1][5:], "date:": header[2][6:], "total_frames": int(annex[0][3:]),
+                       "duration": float(annex[1][10:-8])}
+    actors_info = {}
+    frames_info = []
+
+    for frame in recorder_list[1:-1]:
+        rows = frame.split("\n")
+        frame_info = rows[0].split(" ")
+        frame_number, frame_time = int(frame_info[1]), float(frame_info[3])
+        try:
+            delta_time = round(frame_time - frames_info[frame_number - 2]["frame"]["elapsed_time"], 6)
+        except IndexError:
+            delta_time = 0
+        frame_state = {
+            "frame": {"elapsed_time": frame_time, "delta_time": delta_time, "platform_time": None},
+            "actors": {},
+            "events": {"scene_lights": {}, "physics_control": {}, "traffic_light_state_time": {}, "collisions": {}},
+        }
+        actors, events = frame_state["actors"], frame_state["events"]
+        i = 1
+
+        def section(title):
+            # the rows of the section if the frame has it next, split as the parser splits them
+            nonlocal i
+            if not rows[i].startswith(title):
+                return []
+            i += 1
+            elements = []
+            while rows[i].startswith("  "):
+                elements.append(rows[i][2:].split(" "))
+                i += 1
+            return elements
+
+        while rows[i].startswith(" Create") or rows[i].startswith("  "):
+            if rows[i].startswith(" Create"):
+                elements = rows[i][1:].split(" ")
+                actor_id = int(elements[1][:-1])
+                actors_info[actor_id] = dict(p.parse_actor(elements), created=frame_number)
+            else:
+                elements = rows[i][2:].split(" = ")
+                actors_info[actor_id][elements[0]] = elements[1]
+            i += 1
+        while rows[i].startswith(" Destroy"):
+            actors_info[int(rows[i][1:].split(" ")[1])]["destroyed"] = frame_number
+            i += 1
+        while rows[i].startswith(" Collision"):
+            elements = rows[i][1:].split(" ")
+            events["collisions"].setdefault(int(elements[4]), []).append(int(elements[-1]))
+            i += 1
+        while rows[i].startswith(" Parenting"):
+            elements = rows[i][1:].split(" ")
+            actors_info[int(elements[1])]["parent"] = int(elements[3])
+            i += 1
+
+        for elements in section(" Positions"):
+            actors[int(elements[1])] = {"transform": p.parse_transform(elements)}
+        for elements in section(" State traffic lights"):
+            actors[int(elements[1])] = p.parse_traffic_light(elements)
+        for elements in section(" Vehicle animations"):
+            actors[int(elements[1])]["control"] = p.parse_control(elements)
+        for elements in section(" Walker animations"):
+            actors[int(elements[1])]["speed"] = elements[3]
+        for elements in section(" Vehicle light animations"):
+            actors[int(elements[1])]["lights"] = p.parse_vehicle_lights(elements)
+        for elements in section(" Scene light changes"):
+            events["scene_lights"][int(elements[1])] = p.parse_scene_lights(elements)
+        for elements in section(" Dynamic actors"):
+            actor = actors[int(elements[1])]
+            actor["velocity"] = p.parse_velocity(elements)
+            actor["angular_velocity"] = p.parse_angular_velocity(elements)
+            if delta_time == 0:
+                actor["acceleration"] = carla.Vector3D(0, 0, 0)
+            else:
+                actor["acceleration"] = (actor["velocity"] - actor["velocity"]) / delta_time
+        for elements in section(" Actor bounding boxes"):
+            actors_info[int(elements[1])]["bounding_box"] = p.parse_bounding_box(elements)
+        for elements in section(" Actor trigger volumes"):
+            actors_info[int(elements[1])]["trigger_volume"] = p.parse_bounding_box(elements)
+        if rows[i].startswith(" Current platform time"):
+            frame_state["frame"]["platform_time"] = float(rows[i][1:].split(" ")[-1])
+            i += 1
+        if rows[i].startswith(" Physics Control"):
+            i += 1
+            while rows[i].startswith("  "):
+                actor_id = int(rows[i][2:].split(" ")[1])
+                i += 1
+                control_rows = []
+                while rows[i].startswith("   "):
+                    control_rows.append(rows[i])
+                    i += 1
+                events["physics_control"][actor_id] = p.parse_physics_control(control_rows)
+        for elements in section(" Traffic Light time events"):
+            events["traffic_light_state_time"][int(elements[1])] = p.parse_state_times(elements)
+
+        frames_info.append(frame_state)
+
+    return simulation_info, actors_info, frames_info
+
+
+@pytest.fixture(scope="module")
+def recorder():
+    return synthetic_recorder()
+
+
+@pytest.fixture(scope="module")
+def legacy(recorder):
+    return legacy_parse_recorder_info(recorder)
+
+
+@pytest.fixture(scope="module")
+def log(recorder):
+    return metrics_log.MetricsLog(recorder)
+
+
+class TestMetricsArrays:
+    def test_simulation_and_actors(self, log, legacy):
+        simulation, actors, frames = legacy
+        assert log._simulation == simulation
+        assert plain(log._actors) == plain(actors)
+        assert log.get_ego_vehicle_id() == 100
+        assert log.get_actor_ids_with_role_name("scenario") == [101]
+        assert log.get_actor_alive_frames(105) == (1, 30)
+        assert plain(log.get_actor_bounding_box(101)) == plain(actors[101]["bounding_box"])
+        for frame in range(len(frames)):
+            assert log.get_elapsed_time(frame) == frames[frame]["frame"]["elapsed_time"]
+            assert log.get_delta_time(frame) == frames[frame]["frame"]["delta_time"]
+            assert log.get_platform_time(frame) == frames[frame]["frame"]["platform_time"]
+        for actor_id in actors:
+            expected = {i: frame["events"]["collisions"][actor_id] for i, frame in enumerate(frames)
+                        if actor_id in frame["events"]["collisions"]}
+            assert log.get_actor_collisions(actor_id) == expected
+        assert len(log.get_actor_collisions(100)) == 3
+
+    def test_actor_states(self, log, legacy):
+        _, actors, frames = legacy
+        states = ["transform", "velocity", "angular_velocity", "control", "speed", "lights", "state", "frozen",
+                  "elapsed_time"]
+        for actor_id in list(actors) + [12345]:
+            for state in states:
+                expected = [legacy_state(frames, actor_id, state, frame) for frame in range(1, len(frames) + 1)]
+                assert [plain(log._get_actor_state(actor_id, state, frame)) for frame in range(1, len(frames) + 1)] \
+                    == plain(expected), (actor_id, state)
+                assert plain(log._get_all_actor_states(actor_id, state)) == plain(expected)
+                assert plain(log._get_all_actor_states(actor_id, state, 10, 40)) == plain(expected[9:40])
+        assert log.is_vehicle_light_active(carla.VehicleLightState.Brake, 100, 2)
+        assert log.get_walker_speed(300, 5) == legacy_state(frames, 300, "speed", 5)
+
+        for frame in range(1, len(frames) - 1):
+            for getter, state in [(log.get_actor_transforms_at_frame, "transform"),
+                                  (log.get_actor_velocities_at_frame, "velocity")]:
+                expected = {actor_id: legacy_state(frames, actor_id, state, frame)
+                            for actor_id in frames[frame]["actors"]
+                            if legacy_state(frames, actor_id, state, frame)}
+                assert plain(getter(frame)) == plain(expected)
+                assert plain(getter(frame, [101, 300])) == plain({
+                    actor_id: legacy_state(frames, actor_id, state, frame)
+                    for actor_id in frames[frame]["actors"] if actor_id in [101, 300]})
+
+    def test_acceleration(self, log, legacy):
+        # the change of the velocity since the frame before (the dictionaries compare a velocity to itself)
+        _, _, frames = legacy
+        velocities = log.get_actor_state_array(105, "velocity")
+        accelerations = log.get_actor_state_array(105, "acceleration")
+        assert np.isnan(velocities[30:]).all() and np.isnan(accelerations[30:]).all()
+        np.testing.assert_allclose(accelerations[1:30], np.diff(velocities[:30], axis=0) / 0.05, rtol=1e-6)
+        assert np.all(accelerations[0] == 0)
+        acceleration = log.get_actor_acceleration(105, 2)
+        assert [acceleration.x, acceleration.y, acceleration.z] == pytest.approx(accelerations[1].tolist())
+        assert legacy_state(frames, 105, "acceleration", 2) == carla.Vector3D(0, 0, 0)
+
+    def test_acceleration_behaviour_change(self, log, legacy):
+        # get_actor_acceleration was always 0: it is now the change of the velocities of the dictionaries
+        _, _, frames = legacy
+        for actor_id in [100, 101, 105]:
+            accelerations = log.get_all_actor_accelerations(actor_id)
+            assert plain(accelerations[0]) == plain(carla.Vector3D(0, 0, 0))
+            for frame in range(2, 30):
+                before = legacy_state(frames, actor_id, "velocity", frame - 1)
+                after = legacy_state(frames, actor_id, "velocity", frame)
+                expected = (after - before) / 0.05
+                acceleration = log.get_actor_acceleration(actor_id, frame)
+                assert [acceleration.x, acceleration.y, acceleration.z] == pytest.approx(
+                    [expected.x, expected.y, expected.z], rel=1e-5, abs=1e-3)
+                assert legacy_state(frames, actor_id, "acceleration", frame) == carla.Vector3D(0, 0, 0)
+            assert any(abs(value.x) + abs(value.y) > 0 for value in accelerations[1:29])
+
+    def test_state_arrays(self, log, legacy):
+        _, _, frames = legacy
+        transforms = log.get_actor_state_array(101, "transform", 5, 64)
+        assert transforms.shape == (60, 6)
+        assert np.isnan(transforms[56:]).all()
+        transform = legacy_state(frames, 101, "transform", 5)
+        assert transforms[0].tolist() == [transform.location.x, transform.location.y, transform.location.z,
+                                          transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll]
+        controls = log.get_actor_state_array(102, "control")
+        control = legacy_state(frames, 102, "control", 7)
+        assert controls[6].tolist() == [control.throttle, control.steer, control.brake, control.hand_brake,
+                                        control.reverse, control.gear]
+        lights = log.get_actor_state_array(501, "traffic_light", 1, 3)
+        assert lights[:, 0].tolist() == [legacy_state(frames, 501, "state", f).value for f in range(1, 4)]
+        assert np.isnan(log.get_actor_state_array(12345, "velocity", 1, 4)).all()
+
+    def test_events(self, log, legacy):
+        _, _, frames = legacy
+        for frame in range(1, len(frames) + 1):
+            assert plain(log.get_vehicle_physics_control(100, frame)) == \
+                plain(legacy_last_event(frames, "physics_control", 100, frame))
+            assert plain(log.get_scene_light_state(7, frame)) == \
+                plain(legacy_last_event(frames, "scene_lights", 7, frame))
+            state_times = legacy_last_event(frames, "traffic_light_state_time", 502, frame)
+            assert log.get_traffic_light_state_time(502, carla.TrafficLightState.Green, frame) == \
+                state_times[carla.TrafficLightState.Green]
+        assert log.get_vehicle_physics_control(101, 10) is None
+        assert log.get_vehicle_physics_control(100, 40).max_rpm == 5830
+
+    def test_cache(self, recorder, log, tmp_path):
+        with metrics_modules():
+            cached = metrics_log.MetricsLog(recorder, str(tmp_path))
+        files = os.listdir(str(tmp_path))
+        assert len(files) == 1
+        mtime = os.path.getmtime(os.path.join(str(tmp_path), files[0]))
+        with metrics_modules():
+            loaded = metrics_log.MetricsLog(recorder, str(tmp_path))
+        assert os.path.getmtime(os.path.join(str(tmp_path), files[0])) == mtime
+        for other in [cached, loaded]:
+            assert plain(other._actors) == plain(log._actors)
+            assert plain(other.get_all_actor_transforms(103)) == plain(log.get_all_actor_transforms(103))
+            assert plain(other.get_vehicle_physics_control(100, 50)) == plain(log.get_vehicle_physics_control(100, 50))
+            np.testing.assert_array_equal(other.get_actor_state_array(300, "velocity"),
+                                          log.get_actor_state_array(300, "velocity"))
+        # another recorder, another cache file
+        with metrics_modules():
+            metrics_log.MetricsLog(synthetic_recorder(frames=20, seed=1), str(tmp_path))
+        assert len(os.listdir(str(tmp_path))) == 2
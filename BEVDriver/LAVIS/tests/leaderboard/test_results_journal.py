@@ -0,0 +1,151 @@
+"""
+Tests for the results journal of the leaderboard checkpoint (leaderboard/leaderboard/utils/checkpoint_tools.py):
+the route records, entry status and progress appended as JSON lines, replayed by the readers and on resume,
+compacted into the summary JSON of create_default_json_msg, and the journal of thousands of routes.
+"""
+
+import os
+import json
+
+from team_code.agent_replay import install_simulator_stubs
+
+install_simulator_stubs()
+from leaderboard.utils.checkpoint_tools import (append_entry, compact_checkpoint, create_default_json_msg, fetch_dict,
+                                                journal_path)
+from leaderboard.utils.route_indexer import RouteIndexer
+from leaderboard.utils.statistics_manager import RouteRecord, StatisticsManager
+
+N_ROUTES = 2000
+
+
+def make_record(index, status="Completed"):
+    record = RouteRecord()
+    record.route_id = "RouteScenario_%d" % index
+    record.index = index
+    record.status = status
+    record.scores = {"score_route": 100.0, "score_penalty": 0.7, "score_composed": 70.0}
+    record.infractions["red_light"].append("Agent ran a red light %d at (x=12.3, y=45.6, z=0.0)" % index)
+    record.meta = {"duration_system": 120.5, "duration_game": 60.25, "route_length": 812.3}
+    return record
+
+
+def route_indexer(index, total):
+    # the progress of RouteIndexer without parsing a routes file
+    indexer = RouteIndexer.__new__(RouteIndexer)
+    indexer._index, indexer.total = index, total
+    return indexer
+
+
+def run_routes(endpoint, start, stop, total):
+    # what LeaderboardEvaluator saves per route
+    for index in range(start, stop):
+        StatisticsManager.save_record(make_record(index), index, endpoint)
+        StatisticsManager.save_entry_status("Started", False, endpoint)
+        route_indexer(index + 1, total).save_state(endpoint)
+
+
+def expected_checkpoint(n_routes, total):
+    data = create_default_json_msg()
+    data["_checkpoint"]["records"] = [json.loads(json.dumps(make_record(i).__dict__)) for i in range(n_routes)]
+    data["_checkpoint"]["progress"] = [n_routes, total]
+    data["entry_status"], data["eligible"] = "Started", False
+    return data
+
+
+class TestResultsJournal:
+    def test_readers_replay_the_journal(self, tmp_path):
+        endpoint = str(tmp_path / "results.json")
+        StatisticsManager.clear_record(endpoint)
+        route_indexer(0, 5).save_state(endpoint)
+        StatisticsManager.save_sensors(["carla_camera", "carla_lidar"], endpoint)
+        run_routes(endpoint, 0, 3, 5)
+        # the checkpoint file is left as cleared, the routes are in the journal
+        assert os.path.getsize(endpoint) == 0
+        with open(journal_path(endpoint)) as f:
+            assert len(f.readlines()) == 2 + 3 * 3
+
+        expected = expected_checkpoint(3, 5)
+        expected["sensors"] = ["carla_camera", "carla_lidar"]
+        assert fetch_dict(endpoint) == expected
+        # the sensors of the first route are kept, as save_sensors did
+        StatisticsManager.save_sensors(["carla_gnss"], endpoint)
+        assert fetch_dict(endpoint)["sensors"] == ["carla_camera", "carla_lidar"]
+
+    def test_resume_compacts(self, tmp_path):
+        endpoint = str(tmp_path / "results.json")
+        StatisticsManager.clear_record(endpoint)
+        run_routes(endpoint, 0, 4, 6)
+        # a route that is evaluated again replaces its record
+        StatisticsManager.save_record(make_record(2, "Failed - Agent timed out"), 2, endpoint)
+
+        manager = StatisticsManager()
+        manager.resume(endpoint)
+        assert [record.status for record in manager._registry_route_records] == ["Completed"] * 2 + [
+            "Failed - Agent timed out", "Completed"]
+        assert not os.path.exists(journal_path(endpoint))
+        with open(endpoint) as f:
+            data = json.load(f)
+        assert data["_checkpoint"]["progress"] == [4, 6]
+        assert data["_checkpoint"]["records"][2]["status"] == "Failed - Agent timed out"
+
+        # the rest of the run and the global record, written as the summary JSON
+        run_routes(endpoint, 4, 6, 6)
+        manager = StatisticsManager()
+        manager.resume(endpoint)
+        global_record = manager.compute_global_statistics(6)
+        StatisticsManager.save_global_record(global_record, [], 6, endpoint)
+        assert not os.path.exists(journal_path(endpoint))
+        with open(endpoint) as f:
+            data = json.load(f)
+        assert len(data["_checkpoint"]["records"]) == 6
+        assert data["entry_status"] == "Finished with agent errors"
+        assert data["values"][0] == "{:.3f}".format(global_record.scores["score_composed"])
+
+    def test_crash_safety(self, tmp_path):
+        endpoint = str(tmp_path / "results.json")
+        StatisticsManager.clear_record(endpoint)
+        run_routes(endpoint, 0, 3, 3)
+        # a crash while appending the last line
+        with open(journal_path(endpoint), "a") as f:
+            f.write('{"index": 3, "op": "record", "rec')
+        assert fetch_dict(endpoint) == expected_checkpoint(3, 3)
+        # and the routes after it
+        run_routes(endpoint, 3, 4, 4)
+        assert fetch_dict(endpoint) == expected_checkpoint(4, 4)
+
+        # a crash after the compacted checkpoint replaced the old one, before the journal was removed
+        with open(journal_path(endpoint)) as f:
+            journal = f.read()
+        compact_checkpoint(endpoint)
+        with open(journal_path(endpoint), "w") as f:
+            f.write(journal)
+        assert fetch_dict(endpoint) == expected_checkpoint(4, 4)
+
+    def test_record_that_skips_routes(self, tmp_path, capsys):
+        # is left out with an error, the checkpoint stays readable
+        endpoint = str(tmp_path / "results.json")
+        StatisticsManager.clear_record(endpoint)
+        run_routes(endpoint, 0, 3, 4)
+        append_entry(endpoint, {"op": "record", "index": 7, "record": make_record(7).__dict__})
+        run_routes(endpoint, 3, 4, 4)
+        assert fetch_dict(endpoint) == expected_checkpoint(4, 4)
+        assert "Journal record 7 after 3 records, skipped" in capsys.readouterr().out
+        assert compact_checkpoint(endpoint) == expected_checkpoint(4, 4)
+
+    def test_thousands_of_routes(self, tmp_path):
+        # three lines per route however long the run, the time per route is in tools/benchmarks/bench_results_journal.py
+        endpoint = str(tmp_path / "results.json")
+        StatisticsManager.clear_record(endpoint)
+        run_routes(endpoint, 0, N_ROUTES, N_ROUTES)
+        with open(journal_path(endpoint)) as f:
+            assert len(f.readlines()) == 3 * N_ROUTES
+        assert compact_checkpoint(endpoint) == expected_checkpoint(N_ROUTES, N_ROUTES)
+        assert not os.path.exists(journal_path(endpoint))
+        with open(endpoint) as f:
+            assert json.load(f) == expected_checkpoint(N_ROUTES, N_ROUTES)
+
+        # a route after the compaction is appended to a new journal
+        run_routes(endpoint, N_ROUTES, N_ROUTES + 1, N_ROUTES + 1)
+        with open(journal_path(endpoint)) as f:
+            assert len(f.readlines()) == 3
+        assert fetch_dict(endpoint) == expected_checkpoint(N_ROUTES + 1, N_ROUTES + 1)
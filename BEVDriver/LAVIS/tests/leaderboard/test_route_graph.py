@@ -0,0 +1,229 @@
+"""
+Tests for the route graph of leaderboard/leaderboard/utils/route_graph.py on a synthetic town standing in for
+the CARLA map: a grid of two-way roads whose topology is given as GlobalRoutePlannerDAO.get_topology gives it.
+The dense routes and their road options, the cache file, load_route_graph and the batch interpolation in
+worker processes, with the keypoints looked up on the map by the parent process.
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+from leaderboard.utils import route_graph
+from leaderboard.utils.route_graph import (GraphWaypoint, Location, RoadOption, Rotation, RouteGraph, Transform,
+                                           cache_path, interpolate_routes, load_route_graph, map_name,
+                                           map_waypoints)
+
+LANE_OFFSET = 1.75
+JUNCTION_SIZE = 8.0
+
+
+def make_waypoint(point, direction, road_id, lane_id, is_junction):
+    yaw = math.degrees(math.atan2(direction[1], direction[0]))
+    return GraphWaypoint(Transform(Location(float(point[0]), float(point[1]), 0.0), Rotation(0.0, yaw, 0.0)),
+                         road_id, 0, lane_id, is_junction)
+
+
+def make_segment(points, road_id, lane_id, is_junction, hop_resolution):
+    # points: a dense polyline, resampled every hop_resolution as the DAO samples waypoint.next(hop_resolution)
+    steps = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    arc = np.concatenate([[0.0], np.cumsum(steps)])
+    samples = np.arange(0.0, arc[-1], hop_resolution)
+    samples = samples[arc[-1] - samples > hop_resolution]
+    xs, ys = np.interp(samples, arc, points[:, 0]), np.interp(samples, arc, points[:, 1])
+    directions = np.gradient(np.stack([xs, ys], axis=1), axis=0) if len(samples) > 1 else [points[-1] - points[0]]
+    waypoints = [make_waypoint((x, y), d, road_id, lane_id, is_junction) for x, y, d in zip(xs, ys, directions)]
+    exit_wp = make_waypoint(points[-1], points[-1] - points[-2], road_id, lane_id, is_junction)
+    entry_wp = waypoints[0]
+    return {
+        "entry": entry_wp,
+        "exit": exit_wp,
+        "entryxyz": tuple(np.round([entry_wp.transform.location.x, entry_wp.transform.location.y, 0.0], 0)),
+        "exitxyz": tuple(np.round([exit_wp.transform.location.x, exit_wp.transform.location.y, 0.0], 0)),
+        "path": waypoints[1:],
+    }
+
+
+def synthetic_town(grid=4, block=60.0, hop_resolution=1.0):
+    """
+    The topology of a grid x grid town of two-way roads block meters apart (right-hand traffic in the frame of
+    CARLA) and a junction at each crossing with a lane from every incoming to every outgoing lane but the U-turn.
+    Returns the topology and the lanes of the roads as (road_id, lane_id) -> (start, end).
+    """
+    topology, lanes = [], {}
+    road_id = 0
+    incoming, outgoing = {}, {}
+    for i in range(grid):
+        for j in range(grid):
+            for di, dj in [(1, 0), (0, 1)]:
+                if i + di >= grid or j + dj >= grid:
+                    continue
+                road_id += 1
+                a, b = np.array([i, j]) * block, np.array([i + di, j + dj]) * block
+                for lane_id, (start, end) in [(-1, (a, b)), (1, (b, a))]:
+                    d = (end - start) / block
+                    right = np.array([-d[1], d[0]])
+                    p0 = start + d * JUNCTION_SIZE + right * LANE_OFFSET
+                    p1 = end - d * JUNCTION_SIZE + right * LANE_OFFSET
+                    points = np.linspace(p0, p1, 200)
+                    topology.append(make_segment(points, road_id, lane_id, False, hop_resolution))
+                    lanes[(road_id, lane_id)] = (p0, p1)
+                    outgoing.setdefault(tuple(start), []).append((d, p0))
+                    incoming.setdefault(tuple(end), []).append((d, p1))
+
+    for crossing in incoming:
+        for d_in, p0 in incoming[crossing]:
+            for d_out, p2 in outgoing[crossing]:
+                if np.allclose(d_out, -d_in):
+                    continue
+                if np.allclose(d_out, d_in):
+                    control = (p0 + p2) / 2
+                elif d_in[0] != 0:
+                    control = np.array([p2[0], p0[1]])
+                else:
+                    control = np.array([p0[0], p2[1]])
+                t = np.linspace(0.0, 1.0, 200)[:, None]
+                points = (1 - t) ** 2 * p0 + 2 * (1 - t) * t * control + t ** 2 * p2
+                road_id += 1
+                topology.append(make_segment(points, road_id, -1, True, hop_resolution))
+    return topology, lanes
+
+
+def lane_point(lanes, road_id, lane_id, fraction=0.5):
+    start, end = lanes[(road_id, lane_id)]
+    x, y = start + (end - start) * fraction
+    return Location(float(x), float(y), 0.0)
+
+
+def road_between(lanes, a, b, block=60.0):
+    # the road and lane from crossing a to crossing b
+    for (road_id, lane_id), (start, end) in lanes.items():
+        d = np.array(b) - np.array(a)
+        if np.allclose((end - start) / np.linalg.norm(end - start), d / np.linalg.norm(d)) and \
+                np.linalg.norm((start + end) / 2 - (np.array(a) + np.array(b)) * block / 2) < 2 * LANE_OFFSET:
+            return road_id, lane_id
+    raise KeyError((a, b))
+
+
+def options(route):
+    # the road options of a route without repeats
+    collapsed = []
+    for _, option in route:
+        if not collapsed or collapsed[-1] != option:
+            collapsed.append(option)
+    return collapsed
+
+
+class FakeMap:
+    """ the name and the OpenDRIVE of a carla.Map, for the cache file of load_route_graph"""
+    name = "Carla/Maps/Town99"
+
+    def to_opendrive(self):
+        return "<OpenDRIVE><header/></OpenDRIVE>"
+
+
+class LaneMap(FakeMap):
+    """ carla.Map.get_waypoint on the lanes of the synthetic town: the location projected on the closest lane"""
+    def __init__(self, lanes):
+        self.lanes = lanes
+
+    def get_waypoint(self, location):
+        point = np.array([location.x, location.y])
+        projections = {}
+        for key, (start, end) in self.lanes.items():
+            d = end - start
+            projections[key] = start + d * np.clip(np.dot(point - start, d) / np.dot(d, d), 0.0, 1.0)
+        (road_id, lane_id), projection = min(projections.items(), key=lambda item: np.linalg.norm(point - item[1]))
+        start, end = self.lanes[(road_id, lane_id)]
+        return make_waypoint(projection, end - start, road_id, lane_id, False)
+
+
+@pytest.fixture(scope="module")
+def town():
+    topology, lanes = synthetic_town()
+    return RouteGraph.from_topology(topology, 1.0, "Town99"), lanes
+
+
+class TestRouteGraph:
+    def test_road_options(self, town):
+        graph, lanes = town
+        east = road_between(lanes, (0, 1), (1, 1))
+        # straight on through the crossing (2, 1), then right (+y is on the right heading +x)
+        straight = graph.interpolate([lane_point(lanes, *east), lane_point(lanes, *road_between(lanes, (2, 1), (3, 1)))])
+        assert options(straight) == [RoadOption.LANEFOLLOW, RoadOption.STRAIGHT, RoadOption.LANEFOLLOW,
+                                     RoadOption.STRAIGHT, RoadOption.LANEFOLLOW]
+        right = graph.interpolate([lane_point(lanes, *east), lane_point(lanes, *road_between(lanes, (1, 1), (1, 2)))])
+        assert options(right) == [RoadOption.LANEFOLLOW, RoadOption.RIGHT, RoadOption.LANEFOLLOW]
+        left = graph.interpolate([lane_point(lanes, *east), lane_point(lanes, *road_between(lanes, (1, 1), (1, 0)))])
+        assert options(left) == [RoadOption.LANEFOLLOW, RoadOption.LEFT, RoadOption.LANEFOLLOW]
+
+        # a dense route from the origin to the destination
+        locations = np.array([transform.location for transform, _ in straight])
+        steps = np.linalg.norm(np.diff(locations, axis=0), axis=1)
+        assert steps.max() <= 2.0
+        assert locations[0][0] == pytest.approx(lane_point(lanes, *east).x, abs=1.0)
+        assert np.linalg.norm(locations[-1] - lane_point(lanes, *road_between(lanes, (2, 1), (3, 1)))) < 2.0
+
+    def test_keypoints(self, town):
+        graph, lanes = town
+        keypoints = [lane_point(lanes, *road_between(lanes, a, b)) for a, b in
+                     [((0, 0), (1, 0)), ((1, 1), (1, 2)), ((2, 2), (3, 2)), ((3, 2), (3, 3))]]
+        route = graph.interpolate(keypoints)
+        # as interpolate_trajectory, the traces of the pairs of keypoints one after the other
+        traces = [graph.interpolate(keypoints[i:i + 2]) for i in range(len(keypoints) - 1)]
+        assert len(route) == sum(len(trace) for trace in traces)
+        assert [t for t, _ in route] == [t for trace in traces for t, _ in trace]
+
+    def test_cache_file(self, town, tmp_path):
+        graph, lanes = town
+        filename = cache_path("Town99", 1.0, str(tmp_path))
+        graph.save(filename)
+        loaded = RouteGraph.load(filename)
+        trajectory = [lane_point(lanes, *road_between(lanes, (0, 0), (0, 1))),
+                      lane_point(lanes, *road_between(lanes, (3, 2), (2, 2)))]
+        assert loaded.interpolate(trajectory) == graph.interpolate(trajectory)
+        assert loaded.hop_resolution == 1.0 and loaded.town == "Town99"
+
+        # load_route_graph keys the cache file by the town and its OpenDRIVE and reads it once per process
+        filename = cache_path(map_name(FakeMap()), 1.0, str(tmp_path))
+        graph.save(filename)
+        cached = load_route_graph(FakeMap(), 1.0, str(tmp_path))
+        assert cached.filename == filename
+        assert load_route_graph(FakeMap(), 1.0, str(tmp_path)) is cached
+        assert cached.interpolate(trajectory) == graph.interpolate(trajectory)
+        route_graph._graphs.clear()
+
+    def test_interpolate_routes(self, town, tmp_path):
+        graph, lanes = town
+        filename = cache_path("Town99", 1.0, str(tmp_path))
+        graph.save(filename)
+        rng = np.random.default_rng(0)
+        keys = sorted(lanes)
+        trajectories = [[lane_point(lanes, *keys[k], fraction=rng.uniform(0.2, 0.8))
+                         for k in rng.choice(len(keys), 3, replace=False)] for _ in range(12)]
+        expected = [graph.interpolate(trajectory) for trajectory in trajectories]
+        assert interpolate_routes(filename, trajectories, processes=1) == expected
+        # (x, y, z) tuples are what the worker processes are sent
+        routes = interpolate_routes(filename, [[tuple(location) for location in t] for t in trajectories], processes=2)
+        assert routes == expected
+
+    def test_map_waypoints(self, town, tmp_path):
+        # the routes of the workers with the waypoints of the map looked up by the parent process, as
+        # interpolate_trajectory with the map
+        graph, lanes = town
+        filename = cache_path("Town99", 1.0, str(tmp_path))
+        graph.save(filename)
+        lane_map = LaneMap(lanes)
+        rng = np.random.default_rng(1)
+        keys = sorted(lanes)
+        trajectories = [[lane_point(lanes, *keys[k], fraction=rng.uniform(0.2, 0.8))
+                         for k in rng.choice(len(keys), 3, replace=False)] for _ in range(8)]
+        # keypoints off the middle of their lanes
+        trajectories = [[Location(x, y + 0.5, z) for x, y, z in trajectory] for trajectory in trajectories]
+        waypoints = map_waypoints(lane_map, trajectories)
+        assert [(w.road_id, w.lane_id) for trajectory in waypoints for w in trajectory] == \
+            [(w.road_id, w.lane_id) for trajectory in trajectories for w in map(lane_map.get_waypoint, trajectory)]
+        expected = [graph.interpolate(trajectory, lane_map) for trajectory in trajectories]
+        assert interpolate_routes(filename, trajectories, 1, waypoints) == expected
+        assert interpolate_routes(filename, trajectories, 2, waypoints) == expected
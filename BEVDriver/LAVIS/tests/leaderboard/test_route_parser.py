@@ -0,0 +1,225 @@
+"""
+Tests for the scenarios of a route of RouteParser.scan_route_for_scenarios
+(leaderboard/leaderboard/utils/route_parser.py) with the waypoints of the route and the triggers in a
+LocationGrid: the same scenarios and triggers as the scan over the whole route and all the triggers, on the
+shipped scenario files of leaderboard/data/scenarios and the longest shipped routes of their towns, and on the
+thresholds of the distance and the yaw.
+"""
+
+import os
+import glob
+import json
+import math
+import tarfile
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from team_code.agent_replay import install_simulator_stubs
+
+install_simulator_stubs()
+from leaderboard.utils import route_parser
+from leaderboard.utils.route_graph import Location, RoadOption, Rotation, Transform
+from leaderboard.utils.route_parser import TRIGGER_THRESHOLD, LocationGrid, RouteParser
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../leaderboard/data")
+ROUTES_PER_TOWN = 2
+# the towns of the merged scenario file with the triggers the legacy scan goes through in seconds, the others
+# are in tools/benchmarks/bench_route_parser.py
+MERGED_TOWNS = ("Town01", "Town02", "Town07", "Town10HD")
+
+
+def load_scenario_files():
+    # the annotations of the towns of every scenario file, as RouteParser.parse_annotations_file
+    files = OrderedDict()
+    for filename in sorted(glob.glob(os.path.join(DATA, "scenarios", "town*_all_scenarios.json"))):
+        files[os.path.basename(filename)] = RouteParser.parse_annotations_file(filename)
+    with tarfile.open(os.path.join(DATA, "scenarios", "merged_all_towns_scenarios.json.tar.gz")) as archive:
+        annotations = json.load(archive.extractfile("merged_all_towns_scenarios.json"), object_pairs_hook=OrderedDict)
+    files["merged_all_towns_scenarios.json"] = OrderedDict()
+    for town_dict in annotations["available_scenarios"]:
+        files["merged_all_towns_scenarios.json"].update(town_dict)
+    return files
+
+
+def longest_routes(town, count):
+    # the keypoints of the count longest routes of the town in the routes files
+    routes = {}
+    for filename in glob.glob(os.path.join(DATA, "*", "*.xml")):
+        for route in ET.parse(filename).iter("route"):
+            if route.attrib["town"] != town:
+                continue
+            keypoints = tuple((float(w.attrib["x"]), float(w.attrib["y"]), float(w.attrib["z"]))
+                              for w in route.iter("waypoint"))
+            routes[keypoints] = sum(math.dist(a, b) for a, b in zip(keypoints, keypoints[1:]))
+    return sorted(routes, key=routes.get, reverse=True)[:count]
+
+
+def dense_route(keypoints, hop_resolution=1.0):
+    """
+    The route of the keypoints as interpolate_trajectory gives it: a (transform, road option) every
+    hop_resolution meters, straight lines between the keypoints standing in for the roads of the map, with a
+    turn at the keypoints where the heading changes and a crossing straight on at some of the others.
+    """
+    route = []
+    headings = [math.atan2(b[1] - a[1], b[0] - a[0]) for a, b in zip(keypoints, keypoints[1:])]
+    for i, (a, b) in enumerate(zip(keypoints, keypoints[1:])):
+        a, b = np.array(a), np.array(b)
+        steps = max(int(np.linalg.norm(b - a) / hop_resolution), 1)
+        turn = math.degrees((headings[i] - headings[i - 1] + math.pi) % (2 * math.pi) - math.pi) if i else 0.0
+        for step in range(steps):
+            x, y, z = a + (b - a) * step / steps
+            option = RoadOption.LANEFOLLOW
+            if step * hop_resolution < 10.0:
+                if turn > 30.0:
+                    option = RoadOption.RIGHT
+                elif turn < -30.0:
+                    option = RoadOption.LEFT
+                elif i % 3 == 0:
+                    option = RoadOption.STRAIGHT
+            route.append((Transform(Location(float(x), float(y), float(z)),
+                                    Rotation(0.0, math.degrees(headings[i]), 0.0)), option))
+    return route
+
+
+def trigger_route(annotations, town, seed=0, size=1000):
+    # a route through the triggers of the town moved up to past the thresholds of the distance and the yaw
+    rng = np.random.default_rng(seed)
+    triggers = [event["transform"] for scenario in annotations[town]
+                for event in scenario["available_event_configurations"]]
+    route = []
+    for k in rng.choice(len(triggers), min(size, len(triggers)), replace=False):
+        trigger = triggers[k]
+        dx, dy = rng.uniform(-1.0, 1.0, 2) * TRIGGER_THRESHOLD * 1.2
+        dyaw = rng.uniform(-15.0, 15.0)
+        route.append((Transform(Location(float(trigger["x"]) + dx, float(trigger["y"]) + dy, float(trigger["z"])),
+                                Rotation(0.0, float(trigger["yaw"]) + dyaw, 0.0)), RoadOption(rng.integers(1, 7))))
+    return route
+
+
+def close_events(annotations, town, route, distance=3.0):
+    """
+    The annotations of the town with only the events in the cells of distance meters around the waypoints of
+    the route: the events farther than TRIGGER_THRESHOLD match no waypoint, so the scenarios of the route are
+    the same with fewer events to scan the whole route for.
+    """
+    cells = {(math.floor(t.location.x / distance) + dx, math.floor(t.location.y / distance) + dy)
+             for t, _ in route for dx in (-1, 0, 1) for dy in (-1, 0, 1)}
+    close = []
+    for scenario in annotations[town]:
+        events = [event for event in scenario["available_event_configurations"]
+                  if (math.floor(float(event["transform"]["x"]) / distance),
+                      math.floor(float(event["transform"]["y"]) / distance)) in cells]
+        close.append(dict(scenario, available_event_configurations=events))
+    return {town: close}
+
+
+def legacy_scan_route_for_scenarios(route_name, trajectory, world_annotations, memoize=True):
+    # RouteParser.scan_route_for_scenarios before the grids: every waypoint of the route and every trigger, with
+    # memoize the match of a trigger transform scanned for once as the scenarios of a town share their triggers
+    existent_triggers = OrderedDict()
+    possible_scenarios = OrderedDict()
+    latest_trigger_id = 0
+    matches = {}
+    for scenario in world_annotations.get(route_name, []):
+        scenario_name = scenario["scenario_type"]
+        for event in scenario["available_event_configurations"]:
+            waypoint = event['transform']
+            RouteParser.convert_waypoint_float(waypoint)
+            key = (waypoint['x'], waypoint['y'], waypoint['z'], waypoint['yaw'])
+            if key not in matches or not memoize:
+                matches[key] = RouteParser.match_world_location_to_route(waypoint, trajectory)
+            match_position = matches[key]
+            if match_position is None:
+                continue
+            scenario_subtype = RouteParser.get_scenario_type(scenario_name, match_position, trajectory)
+            if scenario_subtype is None:
+                continue
+            scenario_description = {
+                'name': scenario_name,
+                'other_actors': event.get('other_actors'),
+                'trigger_position': waypoint,
+                'scenario_type': scenario_subtype,
+            }
+            trigger_id = RouteParser.check_trigger_position(waypoint, existent_triggers)
+            if trigger_id is None:
+                existent_triggers.update({latest_trigger_id: waypoint})
+                possible_scenarios.update({latest_trigger_id: []})
+                trigger_id = latest_trigger_id
+                latest_trigger_id += 1
+            possible_scenarios[trigger_id].append(scenario_description)
+    return possible_scenarios, existent_triggers
+
+
+@pytest.fixture(scope="module", autouse=True)
+def road_options():
+    # the road options of the routes, in place of those of the stubbed agents package
+    stubbed, route_parser.RoadOption = route_parser.RoadOption, RoadOption
+    yield
+    route_parser.RoadOption = stubbed
+
+
+@pytest.fixture(scope="module")
+def scenario_files():
+    return load_scenario_files()
+
+
+class TestRouteParser:
+    def test_location_grid(self):
+        rng = np.random.default_rng(0)
+        points = rng.uniform(-50.0, 50.0, (2000, 2))
+        grid = LocationGrid()
+        for key, (x, y) in enumerate(points):
+            grid.add(key, x, y)
+        for x, y in rng.uniform(-55.0, 55.0, (200, 2)):
+            close = np.flatnonzero(np.hypot(points[:, 0] - x, points[:, 1] - y) < TRIGGER_THRESHOLD)
+            candidates = grid.candidates(x, y)
+            assert set(close) <= set(candidates)
+            assert candidates == sorted(candidates)
+
+    def test_thresholds(self):
+        route = [(Transform(Location(10.0 * i, 0.0, 0.0), Rotation(0.0, 0.0, 0.0)), RoadOption.LANEFOLLOW)
+                 for i in range(20)]
+        grid = LocationGrid.from_route(route)
+        for x, y, yaw in [(50.0, 1.99, 359.0), (51.99, 0.0, 9.9), (50.0, 2.0, 0.0), (50.0, 0.0, 10.0),
+                          (45.0, 0.0, 0.0), (-1.0, -1.0, -9.0), (190.0, 0.0, 180.0)]:
+            location = {'x': x, 'y': y, 'z': 0.0, 'yaw': yaw}
+            assert RouteParser.match_world_location_to_route(location, route, grid) == \
+                RouteParser.match_world_location_to_route(location, route)
+        # the first of the waypoints that match, not the closest
+        route[6] = (Transform(Location(50.5, 0.0, 0.0), Rotation(0.0, 0.0, 0.0)), RoadOption.LANEFOLLOW)
+        assert RouteParser.match_world_location_to_route({'x': 51.0, 'y': 0.0, 'z': 0.0, 'yaw': 0.0}, route,
+                                                         LocationGrid.from_route(route)) == 5
+
+        triggers = OrderedDict([(0, {'x': 0.0, 'y': 0.0, 'yaw': 90.0}), (1, {'x': 1.0, 'y': 0.0, 'yaw': 0.0}),
+                                (2, {'x': 0.5, 'y': 0.0, 'yaw': 0.0})])
+        trigger_grid = LocationGrid()
+        for trigger_id, trigger in triggers.items():
+            trigger_grid.add(trigger_id, trigger['x'], trigger['y'])
+        for trigger in [{'x': 0.6, 'y': 0.5, 'yaw': 355.0}, {'x': 0.0, 'y': 1.9, 'yaw': 85.0},
+                        {'x': -2.0, 'y': 0.0, 'yaw': 90.0}, {'x': 1.0, 'y': 0.0, 'yaw': 180.0}]:
+            assert RouteParser.check_trigger_position(trigger, triggers, trigger_grid) == \
+                RouteParser.check_trigger_position(trigger, triggers)
+
+    def test_shipped_scenarios(self, scenario_files):
+        matched = 0
+        for name, annotations in scenario_files.items():
+            towns = MERGED_TOWNS if name == "merged_all_towns_scenarios.json" else annotations
+            for town in towns:
+                for keypoints in longest_routes(town, ROUTES_PER_TOWN):
+                    route = dense_route(keypoints)
+                    expected = legacy_scan_route_for_scenarios(town, route, close_events(annotations, town, route))
+                    assert RouteParser.scan_route_for_scenarios(town, route, annotations) == expected
+                    matched += len(expected[1])
+        assert matched > 100
+
+    def test_thresholds_of_shipped_triggers(self, scenario_files):
+        # routes through the triggers, for matches and misses around the thresholds of the distance and the yaw
+        annotations = scenario_files["merged_all_towns_scenarios.json"]
+        for seed, town in enumerate(["Town02", "Town07", "Town10HD"]):
+            route = trigger_route(annotations, town, seed)
+            expected = legacy_scan_route_for_scenarios(town, route, close_events(annotations, town, route))
+            assert RouteParser.scan_route_for_scenarios(town, route, annotations) == expected
+            assert len(expected[1]) > 10
@@ -0,0 +1,105 @@
+"""
+Shared fixtures for the drive model tests.
+
+`build_tiny_drive_model` assembles a Blip2VicunaDrive with a randomly initialized tiny LLaMA,
+Q-Former and tokenizer so the model logic can be exercised on CPU without downloading any
+pretrained weights.
+"""
+
+import pytest
+import torch
+import torch.nn as nn
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import LlamaConfig, PreTrainedTokenizerFast
+
+from lavis.models.blip2_models.modeling_llama import LlamaForCausalLM
+from lavis.models.bevllm_models.Qformer import BertConfig, BertLMHeadModel
+from lavis.models.drive_models.drive import Blip2VicunaDrive, LayerNorm
+
+ENCODER_DIM = 16
+NUM_QUERY_TOKEN = 4
+
+WORDS = (
+    "turn left right at the next intersection follow lane go straight stop drive safely "
+    "change to keep speed up slow down , . <frame> </frame> 0.0 1.0 2.0 -1.0"
+).split()
+
+
+def build_tiny_tokenizer():
+    vocab = {w: i for i, w in enumerate(["[PAD]", "</s>", "[UNK]"] + WORDS)}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        pad_token="[PAD]",
+        bos_token="</s>",
+        eos_token="</s>",
+        unk_token="[UNK]",
+    )
+
+
+def build_tiny_drive_model(has_gru_decoder=False, hidden_size=32, num_layers=2, seed=0):
+    torch.manual_seed(seed)
+    model = Blip2VicunaDrive.__new__(Blip2VicunaDrive)
+    nn.Module.__init__(model)
+
+    model.use_extra_prompt = False
+    model.freeze_decoder_of_bev_encoder = False
+    model.has_qformer = True
+    model.has_gru_decoder = has_gru_decoder
+    model.has_lora = False
+    model.split_section_num_for_bev_encoder = 1
+    model.max_txt_len = 64
+
+    model.llm_tokenizer = build_tiny_tokenizer()
+    model.llm_model = LlamaForCausalLM(
+        LlamaConfig(
+            vocab_size=len(model.llm_tokenizer),
+            hidden_size=hidden_size,
+            intermediate_size=hidden_size * 2,
+            num_hidden_layers=num_layers,
+            num_attention_heads=4,
+            max_position_embeddings=2048,
+        )
+    )
+
+    qformer_config = BertConfig(
+        vocab_size=len(model.llm_tokenizer),
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+    )
+    qformer_config.encoder_width = ENCODER_DIM
+    qformer_config.add_cross_attention = True
+    qformer_config.cross_attention_freq = 2
+    qformer_config.query_length = NUM_QUERY_TOKEN
+    model.Qformer = BertLMHeadModel(qformer_config)
+    model.Qformer.cls = None
+    model.query_tokens = nn.Parameter(torch.randn(1, NUM_QUERY_TOKEN, qformer_config.hidden_size) * 0.02)
+
+    model.ln_vision = LayerNorm(ENCODER_DIM)
+    model.llm_proj = nn.Linear(qformer_config.hidden_size, hidden_size)
+
+    if has_gru_decoder:
+        model.waypoints_fc = nn.Sequential(
+            nn.Linear(hidden_size, hidden_size), nn.ReLU(), nn.Linear(hidden_size, 64)
+        )
+        model.waypoints_predictor = nn.GRUCell(input_size=2, hidden_size=64)
+        model.waypoints_output = nn.Linear(64, 2)
+    else:
+        model.waypoints_predictor = nn.Sequential(
+            nn.Linear(hidden_size, hidden_size), nn.ReLU(), nn.Linear(hidden_size, 10)
+        )
+    model.end_predictor = nn.Sequential(
+        nn.Linear(hidden_size, hidden_size), nn.ReLU(), nn.Linear(hidden_size, 2)
+    )
+    model.waypoints_loss = torch.nn.L1Loss()
+    model.end_loss = torch.nn.CrossEntropyLoss()
+    model.reset_stream()
+    return model.eval()
+
+
+@pytest.fixture
+def tiny_drive_model():
+    return build_tiny_drive_model()
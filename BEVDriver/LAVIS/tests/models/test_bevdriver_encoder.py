@@ -0,0 +1,115 @@
+"""
+Tests for the multi-view forward of the bev encoder (timm/models/bevdriver_encoder.py): one backbone
+pass over the 128 px views and cached sine position tables, checked against the per-view forward.
+"""
+
+import importlib
+
+import pytest
+import torch
+
+from timm.models.bevdriver_encoder import Interfuser, PositionEmbeddingSine
+
+# the module, timm.models.bevdriver_encoder is the registered model function
+bevdriver_encoder = importlib.import_module("timm.models.bevdriver_encoder")
+
+
+def without_pretrained(create):
+    def create_random(*args, pretrained=False, **kwargs):
+        return create(*args, pretrained=False, **kwargs)
+    return create_random
+
+
+def build_encoder(monkeypatch, **kwargs):
+    # random weights, the rgb backbones would download pretrained ones
+    for name in ["resnet50d", "resnet26d", "resnet18d"]:
+        monkeypatch.setattr(bevdriver_encoder, name, without_pretrained(getattr(bevdriver_encoder, name)))
+    torch.manual_seed(0)
+    kwargs = dict(dict(enc_depth=1, embed_dim=32, num_heads=4, dim_feedforward=64, rgb_backbone_name="r18",
+                       lidar_backbone_name="r18", use_different_backbone=True), **kwargs)
+    encoder = Interfuser(**kwargs)
+    # non-trivial batch norm statistics, eval mode uses them
+    for module in encoder.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            module.running_mean.uniform_(-0.1, 0.1)
+            module.running_var.uniform_(0.5, 1.5)
+    return encoder.eval()
+
+
+def make_inputs(bs, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    inputs = {key: torch.randn(bs, 3, 128, 128, generator=generator) for key in ["rgb_left", "rgb_right", "rgb_center"]}
+    inputs["rgb"] = torch.randn(bs, 3, 224, 224, generator=generator)
+    inputs["lidar"] = torch.randn(bs, 3, 224, 224, generator=generator)
+    inputs["measurements"] = torch.randn(bs, 10, generator=generator)
+    return inputs
+
+
+def reference_position_encoding(module, x):
+    # PositionEmbeddingSine.forward before the tables were cached
+    bs, _, h, w = x.shape
+    not_mask = torch.ones((bs, h, w), device=x.device)
+    y_embed = not_mask.cumsum(1, dtype=torch.float32)
+    x_embed = not_mask.cumsum(2, dtype=torch.float32)
+    if module.normalize:
+        eps = 1e-6
+        y_embed = y_embed / (y_embed[:, -1:, :] + eps) * module.scale
+        x_embed = x_embed / (x_embed[:, :, -1:] + eps) * module.scale
+    dim_t = torch.arange(module.num_pos_feats, dtype=torch.float32, device=x.device)
+    dim_t = module.temperature ** (2 * (dim_t // 2) / module.num_pos_feats)
+    pos_x = x_embed[:, :, :, None] / dim_t
+    pos_y = y_embed[:, :, :, None] / dim_t
+    pos_x = torch.stack((pos_x[:, :, :, 0::2].sin(), pos_x[:, :, :, 1::2].cos()), dim=4).flatten(3)
+    pos_y = torch.stack((pos_y[:, :, :, 0::2].sin(), pos_y[:, :, :, 1::2].cos()), dim=4).flatten(3)
+    return torch.cat((pos_y, pos_x), dim=3).permute(0, 3, 1, 2)
+
+
+def reference_forward(encoder, x):
+    # Interfuser.forward with one rgb_patch_embed call per view, as before
+    features = []
+    views = [(0, encoder.rgb_patch_embed, x["rgb"])]
+    if encoder.with_right_left_sensors:
+        views += [(1, encoder.rgb_patch_embed, x["rgb_left"]), (2, encoder.rgb_patch_embed, x["rgb_right"])]
+    if encoder.with_center_sensor:
+        views.append((3, encoder.rgb_patch_embed, x["rgb_center"]))
+    if encoder.with_lidar:
+        views.append((4, encoder.lidar_patch_embed, x["lidar"]))
+    for view, patch_embed, image in views:
+        token, token_global = patch_embed(image)
+        position = reference_position_encoding(encoder.position_encoding, token)
+        if encoder.use_view_embed:
+            token = token + encoder.view_embed[:, :, view:view+1, :] + position
+        else:
+            token = token + position
+        token = token.flatten(2).permute(2, 0, 1)
+        token_global = token_global + encoder.view_embed[:, :, view, :] + encoder.global_embed[:, :, view:view+1]
+        features.extend([token, token_global.permute(2, 0, 1)])
+    return encoder.encoder(torch.cat(features, 0), mask=encoder.attn_mask).permute(1, 0, 2)
+
+
+class TestPositionEmbeddingSine:
+    def test_cached_table_matches(self):
+        module = PositionEmbeddingSine(16, normalize=True)
+        for shape in [(2, 32, 7, 7), (5, 32, 4, 4), (2, 32, 7, 7)]:
+            x = torch.zeros(shape)
+            assert torch.equal(module(x), reference_position_encoding(module, x))
+        assert len(module._tables) == 2
+
+
+class TestInterfuserForward:
+    @pytest.mark.parametrize("flags", [{}, {"with_center_sensor": False}, {"with_right_left_sensors": False},
+                                       {"use_view_embed": False}])
+    def test_matches_per_view_forward(self, monkeypatch, flags):
+        encoder = build_encoder(monkeypatch, **flags)
+        inputs = make_inputs(3)
+        with torch.no_grad():
+            expected = reference_forward(encoder, inputs)
+            output = encoder(inputs)
+        assert output.shape == expected.shape
+        assert torch.allclose(output, expected, atol=1e-5, rtol=1e-5)
+
+    def test_training_mode_keeps_batch_norm_per_view(self, monkeypatch):
+        encoder = build_encoder(monkeypatch, dropout=0.0).train()
+        inputs = make_inputs(2)
+        with torch.no_grad():
+            assert torch.allclose(encoder(inputs), reference_forward(encoder, inputs), atol=1e-5, rtol=1e-5)
@@ -0,0 +1,233 @@
+"""
+Tests for the training metrics kept on the device (timm/utils/device_metrics.py): the meters and IoUs
+of BEV_encoder/train.py and the per-iteration scalars of DriveTask, checked against the values logged
+with .item() on every step before.
+"""
+
+import random
+
+import numpy as np
+import pytest
+import torch
+
+from conftest import build_tiny_drive_model
+from test_drive_bev_cache import TinyBevEncoder, dataset_root
+from lavis.common.logger import MetricLogger, SmoothedValue
+from lavis.datasets.datasets.carla_dataset_llm import CarlaVoiceDataset
+from lavis.tasks.drive import DriveTask
+from timm.utils import AverageMeter, DeviceAverageMeter, binary_iou, confusion_matrix, semantic_iou_stats, sync_meters
+
+NUM_CLASSES = 28
+
+
+def reference_traffic_iou(output, target):
+    # traffic_iou of BEV_encoder/train.py before the device metrics
+    prediction = (output > 0.5).bool()
+    target = (target > 0.5).bool()
+    intersection = torch.sum(prediction & target).float()
+    union = torch.sum(prediction | target).float()
+    if union == 0.0:
+        return 0.0
+    return (intersection / union).item()
+
+
+def reference_semantic_iou(output, target):
+    # semantic_iou of BEV_encoder/train.py
+    pred = output.view(-1)
+    target = target.view(-1)
+    num_classes = len(torch.unique(target))
+    iou_per_class = torch.zeros(num_classes, dtype=torch.float32)
+    weighted_classes = torch.zeros(num_classes, dtype=torch.float32)
+    for c in range(1, num_classes + 1):
+        pred_c = (pred == c)
+        target_c = (target == c)
+        intersection = torch.sum(pred_c & target_c).float()
+        union = torch.sum(pred_c | target_c).float()
+        if union > 0:
+            iou_per_class[c - 1] = intersection / union
+            weighted_classes[c - 1] = torch.sum(target_c).float()
+    return iou_per_class, weighted_classes
+
+
+def reference_update(meters, semantic_pred, semantic_target, has_embeddings, batch_size):
+    # the semantic IoU updates of train_one_epoch before the device metrics
+    semantic_iou_m, semantic_iou_m_valid, semantic_iou_m_weighted = meters
+    if has_embeddings:
+        batch_semantic_ious, batch_weighted_classes = reference_semantic_iou(semantic_pred, semantic_target)
+        semantic_iou_m.update(batch_semantic_ious.mean().item(), batch_size)
+        valid_classes = batch_weighted_classes > 0
+        if valid_classes.sum() > 0:
+            semantic_iou_m_valid.update(batch_semantic_ious[valid_classes].mean().item(), batch_size)
+        else:
+            semantic_iou_m_valid.update(0.0, batch_size)
+        if batch_weighted_classes.sum() > 0:
+            weighted_mean = (batch_semantic_ious * batch_weighted_classes).sum() / batch_weighted_classes.sum()
+            semantic_iou_m_weighted.update(weighted_mean.item(), batch_size)
+        else:
+            semantic_iou_m_weighted.update(0.0, batch_size)
+
+
+def make_semantic_batch(generator, pixels, labels):
+    # masked predictions and targets as in train_one_epoch, targets >= NUM_CLASSES set to -100
+    pred = torch.randint(0, NUM_CLASSES, (pixels,), generator=generator)
+    target = torch.tensor(labels)[torch.randint(0, len(labels), (pixels,), generator=generator)]
+    agree = torch.rand(pixels, generator=generator) < 0.5
+    pred[agree] = target[agree].clamp(min=0)
+    return pred, target
+
+
+def log_line(meters):
+    return "  ".join("{m.val:.3f} ({m.avg:.3f})".format(m=meter) for meter in meters)
+
+
+class TestDeviceMetrics:
+    def test_meter_matches_average_meter(self):
+        generator = torch.Generator().manual_seed(0)
+        meter, device_meter = AverageMeter(), DeviceAverageMeter()
+        for step in range(20):
+            loss = torch.rand((), generator=generator) * 10
+            valid = torch.tensor(step % 3 != 0)
+            if valid:
+                meter.update(loss.item(), 4 + step)
+            device_meter.update(loss, 4 + step, valid=valid)
+            if step % 5 == 4:
+                sync_meters(device_meter)
+                # the same float64 arithmetic as the Python floats of AverageMeter
+                assert (device_meter.val, device_meter.sum, device_meter.avg) == (meter.val, meter.sum, meter.avg)
+                assert device_meter.count == meter.count
+
+    def test_confusion_matrix(self):
+        generator = torch.Generator().manual_seed(0)
+        pred, target = make_semantic_batch(generator, 500, [0, 1, 2, 5, -100])
+        confusion = confusion_matrix(target, pred, NUM_CLASSES)
+        target_index = torch.where(target < 0, NUM_CLASSES, target)
+        expected = torch.bincount(target_index * (NUM_CLASSES + 1) + pred, minlength=(NUM_CLASSES + 1) ** 2)
+        assert torch.equal(confusion, expected.view(NUM_CLASSES + 1, NUM_CLASSES + 1))
+
+    def test_traffic_iou(self):
+        generator = torch.Generator().manual_seed(0)
+        for _ in range(10):
+            output, target = torch.rand(2, 1, 20, 20, generator=generator) ** 3
+            assert binary_iou(output, target).item() == reference_traffic_iou(output, target)
+        assert binary_iou(torch.zeros(1, 20, 20), torch.zeros(1, 20, 20)).item() == 0.0
+
+    @pytest.mark.parametrize("labels", [
+        list(range(NUM_CLASSES)) + [-100],
+        [0, 3, 4, 7, 12, 27],
+        [0, -100],
+        [2],
+    ])
+    def test_semantic_iou_matches_class_loop(self, labels):
+        generator = torch.Generator().manual_seed(len(labels))
+        reference = [AverageMeter() for _ in range(3)]
+        meters = [DeviceAverageMeter() for _ in range(3)]
+        for step in range(6):
+            pred, target = make_semantic_batch(generator, int(torch.randint(200, 2000, (), generator=generator)), labels)
+            has_embeddings = step != 2
+            reference_update(reference, pred, target, has_embeddings, 8)
+            stats = semantic_iou_stats(pred, target, NUM_CLASSES)
+            for meter, value in zip(meters, stats):
+                meter.update(value, 8, valid=torch.tensor(has_embeddings))
+            sync_meters(*meters)
+            for meter, expected in zip(meters, reference):
+                assert meter.val == pytest.approx(expected.val, rel=1e-6, abs=1e-7)
+                assert meter.avg == pytest.approx(expected.avg, rel=1e-6, abs=1e-7)
+            assert log_line(meters) == log_line(reference)
+
+    def test_empty_batch(self):
+        # no valid pixels: the mean over no classes is nan, as torch.zeros(0).mean()
+        empty = torch.zeros(0, dtype=torch.long)
+        mean, valid_mean, weighted_mean = semantic_iou_stats(empty, empty, NUM_CLASSES).tolist()
+        assert np.isnan(mean) and valid_mean == 0.0 and weighted_mean == 0.0
+
+
+class RecordingWriter:
+    def __init__(self, model_calls):
+        self.model_calls = model_calls
+        self.scalars = []
+
+    def add_scalar(self, tag, value, step):
+        # with the number of forward passes done when the value was written
+        self.scalars.append((tag, value, step, len(self.model_calls)))
+
+
+class StepScheduler:
+    def __init__(self, optimizer):
+        self.optimizer = optimizer
+
+    def step(self, cur_epoch, cur_step):
+        for group in self.optimizer.param_groups:
+            group["lr"] = 1e-3 / (1 + cur_step)
+
+
+def reference_train_inner_loop(model, batches, writer, epoch, iters_per_epoch, log_freq):
+    # DriveTask._train_inner_loop before the device metrics: .item() of every loss on every iteration
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+    lr_scheduler = StepScheduler(optimizer)
+    data_loader = iter(batches)
+    metric_logger = MetricLogger(delimiter="  ")
+    metric_logger.add_meter("lr", SmoothedValue(window_size=1, fmt="{value:.6f}"))
+    metric_logger.add_meter("loss", SmoothedValue(window_size=1, fmt="{value:.4f}"))
+    for i in metric_logger.log_every(range(iters_per_epoch), log_freq, "Train"):
+        samples = next(data_loader)
+        lr_scheduler.step(cur_epoch=epoch, cur_step=i)
+        output = model(samples)
+        loss, loss_dict = output["loss"], dict(output)
+        for key in loss_dict:
+            if isinstance(loss_dict[key], (float, int)):
+                writer.add_scalar('train/%s_iter' % key, loss_dict[key], epoch * iters_per_epoch + i)
+            else:
+                writer.add_scalar('train/%s_iter' % key, loss_dict[key].item(), epoch * iters_per_epoch + i)
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        metric_logger.update(**loss_dict)
+        metric_logger.update(lr=optimizer.param_groups[0]["lr"])
+    for key, meter in metric_logger.meters.items():
+        writer.add_scalar('train/%s_epoch' % key, meter.global_avg, epoch)
+    return {k: "{:.3f}".format(meter.global_avg) for k, meter in metric_logger.meters.items()}
+
+
+class CountingModel(torch.nn.Module):
+    def __init__(self, model, calls):
+        super().__init__()
+        self.model = model
+        self.calls = calls
+
+    def forward(self, samples):
+        self.calls.append(1)
+        return self.model(samples)
+
+
+class TestDriveTaskLogging:
+    def test_logged_values_match_item_per_iteration(self, dataset_root):
+        dataset = CarlaVoiceDataset(dataset_root, token_max_length=4, sample_interval=2)
+
+        results = []
+        for run in ["reference", "device"]:
+            # forward reshapes the tensors of the samples in place
+            random.seed(0)
+            np.random.seed(0)
+            batches = [dataset.collater([dataset[i % len(dataset)]]) for i in range(7)]
+            calls = []
+            model = build_tiny_drive_model()
+            model.bev_encoder = TinyBevEncoder()
+            model = CountingModel(model, calls).train()
+            writer = RecordingWriter(calls)
+            if run == "reference":
+                averages = reference_train_inner_loop(model, batches, writer, epoch=1, iters_per_epoch=7, log_freq=3)
+            else:
+                optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+                averages = DriveTask()._train_inner_loop(
+                    epoch=1, iters_per_epoch=7, model=model, data_loader=batches, optimizer=optimizer,
+                    lr_scheduler=StepScheduler(optimizer), log_freq=3, writer=writer,
+                )
+            results.append((writer.scalars, averages))
+
+        (reference_scalars, reference_averages), (scalars, averages) = results
+        assert averages == reference_averages
+        by_step = lambda values: sorted((tag, step, value) for tag, value, step, _ in values)
+        assert by_step(scalars) == by_step(reference_scalars)
+        # the iteration values are written on the log iterations 0, 3 and 6 only
+        assert {calls for tag, _, _, calls in scalars if tag.endswith("_iter")} == {1, 4, 7}
+        assert {tag for tag, _, _, _ in scalars} >= {"train/end_acc_iter", "train/waypoints_loss_iter"}
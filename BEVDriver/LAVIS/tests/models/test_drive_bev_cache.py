@@ -0,0 +1,154 @@
+"""
+Tests for training Blip2VicunaDrive on precomputed bev encoder outputs
+(lavis/datasets/datasets/bev_embedding_store.py).
+"""
+
+import os
+import sys
+import json
+import random
+
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+
+from conftest import ENCODER_DIM, build_tiny_drive_model
+from lavis.datasets.datasets.bev_embedding_store import (bev_embedding_meta_path, extract_route_embeddings,
+                                                         load_bev_embeddings)
+from lavis.datasets.datasets.carla_dataset_llm import FRAME_KEYS, CarlaVoiceDataset
+from torch.utils.data.dataloader import default_collate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../tools/benchmarks"))
+from synthetic_routes import instruction_line, make_route, write_instruction_list
+
+FRAMES = 12
+N_ENCODER_TOKENS = 6
+
+
+class TinyBevEncoder(nn.Module):
+    # stands in for the Interfuser encoder: [B, N_ENCODER_TOKENS, ENCODER_DIM] from cameras and LiDAR
+    def __init__(self):
+        super().__init__()
+        self.rgb_proj = nn.Linear(3, ENCODER_DIM)
+        self.lidar_proj = nn.Linear(3, ENCODER_DIM)
+
+    def forward(self, x):
+        pool = lambda image: nn.functional.adaptive_avg_pool2d(image, (2, 3))
+        rgb = pool(x["rgb"]) + pool(x["rgb_left"]) - pool(x["rgb_right"])
+        lidar = x["lidar"].float().mean(dim=(2, 3))
+        return self.rgb_proj(rgb.flatten(2).transpose(1, 2)) + self.lidar_proj(lidar)[:, None]
+
+
+@pytest.fixture
+def dataset_root(tmp_path):
+    route_path = tmp_path / "sub-0" / "data" / "routes_town01_0_w1"
+    make_route(str(route_path), FRAMES, lidar_points=2000)
+    route = os.path.relpath(route_path, tmp_path)
+    write_instruction_list(str(tmp_path), [instruction_line(route, 0, 5, FRAMES), instruction_line(route, 3, 11, FRAMES)])
+    load_bev_embeddings.cache_clear()
+    yield str(tmp_path)
+    load_bev_embeddings.cache_clear()
+
+
+def loss(model, dataset):
+    random.seed(0)
+    np.random.seed(0)
+    samples = dataset.collater([dataset[i] for i in range(len(dataset))])
+    with torch.no_grad():
+        return model(samples)["loss"]
+
+
+ENCODER = {"encoder_model": "tiny_bev_encoder", "encoder_model_ckpt": "tiny.pth"}
+
+
+class TestDriveBevCache:
+    @pytest.mark.parametrize("dtype,atol", [(np.float32, 1e-5), (np.float16, 1e-2)])
+    def test_cached_loss_matches_live_encoder(self, dataset_root, dtype, atol):
+        model = build_tiny_drive_model()
+        model.bev_encoder = TinyBevEncoder().eval().requires_grad_(False)
+        live = CarlaVoiceDataset(dataset_root, token_max_length=4, sample_interval=2)
+        expected = loss(model, live)
+
+        route_path = live.scenario_infos[0]["route_path"]
+        extract_route_embeddings(model.bev_encoder, live, route_path, FRAMES, batch_size=5, dtype=dtype, meta=ENCODER)
+        embeddings = load_bev_embeddings(route_path)
+        assert embeddings.shape == (FRAMES, N_ENCODER_TOKENS, ENCODER_DIM) and embeddings.dtype == dtype
+
+        cached = CarlaVoiceDataset(dataset_root, token_max_length=4, sample_interval=2,
+                                   bev_embedding_cache="bev_embeddings", bev_embedding_encoder=ENCODER)
+        sample = cached[1]
+        assert "rgb" not in sample and "lidar" not in sample
+        assert sample["bev_embeddings"].shape == (4, N_ENCODER_TOKENS, ENCODER_DIM)
+        assert torch.allclose(loss(model, cached), expected, atol=atol)
+
+    def test_padding_to_longest_clip_keeps_loss(self, dataset_root):
+        model = build_tiny_drive_model()
+        model.bev_encoder = TinyBevEncoder().eval()
+        dataset = CarlaVoiceDataset(dataset_root, token_max_length=8, sample_interval=2)
+        random.seed(0)
+        np.random.seed(0)
+        items = [dataset[i] for i in range(len(dataset))]
+        assert dataset.clip_lengths() == [3, 5]
+        assert [item["rgb"].size(0) for item in items] == [item["valid_frames"] for item in items]
+
+        batch = dataset.collater(items)
+        assert batch["rgb"].size(1) == batch["target_point"].size(1) == max(batch["valid_frames"].tolist()) < 8
+        # the same batch padded to token_max_length, as before
+        full = default_collate([
+            {key: dataset.pad_and_stack(value, 8) if key in FRAME_KEYS else value for key, value in item.items()}
+            for item in items
+        ])
+        with torch.no_grad():
+            assert torch.allclose(model(batch)["loss"], model(full)["loss"], atol=1e-5)
+
+    def test_device_preprocessing_keeps_loss(self, dataset_root):
+        model = build_tiny_drive_model()
+        model.bev_encoder = TinyBevEncoder().eval()
+        expected = loss(model, CarlaVoiceDataset(dataset_root, token_max_length=4, sample_interval=2))
+        dataset = CarlaVoiceDataset(dataset_root, token_max_length=4, sample_interval=2, device_preprocessing=True)
+        assert dataset[0]["rgb"].dtype == torch.uint8
+        # forward resizes and normalizes the uint8 views, up to the resampling differences to PIL
+        assert torch.allclose(loss(model, dataset), expected, atol=1e-3)
+
+    def test_cache_needs_a_frozen_encoder(self, dataset_root):
+        model = build_tiny_drive_model()
+        model.bev_encoder = TinyBevEncoder().eval().requires_grad_(False)
+        live = CarlaVoiceDataset(dataset_root, token_max_length=4, sample_interval=2)
+        extract_route_embeddings(model.bev_encoder, live, live.scenario_infos[0]["route_path"], FRAMES, meta=ENCODER)
+        cached = CarlaVoiceDataset(dataset_root, token_max_length=4, sample_interval=2,
+                                   bev_embedding_cache="bev_embeddings", bev_embedding_encoder=ENCODER)
+        samples = cached.collater([cached[0]])
+        model.bev_encoder.requires_grad_(True)
+        with pytest.raises(ValueError, match="frozen bev encoder"):
+            model(samples)
+
+    def test_cache_of_another_encoder_or_route(self, dataset_root):
+        encoder = TinyBevEncoder().eval()
+        live = CarlaVoiceDataset(dataset_root, token_max_length=4, sample_interval=2)
+        route_path = live.scenario_infos[0]["route_path"]
+        extract_route_embeddings(encoder, live, route_path, FRAMES, meta=ENCODER)
+
+        def first_sample(bev_embedding_encoder):
+            load_bev_embeddings.cache_clear()
+            return CarlaVoiceDataset(dataset_root, token_max_length=4, sample_interval=2,
+                                     bev_embedding_cache="bev_embeddings",
+                                     bev_embedding_encoder=bev_embedding_encoder)[0]
+
+        assert "bev_embeddings" in first_sample(ENCODER)
+        with pytest.raises(ValueError, match="encoder_model_ckpt 'tiny.pth' \\(expected 'other.pth'\\)"):
+            first_sample(dict(ENCODER, encoder_model_ckpt="other.pth"))
+        with pytest.raises(ValueError, match="encoder_model 'tiny_bev_encoder'"):
+            first_sample(dict(ENCODER, encoder_model="bevdriver_encoder"))
+
+        # a store of a route that was recorded further, or without its meta json
+        meta_path = bev_embedding_meta_path(route_path)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        with open(meta_path, "w") as f:
+            json.dump(dict(meta, frames=FRAMES - 2), f)
+        with pytest.raises(ValueError, match="frames 10 of 12 \\(expected 12\\)"):
+            first_sample(ENCODER)
+        os.unlink(meta_path)
+        with pytest.raises(ValueError, match="has no"):
+            first_sample(ENCODER)
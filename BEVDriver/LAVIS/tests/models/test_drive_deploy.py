@@ -0,0 +1,150 @@
+"""
+Tests for the single-file deploy artifact of Blip2VicunaDrive (lavis/models/drive_models/deploy.py):
+LoRA merged into the LLM, the round trip through the safetensors file, and startup time and peak RSS
+against building the model from its checkpoints with PEFT.
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+import torch
+from peft import LoraConfig, get_peft_model
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+from conftest import ENCODER_DIM, build_tiny_drive_model
+from test_drive_bev_cache import TinyBevEncoder
+from lavis.models.drive_models.deploy import TOKENIZER_PREFIX, export_deploy_model, load_deploy_model
+from timm.models.registry import register_model
+
+N_ENCODER_TOKENS = 6
+
+
+@register_model
+def tiny_bev_encoder(pretrained=False, pretrained_backbone=True, **kwargs):
+    # TinyBevEncoder under a timm name, the deploy file rebuilds the encoder by name
+    encoder = TinyBevEncoder()
+    encoder.embed_dim = ENCODER_DIM
+    return encoder
+
+
+def build_lora_model(seed=0, **kwargs):
+    # as Blip2VicunaDrive.__init__ with has_lora=True, with non-zero deltas as after training
+    model = build_tiny_drive_model(seed=seed, **kwargs)
+    model.bev_encoder = TinyBevEncoder()
+    model.llm_model = get_peft_model(model.llm_model, LoraConfig(
+        r=4, lora_alpha=8, target_modules=["q_proj", "v_proj"], lora_dropout=0.05, bias="none", task_type="CAUSAL_LM"
+    ))
+    model.has_lora = True
+    for name, param in model.named_parameters():
+        if "lora_B" in name:
+            param.data.normal_(std=0.1)
+    return model.eval()
+
+
+def run_stream(model, frames, instruction="turn left at the next intersection"):
+    model.reset_stream()
+    outputs = []
+    with torch.no_grad():
+        for i, frame in enumerate(frames):
+            outputs.append(model.stream_step({"text_input": [instruction]}, frame, commit=i % 2 == 0))
+    return outputs
+
+
+STARTUP = """
+import os, sys, time, json
+sys.path.insert(0, {tests!r})
+import torch
+from peft import get_peft_model
+from test_drive_deploy import build_lora_model
+from lavis.models.blip2_models.modeling_llama import LlamaForCausalLM
+from lavis.models.drive_models.deploy import load_deploy_model
+
+start = time.perf_counter()
+if {mode!r} == "deploy":
+    model = load_deploy_model(os.path.join({workdir!r}, "model.safetensors"))
+else:
+    # the steps of Blip2VicunaDrive.__init__ and build_model: the LLM from its directory, PEFT LoRA,
+    # then the BEVDriver checkpoint
+    model = build_lora_model(hidden_size={hidden_size}, num_layers={num_layers})
+    llm_model = LlamaForCausalLM.from_pretrained(os.path.join({workdir!r}, "llm"))
+    model.llm_model = get_peft_model(llm_model, model.llm_model.peft_config["default"])
+    model.load_state_dict(torch.load(os.path.join({workdir!r}, "checkpoint.pth"))["model"], strict=False)
+seconds = time.perf_counter() - start
+# VmHWM of this process, ru_maxrss would include the peak of the parent from before the exec
+peak = [line for line in open("/proc/self/status") if line.startswith("VmHWM")][0]
+print(json.dumps({{"seconds": seconds, "max_rss_mb": int(peak.split()[1]) / 1024}}))
+"""
+
+
+def write_checkpoints(workdir, hidden_size, num_layers):
+    # the LLM directory and BEVDriver checkpoint of the PEFT path, and the deploy file of the same model
+    model = build_lora_model(hidden_size=hidden_size, num_layers=num_layers)
+    model.llm_model.get_base_model().save_pretrained(os.path.join(workdir, "llm"))
+    torch.save({"model": model.state_dict()}, os.path.join(workdir, "checkpoint.pth"))
+    export_deploy_model(model, os.path.join(workdir, "model.safetensors"), "tiny_bev_encoder")
+
+
+def measure_startup(mode, workdir, hidden_size, num_layers):
+    """ seconds to build the model and peak RSS (MB) of a fresh process, mode "deploy" or "peft" """
+    tests = os.path.dirname(os.path.abspath(__file__))
+    script = STARTUP.format(tests=tests, mode=mode, workdir=str(workdir), hidden_size=hidden_size, num_layers=num_layers)
+    output = subprocess.run([sys.executable, "-c", script], check=True, capture_output=True, text=True,
+                            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+class TestDeployModel:
+    def test_loaded_model_matches_lora_model(self, tmp_path):
+        model = build_lora_model()
+        path = str(tmp_path / "model.safetensors")
+        manifest = export_deploy_model(model, path, "tiny_bev_encoder", source={"bevdriver_ckpt": "best.pth"})
+        assert manifest["lora"] == {"r": 4, "lora_alpha": 8, "target_modules": ["q_proj", "v_proj"], "merged_layers": 4}
+
+        loaded = load_deploy_model(path)
+        assert not loaded.has_lora and type(loaded.llm_model).__name__ == "LlamaForCausalLM"
+        assert not any("lora" in name for name, _ in loaded.named_parameters())
+        assert all(not param.requires_grad for param in loaded.parameters())
+
+        torch.manual_seed(1)
+        frames = [torch.randn(1, N_ENCODER_TOKENS, ENCODER_DIM) for _ in range(5)]
+        for (waypoints, end), (expected_waypoints, expected_end) in zip(run_stream(loaded, frames), run_stream(model, frames)):
+            assert torch.allclose(waypoints, expected_waypoints, atol=1e-5)
+            assert torch.allclose(end, expected_end, atol=1e-5)
+        text = "turn left at the next intersection"
+        assert loaded.llm_tokenizer(text).input_ids == model.llm_tokenizer(text).input_ids
+        assert len(loaded.llm_tokenizer) == len(model.llm_tokenizer)
+
+    def test_one_file_with_manifest(self, tmp_path):
+        model = build_lora_model(has_gru_decoder=True)
+        path = str(tmp_path / "model.safetensors")
+        export_deploy_model(model, path, "tiny_bev_encoder")
+        with safe_open(path, framework="pt") as f:
+            manifest = json.loads(f.metadata()["manifest"])
+            keys = list(f.keys())
+        assert manifest["model_args"]["has_gru_decoder"] and manifest["encoder_model"] == "tiny_bev_encoder"
+        for prefix in ["bev_encoder.", "ln_vision.", "Qformer.", "query_tokens", "llm_proj.", "llm_model.model.layers.",
+                       "waypoints_fc.", "waypoints_output.", "end_predictor.", TOKENIZER_PREFIX]:
+            assert any(key.startswith(prefix) for key in keys), prefix
+        assert not any("lora_" in key or "base_model" in key for key in keys)
+        assert load_deploy_model(path).waypoints_output.weight.shape == (2, 64)
+
+    def test_not_a_deploy_file(self, tmp_path):
+        path = str(tmp_path / "weights.safetensors")
+        save_file({"weight": torch.zeros(2)}, path)
+        with pytest.raises(ValueError, match="not a deploy file"):
+            load_deploy_model(path)
+
+    def test_startup_time_and_peak_rss(self, tmp_path):
+        # a tiny LLaMA large enough (10M parameters) that its copies show in the peak RSS
+        size = dict(hidden_size=512, num_layers=4)
+        write_checkpoints(tmp_path, **size)
+        peft_startup = measure_startup("peft", tmp_path, **size)
+        deploy_startup = measure_startup("deploy", tmp_path, **size)
+        print("startup peft %(seconds).2f s %(max_rss_mb).0f MB" % peft_startup,
+              "deploy %(seconds).2f s %(max_rss_mb).0f MB" % deploy_startup)
+        # the weights are memory-mapped instead of read into a state dict and copied into the model
+        assert deploy_startup["max_rss_mb"] < peft_startup["max_rss_mb"]
@@ -0,0 +1,131 @@
+"""
+Tests for the weight-only quantization of the LLM of Blip2VicunaDrive (lavis/models/drive_models/quantize.py):
+the int8 and grouped int4 weights, the quantized LLM against the floating point model and the waypoint
+comparison of evaluate_quantization.py.
+"""
+
+import os
+import sys
+import copy
+import types
+import random
+
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+
+from conftest import ENCODER_DIM
+from test_drive_bev_cache import dataset_root
+from test_drive_deploy import N_ENCODER_TOKENS, build_lora_model, run_stream
+from lavis.datasets.datasets.carla_dataset_llm import CarlaVoiceDataset
+from lavis.models.drive_models.deploy import export_deploy_model
+from lavis.models.drive_models.quantize import (QuantizedLinear, compare_waypoints, module_nbytes, pack_int4,
+                                                quantize_llm, quantize_weight, unpack_int4)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../leaderboard"))
+from team_code.inference_server import build_model
+
+
+def quantized_model(weight_format, **kwargs):
+    # the LoRA model merged as the reference, and its quantized copy
+    model = build_lora_model(hidden_size=64)
+    model.llm_model = model.llm_model.merge_and_unload()
+    quantized = copy.deepcopy(model)
+    summary = quantize_llm(quantized, weight_format, **kwargs)
+    return model, quantized, summary
+
+
+class TestQuantizedWeights:
+    @pytest.mark.parametrize("bits, group_size", [(8, None), (4, 16), (4, 64)])
+    def test_round_to_nearest(self, bits, group_size):
+        weight = torch.randn(24, 64, generator=torch.Generator().manual_seed(0))
+        values, scales = quantize_weight(weight, bits, group_size)
+        assert values.dtype == torch.int8 and scales.shape == (24, 64 // (group_size or 64))
+        assert values.int().abs().max() <= 2 ** (bits - 1)
+        dequantized = values.view(24, scales.size(1), -1).float() * scales.unsqueeze(2)
+        error = (dequantized.view(24, 64) - weight).abs().view(24, scales.size(1), -1)
+        assert (error <= scales.unsqueeze(2) / 2 + 1e-6).all()
+
+    def test_int4_packing(self):
+        values = torch.randint(-8, 8, (5, 32), dtype=torch.int8)
+        packed = pack_int4(values)
+        assert packed.dtype == torch.uint8 and packed.shape == (5, 16)
+        assert torch.equal(unpack_int4(packed), values)
+
+    def test_clip_search_reduces_the_weight_error(self):
+        # heavy-tailed weights, where clipping the range pays off
+        weight = torch.distributions.StudentT(2.0).sample((32, 128))
+        errors = []
+        for clip_search in [False, True]:
+            values, scales = quantize_weight(weight, 4, 32, clip_search)
+            dequantized = (values.view(32, 4, 32).float() * scales.unsqueeze(2)).view(32, 128)
+            errors.append((dequantized - weight).pow(2).sum())
+        assert errors[1] < errors[0]
+
+    @pytest.mark.parametrize("bits", [8, 4])
+    def test_linear(self, bits):
+        torch.manual_seed(0)
+        linear = nn.Linear(64, 32)
+        quantized = QuantizedLinear.from_linear(linear, bits, 16)
+        x = torch.randn(3, 7, 64)
+        assert torch.equal(quantized(x), nn.functional.linear(x, quantized.weight, linear.bias))
+        relative = (quantized(x) - linear(x)).norm() / linear(x).norm()
+        assert relative < (0.01 if bits == 8 else 0.1)
+        # the values, a float32 scale per 16 inputs and the bias
+        assert module_nbytes(quantized) == 32 * 64 * bits // 8 + 32 * 4 * 4 + 32 * 4
+
+
+class TestQuantizedLLM:
+    @pytest.mark.parametrize("weight_format, tolerance", [("int8", 0.02), ("int4", 0.2)])
+    def test_stream_matches_float_model(self, weight_format, tolerance):
+        model, quantized, summary = quantized_model(weight_format, group_size=32)
+        # q, k, v, o, gate, up and down of the 2 layers, not lm_head
+        assert summary["layers"] == 14
+        assert isinstance(quantized.llm_model.model.layers[0].self_attn.q_proj, QuantizedLinear)
+        assert isinstance(quantized.llm_model.lm_head, nn.Linear)
+        assert summary["quantized_llm_bytes"] < summary["llm_bytes"]
+
+        torch.manual_seed(1)
+        frames = [torch.randn(1, N_ENCODER_TOKENS, ENCODER_DIM) for _ in range(5)]
+        for (waypoints, _), (expected, _) in zip(run_stream(quantized, frames), run_stream(model, frames)):
+            assert (waypoints - expected).abs().max() < tolerance * expected.abs().max()
+
+    def test_merges_lora_first(self):
+        model = build_lora_model(hidden_size=64)
+        merged = copy.deepcopy(model)
+        merged.llm_model = merged.llm_model.merge_and_unload()
+        quantize_llm(model, "int8")
+        assert not model.has_lora
+        expected = quantize_weight(merged.llm_model.model.layers[0].self_attn.q_proj.weight, 8, None)[0]
+        assert torch.equal(model.llm_model.model.layers[0].self_attn.q_proj.qweight, expected)
+
+    def test_unknown_format(self):
+        with pytest.raises(ValueError, match="unknown weight format"):
+            quantize_llm(build_lora_model(), "int2")
+
+    def test_agent_config(self, tmp_path):
+        path = str(tmp_path / "model.safetensors")
+        export_deploy_model(build_lora_model(hidden_size=64), path, "tiny_bev_encoder")
+        model = build_model(types.SimpleNamespace(deploy_model=path, quantize_llm="int4"))
+        down_proj = model.llm_model.model.layers[1].mlp.down_proj
+        assert isinstance(down_proj, QuantizedLinear) and down_proj.bits == 4
+
+    def test_compare_waypoints(self, dataset_root):
+        random.seed(0)
+        np.random.seed(0)
+        dataset = CarlaVoiceDataset(dataset_root, token_max_length=4, sample_interval=2)
+        clips = [dataset.collater([dataset[i]]) for i in range(len(dataset))]
+        results = {}
+        for weight_format in [None, "int8", "int4"]:
+            model = build_lora_model(hidden_size=64)
+            if weight_format is not None:
+                quantize_llm(model, weight_format, group_size=32)
+            reference = results[None]["predictions"] if weight_format else None
+            results[weight_format] = compare_waypoints(model, clips, reference)
+        assert results[None]["tokens_per_second"] > 0
+        assert 0 < results["int8"]["l1_reference"] < results["int4"]["l1_reference"]
+        assert abs(results["int8"]["l1"] - results[None]["l1"]) < 0.05 * results[None]["l1"]
+        assert results["int4"]["llm_bytes"] < results["int8"]["llm_bytes"] < results[None]["llm_bytes"]
+        # the clips are left as they were
+        assert [clip["rgb"].dim() for clip in clips] == [5] * len(clips)
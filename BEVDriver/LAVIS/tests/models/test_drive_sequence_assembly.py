@@ -0,0 +1,245 @@
+"""
+Parity tests for the batched sequence assembly of Blip2VicunaDrive (concat_text_image_input,
+concat_text_image_input_with_notice, prompt_wrap) against the per-sample loops they replace.
+"""
+
+import pytest
+import torch
+
+from conftest import build_tiny_drive_model
+
+BS, FRAMES, N_QUERY, HIDDEN = 4, 5, 4, 32
+INSTRUCTIONS = ["turn left at the next intersection", "follow lane", "go straight , slow down", "stop"]
+NOTICES = ["slow down", "", "change to left lane , keep speed", "stop"]
+
+
+# the per-sample implementations of drive.py before the batched assembly
+
+
+def reference_concat_text_image_input(model, input_embeds, input_atts, image_embeds, image_nums, end_flag_pos_list, image_atts=None):
+    input_part_targets_len = []
+    llm_inputs = []
+    llm_attention_mask = []
+    wp_target_index = []
+    bs = input_embeds.size()[0]
+    for i in range(bs):
+        this_input_ones = input_atts[i].sum()
+        input_part_targets_len.append(this_input_ones)
+        if image_atts is None:
+            bs, t, n, dim = image_embeds.size()
+            llm_inputs.append(
+                torch.cat([
+                    input_embeds[i][:this_input_ones],
+                    image_embeds[i].view(t*n, -1),
+                    input_embeds[i][this_input_ones:]
+                ])
+            )
+        else:
+            llm_inputs.append(
+                torch.cat([
+                    input_embeds[i][:this_input_ones],
+                    image_embeds[i],
+                    input_embeds[i][this_input_ones:]
+                ])
+            )
+        if image_atts is None:
+            bs, t, n, dim = image_embeds.size()
+            llm_attention_mask.append(
+                torch.cat([
+                    input_atts[i][:this_input_ones],
+                    torch.ones((image_nums[i]*n), device=image_embeds.device, dtype=torch.long),
+                    torch.zeros(((t-image_nums[i])*n), device=image_embeds.device, dtype=torch.long),
+                    input_atts[i][this_input_ones:]
+                ])
+            )
+        else:
+            llm_attention_mask.append(
+                torch.cat([
+                    input_atts[i][:this_input_ones],
+                    image_atts[i],
+                    input_atts[i][this_input_ones:]
+                ])
+            )
+        sub_target_index = []
+        for j in end_flag_pos_list[i]:
+            sub_target_index.append([i, j + this_input_ones])
+        wp_target_index.extend(sub_target_index)
+    llm_inputs = torch.stack(llm_inputs, 0)
+    llm_attention_mask = torch.stack(llm_attention_mask, 0)
+    return llm_inputs, llm_attention_mask, input_part_targets_len, wp_target_index
+
+def reference_concat_text_image_input_with_notice(model, input_embeds, input_atts, image_embeds, image_nums,
+                                        end_flag_pos_list, notice_frame_id, notice_text, image_atts=None):
+    input_part_targets_len = []
+    llm_inputs = []
+    llm_attention_mask = []
+    wp_target_index = []
+    bs = input_embeds.size()[0]
+
+    model.llm_tokenizer.padding_side = "right"
+    model.llm_tokenizer.truncation_side = 'left'
+    text_input_tokens = model.llm_tokenizer(
+        notice_text,
+        return_tensors="pt",
+        padding="longest",
+        truncation=True,
+        max_length=model.max_txt_len,
+    ).to(image_embeds.device)
+    input_notice_atts = text_input_tokens.attention_mask
+    notice_embeds = model.llm_model.get_input_embeddings()(text_input_tokens.input_ids)
+
+    for i in range(bs):
+        this_input_ones = input_atts[i].sum()
+        input_part_targets_len.append(this_input_ones)
+
+        this_notice_input_ones = input_notice_atts[i].sum()
+        if image_atts is None:
+            bs, t, n, dim = image_embeds.size()
+            if notice_frame_id[i] <= 0: # which means the scenario do not include any notice
+                llm_inputs.append(
+                    torch.cat([
+                        input_embeds[i][:this_input_ones],
+                        image_embeds[i].view(t*n, -1),
+                        input_embeds[i][this_input_ones:],
+                        notice_embeds[i][:],
+                    ])
+                )
+            else:
+                llm_inputs.append(
+                    torch.cat([
+                        input_embeds[i][:this_input_ones],
+                        image_embeds[i, :notice_frame_id[i]].view(notice_frame_id[i]*n, -1),
+                        notice_embeds[i][:this_notice_input_ones],
+                        image_embeds[i, notice_frame_id[i]:].view((t-notice_frame_id[i])*n, -1),
+                        input_embeds[i][this_input_ones:],
+                        notice_embeds[i][this_notice_input_ones:],
+                    ])
+                )
+        else:
+            pass 
+        if image_atts is None:
+            bs, t, n, dim = image_embeds.size()
+            if notice_frame_id[i] < 0: # which means the scenario do not include any notice
+                llm_attention_mask.append(
+                    torch.cat([
+                        input_atts[i][:this_input_ones],
+                        torch.ones((image_nums[i]*n), device=image_embeds.device, dtype=torch.long),
+                        torch.zeros(((t-image_nums[i])*n), device=image_embeds.device, dtype=torch.long),
+                        torch.zeros((input_notice_atts.size(1)), device=image_embeds.device, dtype=torch.long),
+                        input_atts[i][this_input_ones:]
+                    ])
+                )
+            else:
+                llm_attention_mask.append(
+                    torch.cat([
+                        input_atts[i][:this_input_ones],
+                        torch.ones((image_nums[i]*n), device=image_embeds.device, dtype=torch.long),
+                        input_notice_atts[i][:this_notice_input_ones],
+                        torch.zeros(((t-image_nums[i])*n), device=image_embeds.device, dtype=torch.long),
+                        input_atts[i][this_input_ones:],
+                        input_notice_atts[i][this_notice_input_ones:],
+                    ])
+                )
+        else:
+            pass
+        sub_target_index = []
+        for j in range(len(end_flag_pos_list[i])):
+            if j < notice_frame_id[i] or notice_frame_id[i] < 0: # when notice is '', the input_ones is 1, not ZERO
+                sub_target_index.append([i, end_flag_pos_list[i][j] + this_input_ones])
+            else:
+                sub_target_index.append([i, end_flag_pos_list[i][j] + this_input_ones + this_notice_input_ones])
+        wp_target_index.extend(sub_target_index)
+    llm_inputs = torch.stack(llm_inputs, 0)
+    llm_attention_mask = torch.stack(llm_attention_mask, 0)
+    return llm_inputs, llm_attention_mask, input_part_targets_len, wp_target_index
+
+def reference_prompt_wrap(model, input_embeds, text_before_img, text_after_img, valid_frames):
+    bs, t, n, dim = input_embeds.size()
+    emb_list = []
+    end_flag_pos_list = []
+    for i in range(bs):
+        before_texts = text_before_img[i].split('|')
+        after_texts = text_after_img[i].split('|')
+        temp_embeds = []
+        temp_end_flag_pos_list = []
+        for j in range(valid_frames[i]):
+            p_before_tokens = model.llm_tokenizer(before_texts[j], return_tensors="pt", add_special_tokens=False).to(input_embeds.device)
+            p_after_tokens = model.llm_tokenizer(before_texts[j], return_tensors="pt", add_special_tokens=False).to(input_embeds.device)
+            p_before_embed = model.llm_model.get_input_embeddings()(p_before_tokens.input_ids)
+            p_after_embed = model.llm_model.get_input_embeddings()(p_after_tokens.input_ids)
+            p_embed = torch.cat([p_before_embed, input_embeds[i][j][None], p_after_embed], dim=1)
+            temp_embeds.append(p_embed)
+            temp_end_flag_pos_list.append(p_embed.size(1)-1)
+        end_flag_pos_list.append(temp_end_flag_pos_list)
+        emb_list.append(torch.cat(temp_embeds, dim=1)) # 1 * m * d_dim
+    emb_lens = [emb.shape[1] for emb in emb_list]
+    pad_emb = model.llm_model.get_input_embeddings()(torch.tensor(model.llm_tokenizer.pad_token_id, device=input_embeds.device))
+    wrapped_embs = pad_emb.expand(len(emb_lens), max(emb_lens), -1).clone()
+    wrapped_atts = torch.zeros([len(emb_lens), max(emb_lens)], dtype=torch.long, device=input_embeds.device)
+    for i, emb in enumerate(emb_list):
+        wrapped_embs[i, :emb_lens[i]] = emb
+        wrapped_atts[i, :emb_lens[i]] = 1
+    return wrapped_embs, wrapped_atts, end_flag_pos_list
+
+
+def make_batch(model, valid_frames, seed=0):
+    torch.manual_seed(seed)
+    tokens = model.llm_tokenizer(INSTRUCTIONS, return_tensors="pt", padding="longest")
+    input_embeds = model.llm_model.get_input_embeddings()(tokens.input_ids)
+    image_embeds = torch.randn(BS, FRAMES, N_QUERY, HIDDEN)
+    end_flag_pos_list = [[N_QUERY*(j+1)-1 for j in range(v)] for v in valid_frames]
+    return input_embeds, tokens.attention_mask, image_embeds, end_flag_pos_list
+
+
+def assert_same(result, expected):
+    llm_inputs, llm_attention_mask, input_part_targets_len, wp_target_index = result
+    assert torch.equal(llm_inputs, expected[0])
+    assert torch.equal(llm_attention_mask, expected[1])
+    assert input_part_targets_len.tolist() == [int(x) for x in expected[2]]
+    assert wp_target_index.tolist() == torch.tensor(expected[3]).long().tolist()
+
+
+@pytest.fixture(scope="module")
+def model():
+    return build_tiny_drive_model()
+
+
+class TestSequenceAssembly:
+    def test_concat_text_image_input(self, model):
+        valid_frames = torch.tensor([5, 1, 3, 4])
+        input_embeds, input_atts, image_embeds, end_flag_pos_list = make_batch(model, valid_frames)
+        with torch.no_grad():
+            result = model.concat_text_image_input(input_embeds, input_atts, image_embeds, valid_frames, end_flag_pos_list)
+            expected = reference_concat_text_image_input(model, input_embeds, input_atts, image_embeds, valid_frames, end_flag_pos_list)
+        assert_same(result, expected)
+
+    @pytest.mark.parametrize("notice_frame_id", [[-1, 1, 2, 0], [3, -1, 1, 4], [-1, -1, -1, -1]])
+    def test_concat_text_image_input_with_notice(self, model, notice_frame_id):
+        valid_frames = torch.tensor([5, 2, 3, 4])
+        input_embeds, input_atts, image_embeds, end_flag_pos_list = make_batch(model, valid_frames, seed=1)
+        notice_frame_id = torch.tensor(notice_frame_id)
+        args = (input_embeds, input_atts, image_embeds, valid_frames, end_flag_pos_list, notice_frame_id, NOTICES)
+        with torch.no_grad():
+            result = model.concat_text_image_input_with_notice(*args)
+            expected = reference_concat_text_image_input_with_notice(model, *args)
+        assert_same(result, expected)
+
+    def test_prompt_wrap(self, model):
+        valid_frames = torch.tensor([5, 1, 3, 4])
+        _, _, image_embeds, _ = make_batch(model, valid_frames, seed=2)
+        words = ["<frame> 1.0 , 2.0", "<frame> 0.0", "<frame> -1.0 , 1.0", "<frame> 2.0 , 2.0 ."]
+        text_before_img = ["|".join(words[(i + j) % 4] for j in range(v)) for i, v in enumerate(valid_frames.tolist())]
+        text_after_img = ["|".join(["</frame>"] * v) for v in valid_frames.tolist()]
+        with torch.no_grad():
+            embs, atts, end_flag_pos_list = model.prompt_wrap(image_embeds, text_before_img, text_after_img, valid_frames)
+            expected = reference_prompt_wrap(model, image_embeds, text_before_img, text_after_img, valid_frames)
+        assert torch.equal(embs, expected[0])
+        assert torch.equal(atts, expected[1])
+        assert end_flag_pos_list == expected[2]
+
+        # and the sequences built from the wrapped frames
+        input_embeds, input_atts, _, _ = make_batch(model, valid_frames, seed=2)
+        with torch.no_grad():
+            result = model.concat_text_image_input(input_embeds, input_atts, embs, valid_frames, end_flag_pos_list, atts)
+            expected = reference_concat_text_image_input(model, input_embeds, input_atts, embs, valid_frames, end_flag_pos_list, atts)
+        assert_same(result, expected)
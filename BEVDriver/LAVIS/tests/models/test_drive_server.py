@@ -0,0 +1,209 @@
+"""
+Tests for serving several agents from one Blip2VicunaDrive: `stream_step_batch` and the batching
+inference server of leaderboard/team_code/inference_server.py.
+"""
+
+import os
+import sys
+import stat
+import threading
+from multiprocessing import AuthenticationError
+
+import numpy as np
+import pytest
+import torch
+
+from conftest import ENCODER_DIM, build_tiny_drive_model
+from test_drive_bev_cache import TinyBevEncoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../leaderboard"))
+from team_code.inference_server import (AUTHKEY_ENV, ENCODER_KEYS, DriveSession, InferenceClient, InferenceServer,
+                                        authkey_path)
+
+N_ENCODER_TOKENS = 6
+INSTRUCTIONS = ["turn left at the next intersection", "follow lane", "go straight", "change to left lane"]
+
+
+def make_inputs(rng, instruction):
+    # model inputs of one agent step, as BEVDriverAgent.run_step builds them (smaller images)
+    inputs = {key: torch.from_numpy(rng.normal(size=(1, 3, 12, 12)).astype(np.float32))
+              for key in ["rgb", "rgb_left", "rgb_right", "rgb_center", "rgb_rear", "lidar"]}
+    inputs["measurements"] = list(rng.normal(size=4))
+    inputs["target_point"] = torch.from_numpy(rng.normal(size=(1, 2)).astype(np.float32))
+    inputs["num_points"] = torch.tensor([[int(rng.integers(100, 1000))]])
+    inputs["velocity"] = torch.tensor([[float(rng.uniform(0, 8))]])
+    inputs["text_input"] = [instruction]
+    return inputs
+
+
+def agent_schedule(agent, steps):
+    # instruction and commit of every step of an agent, its history restarts when the instruction changes
+    rng = np.random.default_rng(agent)
+    schedule, instruction, num_history_frames = [], None, 0
+    for step in range(steps):
+        if instruction is None or rng.random() < 0.15:
+            instruction = INSTRUCTIONS[int(rng.integers(len(INSTRUCTIONS)))]
+            num_history_frames = 0
+            schedule.append((instruction, True, True))
+        else:
+            schedule.append((instruction, num_history_frames % 2 == 0, False))
+        num_history_frames += 1
+    return schedule
+
+
+@pytest.fixture
+def served_model():
+    model = build_tiny_drive_model()
+    model.bev_encoder = TinyBevEncoder()
+    return model.eval()
+
+
+def run_local(model, inputs, session, commit):
+    # one agent on the model alone, as BEVDriverAgent.run_step without a server
+    with torch.no_grad():
+        image_embeds = model.bev_encoder(inputs)
+        if session.use_kv_cache:
+            model._stream_cache = session.stream_cache
+            waypoints, end_prob = model.stream_step(inputs, image_embeds, commit=commit)
+            session.stream_cache = model._stream_cache
+            return waypoints, end_prob
+        input_embeds = session.update_and_collect(image_embeds)
+        samples = {
+            "text_input": inputs["text_input"],
+            "valid_frames": [input_embeds.size(1)],
+            "target_point": torch.zeros(1, input_embeds.size(1), 2),
+        }
+        waypoints, end_prob = model(samples, inference_mode=True, input_embeds=input_embeds)
+        return waypoints[-1:], end_prob[-1:]
+
+
+class TestStreamStepBatch:
+    @pytest.mark.parametrize("has_gru_decoder", [False, True])
+    def test_matches_stream_step_per_stream(self, has_gru_decoder):
+        model = build_tiny_drive_model(has_gru_decoder=has_gru_decoder)
+        schedules = [agent_schedule(agent, 12) for agent in range(4)]
+        torch.manual_seed(2)
+        batch_caches, alone_caches = [None] * 4, [None] * 4
+        for step in range(12):
+            frames = torch.randn(4, N_ENCODER_TOKENS, ENCODER_DIM)
+            text_input = [schedule[step][0] for schedule in schedules]
+            commit = [schedule[step][1] for schedule in schedules]
+            for i, schedule in enumerate(schedules):
+                if schedule[step][2]:
+                    batch_caches[i] = alone_caches[i] = None
+
+            waypoints, end_prob, batch_caches = model.stream_step_batch(batch_caches, text_input, frames, commit)
+
+            for i in range(4):
+                model._stream_cache = alone_caches[i]
+                expected_wp, expected_end = model.stream_step({"text_input": [text_input[i]]}, frames[i:i+1], commit=commit[i])
+                alone_caches[i] = model._stream_cache
+                assert torch.allclose(waypoints[i], expected_wp[0], atol=1e-5), (step, i)
+                assert torch.allclose(end_prob[i], expected_end[0], atol=1e-5), (step, i)
+                assert batch_caches[i]["num_frames"] == alone_caches[i]["num_frames"]
+                assert batch_caches[i]["attention_mask"].size() == alone_caches[i]["attention_mask"].size()
+
+
+class TestInferenceServer:
+    def test_run_batch_matches_local_agents(self, served_model):
+        rng = np.random.default_rng(0)
+        server = InferenceServer(served_model)
+        schedules = [agent_schedule(agent, 10) for agent in range(4)]
+        # agents 0 and 1 stream with the kv cache, 2 and 3 re-run their frame history
+        served = [DriveSession(use_kv_cache=agent < 2, sample_rate=2) for agent in range(4)]
+        local = [DriveSession(use_kv_cache=agent < 2, sample_rate=2) for agent in range(4)]
+        for step in range(10):
+            steps, expected = [], []
+            for agent, schedule in enumerate(schedules):
+                instruction, commit, restart = schedule[step]
+                if restart:
+                    served[agent].reset()
+                    local[agent].reset()
+                inputs = make_inputs(rng, instruction)
+                expected.append(run_local(served_model, inputs, local[agent], commit))
+                client_inputs = {key: np.asarray(inputs[key], dtype=np.float32).reshape(1, -1) if key == "measurements"
+                                 else inputs[key].float().numpy() for key in ENCODER_KEYS}
+                client_inputs["text_input"] = inputs["text_input"]
+                steps.append((served[agent], client_inputs, commit))
+
+            results = server.run_batch(steps)
+            for agent, ((waypoints, end_prob), (expected_wp, expected_end)) in enumerate(zip(results, expected)):
+                assert waypoints.shape == (1, 10) and end_prob.shape == (1, 2)
+                np.testing.assert_allclose(waypoints, expected_wp.numpy(), atol=1e-5, err_msg="%d/%d" % (step, agent))
+                np.testing.assert_allclose(end_prob, expected_end.numpy(), atol=1e-5, err_msg="%d/%d" % (step, agent))
+
+    def test_clients_are_batched_over_socket(self, served_model, tmp_path):
+        server = InferenceServer(served_model, max_batch=4, max_wait=0.05)
+        address = server.start(str(tmp_path / "drive.sock"))
+        num_agents, steps = 4, 6
+        results = [[] for _ in range(num_agents)]
+        start = threading.Barrier(num_agents)
+
+        def agent(index):
+            rng = np.random.default_rng(index)
+            client = InferenceClient(address, use_kv_cache=index % 2 == 0, sample_rate=2)
+            start.wait()
+            for step in range(steps):
+                if step == 3:
+                    client.reset()
+                inputs = make_inputs(rng, INSTRUCTIONS[index])
+                results[index].append(client.step(inputs, commit=step % 2 == 0))
+            client.close()
+
+        threads = [threading.Thread(target=agent, args=(i,)) for i in range(num_agents)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        server.close()
+
+        assert max(server.batch_sizes) > 1
+        assert sum(server.batch_sizes) == num_agents * steps
+        for index in range(num_agents):
+            rng = np.random.default_rng(index)
+            session = DriveSession(use_kv_cache=index % 2 == 0, sample_rate=2)
+            for step in range(steps):
+                if step == 3:
+                    session.reset()
+                expected_wp, expected_end = run_local(served_model, make_inputs(rng, INSTRUCTIONS[index]), session, step % 2 == 0)
+                waypoints, end_prob = results[index][step]
+                assert torch.allclose(waypoints, expected_wp, atol=1e-5), (index, step)
+                assert torch.allclose(end_prob, expected_end, atol=1e-5), (index, step)
+
+    def test_errors_reach_the_client(self, served_model, tmp_path):
+        server = InferenceServer(served_model, max_wait=0.0)
+        address = server.start(str(tmp_path / "drive.sock"))
+        client = InferenceClient(address)
+        inputs = make_inputs(np.random.default_rng(0), "go straight")
+        inputs["rgb"] = inputs["rgb"][:, :2]
+        with pytest.raises(RuntimeError):
+            client.step(inputs)
+        # the server keeps serving
+        inputs = make_inputs(np.random.default_rng(0), "go straight")
+        assert client.step(inputs)[0].shape == (1, 10)
+        client.close()
+        server.close()
+
+    def test_connections_need_the_key(self, served_model, tmp_path, monkeypatch):
+        monkeypatch.delenv(AUTHKEY_ENV, raising=False)
+        server = InferenceServer(served_model, max_wait=0.0)
+        address = server.start(str(tmp_path / "drive.sock"))
+        # the socket and the key file are the owner's only
+        assert stat.S_IMODE(os.stat(address).st_mode) == 0o600
+        assert stat.S_IMODE(os.stat(authkey_path(address)).st_mode) == 0o600
+        with pytest.raises(AuthenticationError):
+            InferenceClient(address, authkey=b"not the key")
+        # the key of the key file, then of the environment
+        client = InferenceClient(address)
+        assert client.step(make_inputs(np.random.default_rng(0), "go straight"))[0].shape == (1, 10)
+        client.close()
+        server.close()
+
+        monkeypatch.setenv(AUTHKEY_ENV, "a shared key")
+        server = InferenceServer(served_model, max_wait=0.0)
+        address = server.start(str(tmp_path / "shared.sock"))
+        assert not os.path.exists(authkey_path(address))
+        client = InferenceClient(address)
+        assert client.step(make_inputs(np.random.default_rng(0), "go straight"))[0].shape == (1, 10)
+        client.close()
+        server.close()
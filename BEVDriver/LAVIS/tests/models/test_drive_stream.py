@@ -0,0 +1,89 @@
+"""
+Tests for the incremental (KV-cached) inference path of Blip2VicunaDrive.
+"""
+
+import pytest
+import torch
+
+from conftest import ENCODER_DIM, build_tiny_drive_model
+
+N_ENCODER_TOKENS = 6
+
+
+def full_recompute(model, instruction, frames, sample_rate):
+    # mirrors BEVDriverAgent.update_and_collect + forward(inference_mode=True)
+    selected = frames[::sample_rate]
+    if (len(frames) - 1) % sample_rate != 0:
+        selected.append(frames[-1])
+    input_embeds = torch.stack(selected, 1)
+    samples = {
+        "text_input": [instruction],
+        "valid_frames": [input_embeds.size(1)],
+        "target_point": torch.zeros(1, input_embeds.size(1), 2),
+    }
+    waypoints, end_prob = model(samples, inference_mode=True, input_embeds=input_embeds)
+    return waypoints[-1], end_prob[-1]
+
+
+class TestDriveStream:
+    @pytest.mark.parametrize("has_gru_decoder", [False, True])
+    def test_stream_matches_full_recompute(self, has_gru_decoder):
+        model = build_tiny_drive_model(has_gru_decoder=has_gru_decoder)
+        sample_rate = 2
+        torch.manual_seed(1)
+
+        schedule = ["turn left at the next intersection"] * 7 + ["follow lane"] * 6
+        frames = []
+        last_instruction = None
+        for step, instruction in enumerate(schedule):
+            if instruction != last_instruction:
+                frames = []
+                last_instruction = instruction
+            frame = torch.randn(1, N_ENCODER_TOKENS, ENCODER_DIM)
+            commit = len(frames) % sample_rate == 0
+            frames.append(frame)
+
+            with torch.no_grad():
+                expected_wp, expected_end = full_recompute(model, instruction, list(frames), sample_rate)
+            stream_wp, stream_end = model.stream_step({"text_input": [instruction]}, frame, commit=commit)
+
+            assert torch.allclose(stream_wp[-1], expected_wp, atol=1e-5), step
+            assert torch.allclose(stream_end[-1], expected_end, atol=1e-5), step
+
+        assert model._stream_cache["num_frames"] == 3
+
+    def test_reset_stream(self, tiny_drive_model):
+        instruction = ["go straight"]
+        frame = torch.randn(1, N_ENCODER_TOKENS, ENCODER_DIM)
+        first = tiny_drive_model.stream_step({"text_input": instruction}, frame)[0]
+        tiny_drive_model.stream_step({"text_input": instruction}, torch.randn_like(frame))
+        tiny_drive_model.reset_stream()
+        again = tiny_drive_model.stream_step({"text_input": instruction}, frame)[0]
+
+        assert torch.allclose(first, again, atol=1e-6)
+
+    def test_notices_are_not_consumed(self, tiny_drive_model):
+        # the agent passes its notices along with the samples: neither path inserts them
+        frames = [torch.randn(1, N_ENCODER_TOKENS, ENCODER_DIM) for _ in range(3)]
+        notice = {"notice_text": ["a pedestrian ahead"], "notice_frame_id": [1]}
+        with torch.no_grad():
+            expected = full_recompute(tiny_drive_model, "go straight", list(frames), 1)
+            samples = {"text_input": ["go straight"], "valid_frames": [3], "target_point": torch.zeros(1, 3, 2)}
+            with_notice = tiny_drive_model(dict(samples, **notice), inference_mode=True,
+                                           input_embeds=torch.stack(frames, 1))
+        assert torch.allclose(with_notice[0][-1], expected[0], atol=1e-6)
+        for frame in frames:
+            stream_wp, stream_end = tiny_drive_model.stream_step(dict({"text_input": ["go straight"]}, **notice), frame)
+        assert torch.allclose(stream_wp[-1], expected[0], atol=1e-5)
+        assert torch.allclose(stream_end[-1], expected[1], atol=1e-5)
+
+    def test_extra_prompt_needs_forward(self, tiny_drive_model):
+        frame = torch.randn(1, N_ENCODER_TOKENS, ENCODER_DIM)
+        tiny_drive_model.use_extra_prompt = True
+        try:
+            with pytest.raises(AssertionError, match="extra prompt"):
+                tiny_drive_model.stream_step({"text_input": ["go straight"]}, frame)
+            with pytest.raises(AssertionError, match="extra prompt"):
+                tiny_drive_model.stream_step_batch([None], ["go straight"], frame, [True])
+        finally:
+            tiny_drive_model.use_extra_prompt = False
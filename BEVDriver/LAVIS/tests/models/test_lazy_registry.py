@@ -0,0 +1,127 @@
+"""
+Tests for the lazily registered entries of the LAVIS registry and of the timm model registry: the indexes
+(lavis/common/registry_index.py, timm/models/model_index.py) against what the modules register, and that
+`import lavis` and `import timm` import a module only on the first lookup of one of its names.
+"""
+
+import os
+import sys
+import importlib
+import subprocess
+
+import pytest
+
+from lavis.common.registry import registry
+from lavis.common.registry_index import REGISTRY_INDEX
+from timm.models import model_index
+from timm.models.registry import is_model, model_entrypoint
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+
+
+def run_fresh(code):
+    # the lazy imports are only visible in an interpreter that has not imported the modules yet
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([bevdriver_root, os.path.join(bevdriver_root, "LAVIS"), env.get("PYTHONPATH", "")])
+    result = subprocess.run([sys.executable, "-c", code], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.split()
+
+
+class TestLavisRegistry:
+    def test_index_matches_registrations(self):
+        for kind, modules in REGISTRY_INDEX.items():
+            for module, names in modules.items():
+                try:
+                    importlib.import_module(module)
+                except ModuleNotFoundError as e:
+                    # e.g. the runners need tensorboard
+                    assert e.name.split(".")[0] not in ("lavis", "timm"), e
+                    continue
+                registered = {name for name, cls in registry.mapping[kind + "_name_mapping"].items()
+                              if cls.__module__ == module}
+                assert registered == set(names), module
+
+    def test_every_registration_is_indexed(self):
+        registry.list_models()
+        registry.list_datasets()
+        registry.list_processors()
+        registry.list_tasks()
+        for kind in ["builder", "model", "processor", "task"]:
+            indexed = {name for names in REGISTRY_INDEX[kind].values() for name in names}
+            assert set(registry.mapping[kind + "_name_mapping"]) <= indexed, kind
+
+    def test_import_is_lazy(self):
+        imported = run_fresh(
+            "import sys\n"
+            "import lavis\n"
+            "from lavis.common.registry import registry\n"
+            "print('lavis.models.drive_models.drive' in sys.modules)\n"
+            "cls = registry.get_model_class('vicuna_drive')\n"
+            "print(cls.__name__, 'lavis.models.drive_models.drive' in sys.modules)\n"
+            "print('lavis.models.blip_models.blip_caption' in sys.modules, 'timm.data.carla_dataset' in sys.modules)\n"
+        )
+        assert imported == ["False", "Blip2VicunaDrive", "True", "False", "False"]
+
+    def test_package_attributes(self):
+        from lavis.models import Blip2VicunaDrive
+        from lavis.tasks import DriveTask
+
+        assert registry.get_model_class("vicuna_drive") is Blip2VicunaDrive
+        assert registry.get_task_class("carla_drive") is DriveTask
+        assert registry.get_model_class("unknown_model") is None
+        with pytest.raises(AttributeError):
+            importlib.import_module("lavis.models").UnknownModel
+
+
+class TestTimmRegistry:
+    @pytest.mark.parametrize("module", list(model_index.MODULE_MODELS))
+    def test_index_matches_registrations(self, module):
+        module_models, module_exports, missing = model_index.build_index([module])
+        if module in missing:
+            pytest.skip("timm.models.%s needs %s" % (module, missing[module]))
+        assert tuple(module_models[module]) == model_index.MODULE_MODELS[module]
+        assert tuple(module_exports.get(module, ())) == model_index.MODULE_EXPORTS.get(module, ())
+
+    def test_listings_without_optional_dependencies(self):
+        # pointpillar needs torch_scatter: without it the other models are listed
+        listed = run_fresh(
+            "import sys\n"
+            "sys.modules['torch_scatter'] = None\n"
+            "from timm.models import list_models, list_modules, is_model\n"
+            "print(len(list_models('resnet26*')), 'pointpillar' in list_modules(), 'resnet' in list_modules())\n"
+            "print('pointpillar' in list_models())\n"
+            "try:\n"
+            "    is_model('pointpillar')\n"
+            "except ImportError as e:\n"
+            "    print(e.name)\n"
+        )
+        assert listed == ["3", "False", "True", "False", "torch_scatter"]
+
+    def test_import_is_lazy(self):
+        imported = run_fresh(
+            "import sys\n"
+            "import timm\n"
+            "print('timm.models.resnet' in sys.modules, 'timm.data.dataset_factory' in sys.modules)\n"
+            "from timm.models import get_model_default_value\n"
+            "print(get_model_default_value('resnet26d', 'input_size'))\n"
+            "print('timm.models.resnet' in sys.modules, 'timm.models.efficientnet' in sys.modules)\n"
+        )
+        assert imported == ["False", "False", "(3,", "224,", "224)", "True", "False"]
+
+    def test_package_attributes(self):
+        import timm.models
+
+        assert is_model("resnet26d") and not is_model("unknown_model")
+        assert timm.models.resnet26d is model_entrypoint("resnet26d")
+        assert timm.models.ResNet is importlib.import_module("timm.models.resnet").ResNet
+        with pytest.raises(AttributeError):
+            timm.models.UnknownModel
+
+        import timm.data
+
+        assert timm.data.create_transform is importlib.import_module("timm.data.transforms_factory").create_transform
+        assert timm.data.__dict__["create_transform"] is timm.data.create_transform
+        with pytest.raises(AttributeError):
+            timm.data.UnknownTransform
@@ -0,0 +1,161 @@
+"""
+Tests for the sensor preprocessing of BEVDriverAgent (leaderboard/team_code/sensor_pipeline.py): a replay
+of synthetic sensor frames through SensorPipeline against the agent's tick and camera transforms.
+"""
+
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from lavis.datasets.datasets.transforms_carla_factory import CarlaRgbDeviceTransform, create_carla_rgb_transform
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../leaderboard"))
+from team_code.sensor_pipeline import STAGES, SensorPipeline, center_view, count_raw_points
+from team_code.utils import lidar_to_histogram_features, transform_2d_points
+
+# camera sizes of BEVDriverAgent.sensors
+CAMERAS = {"rgb_front": (900, 1200), "rgb_left": (300, 400), "rgb_right": (300, 400), "rgb_rear": (300, 400)}
+
+
+def make_frame(rng, frame):
+    # sensor data of one step as the leaderboard passes it to run_step, BGRA cameras and x, y, z, intensity LiDAR
+    input_data = {}
+    for sensor, (height, width) in CAMERAS.items():
+        image = rng.integers(0, 255, size=(height // 25, width // 25, 4), dtype=np.uint8)
+        input_data[sensor] = (frame, cv2.resize(image, (width, height), interpolation=cv2.INTER_CUBIC))
+    lidar = rng.uniform([-30, -30, -3, 0], [30, 30, 2, 1], size=(int(rng.integers(15000, 25000)), 4))
+    # points on the car, left out of num_points
+    lidar[:500, :2] = rng.uniform(-1.1, 1.1, size=(500, 2))
+    input_data["lidar"] = (frame, lidar.astype(np.float32))
+    input_data["gps"] = (frame, np.array([48.99 + 1e-5 * frame, 8.0, 0.0]))
+    input_data["speed"] = (frame, {"speed": 3.0})
+    input_data["imu"] = (frame, np.array([0, 0, 9.8, 0, 0, 0, 0.1 * frame]))
+    return input_data
+
+
+def lidar_to_raw_features(lidar):
+    # bevdriver_agent.py before the pipeline, only num_points was used
+    idx = (lidar[:, 0] > -1.2) & (lidar[:, 0] < 1.2) & (lidar[:, 1] > -1.2) & (lidar[:, 1] < 1.2)
+    lidar_xyzr = np.delete(lidar, np.argwhere(idx), axis=0)
+    idxs = np.arange(len(lidar_xyzr))
+    np.random.shuffle(idxs)
+    lidar_xyzr = lidar_xyzr[idxs]
+    return min(40000, len(lidar_xyzr))
+
+
+def reference_step(input_data, prev_lidar, pos, compass, transforms):
+    # BEVDriverAgent.tick and the camera transforms of run_step before the pipeline
+    views = {sensor: cv2.cvtColor(input_data[sensor][1][:, :, :3], cv2.COLOR_BGR2RGB) for sensor in CAMERAS}
+    lidar_unprocessed = input_data["lidar"][1][..., :4]
+    full = lidar_unprocessed if prev_lidar is None else np.concatenate([lidar_unprocessed, prev_lidar])
+    num_points = lidar_to_raw_features(full)
+
+    lidar_unprocessed = input_data["lidar"][1][:, :3].copy()
+    lidar_unprocessed[:, 1] *= -1
+    full_lidar = transform_2d_points(lidar_unprocessed, np.pi / 2 - compass, -pos[0], -pos[1],
+                                     np.pi / 2 - compass, -pos[0], -pos[1])
+    inputs = {"lidar": torch.from_numpy(lidar_to_histogram_features(full_lidar, crop=224)).float().unsqueeze(0)}
+    images = {
+        "rgb": views["rgb_front"], "rgb_left": views["rgb_left"], "rgb_right": views["rgb_right"],
+        "rgb_rear": views["rgb_rear"], "rgb_center": cv2.resize(views["rgb_front"], (800, 600)),
+    }
+    for key, transform in transforms.items():
+        inputs[key] = transform(Image.fromarray(images[key])).unsqueeze(0).float()
+    return views, inputs, num_points
+
+
+def agent_transforms():
+    right = create_carla_rgb_transform(128)
+    return {"rgb": create_carla_rgb_transform(224), "rgb_left": create_carla_rgb_transform(128),
+            "rgb_right": right, "rgb_rear": right, "rgb_center": create_carla_rgb_transform(128, need_scale=False)}
+
+
+def replay(pipeline, frames):
+    # submits the next frame before the current one is used, as a replay or a model call would overlap it
+    poses = [(np.array([0.5 * i, 0.2 * i]), 0.1 * i) for i in range(len(frames))]
+    futures = [pipeline.submit(frames[0], *poses[0])]
+    for i in range(len(frames)):
+        if i + 1 < len(frames):
+            futures.append(pipeline.submit(frames[i + 1], *poses[i + 1]))
+        views, inputs = pipeline.result(futures[i])
+        # the inputs alias the host buffers on the CPU
+        yield poses[i], views, {key: value.clone() for key, value in inputs.items()}
+
+
+class TestSensorPipeline:
+    def test_replay_matches_agent_tick(self):
+        rng = np.random.default_rng(0)
+        frames = [make_frame(rng, i) for i in range(4)]
+        lidar = frames[0]["lidar"][1].copy()
+        transforms = agent_transforms()
+        pipeline = SensorPipeline(transforms, "cpu")
+        prev_lidar, prev_points = None, 0
+        for frame, ((pos, compass), views, inputs) in zip(frames, replay(pipeline, frames)):
+            expected_views, expected, num_points = reference_step(frame, prev_lidar, pos, compass, transforms)
+            prev_lidar = frame["lidar"][1][..., :4]
+
+            points = count_raw_points(frame["lidar"][1])
+            assert min(40000, points + prev_points) == num_points
+            prev_points = points
+            for sensor, view in expected_views.items():
+                assert np.array_equal(views[sensor], view), sensor
+            assert set(inputs) == set(expected)
+            for key, value in expected.items():
+                assert inputs[key].shape == value.shape and torch.equal(inputs[key], value), key
+        pipeline.close()
+        # the sensor arrays are left as they are
+        assert np.array_equal(frames[0]["lidar"][1], lidar)
+
+    def test_only_encoder_inputs(self):
+        frame = make_frame(np.random.default_rng(0), 0)
+        transforms = {key: value for key, value in agent_transforms().items() if key in ["rgb_left", "rgb_right"]}
+        pipeline = SensorPipeline(transforms, "cpu", with_lidar=False)
+        assert [keys for _, keys in pipeline.groups] == [["rgb_left"], ["rgb_right"]]
+        views, inputs = pipeline(frame, np.zeros(2), 0.0)
+        assert set(inputs) == {"rgb_left", "rgb_right"}
+        # the display still gets the front view, but not the rear one
+        assert set(views) == {"rgb_front", "rgb_left", "rgb_right"}
+        assert pipeline.timings["lidar"][0] == 0 and pipeline.timings["cameras"][0] == 1
+
+    def test_device_transforms_are_batched(self):
+        frame = make_frame(np.random.default_rng(1), 0)
+        side = CarlaRgbDeviceTransform(128)
+        transforms = {"rgb": CarlaRgbDeviceTransform(224), "rgb_left": side, "rgb_right": side, "rgb_rear": side,
+                      "rgb_center": CarlaRgbDeviceTransform(128, need_scale=False)}
+        pipeline = SensorPipeline(transforms, "cpu")
+        assert [keys for _, keys in pipeline.groups] == [["rgb"], ["rgb_left", "rgb_right", "rgb_rear"], ["rgb_center"]]
+        views, inputs = pipeline(frame, np.zeros(2), 0.0)
+        # BEVDriverAgent.preprocess_views before the pipeline
+        batch = torch.stack([side(Image.fromarray(views[sensor])) for sensor in ["rgb_left", "rgb_right", "rgb_rear"]])
+        expected = side.batch(batch)
+        for i, key in enumerate(["rgb_left", "rgb_right", "rgb_rear"]):
+            assert torch.equal(inputs[key], expected[i:i + 1]), key
+        center = transforms["rgb_center"]
+        expected = center.batch(center(Image.fromarray(cv2.resize(views["rgb_front"], (800, 600))))[None])
+        assert torch.equal(inputs["rgb_center"], expected)
+
+    def test_buffers_are_reused(self):
+        rng = np.random.default_rng(2)
+        pipeline = SensorPipeline(agent_transforms(), "cpu", num_buffers=2)
+        pointers = []
+        for i in range(4):
+            _, inputs = pipeline(make_frame(rng, i), np.zeros(2), 0.0)
+            pointers.append({key: value.data_ptr() for key, value in inputs.items()})
+        assert pointers[0] == pointers[2] and pointers[1] == pointers[3]
+        assert all(pointers[0][key] != pointers[1][key] for key in pointers[0])
+        assert all(pipeline.timings[stage][0] == 4 for stage in STAGES if stage != "wait")
+        assert "cameras" in pipeline.summary()
+
+
+class TestCenterView:
+    @pytest.mark.parametrize("size", [(1200, 900), (800, 600), (1100, 825)])
+    def test_matches_full_resize(self, size):
+        rng = np.random.default_rng(0)
+        image = rng.integers(0, 255, size=(size[1], size[0], 3), dtype=np.uint8)
+        expected = cv2.resize(image, (800, 600))[236:364, 336:464]
+        assert np.array_equal(center_view(image), expected)
@@ -24,13 +24,6 @@ from lavis.common.optims import (
 from lavis.common.registry import registry
 from lavis.common.utils import now
 
-# imports modules for registration
-from lavis.datasets.builders import *
-from lavis.models import *
-from lavis.processors import *
-from lavis.runners import *
-from lavis.tasks import *
-
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Training")
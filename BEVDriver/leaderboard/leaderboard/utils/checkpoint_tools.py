@@ -4,8 +4,12 @@ try:
 except ImportError:
     import json
 import requests
+import os
 import os.path
 
+# the journal of a local checkpoint file, appended to by the statistics manager and the route indexer
+JOURNAL_SUFFIX = '.journal'
+
 
 def autodetect_proxy():
     proxies = {}
@@ -21,9 +25,17 @@ def autodetect_proxy():
     return proxies
 
 
+def is_remote(endpoint):
+    return endpoint.startswith(('http:', 'https:', 'ftp:'))
+
+
+def journal_path(endpoint):
+    return endpoint + JOURNAL_SUFFIX
+
+
 def fetch_dict(endpoint):
     data = None
-    if endpoint.startswith(('http:', 'https:', 'ftp:')):
+    if is_remote(endpoint):
         proxies = autodetect_proxy()
 
         if proxies:
@@ -43,6 +55,8 @@ def fetch_dict(endpoint):
                     data = json.load(fd)
                 except json.JSONDecodeError:
                     data = {}
+        if os.path.exists(journal_path(endpoint)):
+            data = replay_journal(data or create_default_json_msg(), journal_path(endpoint))
 
     return data
 
@@ -65,7 +79,7 @@ def create_default_json_msg():
 
 
 def save_dict(endpoint, data):
-    if endpoint.startswith(('http:', 'https:', 'ftp:')):
+    if is_remote(endpoint):
         proxies = autodetect_proxy()
 
         if proxies:
@@ -73,5 +87,80 @@ def save_dict(endpoint, data):
         else:
             _ = requests.patch(url=endpoint, headers={'content-type':'application/json'}, data=json.dumps(data, indent=4, sort_keys=True))
     else:
-        with open(endpoint, 'w') as fd:
+        # written to a temporary file and renamed over the checkpoint, a crash leaves the old or the new one
+        tmp_path = endpoint + '.tmp'
+        with open(tmp_path, 'w') as fd:
             json.dump(data, fd, indent=4, sort_keys=True)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmp_path, endpoint)
+        # data was read with fetch_dict and holds the entries of the journal
+        if os.path.exists(journal_path(endpoint)):
+            os.remove(journal_path(endpoint))
+
+
+def append_entry(endpoint, entry):
+    """
+    Appends an entry (a dict with an "op" of apply_entry) to the journal of a local checkpoint as one
+    JSON line, flushed to disk: the cost does not grow with the number of routes in the checkpoint.
+    """
+    with open(journal_path(endpoint), 'ab+') as fd:
+        # a line cut short by a crash is ended first, replay_journal skips it
+        if fd.seek(0, os.SEEK_END) > 0:
+            fd.seek(-1, os.SEEK_END)
+            if fd.read(1) != b'\n':
+                fd.write(b'\n')
+        fd.write((json.dumps(entry, sort_keys=True) + '\n').encode('utf-8'))
+        fd.flush()
+        os.fsync(fd.fileno())
+
+
+def apply_entry(data, entry):
+    """
+    Applies an entry of the journal to the checkpoint dict data, in place. Applying an entry twice
+    gives the same data, so a journal replayed over a checkpoint it was already compacted into is fine.
+    A record that skips routes is left out, the rest of the checkpoint stays readable.
+    """
+    op = entry['op']
+    checkpoint = data['_checkpoint']
+    if op == 'record':
+        records = checkpoint['records']
+        if entry['index'] > len(records):
+            print('Error! Journal record {} after {} records, skipped'.format(entry['index'], len(records)))
+        elif entry['index'] == len(records):
+            records.append(entry['record'])
+        else:
+            records[entry['index']] = entry['record']
+    elif op == 'progress':
+        checkpoint['progress'] = entry['progress']
+    elif op == 'entry_status':
+        data['entry_status'] = entry['entry_status']
+        data['eligible'] = entry['eligible']
+    elif op == 'sensors':
+        if not data['sensors']:
+            data['sensors'] = entry['sensors']
+    else:
+        raise ValueError('unknown journal entry {}'.format(op))
+
+
+def replay_journal(data, path):
+    with open(path) as fd:
+        for line in fd:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # a line cut short by a crash while it was appended
+                continue
+            apply_entry(data, entry)
+    return data
+
+
+def compact_checkpoint(endpoint):
+    """
+    Writes the checkpoint with its journal replayed (in the layout of create_default_json_msg) and
+    removes the journal. Returns the checkpoint dict.
+    """
+    data = fetch_dict(endpoint)
+    if not is_remote(endpoint) and os.path.exists(journal_path(endpoint)):
+        save_dict(endpoint, data)
+    return data
@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+
+"""
+The graph of the global route planner of the CARLA agents (agents.navigation.global_route_planner) for a town
+and a hop resolution, with its waypoints as plain values: it is built once per town, saved to a cache file and
+loaded by the processes that interpolate routes, which trace the routes on it as GlobalRoutePlanner.trace_route
+does without setting up the planner again.
+"""
+
+import os
+import math
+import pickle
+import hashlib
+import multiprocessing
+from collections import namedtuple
+from enum import IntEnum
+
+import numpy as np
+import networkx as nx
+
+GRAPH_VERSION = 1
+# the folder of the cache files, one per town and hop resolution
+ROUTE_GRAPH_CACHE = os.environ.get('ROUTE_GRAPH_CACHE',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'bevdriver', 'route_graphs'))
+
+
+class RoadOption(IntEnum):
+    """ the values of agents.navigation.local_planner.RoadOption"""
+    VOID = -1
+    LEFT = 1
+    RIGHT = 2
+    STRAIGHT = 3
+    LANEFOLLOW = 4
+    CHANGELANELEFT = 5
+    CHANGELANERIGHT = 6
+
+
+class Location(namedtuple('Location', 'x y z')):
+    def distance(self, other):
+        return _distance(self, other)
+
+
+class Rotation(namedtuple('Rotation', 'pitch yaw roll')):
+    def get_forward_vector(self):
+        pitch, yaw = math.radians(self.pitch), math.radians(self.yaw)
+        return Location(math.cos(pitch) * math.cos(yaw), math.cos(pitch) * math.sin(yaw), math.sin(pitch))
+
+
+Transform = namedtuple('Transform', 'location rotation')
+# the attributes of a carla.Waypoint that the planner uses
+GraphWaypoint = namedtuple('GraphWaypoint', 'transform road_id section_id lane_id is_junction')
+
+
+def _distance(location_1, location_2):
+    return math.sqrt((location_1.x - location_2.x) ** 2 + (location_1.y - location_2.y) ** 2 +
+                     (location_1.z - location_2.z) ** 2)
+
+
+def _vector(location_1, location_2):
+    """ unit vector from location_1 to location_2, as agents.tools.misc.vector"""
+    x, y, z = location_2.x - location_1.x, location_2.y - location_1.y, location_2.z - location_1.z
+    norm = np.linalg.norm([x, y, z]) + np.finfo(float).eps
+    return [x / norm, y / norm, z / norm]
+
+
+def plain_waypoint(waypoint):
+    """ GraphWaypoint of a carla.Waypoint"""
+    location, rotation = waypoint.transform.location, waypoint.transform.rotation
+    return GraphWaypoint(Transform(Location(location.x, location.y, location.z),
+                                   Rotation(rotation.pitch, rotation.yaw, rotation.roll)),
+                         waypoint.road_id, waypoint.section_id, waypoint.lane_id, waypoint.is_junction)
+
+
+def _plain_value(value):
+    if isinstance(value, list):
+        return [_plain_value(item) for item in value]
+    if hasattr(value, 'road_id'):
+        return plain_waypoint(value)
+    if hasattr(value, 'name') and hasattr(value, 'value'):
+        # agents.navigation.local_planner.RoadOption
+        return RoadOption(value.value)
+    return value
+
+
+def map_name(world_map):
+    """ town and a hash of the OpenDRIVE of a carla.Map: the cache files of the town are rebuilt when it changes"""
+    digest = hashlib.sha1(world_map.to_opendrive().encode('utf-8')).hexdigest()[:12]
+    return '{}_{}'.format(os.path.basename(world_map.name), digest)
+
+
+def cache_path(town, hop_resolution, cache_dir=ROUTE_GRAPH_CACHE):
+    return os.path.join(cache_dir, '{}_{:g}.pkl'.format(town, hop_resolution))
+
+
+class RouteGraph(object):
+    """
+    The graph, road_id_to_edge and trace_route of agents.navigation.global_route_planner.GlobalRoutePlanner,
+    with GraphWaypoints in place of the carla.Waypoints. The origin and destination of a route are localized with
+    carla.Map.get_waypoint, or with the waypoints of map_waypoints looked up by the process with the map; without
+    them, offline, on the nearest waypoint of the graph, which can be another lane than the one of the map.
+    """
+
+    def __init__(self, graph, road_id_to_edge, hop_resolution, town=None):
+        self.graph = graph
+        self.road_id_to_edge = road_id_to_edge
+        self.hop_resolution = hop_resolution
+        self.town = town
+        self.filename = None
+        self._intersection_end_node = -1
+        self._previous_decision = RoadOption.VOID
+
+        # the waypoints the locations are localized on
+        waypoints = []
+        for _, _, edge in self.graph.edges(data=True):
+            if edge['type'] == RoadOption.LANEFOLLOW:
+                for waypoint in [edge['entry_waypoint']] + edge['path']:
+                    if waypoint.lane_id in road_id_to_edge.get(waypoint.road_id, {}).get(waypoint.section_id, {}):
+                        waypoints.append(waypoint)
+        self._waypoints = waypoints
+        self._locations = np.array([waypoint.transform.location for waypoint in waypoints], dtype=np.float64)
+
+    @classmethod
+    def from_topology(cls, topology, hop_resolution, town=None):
+        """
+        The graph of GlobalRoutePlanner._build_graph from the segments of GlobalRoutePlannerDAO.get_topology,
+        dicts of entry, exit (GraphWaypoints), entryxyz, exitxyz and path. The loose ends and the lane changes,
+        which are found on the map, are not added.
+        """
+        graph = nx.DiGraph()
+        id_map = dict()
+        road_id_to_edge = dict()
+
+        for segment in topology:
+            entry_xyz, exit_xyz = segment['entryxyz'], segment['exitxyz']
+            path = segment['path']
+            entry_wp, exit_wp = segment['entry'], segment['exit']
+            road_id, section_id, lane_id = entry_wp.road_id, entry_wp.section_id, entry_wp.lane_id
+
+            for vertex in entry_xyz, exit_xyz:
+                if vertex not in id_map:
+                    new_id = len(id_map)
+                    id_map[vertex] = new_id
+                    graph.add_node(new_id, vertex=vertex)
+            n1, n2 = id_map[entry_xyz], id_map[exit_xyz]
+            road_id_to_edge.setdefault(road_id, dict()).setdefault(section_id, dict())[lane_id] = (n1, n2)
+
+            entry_vector = entry_wp.transform.rotation.get_forward_vector()
+            exit_vector = exit_wp.transform.rotation.get_forward_vector()
+            graph.add_edge(
+                n1, n2,
+                length=len(path) + 1, path=path,
+                entry_waypoint=entry_wp, exit_waypoint=exit_wp,
+                entry_vector=np.array(entry_vector), exit_vector=np.array(exit_vector),
+                net_vector=_vector(entry_wp.transform.location, exit_wp.transform.location),
+                intersection=entry_wp.is_junction, type=RoadOption.LANEFOLLOW)
+
+        return cls(graph, road_id_to_edge, hop_resolution, town)
+
+    @classmethod
+    def from_planner(cls, planner, town=None):
+        """ the graph of a GlobalRoutePlanner after setup()"""
+        graph = nx.DiGraph()
+        for node, data in planner._graph.nodes(data=True):
+            graph.add_node(node, **data)
+        for n1, n2, data in planner._graph.edges(data=True):
+            graph.add_edge(n1, n2, **{key: _plain_value(value) for key, value in data.items()})
+        return cls(graph, planner._road_id_to_edge, planner._dao.get_resolution(), town)
+
+    @classmethod
+    def from_map(cls, world_map, hop_resolution):
+        from agents.navigation.global_route_planner import GlobalRoutePlanner
+        from agents.navigation.global_route_planner_dao import GlobalRoutePlannerDAO
+
+        planner = GlobalRoutePlanner(GlobalRoutePlannerDAO(world_map, hop_resolution))
+        planner.setup()
+        return cls.from_planner(planner, map_name(world_map))
+
+    def save(self, filename):
+        data = {
+            'version': GRAPH_VERSION,
+            'town': self.town,
+            'hop_resolution': self.hop_resolution,
+            'nodes': list(self.graph.nodes(data=True)),
+            'edges': list(self.graph.edges(data=True)),
+            'road_id_to_edge': self.road_id_to_edge,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        # written next to the cache file and renamed, for the processes that load it meanwhile
+        tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmp_filename, 'wb') as fd:
+            pickle.dump(data, fd, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as fd:
+            data = pickle.load(fd)
+        if data.get('version') != GRAPH_VERSION:
+            raise ValueError('route graph {} has version {}, expected {}'.format(
+                filename, data.get('version'), GRAPH_VERSION))
+        graph = nx.DiGraph()
+        graph.add_nodes_from(data['nodes'])
+        graph.add_edges_from(data['edges'])
+        return cls(graph, data['road_id_to_edge'], data['hop_resolution'], data['town'])
+
+    def get_waypoint(self, location, world_map=None):
+        """ the waypoint of a location, with world_map as GlobalRoutePlannerDAO.get_waypoint"""
+        if world_map is not None:
+            return plain_waypoint(world_map.get_waypoint(location))
+        distances = np.square(self._locations - (location.x, location.y, location.z)).sum(axis=1)
+        return self._waypoints[int(np.argmin(distances))]
+
+    def _localize(self, waypoint):
+        edge = None
+        try:
+            edge = self.road_id_to_edge[waypoint.road_id][waypoint.section_id][waypoint.lane_id]
+        except KeyError:
+            print("Failed to localize! : ",
+                  "Road id : ", waypoint.road_id,
+                  "Section id : ", waypoint.section_id,
+                  "Lane id : ", waypoint.lane_id,
+                  "Location : ", waypoint.transform.location.x,
+                  waypoint.transform.location.y)
+        return edge
+
+    def _distance_heuristic(self, n1, n2):
+        l1 = np.array(self.graph.nodes[n1]['vertex'])
+        l2 = np.array(self.graph.nodes[n2]['vertex'])
+        return np.linalg.norm(l1 - l2)
+
+    def _path_search(self, origin_waypoint, destination_waypoint):
+        start, end = self._localize(origin_waypoint), self._localize(destination_waypoint)
+        route = nx.astar_path(
+            self.graph, source=start[0], target=end[0],
+            heuristic=self._distance_heuristic, weight='length')
+        route.append(end[1])
+        return route
+
+    def _successive_last_intersection_edge(self, index, route):
+        last_intersection_edge = None
+        last_node = None
+        for node1, node2 in [(route[i], route[i + 1]) for i in range(index, len(route) - 1)]:
+            candidate_edge = self.graph.edges[node1, node2]
+            if node1 == route[index]:
+                last_intersection_edge = candidate_edge
+            if candidate_edge['type'] == RoadOption.LANEFOLLOW and candidate_edge['intersection']:
+                last_intersection_edge = candidate_edge
+                last_node = node2
+            else:
+                break
+        return last_node, last_intersection_edge
+
+    def _turn_decision(self, index, route, threshold=math.radians(35)):
+        decision = None
+        previous_node = route[index - 1]
+        current_node = route[index]
+        next_node = route[index + 1]
+        next_edge = self.graph.edges[current_node, next_node]
+        if index > 0:
+            if self._previous_decision != RoadOption.VOID and \
+                    self._intersection_end_node > 0 and \
+                    self._intersection_end_node != previous_node and \
+                    next_edge['type'] == RoadOption.LANEFOLLOW and \
+                    next_edge['intersection']:
+                decision = self._previous_decision
+            else:
+                self._intersection_end_node = -1
+                current_edge = self.graph.edges[previous_node, current_node]
+                calculate_turn = current_edge['type'] == RoadOption.LANEFOLLOW and \
+                    not current_edge['intersection'] and \
+                    next_edge['type'] == RoadOption.LANEFOLLOW and \
+                    next_edge['intersection']
+                if calculate_turn:
+                    last_node, tail_edge = self._successive_last_intersection_edge(index, route)
+                    self._intersection_end_node = last_node
+                    if tail_edge is not None:
+                        next_edge = tail_edge
+                    cv, nv = current_edge['exit_vector'], next_edge['net_vector']
+                    cross_list = []
+                    for neighbor in self.graph.successors(current_node):
+                        select_edge = self.graph.edges[current_node, neighbor]
+                        if select_edge['type'] == RoadOption.LANEFOLLOW:
+                            if neighbor != route[index + 1]:
+                                sv = select_edge['net_vector']
+                                cross_list.append(np.cross(cv, sv)[2])
+                    next_cross = np.cross(cv, nv)[2]
+                    deviation = math.acos(np.clip(
+                        np.dot(cv, nv) / (np.linalg.norm(cv) * np.linalg.norm(nv)), -1.0, 1.0))
+                    if not cross_list:
+                        cross_list.append(0)
+                    if deviation < threshold:
+                        decision = RoadOption.STRAIGHT
+                    elif cross_list and next_cross < min(cross_list):
+                        decision = RoadOption.LEFT
+                    elif cross_list and next_cross > max(cross_list):
+                        decision = RoadOption.RIGHT
+                    elif next_cross < 0:
+                        decision = RoadOption.LEFT
+                    elif next_cross > 0:
+                        decision = RoadOption.RIGHT
+                else:
+                    decision = next_edge['type']
+        else:
+            decision = next_edge['type']
+
+        self._previous_decision = decision
+        return decision
+
+    @staticmethod
+    def _find_closest_in_list(current_waypoint, waypoint_list):
+        min_distance = float('inf')
+        closest_index = -1
+        for i, waypoint in enumerate(waypoint_list):
+            distance = _distance(waypoint.transform.location, current_waypoint.transform.location)
+            if distance < min_distance:
+                min_distance = distance
+                closest_index = i
+        return closest_index
+
+    def trace_route(self, origin, destination, world_map=None, origin_waypoint=None, destination_waypoint=None):
+        """
+        list of (GraphWaypoint, RoadOption) from origin to destination, as GlobalRoutePlanner.trace_route, with
+        the waypoints of origin and destination if given, else of get_waypoint
+        """
+        route_trace = []
+        current_waypoint = origin_waypoint or self.get_waypoint(origin, world_map)
+        destination_waypoint = destination_waypoint or self.get_waypoint(destination, world_map)
+        route = self._path_search(current_waypoint, destination_waypoint)
+        resolution = self.hop_resolution
+
+        for i in range(len(route) - 1):
+            road_option = self._turn_decision(i, route)
+            edge = self.graph.edges[route[i], route[i + 1]]
+
+            if edge['type'] != RoadOption.LANEFOLLOW and edge['type'] != RoadOption.VOID:
+                route_trace.append((current_waypoint, road_option))
+                exit_wp = edge['exit_waypoint']
+                n1, n2 = self.road_id_to_edge[exit_wp.road_id][exit_wp.section_id][exit_wp.lane_id]
+                next_edge = self.graph.edges[n1, n2]
+                if next_edge['path']:
+                    closest_index = self._find_closest_in_list(current_waypoint, next_edge['path'])
+                    closest_index = min(len(next_edge['path']) - 1, closest_index + 5)
+                    current_waypoint = next_edge['path'][closest_index]
+                else:
+                    current_waypoint = next_edge['exit_waypoint']
+                route_trace.append((current_waypoint, road_option))
+            else:
+                path = [edge['entry_waypoint']] + edge['path'] + [edge['exit_waypoint']]
+                closest_index = self._find_closest_in_list(current_waypoint, path)
+                for waypoint in path[closest_index:]:
+                    current_waypoint = waypoint
+                    route_trace.append((current_waypoint, road_option))
+                    if len(route) - i <= 2 and \
+                            _distance(waypoint.transform.location, destination) < 2 * resolution:
+                        break
+                    elif len(route) - i <= 2 and \
+                            current_waypoint.road_id == destination_waypoint.road_id and \
+                            current_waypoint.section_id == destination_waypoint.section_id and \
+                            current_waypoint.lane_id == destination_waypoint.lane_id:
+                        destination_index = self._find_closest_in_list(destination_waypoint, path)
+                        if closest_index > destination_index:
+                            break
+
+        return route_trace
+
+    def interpolate(self, waypoints_trajectory, world_map=None, keypoint_waypoints=None):
+        """
+        The dense route of (Transform, RoadOption) of the keypoints of waypoints_trajectory, the route of
+        interpolate_trajectory with a new GlobalRoutePlanner. keypoint_waypoints are the waypoints of the
+        keypoints from map_waypoints, in place of those of get_waypoint.
+        """
+        if keypoint_waypoints is None:
+            keypoint_waypoints = [self.get_waypoint(location, world_map) for location in waypoints_trajectory]
+        self._intersection_end_node = -1
+        self._previous_decision = RoadOption.VOID
+        route = []
+        for i in range(len(waypoints_trajectory) - 1):
+            interpolated_trace = self.trace_route(waypoints_trajectory[i], waypoints_trajectory[i + 1], world_map,
+                                                  keypoint_waypoints[i], keypoint_waypoints[i + 1])
+            for wp_tuple in interpolated_trace:
+                route.append((wp_tuple[0].transform, wp_tuple[1]))
+        return route
+
+
+# the graphs loaded by this process, by cache file, and the graph of a worker of interpolate_routes
+_graphs = {}
+_worker_graph = None
+
+
+def load_route_graph(world_map, hop_resolution=1.0, cache_dir=ROUTE_GRAPH_CACHE):
+    """ the RouteGraph of the town of world_map, from its cache file or set up and saved to it"""
+    filename = cache_path(map_name(world_map), hop_resolution, cache_dir)
+    if filename not in _graphs:
+        if os.path.exists(filename):
+            graph = RouteGraph.load(filename)
+        else:
+            graph = RouteGraph.from_map(world_map, hop_resolution)
+            graph.save(filename)
+        graph.filename = filename
+        _graphs[filename] = graph
+    return _graphs[filename]
+
+
+def _init_worker(filename):
+    global _worker_graph
+    _worker_graph = RouteGraph.load(filename)
+
+
+def _interpolate_worker(task):
+    trajectory, keypoint_waypoints = task
+    return _worker_graph.interpolate([Location(*xyz) for xyz in trajectory], keypoint_waypoints=keypoint_waypoints)
+
+
+def map_waypoints(world_map, trajectories):
+    """
+    The GraphWaypoints of carla.Map.get_waypoint of the keypoints of trajectories, lists of carla.Location,
+    for interpolate_routes: the worker processes have no map to look them up.
+    """
+    return [[plain_waypoint(world_map.get_waypoint(location)) for location in trajectory]
+            for trajectory in trajectories]
+
+
+def interpolate_routes(filename, trajectories, processes=None, waypoints=None):
+    """
+    The dense routes of (Transform, RoadOption) of many trajectories, lists of locations or of (x, y, z),
+    on the route graph of a cache file (RouteGraph.filename of load_route_graph): the graph is loaded once
+    by each of the worker processes. waypoints are the waypoints of the keypoints of map_waypoints; without
+    them the keypoints are localized on the nearest waypoint of the graph, for the routes of towns offline.
+    """
+    trajectories = [[tuple(location) if isinstance(location, (tuple, list))
+                     else (location.x, location.y, location.z) for location in trajectory]
+                    for trajectory in trajectories]
+    tasks = list(zip(trajectories, waypoints or [None] * len(trajectories)))
+    processes = processes or os.cpu_count()
+    if processes <= 1 or len(tasks) <= 1:
+        _init_worker(filename)
+        return [_interpolate_worker(task) for task in tasks]
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(filename,)) as pool:
+        return pool.map(_interpolate_worker, tasks, chunksize=max(1, len(tasks) // (4 * processes)))
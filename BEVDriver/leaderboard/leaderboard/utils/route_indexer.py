@@ -7,7 +7,7 @@ from srunner.scenarioconfigs.route_scenario_configuration import RouteScenarioCo
 
 
 from leaderboard.utils.route_parser import RouteParser
-from leaderboard.utils.checkpoint_tools import fetch_dict, create_default_json_msg, save_dict
+from leaderboard.utils.checkpoint_tools import fetch_dict, create_default_json_msg, save_dict, is_remote, append_entry
 
 
 class RouteIndexer():
@@ -64,6 +64,10 @@ class RouteIndexer():
                           'larger than maximum number of routes {}'.format(current_route, self.total))
 
     def save_state(self, endpoint):
+        if not is_remote(endpoint):
+            append_entry(endpoint, {'op': 'progress', 'progress': [self._index, self.total]})
+            return
+
         data = fetch_dict(endpoint)
         if not data:
             data = create_default_json_msg()
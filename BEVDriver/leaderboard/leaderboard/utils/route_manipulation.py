@@ -13,10 +13,11 @@ It also contains functions to convert the CARLA world location do GPS coordinate
 import math
 import xml.etree.ElementTree as ET
 
-from agents.navigation.global_route_planner import GlobalRoutePlanner
-from agents.navigation.global_route_planner_dao import GlobalRoutePlannerDAO
+import carla
 from agents.navigation.local_planner import RoadOption
 
+from leaderboard.utils.route_graph import load_route_graph
+
 
 def _location_to_gps(lat_ref, lon_ref, location):
     """
@@ -140,18 +141,14 @@ def interpolate_trajectory(world, waypoints_trajectory, hop_resolution=1.0):
         - hop_resolution: is the resolution, how dense is the provided trajectory going to be made
     """
 
-    dao = GlobalRoutePlannerDAO(world.get_map(), hop_resolution)
-    grp = GlobalRoutePlanner(dao)
-    grp.setup()
+    # the graph of the planner is set up once per town and hop resolution and kept in a cache file
+    world_map = world.get_map()
+    grp = load_route_graph(world_map, hop_resolution)
     # Obtain route plan
     route = []
-    for i in range(len(waypoints_trajectory) - 1):   # Goes until the one before the last.
-
-        waypoint = waypoints_trajectory[i]
-        waypoint_next = waypoints_trajectory[i + 1]
-        interpolated_trace = grp.trace_route(waypoint, waypoint_next)
-        for wp_tuple in interpolated_trace:
-            route.append((wp_tuple[0].transform, wp_tuple[1]))
+    for transform, road_option in grp.interpolate(waypoints_trajectory, world_map):
+        route.append((carla.Transform(carla.Location(*transform.location), carla.Rotation(*transform.rotation)),
+                      RoadOption(road_option.value)))
 
     lat_ref, lon_ref = _get_latlon_ref(world)
 
@@ -38,6 +38,50 @@ WEATHERS = {
 }
 
 
+class LocationGrid(object):
+
+    """
+    The keys of a set of locations by the cell of a grid they are in, cells of TRIGGER_THRESHOLD
+    meters: the locations closer than TRIGGER_THRESHOLD to a given one are in its cell or the eight
+    around it, so they are found without comparing against all of them.
+    """
+
+    def __init__(self, cell_size=TRIGGER_THRESHOLD):
+        self.cell_size = cell_size
+        self._cells = {}
+
+    @classmethod
+    def from_route(cls, route_description):
+        """
+        Returns the grid of the positions in the route of its waypoints, as (transform, road option).
+        """
+        grid = cls()
+        for position, route_waypoint in enumerate(route_description):
+            grid.add(position, route_waypoint[0].location.x, route_waypoint[0].location.y)
+        return grid
+
+    def _cell(self, x, y):
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def add(self, key, x, y):
+        """
+        Adds the key of the location (x, y).
+        """
+        self._cells.setdefault(self._cell(x, y), []).append(key)
+
+    def candidates(self, x, y):
+        """
+        Returns the sorted keys of the locations that can be closer than cell_size to (x, y).
+        """
+        cell_x, cell_y = self._cell(x, y)
+        keys = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                keys.extend(self._cells.get((cell_x + dx, cell_y + dy), ()))
+        keys.sort()
+        return keys
+
+
 class RouteParser(object):
 
     """
@@ -151,15 +195,20 @@ class RouteParser(object):
         return weather
 
     @staticmethod
-    def check_trigger_position(new_trigger, existing_triggers):
+    def check_trigger_position(new_trigger, existing_triggers, trigger_grid=None):
         """
         Check if this trigger position already exists or if it is a new one.
         :param new_trigger:
         :param existing_triggers:
+        :param trigger_grid: LocationGrid of the existing triggers, to only check the ones close to the new one
         :return:
         """
+        if trigger_grid is None:
+            trigger_ids = existing_triggers.keys()
+        else:
+            trigger_ids = trigger_grid.candidates(new_trigger['x'], new_trigger['y'])
 
-        for trigger_id in existing_triggers.keys():
+        for trigger_id in trigger_ids:
             trigger = existing_triggers[trigger_id]
             dx = trigger['x'] - new_trigger['x']
             dy = trigger['y'] - new_trigger['y']
@@ -183,11 +232,12 @@ class RouteParser(object):
         waypoint['yaw'] = float(waypoint['yaw'])
 
     @staticmethod
-    def match_world_location_to_route(world_location, route_description):
+    def match_world_location_to_route(world_location, route_description, route_grid=None):
         """
         We match this location to a given route.
             world_location:
             route_description:
+            route_grid: LocationGrid of the route, to only check the waypoints close to the location
         """
         def match_waypoints(waypoint1, wtransform):
             """
@@ -203,12 +253,14 @@ class RouteParser(object):
             return dpos < TRIGGER_THRESHOLD \
                 and (dyaw < TRIGGER_ANGLE_THRESHOLD or dyaw > (360 - TRIGGER_ANGLE_THRESHOLD))
 
-        match_position = 0
-        # TODO this function can be optimized to run on Log(N) time
-        for route_waypoint in route_description:
-            if match_waypoints(world_location, route_waypoint[0]):
+        if route_grid is None:
+            positions = range(len(route_description))
+        else:
+            positions = route_grid.candidates(float(world_location['x']), float(world_location['y']))
+
+        for match_position in positions:
+            if match_waypoints(world_location, route_description[match_position][0]):
                 return match_position
-            match_position += 1
 
         return None
 
@@ -310,6 +362,10 @@ class RouteParser(object):
         # Keep track of the trigger ids being added
         latest_trigger_id = 0
 
+        # the waypoints of the route and the triggers by the cells of a grid, as only the close ones can match
+        route_grid = LocationGrid.from_route(trajectory)
+        trigger_grid = LocationGrid()
+
         for town_name in world_annotations.keys():
             if town_name != route_name:
                 continue
@@ -323,7 +379,7 @@ class RouteParser(object):
                     RouteParser.convert_waypoint_float(waypoint)
                     # We match trigger point to the  route, now we need to check if the route affects
                     match_position = RouteParser.match_world_location_to_route(
-                        waypoint, trajectory)
+                        waypoint, trajectory, route_grid)
                     if match_position is not None:
                         # We match a location for this scenario, create a scenario object so this scenario
                         # can be instantiated later
@@ -343,10 +399,11 @@ class RouteParser(object):
                             'scenario_type': scenario_subtype, # some scenarios have route dependent configurations
                         }
 
-                        trigger_id = RouteParser.check_trigger_position(waypoint, existent_triggers)
+                        trigger_id = RouteParser.check_trigger_position(waypoint, existent_triggers, trigger_grid)
                         if trigger_id is None:
                             # This trigger does not exist create a new reference on existent triggers
                             existent_triggers.update({latest_trigger_id: waypoint})
+                            trigger_grid.add(latest_trigger_id, waypoint['x'], waypoint['y'])
                             # Update a reference for this trigger on the possible scenarios
                             possible_scenarios.update({latest_trigger_id: []})
                             trigger_id = latest_trigger_id
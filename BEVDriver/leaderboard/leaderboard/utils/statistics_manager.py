@@ -13,11 +13,13 @@ from __future__ import print_function
 
 from dictor import dictor
 import math
+import os
 import sys
 
 from srunner.scenariomanager.traffic_events import TrafficEventType
 
-from leaderboard.utils.checkpoint_tools import fetch_dict, save_dict, create_default_json_msg
+from leaderboard.utils.checkpoint_tools import (fetch_dict, save_dict, create_default_json_msg, is_remote,
+                                                append_entry, compact_checkpoint, journal_path)
 
 PENALTY_COLLISION_PEDESTRIAN = 0.50
 PENALTY_COLLISION_VEHICLE = 0.60
@@ -88,7 +90,8 @@ class StatisticsManager(object):
         self._registry_route_records = []
 
     def resume(self, endpoint):
-        data = fetch_dict(endpoint)
+        # the checkpoint with the journal of the interrupted run replayed, written back as one file
+        data = compact_checkpoint(endpoint)
 
         if data and dictor(data, '_checkpoint.records'):
             records = data['_checkpoint']['records']
@@ -236,6 +239,10 @@ class StatisticsManager(object):
 
     @staticmethod
     def save_record(route_record, index, endpoint):
+        if not is_remote(endpoint):
+            append_entry(endpoint, {'op': 'record', 'index': index, 'record': route_record.__dict__})
+            return
+
         data = fetch_dict(endpoint)
         if not data:
             data = create_default_json_msg()
@@ -315,6 +322,10 @@ class StatisticsManager(object):
 
     @staticmethod
     def save_sensors(sensors, endpoint):
+        if not is_remote(endpoint):
+            append_entry(endpoint, {'op': 'sensors', 'sensors': sensors})
+            return
+
         data = fetch_dict(endpoint)
         if not data:
             data = create_default_json_msg()
@@ -326,6 +337,10 @@ class StatisticsManager(object):
 
     @staticmethod
     def save_entry_status(entry_status, eligible, endpoint):
+        if not is_remote(endpoint):
+            append_entry(endpoint, {'op': 'entry_status', 'entry_status': entry_status, 'eligible': eligible})
+            return
+
         data = fetch_dict(endpoint)
         if not data:
             data = create_default_json_msg()
@@ -336,6 +351,8 @@ class StatisticsManager(object):
 
     @staticmethod
     def clear_record(endpoint):
-        if not endpoint.startswith(('http:', 'https:', 'ftp:')):
+        if not is_remote(endpoint):
             with open(endpoint, 'w') as fd:
                 fd.truncate(0)
+            if os.path.exists(journal_path(endpoint)):
+                os.remove(journal_path(endpoint))
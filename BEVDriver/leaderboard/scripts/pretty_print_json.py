@@ -14,13 +14,14 @@ from __future__ import print_function
 import argparse
 from argparse import RawTextHelpFormatter
 from dictor import dictor
-import json
 from tabulate import tabulate
 
+from leaderboard.utils.checkpoint_tools import fetch_dict
+
 
 def prettify_json(args):
-    with open(args.file) as fd:
-        json_dict = json.load(fd)
+    # the checkpoint with the journal of a running or interrupted evaluation replayed
+    json_dict = fetch_dict(args.file)
 
     if not json_dict:
         print('[Error] The file [{}] could not be parsed.'.format(args.file))
@@ -0,0 +1,366 @@
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import importlib
+import importlib.abc
+import importlib.util
+from enum import IntEnum
+
+import cv2
+import numpy as np
+
+'''
+Record and replay of BEVDriverAgent runs, to profile the agent without a CARLA server.
+
+Recording: with RECORD_PATH set, the agent writes the sensor data it gets in run_step, the downsampled
+route (GPS and road options), the results of the instruction planner (which asks the CARLA world) and
+its controls to a log directory:
+
+    header.json     sensors, route, town and scenario of the run
+    ticks.jsonl     one line per step: timestamp, GPS/IMU/speed, planner results, control and the
+                    offsets of the step's camera images and LiDAR points in sensors.bin
+    sensors.bin     camera images as PNG (lossless, only on the steps the model runs), LiDAR points raw
+
+Replay: the simulator packages that cannot be imported (carla, srunner, agents, pygame) are stubbed,
+the agent of --config is built (set deploy_model and device in the config for a model on the CPU)
+and its run_step is driven by the log, with the logged timestamps. The recorded instruction planner
+results stand in for the planner, the controls are compared with the recorded ones and the time of
+the stages of run_step is printed:
+
+python leaderboard/team_code/agent_replay.py --config leaderboard/team_code/bevdriver_config.py --log records/route_0
+'''
+
+LOG_VERSION = 1
+HEADER_FILE = 'header.json'
+TICKS_FILE = 'ticks.jsonl'
+SENSORS_FILE = 'sensors.bin'
+CAMERA_SENSORS = ['rgb_front', 'rgb_left', 'rgb_right', 'rgb_rear']
+# the methods of InstructionPlanner called by run_step
+PLANNER_METHODS = ['command2instruct', 'pos2notice', 'traffic_notice', 'command2mislead']
+SIMULATOR_MODULES = ['carla', 'srunner', 'agents', 'pygame']
+
+
+class RoadOption(IntEnum):
+    """ the values of agents.navigation.local_planner.RoadOption, for the route of a log"""
+    VOID = -1
+    LEFT = 1
+    RIGHT = 2
+    STRAIGHT = 3
+    LANEFOLLOW = 4
+    CHANGELANELEFT = 5
+    CHANGELANERIGHT = 6
+
+
+def _to_json(value):
+    # numpy scalars of the planner and the sensors as Python numbers
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError('%s is not JSON serializable' % type(value).__name__)
+
+
+def _encode_value(value):
+    # small sensor values, numpy types kept (the speedometer's speed is a numpy float)
+    if isinstance(value, np.ndarray):
+        return {'array': value.tolist(), 'dtype': str(value.dtype)}
+    if isinstance(value, np.generic):
+        return {'scalar': value.item(), 'dtype': str(value.dtype)}
+    if isinstance(value, dict):
+        return {'dict': {key: _encode_value(item) for key, item in value.items()}}
+    return {'value': value}
+
+
+def _decode_value(encoded):
+    if 'array' in encoded:
+        return np.array(encoded['array'], dtype=encoded['dtype'])
+    if 'scalar' in encoded:
+        return np.dtype(encoded['dtype']).type(encoded['scalar'])
+    if 'dict' in encoded:
+        return {key: _decode_value(item) for key, item in encoded['dict'].items()}
+    return encoded['value']
+
+
+class AgentRecorder(object):
+    """ writes the log of a run of BEVDriverAgent, one tick per run_step"""
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._ticks = open(os.path.join(path, TICKS_FILE), 'w')
+        self._sensors = open(os.path.join(path, SENSORS_FILE), 'wb')
+        self._offset = 0
+        self._tick = None
+
+    def write_header(self, sensors, global_plan, town_id=None, scenario_config_name=None):
+        """
+        Args:
+            sensors (list): sensors() of the agent.
+            global_plan (list): (GPS dict, RoadOption) of the downsampled route, the agent's _global_plan.
+        """
+        header = {
+            'version': LOG_VERSION,
+            'sensors': sensors,
+            'global_plan': [[gps, int(command.value)] for gps, command in global_plan],
+            'town_id': town_id,
+            'scenario_config_name': scenario_config_name,
+        }
+        with open(os.path.join(self.path, HEADER_FILE), 'w') as f:
+            json.dump(header, f, default=_to_json)
+
+    def _write_blob(self, data, encoding, dtype, shape):
+        blob = {'offset': self._offset, 'size': len(data), 'encoding': encoding, 'dtype': dtype, 'shape': shape}
+        self._sensors.write(data)
+        self._offset += len(data)
+        return blob
+
+    def _encode(self, sensor, data, cameras):
+        if sensor in CAMERA_SENSORS:
+            if not cameras:
+                return None
+            ok, png = cv2.imencode('.png', data, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+            assert ok, 'cannot encode %s' % sensor
+            return {'blob': self._write_blob(png.tobytes(), 'png', str(data.dtype), list(data.shape))}
+        if isinstance(data, np.ndarray) and data.size > 64:
+            data = np.ascontiguousarray(data)
+            return {'blob': self._write_blob(data.tobytes(), 'raw', str(data.dtype), list(data.shape))}
+        return _encode_value(data)
+
+    def record_inputs(self, step, input_data, timestamp, cameras=True):
+        """ begins the tick of run_step, the camera images are left out if not cameras"""
+        sensors = {}
+        for sensor, (frame, data) in input_data.items():
+            encoded = self._encode(sensor, data, cameras)
+            if encoded is not None:
+                encoded['frame'] = frame
+                sensors[sensor] = encoded
+        self._tick = {'step': step, 'timestamp': timestamp, 'sensors': sensors, 'planner': {}}
+
+    def record_planner(self, method, result):
+        self._tick['planner'][method] = result
+
+    def record_control(self, control):
+        """ ends the tick with the control returned by run_step"""
+        self._tick['control'] = [float(control.steer), float(control.throttle), float(control.brake)]
+        self._ticks.write(json.dumps(self._tick, default=_to_json) + '\n')
+        # the leaderboard may stop the agent without destroy()
+        self._sensors.flush()
+        self._ticks.flush()
+        self._tick = None
+
+    def close(self):
+        self._ticks.close()
+        self._sensors.close()
+
+
+class RecordingInstructionPlanner(object):
+    """ InstructionPlanner whose results of the methods run_step calls are recorded"""
+    def __init__(self, planner, recorder):
+        self._planner = planner
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        attr = getattr(self._planner, name)
+        if name not in PLANNER_METHODS:
+            return attr
+
+        def recorded(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            self._recorder.record_planner(name, result)
+            return result
+        return recorded
+
+
+class ReplayInstructionPlanner(object):
+    """ returns the recorded results of the instruction planner of the current tick"""
+    def __init__(self):
+        self.results = {}
+
+    def __getattr__(self, name):
+        if name not in PLANNER_METHODS:
+            raise AttributeError(name)
+
+        def replayed(*args, **kwargs):
+            if name not in self.results:
+                raise KeyError('the log has no result of %s for this step' % name)
+            return self.results[name]
+        return replayed
+
+
+class AgentLog(object):
+    """ the log of an AgentRecorder, iterates over (tick, input_data) with input_data as given to run_step"""
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE)) as f:
+            self.header = json.load(f)
+        if self.header['version'] != LOG_VERSION:
+            raise ValueError('%s: log version %s, expected %d' % (path, self.header['version'], LOG_VERSION))
+        with open(os.path.join(path, TICKS_FILE)) as f:
+            self.ticks = [json.loads(line) for line in f]
+        sensors_path = os.path.join(path, SENSORS_FILE)
+        self._sensors = np.memmap(sensors_path, dtype=np.uint8, mode='r') if os.path.getsize(sensors_path) else None
+
+    def global_plan(self):
+        return [(gps, RoadOption(command)) for gps, command in self.header['global_plan']]
+
+    def _decode(self, encoded):
+        if 'blob' in encoded:
+            blob = encoded['blob']
+            data = self._sensors[blob['offset']:blob['offset'] + blob['size']]
+            if blob['encoding'] == 'png':
+                return cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+            return np.frombuffer(data.tobytes(), dtype=blob['dtype']).reshape(blob['shape'])
+        return _decode_value(encoded)
+
+    def input_data(self, tick):
+        return {sensor: (encoded['frame'], self._decode(encoded)) for sensor, encoded in tick['sensors'].items()}
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def __iter__(self):
+        for tick in self.ticks:
+            yield tick, self.input_data(tick)
+
+
+class _StubType(type):
+    # any attribute of a stubbed class is another stubbed class
+    def __getattr__(cls, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _stub_class(name)
+
+    def __or__(cls, other):
+        return cls
+
+    __ror__ = __or__
+
+
+class _StubObject(metaclass=_StubType):
+    """ instance of a stubbed class: takes any arguments, its unknown attributes are stubs"""
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _stub_class(name)
+
+
+def _stub_class(name):
+    return _StubType(name, (_StubObject,), {})
+
+
+class _StubModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        stub = _stub_class(name)
+        setattr(self, name, stub)
+        return stub
+
+
+class _SimulatorStubFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    def __init__(self, packages):
+        self.packages = set(packages)
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname.split('.')[0] in self.packages:
+            return importlib.util.spec_from_loader(fullname, self, is_package=True)
+        return None
+
+    def create_module(self, spec):
+        return _StubModule(spec.name)
+
+    def exec_module(self, module):
+        pass
+
+
+def install_simulator_stubs(packages=SIMULATOR_MODULES):
+    """
+    Stubs the packages of packages that cannot be imported: their modules import and any of their
+    attributes is a class that takes any arguments (carla.VehicleControl() is an object the agent sets
+    steer, throttle and brake of). The installed packages are used as they are. Returns the stubbed
+    packages.
+    """
+    # no window for an installed pygame
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    missing = []
+    for package in packages:
+        try:
+            importlib.import_module(package)
+        except ImportError:
+            missing.append(package)
+    if missing:
+        sys.meta_path.insert(0, _SimulatorStubFinder(missing))
+    return missing
+
+
+def replay(config_path, log_path, record_path=None, save_path=None, sync=False, limit=None):
+    """
+    Runs the agent of config_path on the ticks of the log at log_path.
+
+    Args:
+        record_path (str): records the replay as a new log.
+        save_path (str): the agent saves its display images under this directory, None to not save.
+        sync (bool): waits for the device at every stage, for the time of the stages on a GPU.
+        limit (int): replays only the first limit ticks.
+
+    Returns:
+        (agent, controls, recorded controls), the controls as [steer, throttle, brake] per tick.
+    """
+    install_simulator_stubs()
+    import torch
+    from team_code import bevdriver_agent
+
+    log = AgentLog(log_path)
+    bevdriver_agent.SAVE_PATH = save_path
+    bevdriver_agent.RECORD_PATH = record_path
+    if save_path is not None:
+        os.environ.setdefault('ROUTES', log_path)
+    agent = bevdriver_agent.BEVDriverAgent(config_path)
+    if sync and agent.device.type == 'cuda':
+        agent.timer.sync = torch.cuda.synchronize
+    agent._global_plan = log.global_plan()
+    agent.town_id = log.header['town_id']
+    agent.scenario_cofing_name = log.header['scenario_config_name']
+    planner = ReplayInstructionPlanner()
+    agent.create_instruction_planner = lambda: planner
+
+    ticks = log.ticks[:limit]
+    controls = []
+    try:
+        for tick in ticks:
+            planner.results = tick['planner']
+            control = agent.run_step(log.input_data(tick), tick['timestamp'])
+            controls.append([float(control.steer), float(control.throttle), float(control.brake)])
+    finally:
+        agent.destroy()
+    return agent, controls, [tick['control'] for tick in ticks]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="leaderboard/team_code/bevdriver_config.py")
+    parser.add_argument("--log", required=True, help="log directory written with RECORD_PATH")
+    parser.add_argument("--record", default=None, help="record the replay as a new log")
+    parser.add_argument("--save-path", default=None, help="save the display images as the agent with SAVE_PATH")
+    parser.add_argument("--sync", action="store_true", help="wait for the GPU at every stage")
+    parser.add_argument("--limit", type=int, default=None, help="number of ticks to replay")
+    args = parser.parse_args()
+
+    stubbed = install_simulator_stubs()
+    if stubbed:
+        print('stubbed %s' % ', '.join(stubbed))
+    start = time.time()
+    agent, controls, recorded = replay(args.config, args.log, args.record, args.save_path, args.sync, args.limit)
+    print('replayed %d ticks in %.1f s' % (len(controls), time.time() - start))
+    difference = np.abs(np.array(controls) - np.array(recorded)).max(0) if controls else np.zeros(3)
+    print('max difference to the recorded controls: steer %.4f throttle %.4f brake %.4f' % tuple(difference))
+    print(agent.timer.summary())
+
+
+if __name__ == "__main__":
+    main()
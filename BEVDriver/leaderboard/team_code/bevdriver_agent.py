@@ -22,9 +22,11 @@ from torchvision import transforms
 from leaderboard.autoagents import autonomous_agent
 from team_code.planner import RoutePlanner, InstructionPlanner
 from team_code.pid_controller import PIDController
-from team_code.utils import lidar_to_histogram_features, transform_2d_points
-from timm.models import create_model
-from lavis.common.registry import registry
+from team_code.inference_server import ENCODER_KEYS, InferenceClient, build_model
+from team_code.sensor_pipeline import SensorPipeline, count_raw_points
+from team_code.stage_timer import STAGES, StageTimer
+from lavis.datasets.datasets.transforms_carla_factory import CarlaRgbDeviceTransform
+from timm.models import create_model, get_model_default_value
 
 try:
     import pygame
@@ -33,44 +35,11 @@ except ImportError:
 
 
 SAVE_PATH = os.environ.get("SAVE_PATH", 'eval')
+# log directory of the run for agent_replay.py
+RECORD_PATH = os.environ.get("RECORD_PATH", None)
 IMAGENET_DEFAULT_MEAN = (0.485, 0.456, 0.406)
 IMAGENET_DEFAULT_STD = (0.229, 0.224, 0.225)
 
-def rotate_lidar(lidar, angle):
-    radian = np.deg2rad(angle)
-    return lidar @ [
-        [ np.cos(radian), np.sin(radian), 0, 0],
-        [-np.sin(radian), np.cos(radian), 0, 0],
-        [0,0,1,0],
-        [0,0,0,1]
-    ]
-
-def lidar_to_raw_features(lidar):
-    def preprocess(lidar_xyzr, lidar_painted=None):
-
-        idx = (lidar_xyzr[:,0] > -1.2)&(lidar_xyzr[:,0] < 1.2)&(lidar_xyzr[:,1]>-1.2)&(lidar_xyzr[:,1]<1.2)
-
-        idx = np.argwhere(idx)
-
-        if lidar_painted is None:
-            return np.delete(lidar_xyzr, idx, axis=0)
-        else:
-            return np.delete(lidar_xyzr, idx, axis=0), np.delete(lidar_painted, idx, axis=0)
-
-    lidar_xyzr = preprocess(lidar)
-
-    idxs = np.arange(len(lidar_xyzr))
-    np.random.shuffle(idxs)
-    lidar_xyzr = lidar_xyzr[idxs]
-
-    lidar = np.zeros((40000, 4), dtype=np.float32)
-    num_points = min(40000, len(lidar_xyzr))
-    lidar[:num_points,:4] = lidar_xyzr
-    lidar[np.isinf(lidar)] = 0
-    lidar[np.isnan(lidar)] = 0
-    lidar = rotate_lidar(lidar, -90).astype(np.float32)
-    return lidar, num_points
-
 class DisplayInterface(object):
     def __init__(self):
         self._width = 1200
@@ -190,39 +159,67 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
         self.remaining_misleading_frames = 0
 
         self.visual_feature_buffer = []
+        self.num_history_frames = 0
 
         self.config = imp.load_source("MainModel", path_to_conf_file).GlobalConfig()
 
         self.turn_controller = PIDController(K_P=self.config.turn_KP, K_I=self.config.turn_KI, K_D=self.config.turn_KD, n=self.config.turn_n)
         self.speed_controller = PIDController(K_P=self.config.speed_KP, K_I=self.config.speed_KI, K_D=self.config.speed_KD, n=self.config.speed_n)
 
-        model_cls = registry.get_model_class('vicuna_drive')
-
         self.agent_use_notice = self.config.agent_use_notice
         self.traffic_light_notice = ''
         self.curr_notice = ''
         self.now_notice_frame_id = -1
         self.sample_rate = self.config.sample_rate * 2 # The frequency of CARLA simulation is 20Hz
-
-        print('build model...')
-        model = model_cls(encoder_model=self.config.encoder_model,
-                          encoder_model_ckpt=self.config.encoder_model_ckpt,
-                          llm_model=self.config.llm_model,
-                          max_txt_len=64,
-                          )
-        self.net = model
-
-        print('load model...')
-        self.net.load_state_dict(torch.load(self.config.bevdriver_ckpt)["model"], strict=False)
-        self.net.cuda()
-        self.net.eval()
+        # the notices are passed in the samples but not consumed by the model (neither forward nor stream_step
+        # insert them), so they do not change whether the KV cache can be used
+        self.use_kv_cache = self.config.use_kv_cache
+
+        if self.config.inference_server is not None:
+            # the model is owned by a shared inference_server.py process
+            self.net = None
+            self.client = InferenceClient(self.config.inference_server, self.use_kv_cache, self.sample_rate,
+                                          self.config.inference_server_authkey)
+            self.device = torch.device('cpu')
+        else:
+            self.client = None
+            self.net = build_model(self.config)
+            self.device = torch.device(self.config.device)
+            if self.net.use_extra_prompt:
+                self.use_kv_cache = False
+            self.net.to(self.device)
+            self.net.eval()
+        if self.config.device_preprocessing:
+            # uint8 views resized and normalized on self.device, the three side views as one batch
+            self.rgb_front_transform = CarlaRgbDeviceTransform(224)
+            self.rgb_left_transform = self.rgb_right_transform = CarlaRgbDeviceTransform(128)
+            self.rgb_center_transform = CarlaRgbDeviceTransform(128, need_scale=False)
+        # camera and LiDAR inputs of the model on a worker thread, only those the bev encoder reads
+        input_keys = get_model_default_value(self.config.encoder_model, 'input_keys') or ENCODER_KEYS
+        camera_transforms = {
+            'rgb': self.rgb_front_transform,
+            'rgb_left': self.rgb_left_transform,
+            'rgb_right': self.rgb_right_transform,
+            'rgb_rear': self.rgb_right_transform,
+            'rgb_center': self.rgb_center_transform,
+        }
+        self.sensor_pipeline = SensorPipeline(
+            {key: transform for key, transform in camera_transforms.items() if key in input_keys},
+            self.device, with_lidar='lidar' in input_keys,
+        )
         self.softmax = torch.nn.Softmax(dim=1)
-        self.prev_lidar = None
-        self._prev_lidar = None
+        self._prev_lidar_points = 0
         self.prev_control = None
         self.curr_instruction = 'Drive safely.'
         self.sampled_scenarios = None
         self.instruction = ''
+        # stage times on the GPU include the device work only when it is waited for at every stage
+        profiling = RECORD_PATH is not None or self.config.profile_stages
+        self.timer = StageTimer(STAGES, sync=torch.cuda.synchronize if profiling and self.device.type == 'cuda' else None)
+        self.recorder = None
+        if RECORD_PATH is not None:
+            from team_code.agent_replay import AgentRecorder
+            self.recorder = AgentRecorder(RECORD_PATH)
 
         self.save_path = None
         if SAVE_PATH is not None:
@@ -244,10 +241,17 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
     def _init(self):
         self._route_planner = RoutePlanner(5, 50.0)
         self._route_planner.set_route(self._global_plan, True)
-        self._instruction_planner = InstructionPlanner(self.scenario_cofing_name, True)
+        self._instruction_planner = self.create_instruction_planner()
+        if self.recorder is not None:
+            from team_code.agent_replay import RecordingInstructionPlanner
+            self.recorder.write_header(self.sensors(), self._global_plan, self.town_id, self.scenario_cofing_name)
+            self._instruction_planner = RecordingInstructionPlanner(self._instruction_planner, self.recorder)
         self.initialized = True
         random.seed(''.join([str(x[0]) for x in self._global_plan]))
 
+    def create_instruction_planner(self):
+        return InstructionPlanner(self.scenario_cofing_name, True)
+
     def _get_position(self, tick_data):
         gps = tick_data["gps"]
         gps = (gps - self._route_planner.mean) * self._route_planner.scale
@@ -342,16 +346,8 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
             {"type": "sensor.speedometer", "reading_frequency": 20, "id": "speed"},
         ]
 
-    def tick(self, input_data):
+    def tick(self, input_data, preprocess=False):
 
-        rgb_front = cv2.cvtColor(input_data["rgb_front"][1][:, :, :3], cv2.COLOR_BGR2RGB)
-        rgb_left = cv2.cvtColor(input_data["rgb_left"][1][:, :, :3], cv2.COLOR_BGR2RGB)
-        rgb_right = cv2.cvtColor(
-            input_data["rgb_right"][1][:, :, :3], cv2.COLOR_BGR2RGB
-        )
-        rgb_rear = cv2.cvtColor(
-            input_data["rgb_rear"][1][:, :, :3], cv2.COLOR_BGR2RGB
-        )
         gps = input_data["gps"][1][:2]
         speed = input_data["speed"][1]["speed"]
         compass = input_data["imu"][1][-1]
@@ -361,10 +357,6 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
             compass = 0.0
 
         result = {
-            "rgb_front": rgb_front,
-            "rgb_left": rgb_left,
-            "rgb_right": rgb_right,
-            'rgb_rear': rgb_rear,
             "gps": gps,
             "speed": speed,
             "compass": compass,
@@ -372,43 +364,14 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
 
         pos = self._get_position(result)
 
-        ###BEVDriver specific code
-        
-        _lidar_data = input_data['lidar'][1]
-        #result['raw_lidar'] = lidar_data
+        if preprocess:
+            # camera views and LiDAR histogram on the sensor pipeline's thread, collected in run_step
+            result['preprocessed'] = self.sensor_pipeline.submit(input_data, pos, compass)
 
-        _lidar_unprocessed = _lidar_data[..., :4]
-        if self._prev_lidar is not None:
-            _lidar_unprocessed_full = np.concatenate([_lidar_unprocessed, self._prev_lidar])
-        else:
-            _lidar_unprocessed_full = _lidar_unprocessed
-        self._prev_lidar = _lidar_unprocessed
-
-        _, num_points= lidar_to_raw_features(_lidar_unprocessed_full)
-        #result['lidar'] = lidar_processed
-        
-        
-        ###Interfusion specific code
-        lidar_data = input_data['lidar'][1]
-        result['raw_lidar'] = lidar_data
-
-        lidar_unprocessed = lidar_data[:, :3]
-        lidar_unprocessed[:, 1] *= -1
-        full_lidar = transform_2d_points(
-            lidar_unprocessed,
-            np.pi / 2 - compass,
-            -pos[0],
-            -pos[1],
-            np.pi / 2 - compass,
-            -pos[0],
-            -pos[1],
-        )
-        lidar_processed = lidar_to_histogram_features(full_lidar, crop=224)
-        if self.step % 2 == 0 or self.step < 4:
-            self.prev_lidar = lidar_processed
-        result["lidar"] = self.prev_lidar
-        
-        result['num_points'] = num_points
+        # raw LiDAR points of this and the previous frame outside the box around the sensor
+        lidar_points = count_raw_points(input_data['lidar'][1])
+        result['num_points'] = min(40000, lidar_points + self._prev_lidar_points)
+        self._prev_lidar_points = lidar_points
 
         result["gps"] = pos
         next_wp, next_cmd = self._route_planner.run_step(pos)
@@ -428,6 +391,14 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
         return result
 
 
+    def reset_history(self):
+        self.visual_feature_buffer = []
+        self.num_history_frames = 0
+        if self.client is not None:
+            self.client.reset()
+        else:
+            self.net.reset_stream()
+
     def update_and_collect(self, image_embeds):
         if 'lane' in self.curr_instruction: # change lane
             sample_rate = 1
@@ -440,14 +411,31 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
             result.append(self.visual_feature_buffer[-1])
         return torch.stack(result, 1)
 
+    def is_model_step(self, step):
+        # the model runs on the even steps from step 20
+        return step >= 20 and step % 2 == 0
+
     @torch.no_grad()
     def run_step(self, input_data, timestamp):
         if not self.initialized:
             self._init()
+        if self.recorder is not None:
+            # the camera images only on the steps they are used
+            self.recorder.record_inputs(self.step + 1, input_data, timestamp, cameras=self.is_model_step(self.step + 1))
+        self.timer.start()
+        control = self._run_step(input_data, timestamp)
+        # the stages and the total of the model steps, the other steps only tick and return
+        self.timer.stop(record=self.is_model_step(self.step))
+        if self.recorder is not None:
+            self.recorder.record_control(control)
+        return control
 
+    def _run_step(self, input_data, timestamp):
         self.step += 1
 
-        tick_data = self.tick(input_data)
+        # the sensors of the steps without the model are not preprocessed
+        tick_data = self.tick(input_data, preprocess=self.is_model_step(self.step))
+        self.timer.lap('tick')
 
         if self.step < 20:
             control = carla.VehicleControl()
@@ -462,37 +450,6 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
         velocity = tick_data["speed"]
         command = tick_data["next_command"]
 
-        rgb_front = (
-            self.rgb_front_transform(Image.fromarray(tick_data["rgb_front"]))
-            .unsqueeze(0)
-            .cuda()
-            .float()
-        )
-        rgb_left = (
-            self.rgb_left_transform(Image.fromarray(tick_data["rgb_left"]))
-            .unsqueeze(0)
-            .cuda()
-            .float()
-        )
-        rgb_right = (
-            self.rgb_right_transform(Image.fromarray(tick_data["rgb_right"]))
-            .unsqueeze(0)
-            .cuda()
-            .float()
-        )
-        rgb_rear = (
-            self.rgb_right_transform(Image.fromarray(tick_data["rgb_rear"]))
-            .unsqueeze(0)
-            .cuda()
-            .float()
-        )
-        rgb_center = (
-            self.rgb_center_transform(Image.fromarray(cv2.resize(tick_data["rgb_front"], (800, 600))))
-            .unsqueeze(0)
-            .cuda()
-            .float()
-        )
-
         last_instruction = self._instruction_planner.command2instruct(self.town_id, tick_data, self._route_planner.route)
         last_notice = self._instruction_planner.pos2notice(self.sampled_scenarios, tick_data)
         last_traffic_light_notice = self._instruction_planner.traffic_notice(tick_data)
@@ -501,7 +458,7 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
         if last_notice == '':
             last_notice = last_traffic_light_notice
 
-        if self.curr_instruction != last_instruction or len(self.visual_feature_buffer) > 400:
+        if self.curr_instruction != last_instruction or self.num_history_frames > 400:
             if self.remaining_misleading_frames > 0:
                 self.remaining_misleading_frames = self.remaining_misleading_frames - 1
             else:
@@ -512,52 +469,53 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
                     self.remaining_misleading_frames = 20
                 else:
                     self.curr_instruction = last_instruction
-                self.visual_feature_buffer = []
+                self.reset_history()
                 self.curr_notice = ''
                 self.curr_notice_frame_id = -1
+        self.timer.lap('planner')
 
         logging.info(f"tick data: {tick_data.keys()}")
     
-        input_data = {}
-        input_data["rgb"] = rgb_front
-        input_data["rgb_left"] = rgb_left
-        input_data["rgb_right"] = rgb_right
-        input_data["rgb_center"] = rgb_center
-        input_data["rgb_rear"] = rgb_rear
+        views, inputs = self.sensor_pipeline.result(tick_data['preprocessed'])
+        tick_data.update(views)
+
+        input_data = dict(inputs)
         input_data["measurements"] = tick_data["measurements"]
         
-        input_data['target_point'] = torch.tensor(tick_data['target_point']).cuda().view(1,2).float()
-
-        input_data["lidar"] = (
-            torch.from_numpy(tick_data["lidar"]).float().cuda().unsqueeze(0)
-        )
-
-        ###My Transformations so that the model can accept the input with BEVDriver Agent
-        '''
-        lidar_data = torch.from_numpy(tick_data["lidar"]).float()
-
+        input_data['target_point'] = torch.tensor(tick_data['target_point']).to(self.device).view(1,2).float()
 
-        
-        # First reshape to [40000, 4]
-        lidar_data = lidar_data.view(40000, 4)
-        # Add batch and channel dims
-        lidar_data = lidar_data.unsqueeze(0)  # [1, 40000, 4]
-        # Now expand to 3 channels
-        lidar_data = lidar_data.unsqueeze(1)  # [1, 1, 40000, 4]
-        lidar_data = lidar_data.expand(1, 3, 40000, 4)  # [1, 3, 40000, 4]
-        input_data["lidar"] = lidar_data.cuda()
-        '''
-        input_data['num_points'] = torch.tensor([tick_data['num_points']]).cuda().unsqueeze(0)
-        input_data['velocity'] = torch.tensor([tick_data['speed']]).cuda().view(1, 1).float()
+        input_data['num_points'] = torch.tensor([tick_data['num_points']]).to(self.device).unsqueeze(0)
+        input_data['velocity'] = torch.tensor([tick_data['speed']]).to(self.device).view(1, 1).float()
         input_data['text_input'] = [self.curr_instruction]
-        image_embeds = self.net.visual_encoder(input_data)
-        image_embeds = self.update_and_collect(image_embeds)
-        input_data['valid_frames'] = [image_embeds.size(1)]
+        self.timer.lap('preprocessing')
+        if self.client is None:
+            with torch.cuda.amp.autocast(enabled=True):
+                image_embeds = self.net.bev_encoder(input_data)
+            self.timer.lap('encoder')
+
+        commit = True
+        if self.use_kv_cache:
+            # only frames on the sampling grid stay in the cached history, the newest frame
+            # is appended temporarily, matching update_and_collect
+            commit = self.num_history_frames % self.sample_rate == 0
+            self.num_history_frames += 1
+            num_frames = (self.num_history_frames - 1) // self.sample_rate + 1 + (0 if commit else 1)
+        elif self.client is None:
+            image_embeds = self.update_and_collect(image_embeds)
+            self.num_history_frames = len(self.visual_feature_buffer)
+            num_frames = image_embeds.size(1)
+        else:
+            # the server keeps the frame buffer, count the frames update_and_collect returns
+            self.num_history_frames += 1
+            num_frames = (self.num_history_frames - 1) // self.sample_rate + 1
+            if (self.num_history_frames - 1) % self.sample_rate != 0:
+                num_frames += 1
+        input_data['valid_frames'] = [num_frames]
 
         if last_notice != '' and last_notice != self.curr_notice:
             new_notice_flag = True
             self.curr_notice = last_notice
-            self.curr_notice_frame_id = image_embeds.size(1) - 1
+            self.curr_notice_frame_id = num_frames - 1
         else:
             new_notice_flag = False
 
@@ -565,17 +523,24 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
             input_data['notice_text'] = [self.curr_notice]
             input_data['notice_frame_id'] = [self.curr_notice_frame_id]
 
-        with torch.cuda.amp.autocast(enabled=True):
-            waypoints, is_end = self.net(input_data, inference_mode=True, image_embeds=image_embeds)
+        if self.client is not None:
+            waypoints, is_end = self.client.step(input_data, commit=commit)
+        else:
+            with torch.cuda.amp.autocast(enabled=True):
+                if self.use_kv_cache:
+                    waypoints, is_end = self.net.stream_step(input_data, image_embeds, commit=commit)
+                else:
+                    waypoints, is_end = self.net(input_data, inference_mode=True, input_embeds=image_embeds)
 
         waypoints = waypoints[-1]
         waypoints = waypoints.view(5, 2)
         end_prob = self.softmax(is_end)[-1][1] # is_end[1] means the prob of the frame is the last frame
+        self.timer.lap('llm')
 
         steer, throttle, brake, metadata = self.control_pid(waypoints, velocity)
 
         if end_prob > 0.75:
-            self.visual_feature_buffer = []
+            self.reset_history()
             self.curr_notice = ''
             self.curr_notice_frame_id = -1
 
@@ -588,6 +553,7 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
         control.steer = float(steer) * 0.8
         control.throttle = float(throttle)
         control.brake = float(brake)
+        self.timer.lap('pid')
 
         display_data = {}
         display_data['rgb'] = cv2.resize(tick_data['rgb_front'], (1200, 900))
@@ -598,7 +564,7 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
             display_data['instruction'] = "Instruction: [Misleading] %s" % input_data['text_input'][0]
         else:
             display_data['instruction'] = "Instruction: %s" % input_data['text_input'][0]
-        display_data['time'] = 'Time: %.3f. Frames: %d. End prob: %.2f' % (timestamp, len(self.visual_feature_buffer), end_prob)
+        display_data['time'] = 'Time: %.3f. Frames: %d. End prob: %.2f' % (timestamp, self.num_history_frames, end_prob)
         display_data['meta_control'] = 'Throttle: %.2f. Steer: %.2f. Brake: %.2f' %(
             control.steer, control.throttle, control.brake
         )
@@ -606,6 +572,7 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
         display_data['notice'] = "Notice: %s" % last_notice
         surface = self._hic.run_interface(display_data)
         tick_data['surface'] = surface
+        self.timer.lap('display')
 
         if self.step % 2 != 0 and self.step > 4:
             control = self.prev_control
@@ -614,6 +581,7 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
 
         if SAVE_PATH is not None:
             self.save(tick_data)
+            self.timer.lap('save')
 
         return control
 
@@ -625,6 +593,13 @@ class BEVDriverAgent(autonomous_agent.AutonomousAgent):
         return
 
     def destroy(self):
+        logging.info("sensor preprocessing: %s" % self.sensor_pipeline.summary())
+        logging.info("run_step stages:\n%s" % self.timer.summary())
+        if self.recorder is not None:
+            self.recorder.close()
+        self.sensor_pipeline.close()
+        if self.client is not None:
+            self.client.close()
         del self.net
 
     def control_pid(self, waypoints, velocity):
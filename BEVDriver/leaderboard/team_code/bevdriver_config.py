@@ -24,9 +24,17 @@ class GlobalConfig:
     encoder_model = 'bevdriver_encoder' # architecture of the encoder model
     encoder_model_ckpt = '/path/to/last.pth.tar' # encoder model checkpoint
     bevdriver_ckpt = 'path/to/checkpoint_best.pth' # model checkpoint
+    deploy_model = None # single-file model of export_deploy_model.py, replaces llm_model, encoder_model_ckpt and bevdriver_ckpt
+    quantize_llm = None # 'int8' or 'int4': weight-only quantization of the LLM's linear layers (lavis/models/drive_models/quantize.py)
 
     agent_use_notice = False
     sample_rate = 2
+    use_kv_cache = True # reuse the LLM key/value cache across steps instead of re-running the whole frame history
+    device_preprocessing = False # resize and normalize the camera images on the model's device (CarlaRgbDeviceTransform) instead of with PIL
+    device = 'cuda' # device of the model loaded in the agent
+    inference_server = None # unix socket of a running inference_server.py to share one model between agents, None loads the model in the agent
+    inference_server_authkey = None # key of the inference server connections, None for $BEVDRIVER_INFERENCE_AUTHKEY or the key file the server writes next to its socket
+    profile_stages = False # wait for the GPU at every stage of run_step, for the stage times of the log (always with RECORD_PATH)
 
 
     def __init__(self, **kwargs):
@@ -0,0 +1,42 @@
+import imp
+import time
+import argparse
+
+from lavis.models.drive_models.deploy import export_deploy_model
+from team_code.inference_server import build_model
+
+'''
+Export the model of an agent config as one safetensors file for fast agent startup, see
+LAVIS/lavis/models/drive_models/deploy.py. The LoRA deltas are merged into the LLM weights.
+
+python leaderboard/team_code/export_deploy_model.py --config leaderboard/team_code/bevdriver_config.py --output bevdriver.safetensors
+
+and set deploy_model = 'bevdriver.safetensors' in the config of the agents (or of inference_server.py).
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="leaderboard/team_code/bevdriver_config.py")
+    parser.add_argument("--output", required=True, help="path of the .safetensors file")
+    args = parser.parse_args()
+
+    config = imp.load_source("MainModel", args.config).GlobalConfig()
+    # always from the original checkpoints
+    config.deploy_model = None
+    # the file keeps the floating point weights, quantize_llm is applied when it is loaded
+    config.quantize_llm = None
+    start = time.time()
+    net = build_model(config)
+    net.eval()
+    print('built in %.1f s, export...' % (time.time() - start))
+    manifest = export_deploy_model(net, args.output, config.encoder_model, source={
+        'llm_model': config.llm_model,
+        'encoder_model_ckpt': config.encoder_model_ckpt,
+        'bevdriver_ckpt': config.bevdriver_ckpt,
+    })
+    print('wrote %s (%s, LoRA %s)' % (args.output, manifest['llm_class'], manifest['lora']))
+
+
+if __name__ == "__main__":
+    main()
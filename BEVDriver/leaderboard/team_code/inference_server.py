@@ -0,0 +1,332 @@
+import os
+import imp
+import time
+import queue
+import argparse
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+import torch
+
+from lavis.common.registry import registry
+from lavis.models.drive_models.deploy import load_deploy_model
+from lavis.models.drive_models.quantize import quantize_llm
+
+'''
+Local inference server for BEVDriverAgent. One process owns the Blip2VicunaDrive model and serves the
+agents of several leaderboard processes (one route each): step requests arriving within max_wait of
+each other are run as one batch through the bev encoder and the LLM.
+
+python leaderboard/team_code/inference_server.py --config leaderboard/team_code/bevdriver_config.py --address /tmp/bevdriver.sock
+
+and set inference_server = '/tmp/bevdriver.sock' in the config of the agents, they then connect to the
+server instead of loading the model.
+
+The server unpickles what it receives, so only its user may connect: the socket is created readable by its
+owner only and connections authenticate with a key, inference_server_authkey of the config or
+$BEVDRIVER_INFERENCE_AUTHKEY if set, else a random one the server writes to <address>.key (mode 0600) for the
+agents of the same user to read.
+'''
+
+# inputs of the bev encoder sent by the agents, [1, ...] each, those the encoder does not read may be left out
+ENCODER_KEYS = ['rgb', 'rgb_left', 'rgb_right', 'rgb_center', 'rgb_rear', 'lidar', 'measurements',
+                'target_point', 'num_points', 'velocity']
+
+AUTHKEY_ENV = 'BEVDRIVER_INFERENCE_AUTHKEY'
+
+
+def authkey_path(address):
+    return address + '.key'
+
+
+def load_authkey(address, authkey=None):
+    """ the key of the server at address: authkey, $BEVDRIVER_INFERENCE_AUTHKEY or the key file of the server"""
+    if authkey is None:
+        authkey = os.environ.get(AUTHKEY_ENV)
+    if authkey is None:
+        if not isinstance(address, str):
+            raise ValueError('no authkey for the inference server at %r' % (address,))
+        with open(authkey_path(address), 'rb') as f:
+            return f.read()
+    return authkey.encode() if isinstance(authkey, str) else authkey
+
+
+def build_model(config):
+    if config.deploy_model is not None:
+        # single file written by export_deploy_model.py, the LoRA deltas merged into the LLM
+        print('load deploy model...')
+        model = load_deploy_model(config.deploy_model)
+    else:
+        model_cls = registry.get_model_class('vicuna_drive')
+        print('build model...')
+        model = model_cls(encoder_model=config.encoder_model,
+                          encoder_model_ckpt=config.encoder_model_ckpt,
+                          llm_model=config.llm_model,
+                          max_txt_len=64,
+                          )
+        print('load model...')
+        model.load_state_dict(torch.load(config.bevdriver_ckpt)["model"], strict=False)
+    if config.quantize_llm is not None:
+        # on the CPU, before the model is moved to its device
+        summary = quantize_llm(model, config.quantize_llm)
+        print('quantized %(layers)d LLM layers to %(format)s: %(llm_bytes)d -> %(quantized_llm_bytes)d bytes' % summary)
+    return model
+
+
+class DriveSession():
+    """ Frame history of one agent, kept on the server between its steps"""
+    def __init__(self, use_kv_cache=True, sample_rate=4):
+        self.use_kv_cache = use_kv_cache
+        self.sample_rate = sample_rate
+        self.reset()
+
+    def reset(self):
+        self.visual_feature_buffer = []
+        self.stream_cache = None
+
+    def update_and_collect(self, image_embeds):
+        # BEVDriverAgent.update_and_collect
+        self.visual_feature_buffer.append(image_embeds)
+        result = self.visual_feature_buffer[::self.sample_rate]
+        if (len(self.visual_feature_buffer) - 1) % self.sample_rate != 0:
+            result.append(self.visual_feature_buffer[-1])
+        return torch.stack(result, 1)
+
+
+class InferenceServer():
+    """
+    Batches the steps of the connected agents. Every connection gets a DriveSession and a thread that
+    queues its requests; the batch loop takes up to max_batch queued steps, waiting at most max_wait
+    seconds after the first one, and answers each with the waypoints [1, 10] and end logits [1, 2] of
+    its newest frame (what `Blip2VicunaDrive.stream_step` or `forward(inference_mode=True)` return
+    for the agent alone).
+    """
+    def __init__(self, net, max_batch=8, max_wait=0.005):
+        self.net = net
+        self.device = next(net.parameters()).device
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.listener = None
+        self.authkey = None
+        self.batch_sizes = []
+
+    def start(self, address, authkey=None):
+        """
+        Listens on address, a unix socket path, with authkey, $BEVDRIVER_INFERENCE_AUTHKEY or a random key
+        written to authkey_path(address).
+        """
+        if authkey is None:
+            authkey = os.environ.get(AUTHKEY_ENV)
+        if authkey is None and isinstance(address, str):
+            self.authkey = os.urandom(32)
+            key_file = authkey_path(address)
+            if os.path.exists(key_file):
+                os.unlink(key_file)
+            with os.fdopen(os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+                f.write(self.authkey)
+        else:
+            self.authkey = load_authkey(address, authkey)
+        if isinstance(address, str) and os.path.exists(address):
+            os.unlink(address)
+        # the socket is created readable and writable by its owner only
+        umask = os.umask(0o177)
+        try:
+            self.listener = Listener(address, authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        self.threads = [
+            threading.Thread(target=self._accept_loop, daemon=True),
+            threading.Thread(target=self._batch_loop, daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+        return self.listener.address
+
+    def serve_forever(self, address, authkey=None):
+        self.start(address, authkey)
+        print('serving on', self.listener.address)
+        self.threads[1].join()
+
+    def close(self):
+        self.requests.put(None)
+        if self.listener is not None:
+            self.listener.close()
+        self.threads[1].join()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (AuthenticationError, EOFError):
+                # a connection without the key, or closed during the handshake
+                continue
+            except OSError: # listener closed
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        session = DriveSession()
+        reply = queue.Queue(maxsize=1)
+        with conn:
+            while True:
+                try:
+                    op, *args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if op == 'hello':
+                    session = DriveSession(**args[0])
+                    # stream_step_batch does not wrap the frames in the extra prompt
+                    session.use_kv_cache = session.use_kv_cache and not self.net.use_extra_prompt
+                    conn.send(True)
+                elif op == 'reset':
+                    session.reset()
+                    conn.send(True)
+                elif op == 'step':
+                    # agents wait for their answer, so a session is never twice in the queue
+                    self.requests.put((session, args[0], args[1], reply))
+                    conn.send(reply.get())
+                else:
+                    conn.send(ValueError("unknown request %r" % op))
+
+    def _batch_loop(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.requests.put(None)
+                    break
+                batch.append(request)
+
+            try:
+                results = self.run_batch([(session, inputs, commit) for session, inputs, commit, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            self.batch_sizes.append(len(batch))
+            for (_, _, _, reply), result in zip(batch, results):
+                reply.put(result)
+
+    def collate(self, inputs):
+        samples = {key: torch.cat([torch.from_numpy(x[key]) for x in inputs]).to(self.device)
+                   for key in ENCODER_KEYS if key in inputs[0]}
+        samples['text_input'] = [text for x in inputs for text in x['text_input']]
+        return samples
+
+    @torch.no_grad()
+    def run_batch(self, steps):
+        """
+        Args:
+            steps (list): (session, inputs, commit) per agent, inputs holds the ENCODER_KEYS arrays and
+                text_input of one frame as sent by InferenceClient.step.
+
+        Returns:
+            (waypoints, end_prob) numpy arrays per agent.
+        """
+        samples = self.collate([inputs for _, inputs, _ in steps])
+        autocast = torch.autocast(self.device.type, enabled=self.device.type == 'cuda')
+        with autocast:
+            image_embeds = self.net.bev_encoder(samples)
+        text_input = samples['text_input']
+        results = [None] * len(steps)
+
+        kv = [i for i, (session, _, _) in enumerate(steps) if session.use_kv_cache]
+        if kv:
+            with autocast:
+                waypoints, end_prob, caches = self.net.stream_step_batch(
+                    [steps[i][0].stream_cache for i in kv],
+                    [text_input[i] for i in kv],
+                    image_embeds[kv],
+                    [steps[i][2] for i in kv],
+                )
+            for j, i in enumerate(kv):
+                steps[i][0].stream_cache = caches[j]
+                results[i] = (waypoints[j:j+1], end_prob[j:j+1])
+
+        history = [i for i, (session, _, _) in enumerate(steps) if not session.use_kv_cache]
+        if history:
+            # frame histories padded to the longest one, forward masks the frames past valid_frames
+            frames = [steps[i][0].update_and_collect(image_embeds[i:i+1]) for i in history]
+            valid_frames = [x.size(1) for x in frames]
+            t = max(valid_frames)
+            input_embeds = torch.cat([torch.nn.functional.pad(x, (0, 0, 0, 0, 0, t - x.size(1))) for x in frames])
+            samples = {
+                'text_input': [text_input[i] for i in history],
+                'valid_frames': valid_frames,
+                'target_point': torch.zeros(len(history), t, 2, device=self.device),
+            }
+            with autocast:
+                waypoints, end_prob = self.net(samples, inference_mode=True, input_embeds=input_embeds)
+            last = np.cumsum(valid_frames) - 1
+            for j, i in enumerate(history):
+                results[i] = (waypoints[last[j]:last[j]+1], end_prob[last[j]:last[j]+1])
+
+        return [(w.float().cpu().numpy(), e.float().cpu().numpy()) for w, e in results]
+
+
+class InferenceClient():
+    """
+    Connection of one agent to an InferenceServer, with the same step/reset as the local model. authkey None
+    reads $BEVDRIVER_INFERENCE_AUTHKEY or the key file of the server.
+    """
+    def __init__(self, address, use_kv_cache=True, sample_rate=4, authkey=None):
+        self.conn = Client(address, authkey=load_authkey(address, authkey))
+        self._call('hello', {'use_kv_cache': use_kv_cache, 'sample_rate': sample_rate})
+
+    def _call(self, *request):
+        self.conn.send(request)
+        result = self.conn.recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def step(self, input_data, commit=True):
+        """ waypoints [1, 10] and end logits [1, 2] of the frame in input_data (the agent's model inputs)"""
+        inputs = {}
+        for key in ENCODER_KEYS:
+            if key not in input_data:
+                continue
+            value = input_data[key]
+            if torch.is_tensor(value):
+                inputs[key] = value.detach().float().cpu().numpy()
+            else:
+                inputs[key] = np.asarray(value, dtype=np.float32).reshape(1, -1)
+        inputs['text_input'] = list(input_data['text_input'])
+        waypoints, end_prob = self._call('step', inputs, commit)
+        return torch.from_numpy(waypoints), torch.from_numpy(end_prob)
+
+    def reset(self):
+        """ Start a new frame history, as reset_stream of the model"""
+        self._call('reset')
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="leaderboard/team_code/bevdriver_config.py")
+    parser.add_argument("--address", default="/tmp/bevdriver_inference.sock", help="unix socket path")
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    config = imp.load_source("MainModel", args.config).GlobalConfig()
+    net = build_model(config)
+    net.to(torch.device(config.device))
+    net.eval()
+    server = InferenceServer(net, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000)
+    server.serve_forever(args.address, config.inference_server_authkey)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from team_code.utils import lidar_to_histogram_features, transform_2d_points
+
+'''
+Model inputs of BEVDriverAgent from the raw sensor data of one frame.
+
+SensorPipeline runs on a worker thread: the agent submits a frame as soon as it has the pose of the
+frame and does its route and instruction planning while the camera views are converted, resized and
+normalized and the LiDAR histogram is built. The tensors are written to preallocated (pinned, when the
+model is on the GPU) buffers and copied to the device without blocking. A caller that has the next
+frame before the model call of the current one (e.g. a replay of recorded sensors) can submit it
+right away, its preprocessing then overlaps with the model call.
+
+Only the inputs the bev encoder reads are computed, and only on the steps the model runs.
+'''
+
+# sensor of every camera input of the model, rgb_center is cropped from the front camera
+CAMERA_SENSORS = {'rgb': 'rgb_front', 'rgb_left': 'rgb_left', 'rgb_right': 'rgb_right',
+                  'rgb_rear': 'rgb_rear', 'rgb_center': 'rgb_front'}
+# shown by the agent's display on every model step
+DISPLAY_SENSORS = ['rgb_front', 'rgb_left', 'rgb_right']
+STAGES = ['convert', 'cameras', 'lidar', 'copy', 'wait']
+
+
+def count_raw_points(lidar):
+    """ number of points of a raw LiDAR frame outside the 1.2 m box around the sensor, which the agent reports as num_points"""
+    x, y = lidar[:, 0], lidar[:, 1]
+    inside = (x > -1.2) & (x < 1.2) & (y > -1.2) & (y < 1.2)
+    return len(lidar) - int(np.count_nonzero(inside))
+
+
+def rgb_view(image):
+    """ RGB array of a camera image (BGRA from CARLA), converted as a whole since slicing off alpha first copies it"""
+    return cv2.cvtColor(image, cv2.COLOR_BGRA2RGB if image.shape[2] == 4 else cv2.COLOR_BGR2RGB)
+
+
+def center_view(rgb_front, size=(800, 600), crop=128):
+    """
+    The crop x crop center of rgb_front resized to size (cv2, bilinear). When the crop maps to whole
+    pixels of rgb_front (1200x900 to 800x600), only that region is resized, with the same result.
+    """
+    height, width = rgb_front.shape[:2]
+    top, left = int(round((size[1] - crop) / 2.0)), int(round((size[0] - crop) / 2.0))
+    box = np.array([left * width / size[0], top * height / size[1], crop * width / size[0], crop * height / size[1]])
+    if np.array_equal(box, np.round(box)):
+        x, y, w, h = box.astype(int)
+        return cv2.resize(rgb_front[y:y + h, x:x + w], (crop, crop))
+    return cv2.resize(rgb_front, size)[top:top + crop, left:left + crop]
+
+
+def lidar_histogram(lidar_data, pos, compass):
+    """ BEV histogram [3, 224, 224] of a raw LiDAR frame (x, y, z, intensity), the y axis flipped"""
+    lidar = lidar_data[:, :3] * np.array([1, -1, 1], dtype=lidar_data.dtype)
+    full_lidar = transform_2d_points(
+        lidar,
+        np.pi / 2 - compass,
+        -pos[0],
+        -pos[1],
+        np.pi / 2 - compass,
+        -pos[0],
+        -pos[1],
+    )
+    return lidar_to_histogram_features(full_lidar, crop=224)
+
+
+class SensorPipeline(object):
+    def __init__(self, transforms, device, with_lidar=True, num_buffers=2):
+        """
+        Args:
+            transforms (dict): camera input key (CAMERA_SENSORS) -> transform of its RGB view,
+                create_carla_rgb_transform or CarlaRgbDeviceTransform. Only these camera inputs are
+                computed, the views of keys sharing a CarlaRgbDeviceTransform are resized as one batch.
+            device (torch.device): device of the model inputs.
+            with_lidar (bool): compute the LiDAR histogram input.
+            num_buffers (int): sets of host buffers used in turn, the inputs of a frame alias its buffers
+                on the CPU and stay valid until num_buffers more frames are processed.
+        """
+        self.device = torch.device(device)
+        self.pin_memory = self.device.type == 'cuda'
+        self.with_lidar = with_lidar
+        self.sensors = sorted(set(DISPLAY_SENSORS) | {CAMERA_SENSORS[key] for key in transforms})
+        # keys of every transform, in the order of transforms
+        self.groups = []
+        for key, transform in transforms.items():
+            group = next((keys for t, keys in self.groups if t is transform), None)
+            if group is None:
+                self.groups.append((transform, [key]))
+            else:
+                group.append(key)
+        self._buffers = [{} for _ in range(num_buffers)]
+        self._copied = [None] * num_buffers
+        self._frame = 0
+        self.timings = {stage: [0, 0.0] for stage in STAGES}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sensor_pipeline')
+
+    def _time(self, stage, start):
+        timing = self.timings[stage]
+        timing[0] += 1
+        timing[1] += time.perf_counter() - start
+
+    def _buffer(self, buffers, name, shape, dtype):
+        buffer = buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = buffers[name] = torch.empty(shape, dtype=dtype, pin_memory=self.pin_memory)
+        return buffer
+
+    def __call__(self, input_data, pos, compass):
+        """
+        Args:
+            input_data (dict): sensor id -> (frame, data), as passed to the agent's run_step.
+            pos (np.array): position of the frame in meters, BEVDriverAgent._get_position.
+            compass (float): heading of the frame.
+
+        Returns:
+            views (dict): RGB arrays [H, W, 3] of the cameras (sensor id), for the display.
+            inputs (dict): camera and lidar inputs of the model, [1, ...] tensors on the device.
+        """
+        index = self._frame % len(self._buffers)
+        self._frame += 1
+        buffers = self._buffers[index]
+        if self._copied[index] is not None:
+            # the previous copy from these buffers has to be done before they are overwritten
+            self._copied[index].synchronize()
+
+        start = time.perf_counter()
+        views = {sensor: rgb_view(input_data[sensor][1]) for sensor in self.sensors}
+        self._time('convert', start)
+
+        start = time.perf_counter()
+        hosts = []
+        for i, (transform, keys) in enumerate(self.groups):
+            images = []
+            for key in keys:
+                view = views[CAMERA_SENSORS[key]]
+                if key == 'rgb_center':
+                    view = center_view(view)
+                images.append(transform(Image.fromarray(view)))
+            buffer = self._buffer(buffers, i, (len(images),) + tuple(images[0].shape), images[0].dtype)
+            for image, host in zip(images, buffer):
+                host.copy_(image)
+            hosts.append(buffer)
+        self._time('cameras', start)
+
+        if self.with_lidar:
+            start = time.perf_counter()
+            lidar = lidar_histogram(input_data['lidar'][1], pos, compass)
+            buffer = self._buffer(buffers, 'lidar', (1,) + lidar.shape, torch.float32)
+            buffer.numpy()[0] = lidar
+            self._time('lidar', start)
+
+        start = time.perf_counter()
+        inputs = {}
+        for (transform, keys), host in zip(self.groups, hosts):
+            images = host.to(self.device, non_blocking=self.pin_memory)
+            if hasattr(transform, 'batch'):
+                images = transform.batch(images)
+            for i, key in enumerate(keys):
+                inputs[key] = images[i:i + 1].float()
+        if self.with_lidar:
+            inputs['lidar'] = buffers['lidar'].to(self.device, non_blocking=self.pin_memory)
+        if self.pin_memory:
+            self._copied[index] = torch.cuda.Event()
+            self._copied[index].record()
+        self._time('copy', start)
+        return views, inputs
+
+    def submit(self, input_data, pos, compass):
+        """ starts the preprocessing of a frame on the worker thread, returns a future of __call__'s result"""
+        return self._executor.submit(self, input_data, pos, compass)
+
+    def result(self, future):
+        start = time.perf_counter()
+        result = future.result()
+        self._time('wait', start)
+        return result
+
+    def summary(self):
+        """ average milliseconds per call of every stage"""
+        return ', '.join('%s %.1f ms' % (stage, 1000 * seconds / max(calls, 1))
+                         for stage, (calls, seconds) in self.timings.items())
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,59 @@
+import time
+
+import numpy as np
+
+# the stages of BEVDriverAgent.run_step
+STAGES = ['tick', 'planner', 'preprocessing', 'encoder', 'llm', 'pid', 'display', 'save']
+
+
+class StageTimer(object):
+    """
+    Wall time of the stages of a step. start() begins a step, lap(stage) ends the stage running since
+    the previous lap, stop() ends the step. The laps and the total of a step are kept together, only for the
+    steps stop() records, so the stages add up to the total of the same steps. With sync (e.g. torch.cuda.synchronize) the queued device
+    work is waited for at every lap, so it is timed in the stage that launched it.
+    """
+    def __init__(self, stages=STAGES, sync=None):
+        self.stages = list(stages)
+        self.sync = sync
+        self.samples = {stage: [] for stage in self.stages + ['total']}
+        self._start = self._last = None
+        self._laps = []
+
+    def _now(self):
+        if self.sync is not None:
+            self.sync()
+        return time.perf_counter()
+
+    def start(self):
+        self._start = self._last = self._now()
+        self._laps = []
+
+    def lap(self, stage):
+        now = self._now()
+        self._laps.append((stage, now - self._last))
+        self._last = now
+
+    def stop(self, record=True):
+        """ ends the step, its stage and total times are kept if record"""
+        if record:
+            for stage, seconds in self._laps:
+                self.samples[stage].append(seconds)
+            self.samples['total'].append(self._now() - self._start)
+        self._laps = []
+
+    def percentiles(self, stage):
+        """ (steps, mean, p50, p95, p99) in ms of a stage, None if it never ran"""
+        samples = np.array(self.samples[stage]) * 1000
+        if len(samples) == 0:
+            return None
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        return len(samples), samples.mean(), p50, p95, p99
+
+    def summary(self):
+        lines = []
+        for stage in self.stages + ['total']:
+            values = self.percentiles(stage)
+            if values is not None:
+                lines.append('%-14s %5d steps  mean %8.2f  p50 %8.2f  p95 %8.2f  p99 %8.2f ms' % ((stage,) + values))
+        return '\n'.join(lines)
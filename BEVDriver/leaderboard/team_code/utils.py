@@ -2,55 +2,7 @@ import os
 import re
 import numpy as np
 
-
-def lidar_to_histogram_features(lidar, crop=256):
-    """
-    Convert LiDAR point cloud into 2-bin histogram over 256x256 grid
-    """
-    def splat_points(point_cloud):
-        # 256 x 256 grid
-        pixels_per_meter = 8
-        hist_max_per_pixel = 5
-        x_meters_max = 14
-        y_meters_max = 28
-        xbins = np.linspace(-2*x_meters_max, 2*x_meters_max+1, 2*x_meters_max*pixels_per_meter+1)
-        ybins = np.linspace(-y_meters_max, 0, y_meters_max*pixels_per_meter+1)
-        hist = np.histogramdd(point_cloud[...,:2], bins=(xbins, ybins))[0]
-        hist[hist>hist_max_per_pixel] = hist_max_per_pixel
-        overhead_splat = hist/hist_max_per_pixel
-        return overhead_splat
-
-    below = lidar[lidar[...,2]<=-2.0]
-    above = lidar[lidar[...,2]>-2.0]
-    below_features = splat_points(below)
-    above_features = splat_points(above)
-    total_features = below_features + above_features
-    features = np.stack([below_features, above_features, total_features], axis=-1)
-    features = np.transpose(features, (2, 0, 1)).astype(np.float32)
-    return features
-
-def transform_2d_points(xyz, r1, t1_x, t1_y, r2, t2_x, t2_y):
-    """
-    Build a rotation matrix and take the dot product.
-    """
-    # z value to 1 for rotation
-    xy1 = xyz.copy()
-    xy1[:,2] = 1
-
-    c, s = np.cos(r1), np.sin(r1)
-    r1_to_world = np.matrix([[c, s, t1_x], [-s, c, t1_y], [0, 0, 1]])
-
-    # np.dot converts to a matrix, so we explicitly change it back to an array
-    world = np.asarray(r1_to_world @ xy1.T)
-
-    c, s = np.cos(r2), np.sin(r2)
-    r2_to_world = np.matrix([[c, s, t2_x], [-s, c, t2_y], [0, 0, 1]])
-    world_to_r2 = np.linalg.inv(r2_to_world)
-
-    out = np.asarray(world_to_r2 @ world).T
-    # reset z-coordinate
-    out[:,2] = xyz[:,2]
-
-    return out
+# shared with the training datasets
+from timm.data.lidar_bev import lidar_to_histogram_features, transform_2d_points
 
 
@@ -51,7 +51,7 @@ class MetricsManager(object):
         town_map = world.get_map()
 
         # Instanciate the MetricsLog, used to querry the needed information
-        log = MetricsLog(recorder_str)
+        log = MetricsLog(recorder_str, self._args.cache or None)
 
         # Read and run the metric class
         metric_class = self._get_metric_class(self._args.metric)
@@ -144,6 +144,8 @@ def main():
                         help='Path to the .py file defining the used metric.\nSome examples at srunner/metrics')
     parser.add_argument('--criteria', default="",
                         help='Path to the .json file with the criteria information.\nThis file is created by the record functionality at ScenarioRunner')
+    parser.add_argument('--cache', default="",
+                        help='Folder where the parsed recorder is kept, to not parse it again when running other metrics on it')
     # pylint: enable=line-too-long
 
     args = parser.parse_args()
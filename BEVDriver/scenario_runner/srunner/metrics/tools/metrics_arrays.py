@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Support class of the MetricsLog to parse the information of the CARLA
+recorder line by line into per actor NumPy arrays, with an index from
+the frames to the rows of the arrays and an on-disk cache.
+"""
+
+import io
+import os
+import pickle
+import hashlib
+from array import array
+from bisect import bisect_right
+
+import numpy as np
+
+ARRAYS_VERSION = 1
+
+# the columns of the numeric states of the actors
+STATE_COLUMNS = {
+    "transform": ("x", "y", "z", "pitch", "yaw", "roll"),
+    "velocity": ("x", "y", "z"),
+    "angular_velocity": ("x", "y", "z"),
+    "acceleration": ("x", "y", "z"),
+    "control": ("throttle", "steer", "brake", "hand_brake", "reverse", "gear"),
+    "traffic_light": ("state", "frozen", "elapsed_time"),
+}
+# the states that are kept as they are in the recorder, a value per row
+LIST_STATES = ("speed", "lights")
+
+# the sections of a frame, by the start of their header
+SECTIONS = (
+    (" Positions", "positions"),
+    (" State traffic lights", "traffic_lights"),
+    (" Vehicle animations", "vehicle_animations"),
+    (" Walker animations", "walker_animations"),
+    (" Vehicle light animations", "vehicle_lights"),
+    (" Scene light changes", "scene_lights"),
+    (" Dynamic actors", "dynamic_actors"),
+    (" Actor bounding boxes", "bounding_boxes"),
+    (" Actor trigger volumes", "trigger_volumes"),
+    (" Physics Control", "physics_control"),
+    (" Traffic Light time events", "traffic_light_state_time"),
+)
+
+
+class ActorStates(object):
+    """
+    The rows of a state of an actor: the frames (starting at 1) it was recorded at, in increasing
+    order, the values of those frames and the row of every frame between the first and the last one.
+    """
+
+    def __init__(self, frames, values):
+        self.frames = np.asarray(frames, dtype=np.int64)
+        self.values = values
+        self.first = int(self.frames[0]) if len(self.frames) else 0
+        self.rows = np.full(int(self.frames[-1]) - self.first + 1 if len(self.frames) else 0, -1, dtype=np.int64)
+        self.rows[self.frames - self.first] = np.arange(len(self.frames))
+
+    def row(self, frame):
+        """
+        Returns the row of a frame, -1 if the state was not recorded at it
+        """
+        index = frame - self.first
+        if 0 <= index < len(self.rows):
+            return int(self.rows[index])
+        return -1
+
+    def rows_between(self, first_frame, last_frame):
+        """
+        Returns an array with the row of each frame of the interval, -1 at the frames the state
+        was not recorded at
+        """
+        rows = np.full(max(last_frame - first_frame + 1, 0), -1, dtype=np.int64)
+        start, stop = max(first_frame, self.first), min(last_frame, self.first + len(self.rows) - 1)
+        if start <= stop:
+            rows[start - first_frame:stop - first_frame + 1] = self.rows[start - self.first:stop - self.first + 1]
+        return rows
+
+
+class RecorderArrays(object):
+    """
+    The information of the CARLA recorder as arrays:
+
+    - simulation: map, date, total frames and duration.
+    - actors: the information of each actor as the recorder lists it, with the location
+      as (x, y, z) and the bounding box and trigger volume as the elements of their rows.
+    - elapsed_time, delta_time, platform_time: a value per frame (platform_time NaN if missing).
+    - frame_actors(frame): the actors with a position or a traffic light state at a frame.
+    - states[state][actor_id]: ActorStates of the states of STATE_COLUMNS and LIST_STATES.
+    - collisions[actor_id]: {frame index: ids of the actors it collided with}
+    - events[event][actor_id]: frames and elements of the rows of the scene lights, the physics
+      control and the traffic light state times, the rows that the getters parse when asked.
+    """
+
+    def __init__(self, simulation, actors, elapsed_time, delta_time, platform_time, frame_actor_offsets,
+                 frame_actor_ids, states, collisions, events):
+        self.simulation = simulation
+        self.actors = actors
+        self.elapsed_time = elapsed_time
+        self.delta_time = delta_time
+        self.platform_time = platform_time
+        self.frame_actor_offsets = frame_actor_offsets
+        self.frame_actor_ids = frame_actor_ids
+        self.states = states
+        self.collisions = collisions
+        self.events = events
+
+    def frame_actors(self, frame):
+        """
+        Returns the ids of the actors with a position or a traffic light state at a frame
+        """
+        return self.frame_actor_ids[self.frame_actor_offsets[frame - 1]:self.frame_actor_offsets[frame]].tolist()
+
+    def last_event(self, event, actor_id, frame):
+        """
+        Returns the elements of the rows of the events of an actor at a frame or before it,
+        the last one first
+        """
+        if actor_id not in self.events[event]:
+            return []
+        frames, rows = self.events[event][actor_id]
+        return rows[:bisect_right(frames, frame)][::-1]
+
+    def save(self, filename):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+        with open(tmp_filename, "wb") as fd:
+            pickle.dump({"version": ARRAYS_VERSION, "arrays": self.__dict__}, fd, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as fd:
+            data = pickle.load(fd)
+        if data.get("version") != ARRAYS_VERSION:
+            return None
+        arrays = cls.__new__(cls)
+        arrays.__dict__.update(data["arrays"])
+        return arrays
+
+    @classmethod
+    def from_recorder(cls, recorder, cache_dir=None):
+        """
+        Parses the recorder, or loads it from the cache file of the recorder in cache_dir
+
+        Args:
+            recorder (str): string given by the recorder
+            cache_dir (str): folder of the cache files, None to not cache
+        """
+        if cache_dir is None:
+            return StreamingMetricsParser().parse(recorder)
+
+        digest = hashlib.sha1(recorder.encode("utf-8")).hexdigest()
+        filename = os.path.join(cache_dir, "recorder_{}.pkl".format(digest))
+        arrays = cls.load(filename) if os.path.exists(filename) else None
+        if arrays is None:
+            arrays = StreamingMetricsParser().parse(recorder)
+            arrays.save(filename)
+        return arrays
+
+
+class StreamingMetricsParser(object):
+    """
+    Parses the CARLA recorder line by line: the states are appended to typed buffers per actor and
+    turned into arrays at the end.
+    """
+
+    def __init__(self):
+        self.header = []
+        self.simulation = {}
+        self.actors = {}
+        self.elapsed_time = []
+        self.delta_time = []
+        self.platform_time = []
+        self.frame_actor_offsets = [0]
+        self.frame_actor_ids = array("q")
+        self.buffers = {state: {} for state in list(STATE_COLUMNS) + list(LIST_STATES)}
+        self.collisions = {}
+        self.events = {"scene_lights": {}, "physics_control": {}, "traffic_light_state_time": {}}
+
+        self.frame = 0              # index of the frame, starting at 1
+        self.frame_number = None    # number of the frame in the recorder
+        self.section = None
+        self.actor_id = None        # last created actor, or vehicle of the physics control rows
+
+    def _append(self, state, actor_id, values):
+        buffers = self.buffers[state]
+        if actor_id not in buffers:
+            buffers[actor_id] = (array("q"), [] if state in LIST_STATES else array("d"))
+        frames, buffer = buffers[actor_id]
+        frames.append(self.frame)
+        if state in LIST_STATES:
+            buffer.append(values)
+        else:
+            buffer.extend(values)
+
+    def _add_event(self, event, actor_id, value):
+        frames, rows = self.events[event].setdefault(actor_id, ([], []))
+        if frames and frames[-1] == self.frame:
+            rows[-1] = value
+        else:
+            frames.append(self.frame)
+            rows.append(value)
+
+    def parse(self, recorder):
+        """
+        Parses the recorder into a RecorderArrays.
+
+        Args:
+            recorder (str or iterable): string given by the recorder, or its lines
+        """
+        lines = io.StringIO(recorder) if isinstance(recorder, str) else recorder
+        for line in lines:
+            self.parse_line(line.rstrip("\n"))
+        return self.finish()
+
+    def parse_line(self, line):
+        if line.startswith("  "):
+            if self.section is not None:
+                getattr(self, "_row_" + self.section)(line)
+        elif line.startswith(" "):
+            self._event(line)
+        elif line.startswith("Frames: "):
+            self.section = None
+            self.simulation["total_frames"] = int(line[8:])
+        elif line.startswith("Duration: "):
+            self.simulation["duration"] = float(line[10:-8])
+        elif line.startswith("Frame "):
+            self._frame(line)
+        elif self.frame == 0:
+            self.header.append(line)
+
+    def _frame(self, line):
+        if self.frame == 0:
+            self.simulation.update({"map": self.header[1][5:], "date:": self.header[2][6:]})
+        else:
+            self.frame_actor_offsets.append(len(self.frame_actor_ids))
+        frame_info = line.split(" ")
+        self.frame += 1
+        self.frame_number = int(frame_info[1])
+        frame_time = float(frame_info[3])
+        try:
+            delta_time = round(frame_time - self.elapsed_time[self.frame_number - 2], 6)
+        except IndexError:
+            delta_time = 0
+        self.elapsed_time.append(frame_time)
+        self.delta_time.append(delta_time)
+        self.platform_time.append(np.nan)
+        self.section = None
+
+    def _event(self, line):
+        self.section = None
+        if line.startswith(" Create"):
+            elements = line[1:].split(" ")
+            self.actor_id = int(elements[1][:-1])
+            self.actors[self.actor_id] = {
+                "type_id": elements[2],
+                "location": (float(elements[5][1:-1]) / 100, float(elements[6][:-1]) / 100,
+                             float(elements[7][:-1]) / 100),
+                "created": self.frame_number,
+            }
+            self.section = "attributes"
+        elif line.startswith(" Destroy"):
+            self.actors[int(line[1:].split(" ")[1])]["destroyed"] = self.frame_number
+        elif line.startswith(" Collision"):
+            elements = line[1:].split(" ")
+            frame_collisions = self.collisions.setdefault(int(elements[4]), {}).setdefault(self.frame - 1, [])
+            frame_collisions.append(int(elements[-1]))
+        elif line.startswith(" Parenting"):
+            elements = line[1:].split(" ")
+            self.actors[int(elements[1])]["parent"] = int(elements[3])
+        elif line.startswith(" Current platform time"):
+            self.platform_time[-1] = float(line[1:].split(" ")[-1])
+        else:
+            for start, section in SECTIONS:
+                if line.startswith(start):
+                    self.section = section
+                    break
+
+    def _row_attributes(self, line):
+        elements = line[2:].split(" = ")
+        self.actors[self.actor_id][elements[0]] = elements[1]
+
+    def _row_positions(self, line):
+        e = line[2:].split(" ")
+        actor_id = int(e[1])
+        self._append("transform", actor_id, (
+            float(e[3][1:-1]) / 100, float(e[4][:-1]) / 100, float(e[5][:-1]) / 100,
+            float(e[8][:-1]), float(e[9][:-1]), float(e[7][1:-1])))
+        self.frame_actor_ids.append(actor_id)
+
+    def _row_traffic_lights(self, line):
+        e = line[2:].split(" ")
+        actor_id = int(e[1])
+        self._append("traffic_light", actor_id, (float(e[3]), float(e[5]), float(e[7])))
+        self.frame_actor_ids.append(actor_id)
+
+    def _row_vehicle_animations(self, line):
+        e = line[2:].split(" ")
+        gear = int(e[11])
+        self._append("control", int(e[1]), (float(e[5]), float(e[3]), float(e[7]), int(e[9]), gear < 0, gear))
+
+    def _row_walker_animations(self, line):
+        e = line[2:].split(" ")
+        self._append("speed", int(e[1]), e[3])
+
+    def _row_vehicle_lights(self, line):
+        e = line[2:].split(" ")
+        self._append("lights", int(e[1]), e[2:])
+
+    def _row_scene_lights(self, line):
+        e = line[2:].split(" ")
+        self._add_event("scene_lights", int(e[1]), e)
+
+    def _row_dynamic_actors(self, line):
+        e = line[2:].split(" ")
+        actor_id = int(e[1])
+        self._append("velocity", actor_id, (float(e[3][1:-1]), float(e[4][:-1]), float(e[5][:-1])))
+        self._append("angular_velocity", actor_id, (float(e[7][1:-1]), float(e[8][:-1]), float(e[9][:-1])))
+
+    def _row_bounding_boxes(self, line):
+        e = line[2:].split(" ")
+        self.actors[int(e[1])]["bounding_box"] = e
+
+    def _row_trigger_volumes(self, line):
+        e = line[2:].split(" ")
+        self.actors[int(e[1])]["trigger_volume"] = e
+
+    def _row_physics_control(self, line):
+        if line.startswith("   "):
+            self.events["physics_control"][self.actor_id][1][-1].append(line)
+        else:
+            self.actor_id = int(line[2:].split(" ")[1])
+            self._add_event("physics_control", self.actor_id, [])
+
+    def _row_traffic_light_state_time(self, line):
+        e = line[2:].split(" ")
+        self._add_event("traffic_light_state_time", int(e[1]), e)
+
+    def finish(self):
+        """
+        Returns the RecorderArrays of the parsed lines
+        """
+        if self.frame:
+            self.frame_actor_offsets.append(len(self.frame_actor_ids))
+        delta_time = np.array(self.delta_time, dtype=np.float64)
+
+        states = {}
+        for state, buffers in self.buffers.items():
+            states[state] = {}
+            for actor_id, (frames, buffer) in buffers.items():
+                if state not in LIST_STATES:
+                    buffer = np.frombuffer(buffer, dtype=np.float64).reshape(-1, len(STATE_COLUMNS[state]))
+                states[state][actor_id] = ActorStates(np.frombuffer(frames, dtype=np.int64), buffer)
+
+        # the change of the velocity since the frame before, zero at the first frame of an actor
+        for actor_id, velocity in states["velocity"].items():
+            acceleration = np.zeros_like(velocity.values)
+            frames = velocity.frames
+            dt = delta_time[frames[1:] - 1]
+            consecutive = (np.diff(frames) == 1) & (dt != 0)
+            acceleration[1:][consecutive] = \
+                np.diff(velocity.values, axis=0)[consecutive] / dt[consecutive][:, None]
+            states["acceleration"][actor_id] = ActorStates(frames, acceleration)
+
+        return RecorderArrays(
+            simulation=self.simulation,
+            actors=self.actors,
+            elapsed_time=np.array(self.elapsed_time, dtype=np.float64),
+            delta_time=delta_time,
+            platform_time=np.array(self.platform_time, dtype=np.float64),
+            frame_actor_offsets=np.array(self.frame_actor_offsets, dtype=np.int64),
+            frame_actor_ids=np.frombuffer(self.frame_actor_ids, dtype=np.int64),
+            states=states,
+            collisions=self.collisions,
+            events=self.events,
+        )
@@ -14,21 +14,71 @@ It also provides a series of functions to help the user querry
 specific information
 """
 
+import math
 import fnmatch
-from srunner.metrics.tools.metrics_parser import MetricsParser
+
+import numpy as np
+
+import carla
+from srunner.metrics.tools.metrics_arrays import STATE_COLUMNS, RecorderArrays
+from srunner.metrics.tools.metrics_parser import (parse_bounding_box, parse_physics_control, parse_scene_lights,
+                                                  parse_state_times, parse_vehicle_lights)
+
+TRAFFIC_LIGHT_STATES = {
+    0: carla.TrafficLightState.Red,
+    1: carla.TrafficLightState.Yellow,
+    2: carla.TrafficLightState.Green,
+    3: carla.TrafficLightState.Off,
+    4: carla.TrafficLightState.Unknown,
+}
+
+
+def _vector(values):
+    return carla.Vector3D(values[0], values[1], values[2])
+
+
+# the states of the actors: the arrays they are in and their value from a row of the arrays
+ACTOR_STATES = {
+    "transform": ("transform", lambda v: carla.Transform(carla.Location(v[0], v[1], v[2]),
+                                                         carla.Rotation(v[3], v[4], v[5]))),
+    "velocity": ("velocity", _vector),
+    "angular_velocity": ("angular_velocity", _vector),
+    "acceleration": ("acceleration", _vector),
+    "control": ("control", lambda v: carla.VehicleControl(v[0], v[1], v[2], bool(v[3]), bool(v[4]), False,
+                                                          int(v[5]))),
+    "state": ("traffic_light", lambda v: TRAFFIC_LIGHT_STATES[int(v[0])]),
+    "frozen": ("traffic_light", lambda v: bool(v[1])),
+    "elapsed_time": ("traffic_light", lambda v: v[2]),
+    "speed": ("speed", lambda v: v),
+    "lights": ("lights", lambda v: parse_vehicle_lights([None, None] + v)),
+}
+
 
 class MetricsLog(object):  # pylint: disable=too-many-public-methods
     """
     Utility class to query the log.
     """
 
-    def __init__(self, recorder):
+    def __init__(self, recorder, cache_dir=None):
         """
-        Initializes the log class and parses it to extract the dictionaries.
+        Initializes the log class and parses it into arrays, or loads them from the cache.
+
+        Args:
+            recorder (str): string given by the recorder.
+            cache_dir (str): folder of the parsed recorders, None to parse the recorder every time.
         """
         # Parse the information
-        parser = MetricsParser(recorder)
-        self._simulation, self._actors, self._frames = parser.parse_recorder_info()
+        self._log = RecorderArrays.from_recorder(recorder, cache_dir)
+        self._simulation = self._log.simulation
+
+        self._actors = {}
+        for actor_id, info in self._log.actors.items():
+            actor = dict(info)
+            actor["location"] = carla.Location(*info["location"])
+            for name in ("bounding_box", "trigger_volume"):
+                if name in info:
+                    actor[name] = parse_bounding_box(info[name])
+            self._actors[actor_id] = actor
 
     ### Functions used to get general info of the simulation ###
     def get_actor_collisions(self, actor_id):
@@ -39,15 +89,7 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
         Args:
             actor_id (int): ID of the actor.
         """
-        actor_collisions = {}
-
-        for i, frame in enumerate(self._frames):
-            collisions = frame["events"]["collisions"]
-
-            if actor_id in collisions:
-                actor_collisions.update({i: collisions[actor_id]})
-
-        return actor_collisions
+        return {i: list(collisions) for i, collisions in self._log.collisions.get(actor_id, {}).items()}
 
     def get_total_frame_count(self):
         """
@@ -61,21 +103,22 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
         Returns a float with the elapsed time of a specific frame.
         """
 
-        return self._frames[frame]["frame"]["elapsed_time"]
+        return float(self._log.elapsed_time[frame])
 
     def get_delta_time(self, frame):
         """
         Returns a float with the delta time of a specific frame.
         """
 
-        return self._frames[frame]["frame"]["delta_time"]
+        return float(self._log.delta_time[frame])
 
     def get_platform_time(self, frame):
         """
         Returns a float with the platform time time of a specific frame.
         """
 
-        return self._frames[frame]["frame"]["platform_time"]
+        platform_time = float(self._log.platform_time[frame])
+        return None if math.isnan(platform_time) else platform_time
 
     ### Functions used to get info about the actors ###
     def get_ego_vehicle_id(self):
@@ -191,19 +234,16 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
             frame: (int): frame number of the simulation.
             attribute (str): name of the actor's attribute to be returned.
         """
-        frame_state = self._frames[frame - 1]["actors"]
-
-        # Check if the actor exists
-        if actor_id in frame_state:
-
-            # Check if the state exists
-            if state not in frame_state[actor_id]:
-                return None
+        arrays, value = ACTOR_STATES[state]
+        actor_states = self._log.states[arrays].get(actor_id)
+        if actor_states is None:
+            return None
 
-            state_info = frame_state[actor_id][state]
-            return state_info
+        row = actor_states.row(frame)
+        if row < 0:
+            return None
 
-        return None
+        return value(actor_states.values[row].tolist() if arrays in STATE_COLUMNS else actor_states.values[row])
 
     def _get_all_actor_states(self, actor_id, state, first_frame=None, last_frame=None):
         """
@@ -223,13 +263,43 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
         if last_frame is None:
             last_frame = self.get_total_frame_count()
 
-        state_list = []
+        arrays, value = ACTOR_STATES[state]
+        actor_states = self._log.states[arrays].get(actor_id)
+        if actor_states is None:
+            return [None] * max(last_frame - first_frame + 1, 0)
 
-        for frame_number in range(first_frame, last_frame + 1):
-            state_info = self._get_actor_state(actor_id, state, frame_number)
-            state_list.append(state_info)
+        rows = actor_states.rows_between(first_frame, last_frame)
+        if arrays in STATE_COLUMNS:
+            values = actor_states.values[np.maximum(rows, 0)].tolist()
+            return [value(v) if row >= 0 else None for row, v in zip(rows.tolist(), values)]
+        return [value(actor_states.values[row]) if row >= 0 else None for row in rows.tolist()]
 
-        return state_list
+    def get_actor_state_array(self, actor_id, state, first_frame=None, last_frame=None):
+        """
+        Returns a numpy array with a row per frame of the interval and the columns of
+        STATE_COLUMNS[state] ("transform", "velocity", "angular_velocity", "acceleration",
+        "control" or "traffic_light"), NaN at the frames the actor has no state.
+
+        By default, first_frame and last_frame are the start and end of the simulation, respectively.
+
+        Args:
+            actor_id (int): ID of the actor.
+            state (str): name of the state.
+            first_frame (int): First frame checked. By default, 0.
+            last_frame (int): Last frame checked. By default, max number of frames.
+        """
+        if first_frame is None:
+            first_frame = 1
+        if last_frame is None:
+            last_frame = self.get_total_frame_count()
+
+        values = np.full((max(last_frame - first_frame + 1, 0), len(STATE_COLUMNS[state])), np.nan)
+        actor_states = self._log.states[state].get(actor_id)
+        if actor_states is not None:
+            rows = actor_states.rows_between(first_frame, last_frame)
+            values[rows >= 0] = actor_states.values[rows[rows >= 0]]
+
+        return values
 
     def _get_states_at_frame(self, frame, state, actor_list=None):
         """
@@ -239,9 +309,8 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
         By default, all actors will be considered.
         """
         states = {}
-        actor_info = self._frames[frame]["actors"]
 
-        for actor_id in actor_info:
+        for actor_id in self._log.frame_actors(frame + 1):
             if not actor_list:
                 _state = self._get_actor_state(actor_id, state, frame)
                 if _state:
@@ -345,11 +414,8 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
         Returns None if the id can't be found.
         """
 
-        for i in range(frame - 1, -1, -1):  # Go backwards from the frame until 0
-            physics_info = self._frames[i]["events"]["physics_control"]
-
-            if vehicle_id in physics_info:
-                return physics_info[vehicle_id]
+        for rows in self._log.last_event("physics_control", vehicle_id, frame):
+            return parse_physics_control(rows)
 
         return None
 
@@ -384,13 +450,10 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
         Returns None if the id can't be found.
         """
 
-        for i in range(frame - 1, -1, -1):  # Go backwards from the frame until 0
-            state_times_info = self._frames[i]["events"]["traffic_light_state_time"]
-
-            if traffic_light_id in state_times_info:
-                states = state_times_info[traffic_light_id]
-                if state in states:
-                    return state_times_info[traffic_light_id][state]
+        for elements in self._log.last_event("traffic_light_state_time", traffic_light_id, frame):
+            states = parse_state_times(elements)
+            if state in states:
+                return states[state]
 
         return None
 
@@ -419,10 +482,7 @@ class MetricsLog(object):  # pylint: disable=too-many-public-methods
         Returns None if the id can't be found.
         """
 
-        for i in range(frame - 1, -1, -1):  # Go backwards from the frame until 0
-            scene_lights_info = self._frames[i]["events"]["scene_lights"]
-
-            if light_id in scene_lights_info:
-                return scene_lights_info[light_id]
+        for elements in self._log.last_event("scene_lights", light_id, frame):
+            return parse_scene_lights(elements)
 
         return None
@@ -1,19 +1,33 @@
-from .auto_augment import (
-    RandAugment,
-    AutoAugment,
-    rand_augment_ops,
-    auto_augment_policy,
-    rand_augment_transform,
-    auto_augment_transform,
-)
-from .config import resolve_data_config
 from .constants import *
-from .dataset import ImageDataset, IterableImageDataset, AugMixDataset
-from .dataset_factory import create_dataset, create_carla_dataset
-from .loader import create_loader
-from .carla_loader import create_carla_loader
-from .mixup import Mixup, FastCollateMixup
-from .parsers import create_parser
-from .real_labels import RealLabelsImagenet
-from .transforms import *
-from .transforms_factory import create_transform
+from ..models._lazy import lazy_module_getattr
+
+# the names of the submodules, imported on first use: the datasets and transforms pull in torchvision,
+# imgaug and the carla dataset, which the models (that only need the constants) should not
+_module_of_name = {
+    "RandAugment": "auto_augment",
+    "AutoAugment": "auto_augment",
+    "rand_augment_ops": "auto_augment",
+    "auto_augment_policy": "auto_augment",
+    "rand_augment_transform": "auto_augment",
+    "auto_augment_transform": "auto_augment",
+    "resolve_data_config": "config",
+    "ImageDataset": "dataset",
+    "IterableImageDataset": "dataset",
+    "AugMixDataset": "dataset",
+    "create_dataset": "dataset_factory",
+    "create_carla_dataset": "dataset_factory",
+    "create_loader": "loader",
+    "create_carla_loader": "carla_loader",
+    "Mixup": "mixup",
+    "FastCollateMixup": "mixup",
+    "create_parser": "parsers",
+    "RealLabelsImagenet": "real_labels",
+    "RandomResizedCropAndInterpolation": "transforms",
+    "ToNumpy": "transforms",
+    "ToTensor": "transforms",
+    "create_transform": "transforms_factory",
+}
+
+__getattr__ = lazy_module_getattr(
+    __name__, {name: "%s.%s" % (__name__, module) for name, module in _module_of_name.items()}
+)
@@ -1,5 +1,4 @@
 import os
-import copy
 import re
 import io
 import logging
@@ -10,7 +9,9 @@ import torch.utils.data as data
 from torchvision import transforms
 from PIL import Image
 from .base_io_dataset import BaseIODataset
-from .heatmap_utils import generate_heatmap, generate_future_waypoints
+from .carla_measurements import measurement_features, to_ego_frame
+from .lidar_bev import lidar_to_histogram_features, transform_2d_points
+from .heatmap_utils import ActorArrays, generate_heatmap, generate_future_waypoints
 from .det_utils import generate_det_data
 from skimage.measure import block_reduce
 from .augmenter import augment
@@ -21,62 +22,6 @@ from .augmenter import augment
 _logger = logging.getLogger(__name__)
 _logger = logging.getLogger("train")
 
-def lidar_to_histogram_features(lidar, crop=256):
-    """
-    Convert LiDAR point cloud into 2-bin histogram over 256x256 grid
-    """
-
-    def splat_points(point_cloud):
-        # 256 x 256 grid
-        pixels_per_meter = 8
-        hist_max_per_pixel = 5
-        x_meters_max = 14
-        y_meters_max = 28
-        xbins = np.linspace(
-            -2 * x_meters_max,
-            2 * x_meters_max + 1,
-            2 * x_meters_max * pixels_per_meter + 1,
-        )
-        ybins = np.linspace(-y_meters_max, 0, y_meters_max * pixels_per_meter + 1)
-        hist = np.histogramdd(point_cloud[..., :2], bins=(xbins, ybins))[0]
-        hist[hist > hist_max_per_pixel] = hist_max_per_pixel
-        overhead_splat = hist / hist_max_per_pixel
-        return overhead_splat
-
-    below = lidar[lidar[..., 2] <= -2.0]
-    above = lidar[lidar[..., 2] > -2.0]
-    below_features = splat_points(below)
-    above_features = splat_points(above)
-    total_features = below_features + above_features
-    features = np.stack([below_features, above_features, total_features], axis=-1)
-    features = np.transpose(features, (2, 0, 1)).astype(np.float32)
-    return features
-
-def transform_2d_points(xyz, r1, t1_x, t1_y, r2, t2_x, t2_y):
-    """
-    Build a rotation matrix and take the dot product.
-    """
-    # z value to 1 for rotation
-    xy1 = xyz.copy()
-    xy1[:, 2] = 1
-
-    c, s = np.cos(r1), np.sin(r1)
-    r1_to_world = np.matrix([[c, s, t1_x], [-s, c, t1_y], [0, 0, 1]])
-
-    # np.dot converts to a matrix, so we explicitly change it back to an array
-    world = np.asarray(r1_to_world @ xy1.T)
-
-    c, s = np.cos(r2), np.sin(r2)
-    r2_to_world = np.matrix([[c, s, t2_x], [-s, c, t2_y], [0, 0, 1]])
-    world_to_r2 = np.linalg.inv(r2_to_world)
-
-    out = np.asarray(world_to_r2 @ world).T
-    # reset z-coordinate
-    out[:, 2] = xyz[:, 2]
-
-    return out
-
-
 def check_data(data, info):
     for key in data:
         if isinstance(data[key], np.ndarray):
@@ -261,9 +206,7 @@ class CarlaMVDetDataset(BaseIODataset):
             traffic_light_state = 1
  
         if self.with_lidar:
-            lidar_unprocessed = self._load_npy(
-                os.path.join(route_dir, "lidar", "%04d.npy" % frame_id)
-            )[..., :3]
+            lidar_unprocessed = self._load_lidar(route_dir, frame_id)[..., :3]
             lidar_unprocessed[:, 1] *= -1
             full_lidar = transform_2d_points(
                 lidar_unprocessed,
@@ -278,14 +221,8 @@ class CarlaMVDetDataset(BaseIODataset):
                 full_lidar, crop=self.input_lidar_size
             )
 
-        cmd_one_hot = [0, 0, 0, 0, 0, 0]
-        cmd = measurements["command"] - 1
-        if cmd < 0:
-            cmd = 3
-        cmd_one_hot[cmd] = 1
-        cmd_one_hot.append(measurements["speed"])
-        mes = np.array(cmd_one_hot)
-        mes = torch.from_numpy(mes).float()
+        mes = measurement_features(measurements["command"], measurements["speed"])[0]
+        mes = torch.from_numpy(mes)
 
         data["measurements"] = mes
         #data['command'] = torch.from_numpy(np.array(cmd))
@@ -303,18 +240,7 @@ class CarlaMVDetDataset(BaseIODataset):
             ego_y = measurements["gps_y"]
         else:
             ego_y = measurements["y"]
-        R = np.array(
-            [
-                [np.cos(np.pi / 2 + ego_theta), -np.sin(np.pi / 2 + ego_theta)],
-                [np.sin(np.pi / 2 + ego_theta), np.cos(np.pi / 2 + ego_theta)],
-            ]
-        )
-        local_command_point = np.array([x_command - ego_x, y_command - ego_y])
-        local_command_point = R.T.dot(local_command_point)
-        if any(np.isnan(local_command_point)):
-            local_command_point[np.isnan(local_command_point)] = np.mean(
-                local_command_point
-            )
+        local_command_point = to_ego_frame(x_command - ego_x, y_command - ego_y, ego_theta)
         local_command_point = torch.from_numpy(local_command_point).float()
         data["target_point"] = local_command_point
 
@@ -355,13 +281,10 @@ class CarlaMVDetDataset(BaseIODataset):
             data["rgb_left"] = rgb_left_image
             data["rgb_right"] = rgb_right_image
 
-        heatmap = generate_heatmap(
-            copy.deepcopy(measurements), copy.deepcopy(actors_data)
-        )
+        actors = ActorArrays(actors_data)
+        heatmap = generate_heatmap(measurements, actors)
         det_data = (
-            generate_det_data(
-                heatmap, copy.deepcopy(measurements), copy.deepcopy(actors_data)
-            )
+            generate_det_data(heatmap, measurements, actors)
             .reshape(400, -1)
             .astype(np.float32)
         )
@@ -381,9 +304,7 @@ class CarlaMVDetDataset(BaseIODataset):
     def _extract_data_item_BEVDriver(self, route_dir, frame_id, with_actor_infos=False, cached_measurements=None):
         data = {}
         # You can use tools/data/batch_merge_data.py to generate FULL image (including front, left, right) for reducing io cost
-        rgb_full_image = self._load_image(
-            os.path.join(route_dir, "rgb_full", "%04d.jpg" % frame_id)
-        )
+        rgb_full_image = self._load_rgb_full(route_dir, frame_id)
 
         rgb_image = rgb_full_image.crop((0, 0, 800, 600))
         rgb_left_image = rgb_full_image.crop((0, 600, 800, 1200))
@@ -401,7 +322,6 @@ class CarlaMVDetDataset(BaseIODataset):
                 os.path.join(route_dir, "measurements_full", "%04d.json" % frame_id)
             )
         actors_data = measurements["actors_data"]
-)
         '''
         # You can use tools/data/batch_merge_data.py to generate FULL measurements for reducing io cost
         measurements = self._load_json(
@@ -415,9 +335,7 @@ class CarlaMVDetDataset(BaseIODataset):
         '''
 
         if self.with_lidar:
-            lidar_unprocessed = self._load_npy(
-                os.path.join(route_dir, "lidar", "%04d.npy" % frame_id)
-            )[..., :3]
+            lidar_unprocessed = self._load_lidar(route_dir, frame_id)[..., :3]
             lidar_unprocessed[:, 1] *= -1
             full_lidar = transform_2d_points(
                 lidar_unprocessed,
@@ -436,14 +354,8 @@ class CarlaMVDetDataset(BaseIODataset):
             if self.lidar_transform is not None:
                 lidar_processed = self.lidar_transform(lidar_processed)
             data["lidar"] = lidar_processed
-        cmd_one_hot = [0, 0, 0, 0, 0, 0]
-        cmd = measurements["command"] - 1
-        if cmd < 0:
-            cmd = 3
-        cmd_one_hot[cmd] = 1
-        cmd_one_hot.append(measurements["speed"])
-        mes = np.array(cmd_one_hot)
-        mes = torch.from_numpy(mes).float()
+        mes = measurement_features(measurements["command"], measurements["speed"])[0]
+        mes = torch.from_numpy(mes)
 
         data["measurements"] = mes
         #data['velocity'] = torch.from_numpy(np.array([measurements['speed']])).float()
@@ -456,18 +368,7 @@ class CarlaMVDetDataset(BaseIODataset):
         y_command = measurements["y_command"]
         ego_x = measurements["gps_x"]
         ego_y = measurements["gps_y"]
-        R = np.array(
-            [
-                [np.cos(np.pi / 2 + ego_theta), -np.sin(np.pi / 2 + ego_theta)],
-                [np.sin(np.pi / 2 + ego_theta), np.cos(np.pi / 2 + ego_theta)],
-            ]
-        )
-        local_command_point = np.array([x_command - ego_x, y_command - ego_y])
-        local_command_point = R.T.dot(local_command_point)
-        if any(np.isnan(local_command_point)):
-            local_command_point[np.isnan(local_command_point)] = np.mean(
-                local_command_point
-            )
+        local_command_point = to_ego_frame(x_command - ego_x, y_command - ego_y, ego_theta)
         local_command_point = torch.from_numpy(local_command_point).float()
         data["target_point"] = local_command_point
 
@@ -492,17 +393,15 @@ class CarlaMVDetDataset(BaseIODataset):
             data["rgb_right"] = rgb_right_image
             #data["rgb_rear"] = rgb_rear_image
 
-        heatmap = generate_heatmap(
-            copy.deepcopy(measurements), copy.deepcopy(actors_data)
-        )
+        actors = ActorArrays(actors_data)
+        heatmap = generate_heatmap(measurements, actors)
         if with_actor_infos:
             det_data, actor_infos = (
-                generate_det_data(heatmap, copy.deepcopy(measurements), copy.deepcopy(actors_data), return_object_ids=True))
+                generate_det_data(heatmap, measurements, actors, return_object_ids=True))
             det_data = det_data.reshape(400, -1).astype(np.float32)
         else:
             det_data = (
-                generate_det_data(
-                    heatmap, copy.deepcopy(measurements), copy.deepcopy(actors_data)).reshape(400, -1).astype(np.float32)
+                generate_det_data(heatmap, measurements, actors).reshape(400, -1).astype(np.float32)
             )
         '''
         heatmap_mask = np.zeros((50, 50), dtype=bool).reshape(-1)
@@ -0,0 +1,155 @@
+import os
+import json
+import functools
+
+import numpy as np
+
+# Columnar per-route measurements for the CARLA datasets.
+#
+# measurements_all.json (see tools/data_preprocessing/batch_merge_measurements.py) stores one dict per
+# frame and has to be decoded completely for every sample. The datasets only read a few scalar fields,
+# so the merge step also writes measurements_all.npy: a structured array with one row per frame that is
+# loaded memory-mapped and sliced directly.
+
+MEASUREMENTS_JSON = "measurements_all.json"
+MEASUREMENTS_ARRAY = "measurements_all.npy"
+
+MEASUREMENT_DTYPE = np.dtype(
+    [
+        ("gps_x", np.float64),
+        ("gps_y", np.float64),
+        ("theta", np.float64),
+        ("speed", np.float64),
+        ("throttle", np.float64),
+        ("steer", np.float64),
+        ("brake", np.float64),
+        ("command", np.int64),
+        ("x_command", np.float64),
+        ("y_command", np.float64),
+    ]
+)
+
+ROUTE_CACHE_SIZE = 256
+
+
+def measurements_to_array(measurements):
+    """
+    Convert a list of per-frame measurement dicts into a MEASUREMENT_DTYPE structured array
+    """
+    array = np.zeros(len(measurements), dtype=MEASUREMENT_DTYPE)
+    for name in MEASUREMENT_DTYPE.names:
+        array[name] = [m[name] for m in measurements]
+    return array
+
+
+def save_measurements_array(route_path, measurements):
+    """
+    Write measurements_all.npy for a route, atomically replacing an existing file
+    """
+    array = measurements_to_array(measurements)
+    path = os.path.join(route_path, MEASUREMENTS_ARRAY)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+    return array
+
+
+@functools.lru_cache(maxsize=ROUTE_CACHE_SIZE)
+def load_route_measurements(route_path):
+    """
+    Return the measurements of a route as a structured array (one row per frame).
+
+    measurements_all.npy is memory-mapped when it is present and not older than measurements_all.json,
+    otherwise the json file is decoded and converted. Results are kept in a per-process LRU cache,
+    so every dataloader worker decodes a route at most once while it stays in the cache.
+    """
+    array_path = os.path.join(route_path, MEASUREMENTS_ARRAY)
+    json_path = os.path.join(route_path, MEASUREMENTS_JSON)
+    if os.path.exists(array_path) and (
+        not os.path.exists(json_path) or os.path.getmtime(array_path) >= os.path.getmtime(json_path)
+    ):
+        return np.asarray(np.load(array_path, mmap_mode="r"))
+    with open(json_path) as f:
+        return measurements_to_array(json.load(f))
+
+
+def to_ego_frame(dx, dy, theta):
+    """
+    Rotate world-frame offsets into the ego frame of a vehicle with compass heading theta.
+
+    Same as R.T.dot([dx, dy]) with R the rotation by pi/2 + theta, for arrays of any (broadcastable) shape.
+    Returns an array of shape [..., 2].
+    """
+    angle = np.pi / 2 + theta
+    c, s = np.cos(angle), np.sin(angle)
+    # + 0.0 turns -0.0 into 0.0 like the matrix product does, so '<frame %.1f,%.1f>' prompts stay the same
+    return np.stack([c * dx + s * dy, -s * dx + c * dy], axis=-1) + 0.0
+
+
+def measurement_features(command, speed):
+    """
+    Command one-hot (6 classes, VOID (-1) is mapped to LANEFOLLOW) followed by the speed, as float32 [n, 7]
+    """
+    command = np.asarray(command).reshape(-1) - 1
+    command = np.where(command < 0, 3, command)
+    features = np.zeros((len(command), 7), dtype=np.float32)
+    features[np.arange(len(command)), command] = 1
+    features[:, 6] = speed
+    return features
+
+
+def build_clip_labels(measurements, frame_ids, route_frames, token_max_length, future_steps=5, future_stride=5):
+    """
+    Build the per-frame labels of an instruction clip in one pass.
+
+    Args:
+        measurements: structured array of the route (see load_route_measurements)
+        frame_ids: sampled frame ids of the clip, at most token_max_length of them
+        route_frames: number of frames of the route, future waypoints are clamped to the last frame
+    Returns:
+        dict of arrays padded with zeros to token_max_length rows:
+        local_positions [T, 2] (relative to the first frame), target_points [T, 2],
+        local_future_waypoints [T, 2 * future_steps], ego_throttles, ego_steers, ego_brakes,
+        ego_velocitys [T] and measurements [T, 7]
+    """
+    frame_ids = np.asarray(frame_ids)
+    n = len(frame_ids)
+    frames = measurements[frame_ids]
+    gps_x = measurements["gps_x"]
+    gps_y = measurements["gps_y"]
+    theta = np.nan_to_num(frames["theta"], nan=0.0)
+
+    labels = {
+        "local_positions": np.zeros((token_max_length, 2)),
+        "target_points": np.zeros((token_max_length, 2)),
+        "local_future_waypoints": np.zeros((token_max_length, 2 * future_steps)),
+        "ego_throttles": np.zeros(token_max_length),
+        "ego_steers": np.zeros(token_max_length),
+        "ego_brakes": np.zeros(token_max_length, dtype=np.int64),
+        "ego_velocitys": np.zeros(token_max_length),
+        "measurements": np.zeros((token_max_length, 7), dtype=np.float32),
+    }
+
+    labels["local_positions"][:n] = to_ego_frame(
+        frames["gps_x"] - frames["gps_x"][0], frames["gps_y"] - frames["gps_y"][0], theta[0]
+    )
+    labels["target_points"][:n] = to_ego_frame(
+        frames["x_command"] - frames["gps_x"], frames["y_command"] - frames["gps_y"], theta
+    )
+
+    future_ids = np.minimum(
+        frame_ids[:, None] + future_stride * np.arange(1, future_steps + 1), route_frames - 1
+    )
+    labels["local_future_waypoints"][:n] = to_ego_frame(
+        gps_x[future_ids] - frames["gps_x"][:, None],
+        gps_y[future_ids] - frames["gps_y"][:, None],
+        theta[:, None],
+    ).reshape(n, -1)
+
+    labels["ego_throttles"][:n] = frames["throttle"]
+    labels["ego_steers"][:n] = frames["steer"]
+    labels["ego_brakes"][:n] = frames["brake"]
+    labels["ego_velocitys"][:n] = frames["speed"]
+    labels["measurements"][:n] = measurement_features(frames["command"], frames["speed"])
+    return labels
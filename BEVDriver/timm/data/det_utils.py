@@ -1,15 +1,13 @@
 import math
 import json
 import os
-import copy
 
 from tqdm import tqdm
 from PIL import Image
 import cv2
 import numpy as np
 
-from skimage.measure import block_reduce
-from .heatmap_utils import generate_heatmap, get_yaw_angle
+from .heatmap_utils import as_actor_arrays, ego_rotation
 
 
 def convert_grid_to_xy(i, j):
@@ -19,74 +17,64 @@ def convert_grid_to_xy(i, j):
 
 
 def generate_det_data(
-    heatmap, measurements, actors_data, pixels_per_meter=5, max_distance=18
+    heatmap, measurements, actors_data, pixels_per_meter=5, max_distance=18, return_object_ids=False
 ):
-    traffic_heatmap = block_reduce(heatmap, block_size=(5, 5), func=np.mean)
-    traffic_heatmap = np.clip(traffic_heatmap, 0.0, 255.0)
-    traffic_heatmap = traffic_heatmap[:20, 8:28]
+    """
+    [20, 20, 7] detection targets: for every occupied cell of the 20x20 grid in front of the ego
+    vehicle, (prob, dx, dy, yaw, box x, box y, speed) of the nearest actor.
+
+    actors_data is an actors_data dict or its ActorArrays and is not modified. With return_object_ids,
+    the [20, 20] ids of these actors (-1 for empty cells) are returned as well.
+    """
+    actors = as_actor_arrays(actors_data)
+    # block_reduce(heatmap, (5, 5), np.mean)[:20, 8:28], only for the cells that are used
+    traffic_heatmap = heatmap[:100, 40:140].reshape(20, 5, 20, 5).mean(axis=(1, 3))
     det_data = np.zeros((20, 20, 7))
+    object_ids = np.full((20, 20), -1, dtype=np.int64)
 
     ego_x = measurements["x"]
     ego_y = measurements["y"]
-    ego_theta = measurements["theta"]
-    R = np.array(
-        [
-            [np.cos(ego_theta), -np.sin(ego_theta)],
-            [np.sin(ego_theta), np.cos(ego_theta)],
-        ]
-    )
-    need_deleted_ids = []
-    for _id in actors_data:
-        raw_loc = actors_data[_id]["loc"]
-        new_loc = R.T.dot(np.array([raw_loc[0] - ego_x, raw_loc[1] - ego_y]))
-        new_loc[1] = -new_loc[1]
-        actors_data[_id]["loc"] = np.array(new_loc)
-        raw_ori = actors_data[_id]["ori"]
-        new_ori = R.T.dot(np.array([raw_ori[0], raw_ori[1]]))
-        dis = new_loc[0] ** 2 + new_loc[1] ** 2
-        if (
-            dis <= 1
-            or dis >= (max_distance + 3) ** 2 * 2
-            or "box" not in actors_data[_id]
-        ):
-            need_deleted_ids.append(_id)
-            continue
-        actors_data[_id]["ori"] = np.array(new_ori)
-        actors_data[_id]["box"] = np.array(actors_data[_id]["box"])
+    R = ego_rotation(measurements["theta"])
+    loc = (actors.loc - np.array([ego_x, ego_y])) @ R
+    loc[:, 1] = -loc[:, 1]
+    dis = loc[:, 0] ** 2 + loc[:, 1] ** 2
+    keep = (dis > 1) & (dis < (max_distance + 3) ** 2 * 2) & actors.has_box
+
+    rows, cols = np.nonzero(traffic_heatmap >= 0.05 * 255.0)
+    if keep.any() and len(rows):
+        loc = loc[keep]
+        center_x, center_y = convert_grid_to_xy(rows, cols)
+        center_dis = (loc[None, :, 0] - center_x[:, None]) ** 2 + (loc[None, :, 1] - center_y[:, None]) ** 2
+        nearest = np.argmin(center_dis, axis=1)  # the first of equally near actors
+        min_dis = center_dis[np.arange(len(rows)), nearest]
+        # cells without an actor closer than sqrt(1000) m stay empty
+        found = min_dis < 1000
+        rows, cols, center_x, center_y = rows[found], cols[found], center_x[found], center_y[found]
+        nearest, min_dis = nearest[found], min_dis[found]
 
-    for _id in need_deleted_ids:
-        del actors_data[_id]
+        loc = loc[nearest]
+        ori = actors.ori[keep][nearest] @ R
+        box = actors.box[keep][nearest]
+        ori = ori / np.linalg.norm(ori, axis=1, keepdims=True)
+        yaw = np.arccos(ori[:, 0])
+        yaw = np.where(ori[:, 1] < 0, 2 * np.pi - yaw, yaw)  # get_yaw_angle
+        theta = (yaw / np.pi + 2) % 2
+        speed = np.linalg.norm(actors.vel[keep][nearest], axis=1)
+        prob = np.power(0.5 / np.maximum(0.5, np.sqrt(min_dis)), 0.5)
+        det_data[rows, cols] = np.stack(
+            [
+                prob,
+                (loc[:, 0] - center_x) / 3.5,
+                (loc[:, 1] - center_y) / 3.5,
+                theta / 2.0,
+                box[:, 0] / 3.5,
+                box[:, 1] / 2.0,
+                speed / 8.0,
+            ],
+            axis=1,
+        )
+        object_ids[rows, cols] = actors.ids[keep][nearest]
 
-    for i in range(20):  # Vertical
-        for j in range(20):  # horizontal
-            if traffic_heatmap[i][j] < 0.05 * 255.0:
-                continue
-            center_x, center_y = convert_grid_to_xy(i, j)
-            min_dis = 1000
-            min_id = None
-            for _id in actors_data:
-                loc = actors_data[_id]["loc"][:2]
-                ori = actors_data[_id]["ori"][:2]
-                box = actors_data[_id]["box"]
-                dis = (loc[0] - center_x) ** 2 + (loc[1] - center_y) ** 2
-                if dis < min_dis:
-                    min_dis = dis
-                    min_id = _id
-            loc = actors_data[min_id]["loc"][:2]
-            ori = actors_data[min_id]["ori"][:2]
-            box = actors_data[min_id]["box"]
-            theta = (get_yaw_angle(ori) / np.pi + 2) % 2
-            speed = np.linalg.norm(actors_data[min_id]["vel"])
-            prob = np.power(0.5 / max(0.5, np.sqrt(min_dis)), 0.5)
-            det_data[i][j] = np.array(
-                [
-                    prob,
-                    (loc[0] - center_x) / 3.5,
-                    (loc[1] - center_y) / 3.5,
-                    theta / 2.0,
-                    box[0] / 3.5,
-                    box[1] / 2.0,
-                    speed / 8.0,
-                ]
-            )
+    if return_object_ids:
+        return det_data, object_ids
     return det_data
@@ -0,0 +1,271 @@
+import io
+import os
+import json
+import struct
+import logging
+import functools
+
+import numpy as np
+from PIL import Image
+
+# Packed per-route frame store for the CARLA datasets.
+#
+# Every frame of a route normally costs two file opens on the dataset filesystem (rgb_full/%04d.jpg and
+# lidar/%04d.npy). tools/data_preprocessing/batch_merge_data.py --pack writes them into one file per
+# route, which the datasets memory-map and index by frame id:
+#
+#   magic (8 bytes) | header size (uint64) | json header | index (frames x SHARD_INDEX_DTYPE) | data
+#
+# The data section holds, for every frame, the encoded rgb_full JPEG followed by the LiDAR points
+# (lidar_dtype, lidar_columns per point). Blocks start on SHARD_ALIGNMENT byte boundaries. Missing
+# frames have an image size / point count of -1 and are served from the previous frame, like the
+# loaders in BaseIODataset do for missing files. The header records the mtimes of the rgb_full/ and lidar/
+# folders, which change when a frame file is added, removed or renamed: a shard whose folders changed since
+# it was written is not used and the datasets read the files, two stats per shard opened. A file rewritten
+# in place is not seen, repack the route after changing its frames. Once a route is packed its frame files
+# can be deleted, with the folders or leaving them empty.
+
+SHARD_FILE = "frames.shard"
+SHARD_MAGIC = b"BEVSHRD1"
+SHARD_ALIGNMENT = 64
+SHARD_INDEX_DTYPE = np.dtype(
+    [
+        ("image_offset", "<i8"),
+        ("image_size", "<i8"),
+        ("lidar_offset", "<i8"),
+        ("lidar_points", "<i8"),
+    ]
+)
+
+SHARD_SOURCE_FOLDERS = ("rgb_full", "lidar")
+
+SHARD_CACHE_SIZE = 256
+
+_logger = logging.getLogger(__name__)
+
+
+def _align(offset):
+    return (offset + SHARD_ALIGNMENT - 1) // SHARD_ALIGNMENT * SHARD_ALIGNMENT
+
+
+def _source_paths(route_path, frame_id):
+    return (
+        os.path.join(route_path, "rgb_full", "%04d.jpg" % frame_id),
+        os.path.join(route_path, "lidar", "%04d.npy" % frame_id),
+    )
+
+
+def source_stats(route_path, frames):
+    """
+    [image size, image mtime_ns, lidar size, lidar mtime_ns] of the source files of every frame, -1 for a
+    missing file
+    """
+    stats = []
+    for i in range(frames):
+        entry = []
+        for path in _source_paths(route_path, i):
+            try:
+                stat = os.stat(path)
+                entry += [stat.st_size, stat.st_mtime_ns]
+            except FileNotFoundError:
+                entry += [-1, -1]
+        stats.append(entry)
+    return stats
+
+
+def source_mtimes(route_path):
+    """
+    {folder: mtime_ns} of the SHARD_SOURCE_FOLDERS of a route, -1 for a missing folder
+    """
+    mtimes = {}
+    for folder in SHARD_SOURCE_FOLDERS:
+        try:
+            mtimes[folder] = os.stat(os.path.join(route_path, folder)).st_mtime_ns
+        except FileNotFoundError:
+            mtimes[folder] = -1
+    return mtimes
+
+
+def _is_empty(path):
+    with os.scandir(path) as entries:
+        return next(entries, None) is None
+
+
+def _read_points(path, lidar_dtype):
+    return np.asarray(np.load(path, allow_pickle=True), dtype=lidar_dtype)
+
+
+def _lidar_shape(path):
+    # from the .npy header, without reading the points (pickled arrays are loaded)
+    try:
+        return np.load(path, mmap_mode="r").shape
+    except ValueError:
+        return np.asarray(np.load(path, allow_pickle=True)).shape
+
+
+def write_frame_shard(route_path, frames, lidar_dtype="float32"):
+    """
+    Pack rgb_full/%04d.jpg and lidar/%04d.npy of frames [0, frames) into route_path/frames.shard.
+
+    The JPEG bytes are copied as they are; points are stored as lidar_dtype. float16 halves the point
+    block at about 1-3 cm precision within the 57 m BEV range, but has to be converted on every read,
+    so it only pays off when the filesystem is the bottleneck. The file is written atomically.
+
+    The index is computed from the file sizes and the .npy headers first, then the frames are copied
+    into the file one at a time.
+    """
+    lidar_dtype = np.dtype(lidar_dtype).newbyteorder("<")
+    mtimes = source_mtimes(route_path)
+    stats = source_stats(route_path, frames)
+    lidar_points = [-1] * frames
+    lidar_columns = None
+    for i in range(frames):
+        if stats[i][2] < 0:
+            continue
+        lidar_path = _source_paths(route_path, i)[1]
+        shape = _lidar_shape(lidar_path)
+        lidar_columns = lidar_columns or shape[1]
+        assert shape[1] == lidar_columns, lidar_path
+        lidar_points[i] = shape[0]
+
+    header = json.dumps(
+        {"frames": frames, "lidar_dtype": lidar_dtype.str, "lidar_columns": lidar_columns or 0, "sources": mtimes}
+    ).encode()
+    index = np.full(frames, -1, dtype=SHARD_INDEX_DTYPE)
+    offset = _align(len(SHARD_MAGIC) + 8 + len(header) + index.nbytes)
+    for i in range(frames):
+        if stats[i][0] >= 0:
+            index[i]["image_offset"] = offset
+            index[i]["image_size"] = stats[i][0]
+            offset = _align(offset + stats[i][0])
+        if lidar_points[i] >= 0:
+            index[i]["lidar_offset"] = offset
+            index[i]["lidar_points"] = lidar_points[i]
+            offset = _align(offset + lidar_points[i] * lidar_columns * lidar_dtype.itemsize)
+
+    path = os.path.join(route_path, SHARD_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SHARD_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.write(index.tobytes())
+        for i in range(frames):
+            image_path, lidar_path = _source_paths(route_path, i)
+            if index[i]["image_size"] >= 0:
+                f.seek(index[i]["image_offset"])
+                with open(image_path, "rb") as image:
+                    f.write(image.read())
+            if index[i]["lidar_points"] >= 0:
+                lidar = _read_points(lidar_path, lidar_dtype)
+                assert lidar.shape == (index[i]["lidar_points"], lidar_columns), lidar_path
+                f.seek(index[i]["lidar_offset"])
+                f.write(lidar.tobytes())
+        f.truncate(offset)
+    os.replace(tmp_path, path)
+    return path
+
+
+class FrameShard:
+    """
+    Read-only, memory-mapped view of a route's frames.shard
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(self.buffer[: len(SHARD_MAGIC)]) != SHARD_MAGIC:
+            raise ValueError("%s is not a frame shard" % path)
+        start = len(SHARD_MAGIC) + 8
+        (header_size,) = struct.unpack("<Q", bytes(self.buffer[len(SHARD_MAGIC) : start]))
+        header = json.loads(bytes(self.buffer[start : start + header_size]))
+        start += header_size
+        self.frames = header["frames"]
+        self.lidar_dtype = np.dtype(header["lidar_dtype"])
+        self.lidar_columns = header["lidar_columns"]
+        self.sources = header.get("sources")
+        self.index = np.frombuffer(self.buffer, dtype=SHARD_INDEX_DTYPE, count=self.frames, offset=start)
+
+    def __len__(self):
+        return self.frames
+
+    def is_stale(self, route_path):
+        """
+        Whether frame files of the route were added, removed or renamed since the shard was written (or it has
+        no record of its source folders). Missing or empty folders are frames deleted after packing.
+        """
+        if not isinstance(self.sources, dict):
+            return True
+        for folder, mtime in source_mtimes(route_path).items():
+            if mtime >= 0 and mtime != self.sources.get(folder) and not _is_empty(os.path.join(route_path, folder)):
+                return True
+        return False
+
+    def _entry(self, frame_id, field):
+        # missing frames fall back to the previous frame
+        entry = self.index[frame_id]
+        if entry[field] < 0 and frame_id > 0:
+            entry = self.index[frame_id - 1]
+        if entry[field] < 0:
+            raise KeyError("frame %d is missing in %s" % (frame_id, self.path))
+        return entry
+
+    def image_bytes(self, frame_id):
+        entry = self._entry(frame_id, "image_size")
+        offset = int(entry["image_offset"])
+        return self.buffer[offset : offset + int(entry["image_size"])]
+
+    def image(self, frame_id):
+        return Image.open(io.BytesIO(self.image_bytes(frame_id).tobytes()))
+
+    def lidar(self, frame_id):
+        """
+        Points of a frame as a writable float32 array [points, lidar_columns]
+        """
+        entry = self._entry(frame_id, "lidar_points")
+        points = np.frombuffer(
+            self.buffer,
+            dtype=self.lidar_dtype,
+            count=int(entry["lidar_points"]) * self.lidar_columns,
+            offset=int(entry["lidar_offset"]),
+        )
+        return points.reshape(-1, self.lidar_columns).astype(np.float32)
+
+
+_stale_warned = set()
+
+
+class _NoShard(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=SHARD_CACHE_SIZE)
+def _open_valid_frame_shard(route_path):
+    # raises _NoShard instead of returning None, which lru_cache would keep
+    path = os.path.join(route_path, SHARD_FILE)
+    if not os.path.exists(path):
+        raise _NoShard()
+    shard = FrameShard(path)
+    if shard.is_stale(route_path):
+        if path not in _stale_warned:
+            _stale_warned.add(path)
+            _logger.warning(
+                "%s is stale, reading the frames of the route, repack it with batch_merge_data.py --pack", path
+            )
+        raise _NoShard()
+    return shard
+
+
+def open_frame_shard(route_path):
+    """
+    FrameShard of a route, or None when the route has no frames.shard or frame files were added or removed
+    since it was written. Shards are cached per process; a route without a usable shard is looked up again
+    on the next call, so a shard packed while training runs is picked up.
+    """
+    try:
+        return _open_valid_frame_shard(route_path)
+    except _NoShard:
+        return None
+
+
+open_frame_shard.cache_clear = _open_valid_frame_shard.cache_clear
@@ -71,86 +71,113 @@ def generate_future_waypoints(measurements, pixels_per_meter=5, max_distance=18)
     return img
 
 
+class ActorArrays:
+    """
+    Columns of an actors_data dict (actor id -> loc/ori/box/vel/tpe, see auto_pilot.collect_actor_data),
+    in its iteration order. Built once per frame and shared by generate_heatmap and generate_det_data,
+    which read it without copying or mutating the dict.
+    """
+
+    def __init__(self, actors_data):
+        actors = list(actors_data.values())
+        self.actors = actors
+        self.ids = np.array([int(_id) for _id in actors_data], dtype=np.int64)
+        self.tpe = np.array([actor["tpe"] for actor in actors], dtype=np.int64)
+        self.loc = np.array([actor["loc"][:2] for actor in actors], dtype=np.float64).reshape(-1, 2)
+        self.ori = np.array([actor["ori"][:2] for actor in actors], dtype=np.float64).reshape(-1, 2)
+        # traffic lights have no box and no velocity
+        self.has_box = np.array(["box" in actor for actor in actors], dtype=bool)
+        self.box = np.array(
+            [actor["box"][:2] if "box" in actor else (np.nan, np.nan) for actor in actors], dtype=np.float64
+        ).reshape(-1, 2)
+        self.vel = np.array(
+            [actor.get("vel", (0.0, 0.0, 0.0)) for actor in actors], dtype=np.float64
+        ).reshape(len(actors), -1)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def as_actor_arrays(actors_data):
+    if isinstance(actors_data, ActorArrays):
+        return actors_data
+    return ActorArrays(actors_data)
+
+
+def ego_rotation(theta):
+    return np.array(
+        [
+            [np.cos(theta), -np.sin(theta)],
+            [np.sin(theta), np.cos(theta)],
+        ]
+    )
+
+
 def generate_heatmap(measurements, actors_data, pixels_per_meter=5, max_distance=18):
+    """
+    Occupancy image of the boxes of all actors except traffic lights and the ego vehicle.
+
+    actors_data is an actors_data dict or its ActorArrays and is not modified.
+    """
+    actors = as_actor_arrays(actors_data)
     img_size = max_distance * pixels_per_meter * 2
-    img = np.zeros((img_size, img_size, 3), int)
+    img = np.zeros((img_size, img_size), np.uint8)
     ego_x = measurements["x"]
     ego_y = measurements["y"]
-    ego_theta = measurements["theta"]
-    R = np.array(
-        [
-            [np.cos(ego_theta), -np.sin(ego_theta)],
-            [np.sin(ego_theta), np.cos(ego_theta)],
-        ]
+    R = ego_rotation(measurements["theta"])
+
+    lights = actors.tpe == 2
+    raw_loc = actors.loc
+    considered = ~lights
+    if lights.any():
+        # only the light affecting the ego vehicle takes part, at the center of its trigger volume
+        affected = lights & (actors.ids == int(measurements["affected_light_id"]))
+        raw_loc = raw_loc.copy()
+        for k in np.flatnonzero(affected):
+            light = actors.actors[k]
+            yaw = get_yaw_angle(light["ori"])
+            TR = np.array([[np.cos(yaw), np.sin(yaw)], [-np.sin(yaw), np.cos(yaw)]])
+            raw_loc[k] = np.array(light["loc"][:2]) + TR.T.dot(np.array(light["taigger_loc"])[:2])
+        considered |= affected
+    near = considered & ((raw_loc[:, 0] - ego_x) ** 2 + (raw_loc[:, 1] - ego_y) ** 2 <= 1)
+
+    # actors within 1m of the ego position are drawn with color [0, 1, 1] (invisible in the returned
+    # channel) unless they are a hazard, and the last of them is the ego vehicle, which is removed
+    present = np.isin(
+        actors.ids,
+        [int(x) for key in ("is_vehicle_present", "is_bike_present", "is_junction_vehicle_present",
+                            "is_pedestrian_present") for x in measurements[key]],
     )
-    ego_id = None
-    for _id in actors_data:
-        color = np.array([1, 1, 1])
-        if actors_data[_id]["tpe"] == 2:
-            if int(_id) == int(measurements["affected_light_id"]):
-                if actors_data[_id]["sta"] == 0:
-                    color = np.array([1, 1, 1])
-                else:
-                    color = np.array([0, 0, 0])
-                yaw = get_yaw_angle(actors_data[_id]["ori"])
-                TR = np.array([[np.cos(yaw), np.sin(yaw)], [-np.sin(yaw), np.cos(yaw)]])
-                actors_data[_id]["loc"] = np.array(
-                    actors_data[_id]["loc"][:2]
-                ) + TR.T.dot(np.array(actors_data[_id]["taigger_loc"])[:2])
-                actors_data[_id]["ori"] = np.array(actors_data[_id]["ori"])
-                actors_data[_id]["box"] = np.array(actors_data[_id]["trigger_box"]) * 2
-            else:
-                continue
-        raw_loc = actors_data[_id]["loc"]
-        if (raw_loc[0] - ego_x) ** 2 + (raw_loc[1] - ego_y) ** 2 <= 1:
-            ego_id = _id
-            color = np.array([0, 1, 1])
-        new_loc = R.T.dot(np.array([raw_loc[0] - ego_x, raw_loc[1] - ego_y]))
-        actors_data[_id]["loc"] = np.array(new_loc)
-        raw_ori = actors_data[_id]["ori"]
-        new_ori = R.T.dot(np.array([raw_ori[0], raw_ori[1]]))
-        actors_data[_id]["ori"] = np.array(new_ori)
-        actors_data[_id]["box"] = np.array(actors_data[_id]["box"])
-        if int(_id) in measurements["is_vehicle_present"]:
-            color = np.array([1, 1, 1])
-        elif int(_id) in measurements["is_bike_present"]:
-            color = np.array([1, 1, 1])
-        elif int(_id) in measurements["is_junction_vehicle_present"]:
-            color = np.array([1, 1, 1])
-        elif int(_id) in measurements["is_pedestrian_present"]:
-            color = np.array([1, 1, 1])
-        actors_data[_id]["color"] = color
-
-    if ego_id is not None and ego_id in actors_data:
-        del actors_data[ego_id]  # Do not show ego car
-    for _id in actors_data:
-        if actors_data[_id]["tpe"] == 2:
-            continue  # FIXME donot add traffix light
-            if int(_id) != int(measurements["affected_light_id"]):
-                continue
-            if actors_data[_id]["sta"] != 0:
-                continue
-        act_img = np.zeros((img_size, img_size, 3), np.uint8)
-        loc = actors_data[_id]["loc"][:2]
-        ori = actors_data[_id]["ori"][:2]
-        box = actors_data[_id]["box"]
-        if box[0] < 1.5:
-            box = box * 1.5  # FIXME enlarge the size of pedstrian and bike
-        color = actors_data[_id]["color"]
-        for i in range(len(VALUES)):
-            act_img = add_rect(
-                act_img,
-                loc,
-                ori,
-                box + EXTENT[i],
-                VALUES[i],
-                pixels_per_meter,
-                max_distance,
-                color,
-            )
-        act_img = np.clip(act_img, 0, 255)
-        img = img + act_img
-    img = np.clip(img, 0, 255)
-    img = img.astype(np.uint8)
-    img = img[:, :, 0]
+    drawn = ~lights & ~(near & ~present)
+    if near.any():
+        drawn[np.flatnonzero(near)[-1]] = False
+    if not drawn.any():
+        return img
+
+    # rows of v @ R are R.T.dot(v), the per-actor transform
+    loc = (actors.loc[drawn] - np.array([ego_x, ego_y])) @ R
+    ori = actors.ori[drawn] @ R
+    box = actors.box[drawn]
+    box = np.where(box[:, :1] < 1.5, box * 1.5, box)  # FIXME enlarge the size of pedstrian and bike
+    # with the single 255 level of VALUES / EXTENT, summing and clipping the per-actor images is the
+    # union of the boxes, so all actors are drawn into one canvas
+    for i in range(len(VALUES)):
+        add_rects(img, loc, ori, box + EXTENT[i], VALUES[i], pixels_per_meter, max_distance)
+    return img
+
+
+def add_rects(img, loc, ori, box, value, pixels_per_meter, max_distance):
+    """
+    add_rect for [n, 2] locations, orientations and boxes on a single channel image
+    """
+    vet_ori = np.stack([-ori[:, 1], ori[:, 0]], axis=1)
+    hor_offset = box[:, :1] * ori
+    vet_offset = box[:, 1:2] * vet_ori
+    left_up = (loc + hor_offset + vet_offset + max_distance) * pixels_per_meter
+    left_down = (loc + hor_offset - vet_offset + max_distance) * pixels_per_meter
+    right_up = (loc - hor_offset + vet_offset + max_distance) * pixels_per_meter
+    right_down = (loc - hor_offset - vet_offset + max_distance) * pixels_per_meter
+    polygons = np.around(np.stack([left_up, left_down, right_down, right_up], axis=1)).astype(np.int32)
+    for polygon in polygons:
+        cv2.fillConvexPoly(img, polygon, int(value))
     return img
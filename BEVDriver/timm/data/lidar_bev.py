@@ -0,0 +1,102 @@
+import numpy as np
+
+# LiDAR bird's-eye-view histogram shared by the CARLA datasets and the agent (team_code/utils.py).
+#
+# The grid has 224 x-bins over [-28, 29] and 224 y-bins over [-28, 0]. Points are split into a
+# "below" (z <= -2) and "above" channel, counted, clipped at HIST_MAX_PER_PIXEL and normalized;
+# the third channel is the sum of both. Instead of two np.histogramdd calls, the cell of every point
+# is computed once with integer arithmetic and both channels are counted with a single np.bincount.
+
+PIXELS_PER_METER = 8
+HIST_MAX_PER_PIXEL = 5
+X_METERS_MAX = 14
+Y_METERS_MAX = 28
+GROUND_HEIGHT = -2.0
+
+X_EDGES = np.linspace(-2 * X_METERS_MAX, 2 * X_METERS_MAX + 1, 2 * X_METERS_MAX * PIXELS_PER_METER + 1)
+Y_EDGES = np.linspace(-Y_METERS_MAX, 0, Y_METERS_MAX * PIXELS_PER_METER + 1)
+NUM_X_BINS = len(X_EDGES) - 1
+NUM_Y_BINS = len(Y_EDGES) - 1
+
+
+# normalized splat value of a clipped count, and of the sum of two clipped counts (index a * 6 + b)
+_splat = np.arange(HIST_MAX_PER_PIXEL + 1) / HIST_MAX_PER_PIXEL
+_SPLAT = _splat.astype(np.float32)
+_TOTAL = (_splat[:, None] + _splat[None, :]).astype(np.float32).reshape(-1)
+
+
+def _bin_index(values, edges):
+    """
+    Bin index of every value in [edges[0], edges[-1]] for uniform edges, with the semantics of
+    np.histogramdd: edges[i] <= v < edges[i + 1] and the last bin includes its right edge.
+    """
+    num_bins = len(edges) - 1
+    position = (values - edges[0]) * (num_bins / (edges[-1] - edges[0]))
+    index = position.astype(np.int64)
+    np.minimum(index, num_bins - 1, out=index)
+    # the arithmetic can be off by one right at an edge, bin those few values against the exact edges
+    near_edge = np.flatnonzero(np.abs(position - np.rint(position)) < 1e-6)
+    if len(near_edge):
+        index[near_edge] = np.clip(np.searchsorted(edges, values[near_edge], side="right") - 1, 0, num_bins - 1)
+    return index
+
+
+def _cell_index(lidar):
+    # flattened (channel, x, y) cell of every point inside the grid
+    x, y, z = lidar[:, 0], lidar[:, 1], lidar[:, 2]
+    inside = (x >= X_EDGES[0]) & (x <= X_EDGES[-1]) & (y >= Y_EDGES[0]) & (y <= Y_EDGES[-1]) & ~np.isnan(z)
+    x_index = _bin_index(x[inside].astype(np.float64), X_EDGES)
+    y_index = _bin_index(y[inside].astype(np.float64), Y_EDGES)
+    channel = z[inside] > GROUND_HEIGHT
+    return (channel * NUM_X_BINS + x_index) * NUM_Y_BINS + y_index
+
+
+def _counts_to_features(counts):
+    # counts: [N, 2, NUM_X_BINS, NUM_Y_BINS] -> [N, 3, NUM_X_BINS, NUM_Y_BINS] float32
+    clipped = np.minimum(counts, HIST_MAX_PER_PIXEL)
+    features = np.empty((len(counts), 3, NUM_X_BINS, NUM_Y_BINS), dtype=np.float32)
+    features[:, :2] = _SPLAT[clipped]
+    features[:, 2] = _TOTAL[clipped[:, 0] * (HIST_MAX_PER_PIXEL + 1) + clipped[:, 1]]
+    return features
+
+
+def lidar_to_histogram_features(lidar, crop=256):
+    """
+    Convert LiDAR point cloud into 2-bin histogram over 224x224 grid
+    (channels: below ground threshold, above, total). crop is unused and kept for compatibility.
+    """
+    counts = np.bincount(_cell_index(lidar), minlength=2 * NUM_X_BINS * NUM_Y_BINS)
+    return _counts_to_features(counts.reshape(1, 2, NUM_X_BINS, NUM_Y_BINS))[0]
+
+
+def lidar_to_histogram_features_batch(lidars):
+    """
+    lidar_to_histogram_features for a list of point clouds, returns float32 [len(lidars), 3, 224, 224].
+    """
+    frame_cells = 2 * NUM_X_BINS * NUM_Y_BINS
+    counts = np.empty((len(lidars), frame_cells), dtype=np.int64)
+    for i, lidar in enumerate(lidars):
+        counts[i] = np.bincount(_cell_index(lidar), minlength=frame_cells)
+    return _counts_to_features(counts.reshape(len(lidars), 2, NUM_X_BINS, NUM_Y_BINS))
+
+
+def transform_2d_points(xyz, r1, t1_x, t1_y, r2, t2_x, t2_y):
+    """
+    Move points from the frame of pose 1 (rotation r1, translation t1) into the frame of pose 2.
+
+    Both poses are rigid, so the inverse of pose 2 is its transpose and the two transforms are
+    composed into a single 2x2 rotation and translation. z is kept as is.
+    """
+    c1, s1 = np.cos(r1), np.sin(r1)
+    c2, s2 = np.cos(r2), np.sin(r2)
+    r1_to_world = np.array([[c1, s1], [-s1, c1]])
+    world_to_r2 = np.array([[c2, -s2], [s2, c2]])
+    rotation = world_to_r2 @ r1_to_world
+    translation = world_to_r2 @ np.array([t1_x - t2_x, t1_y - t2_y])
+
+    x, y = xyz[:, 0].astype(np.float64), xyz[:, 1].astype(np.float64)
+    out = np.empty(xyz.shape, dtype=np.result_type(xyz.dtype, np.float64))
+    out[:, 0] = rotation[0, 0] * x + rotation[0, 1] * y + translation[0]
+    out[:, 1] = rotation[1, 0] * x + rotation[1, 1] * y + translation[1]
+    out[:, 2:] = xyz[:, 2:]
+    return out
@@ -1,56 +1,4 @@
-from .byoanet import *
-from .byobnet import *
-from .cait import *
-from .coat import *
-from .convit import *
-from .cspnet import *
-from .densenet import *
-from .dla import *
-from .dpn import *
-from .efficientnet import *
-from .ghostnet import *
-from .gluon_resnet import *
-from .gluon_xception import *
-from .hardcorenas import *
-from .hrnet import *
-from .inception_resnet_v2 import *
-from .inception_v3 import *
-from .inception_v4 import *
-from .levit import *
-from .mlp_mixer import *
-from .mobilenetv3 import *
-from .nasnet import *
-from .nest import *
-from .nfnet import *
-from .pit import *
-from .pnasnet import *
-from .regnet import *
-from .res2net import *
-from .resnest import *
-from .resnet import *
-from .resnetv2 import *
-from .rexnet import *
-from .selecsls import *
-from .senet import *
-from .sknet import *
-from .swin_transformer import *
-from .tnt import *
-from .tresnet import *
-from .vgg import *
-from .visformer import *
-from .vision_transformer_hybrid import *
-from .vovnet import *
-from .xception import *
-from .xception_aligned import *
-from .xcit import *
-from .twins import *
-from .interfuser import *
-from .pointpillar import *
-from .memfuser import *
-from .bevdriver_encoder import *
-from .bevdriver_encoder_train import * 
-
-
+from ._lazy import lazy_module_getattr
 from .factory import create_model, split_model_name, safe_model_name
 from .helpers import load_checkpoint, resume_checkpoint, model_parameters
 from .layers import TestTimePoolHead, apply_test_time_pool
@@ -74,4 +22,15 @@ from .registry import (
     is_model_default_key,
     get_model_default_value,
     is_model_pretrained,
+    register_lazy_models,
 )
+from .model_index import MODULE_EXPORTS, MODULE_MODELS
+
+# the model modules are imported on the first lookup of one of their models or names, not here
+_module_of_name = {}
+for _module, _models in MODULE_MODELS.items():
+    register_lazy_models("%s.%s" % (__name__, _module), _models)
+    _module_of_name.update(dict.fromkeys(_models + MODULE_EXPORTS.get(_module, ()), "%s.%s" % (__name__, _module)))
+
+# the models and other names of the model modules (formerly star imported), and the modules
+__getattr__ = lazy_module_getattr(__name__, _module_of_name, MODULE_MODELS)
@@ -0,0 +1,21 @@
+import sys
+import importlib
+
+
+def lazy_module_getattr(package, module_of_name, modules=()):
+    """
+    Module __getattr__ of a package that imports the module of a name (a dict of name to module path) on
+    first access and keeps the value in the package, in place of importing them all in its __init__. The
+    submodules of the package named in modules are imported when accessed as attributes.
+    """
+
+    def __getattr__(name):
+        if name in module_of_name:
+            value = getattr(importlib.import_module(module_of_name[name]), name)
+            setattr(sys.modules[package], name, value)
+            return value
+        if name in modules:
+            return importlib.import_module("%s.%s" % (package, name))
+        raise AttributeError("module %r has no attribute %r" % (package, name))
+
+    return __getattr__
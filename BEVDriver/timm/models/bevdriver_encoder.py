@@ -85,11 +85,18 @@ class PositionEmbeddingSine(nn.Module):
         if scale is None:
             scale = 2 * math.pi
         self.scale = scale
+        # the embedding only depends on the feature map size, one [1, C, h, w] table per size and device
+        self._tables = {}
 
     def forward(self, tensor):
-        x = tensor
-        bs, _, h, w = x.shape
-        not_mask = torch.ones((bs, h, w), device=x.device)
+        bs, _, h, w = tensor.shape
+        key = (h, w, tensor.device)
+        if key not in self._tables:
+            self._tables[key] = self.table(h, w, tensor.device)
+        return self._tables[key].expand(bs, -1, -1, -1)
+
+    def table(self, h, w, device):
+        not_mask = torch.ones((1, h, w), device=device)
         y_embed = not_mask.cumsum(1, dtype=torch.float32)
         x_embed = not_mask.cumsum(2, dtype=torch.float32)
         if self.normalize:
@@ -97,7 +104,7 @@ class PositionEmbeddingSine(nn.Module):
             y_embed = y_embed / (y_embed[:, -1:, :] + eps) * self.scale
             x_embed = x_embed / (x_embed[:, :, -1:] + eps) * self.scale
 
-        dim_t = torch.arange(self.num_pos_feats, dtype=torch.float32, device=x.device)
+        dim_t = torch.arange(self.num_pos_feats, dtype=torch.float32, device=device)
         dim_t = self.temperature ** (2 * (dim_t // 2) / self.num_pos_feats)
 
         pos_x = x_embed[:, :, :, None] / dim_t
@@ -615,6 +622,18 @@ def build_attn_mask(mask_type):
     return mask
 
 
+def interfuser_input_keys(with_lidar=True, with_right_left_sensors=True, with_center_sensor=True, direct_concat=False):
+    """ Sensor fields of a sample that Interfuser.forward reads with these flags (rgb_rear never is)"""
+    keys = ["rgb"]
+    if with_right_left_sensors or direct_concat:
+        keys += ["rgb_left", "rgb_right"]
+    if with_center_sensor or direct_concat:
+        keys.append("rgb_center")
+    if with_lidar:
+        keys.append("lidar")
+    return keys
+
+
 class Interfuser(nn.Module):
     def __init__(
         self,
@@ -641,6 +660,7 @@ class Interfuser(nn.Module):
         reverse_pos=True,
         use_different_backbone=False,
         use_view_embed=True,
+        pretrained_backbone=True,
     ):
         super().__init__()
         self.num_features = (
@@ -659,6 +679,7 @@ class Interfuser(nn.Module):
         self.separate_view_attention = separate_view_attention
         self.separate_all_attention = separate_all_attention
         self.use_view_embed = use_view_embed
+        self.input_keys = interfuser_input_keys(with_lidar, with_right_left_sensors, with_center_sensor, direct_concat)
 
         if self.direct_concat:
             in_chans = in_chans * 4
@@ -675,11 +696,11 @@ class Interfuser(nn.Module):
         # Backbone and embedding setup
         if use_different_backbone:
             if rgb_backbone_name == "r50":
-                self.rgb_backbone = resnet50d(pretrained=True, in_chans=in_chans, features_only=True, out_indices=[4])
+                self.rgb_backbone = resnet50d(pretrained=pretrained_backbone, in_chans=in_chans, features_only=True, out_indices=[4])
             elif rgb_backbone_name == "r26":
-                self.rgb_backbone = resnet26d(pretrained=True, in_chans=in_chans, features_only=True, out_indices=[4])
+                self.rgb_backbone = resnet26d(pretrained=pretrained_backbone, in_chans=in_chans, features_only=True, out_indices=[4])
             elif rgb_backbone_name == "r18":
-                self.rgb_backbone = resnet18d(pretrained=True, in_chans=in_chans, features_only=True, out_indices=[4])
+                self.rgb_backbone = resnet18d(pretrained=pretrained_backbone, in_chans=in_chans, features_only=True, out_indices=[4])
 
             if lidar_backbone_name == "r50":
                 self.lidar_backbone = resnet50d(pretrained=False, in_chans=in_chans, features_only=True, out_indices=[4])
@@ -695,11 +716,11 @@ class Interfuser(nn.Module):
             self.lidar_patch_embed = lidar_embed_layer(img_size=img_size, patch_size=patch_size, in_chans=3, embed_dim=embed_dim)
         else:
             if rgb_backbone_name == "r50":
-                self.rgb_backbone = resnet50d(pretrained=True, in_chans=3, features_only=True, out_indices=[4])
+                self.rgb_backbone = resnet50d(pretrained=pretrained_backbone, in_chans=3, features_only=True, out_indices=[4])
             elif rgb_backbone_name == "r26":
-                self.rgb_backbone = resnet26d(pretrained=True, in_chans=3, features_only=True, out_indices=[4])
+                self.rgb_backbone = resnet26d(pretrained=pretrained_backbone, in_chans=3, features_only=True, out_indices=[4])
             elif rgb_backbone_name == "r18":
-                self.rgb_backbone = resnet18d(pretrained=True, in_chans=3, features_only=True, out_indices=[4])
+                self.rgb_backbone = resnet18d(pretrained=pretrained_backbone, in_chans=3, features_only=True, out_indices=[4])
 
             embed_layer = partial(HybridEmbed, backbone=self.rgb_backbone)
             self.rgb_patch_embed = embed_layer(img_size=img_size, patch_size=patch_size, in_chans=in_chans, embed_dim=embed_dim)
@@ -721,76 +742,58 @@ class Interfuser(nn.Module):
         nn.init.uniform_(self.global_embed)
         nn.init.uniform_(self.view_embed)
 
+    def view_tokens(self, image_token, image_token_global, view):
+        """ Tokens [h*w, B, C] and global token [1, B, C] of a view (4 is the LiDAR), with its view and position embedding"""
+        if self.use_view_embed:
+            image_token = image_token + self.view_embed[:, :, view:view+1, :] + self.position_encoding(image_token)
+        else:
+            image_token = image_token + self.position_encoding(image_token)
+        image_token = image_token.flatten(2).permute(2, 0, 1)
+        image_token_global = image_token_global + self.view_embed[:, :, view, :] + self.global_embed[:, :, view:view+1]
+        image_token_global = image_token_global.permute(2, 0, 1)
+        return [image_token, image_token_global]
+
+    def patch_embed_views(self, images):
+        """
+        rgb_patch_embed of every image. Images of the same size are stacked along the batch for one
+        backbone pass in eval mode; in training mode every view keeps its own batch norm statistics.
+        """
+        if self.training or any(image.shape != images[0].shape for image in images):
+            return [self.rgb_patch_embed(image) for image in images]
+        image_token, image_token_global = self.rgb_patch_embed(torch.cat(images))
+        return list(zip(image_token.chunk(len(images)), image_token_global.chunk(len(images))))
+
     def forward_features(self, front_image, left_image, right_image, front_center_image, lidar, measurements):
         features = []
 
         # Front view processing
-        front_image_token, front_image_token_global = self.rgb_patch_embed(front_image)
-        if self.use_view_embed:
-            front_image_token = front_image_token + self.view_embed[:, :, 0:1, :] + self.position_encoding(front_image_token)
-        else:
-            front_image_token = front_image_token + self.position_encoding(front_image_token)
-        front_image_token = front_image_token.flatten(2).permute(2, 0, 1)
-        front_image_token_global = front_image_token_global + self.view_embed[:, :, 0, :] + self.global_embed[:, :, 0:1]
-        front_image_token_global = front_image_token_global.permute(2, 0, 1)
-        features.extend([front_image_token, front_image_token_global])
+        features.extend(self.view_tokens(*self.rgb_patch_embed(front_image), 0))
 
+        # left, right and front center views (view embeddings 1, 2 and 3), 128 px each
+        views = []
         if self.with_right_left_sensors:
-            # Left view processing
-            left_image_token, left_image_token_global = self.rgb_patch_embed(left_image)
-            if self.use_view_embed:
-                left_image_token = left_image_token + self.view_embed[:, :, 1:2, :] + self.position_encoding(left_image_token)
-            else:
-                left_image_token = left_image_token + self.position_encoding(left_image_token)
-            left_image_token = left_image_token.flatten(2).permute(2, 0, 1)
-            left_image_token_global = left_image_token_global + self.view_embed[:, :, 1, :] + self.global_embed[:, :, 1:2]
-            left_image_token_global = left_image_token_global.permute(2, 0, 1)
-
-            # Right view processing
-            right_image_token, right_image_token_global = self.rgb_patch_embed(right_image)
-            if self.use_view_embed:
-                right_image_token = right_image_token + self.view_embed[:, :, 2:3, :] + self.position_encoding(right_image_token)
-            else:
-                right_image_token = right_image_token + self.position_encoding(right_image_token)
-            right_image_token = right_image_token.flatten(2).permute(2, 0, 1)
-            right_image_token_global = right_image_token_global + self.view_embed[:, :, 2, :] + self.global_embed[:, :, 2:3]
-            right_image_token_global = right_image_token_global.permute(2, 0, 1)
-
-            features.extend([left_image_token, left_image_token_global, right_image_token, right_image_token_global])
-
+            views.extend([(1, left_image), (2, right_image)])
         if self.with_center_sensor:
-            # Front center view processing
-            front_center_image_token, front_center_image_token_global = self.rgb_patch_embed(front_center_image)
-            if self.use_view_embed:
-                front_center_image_token = front_center_image_token + self.view_embed[:, :, 3:4, :] + self.position_encoding(front_center_image_token)
-            else:
-                front_center_image_token = front_center_image_token + self.position_encoding(front_center_image_token)
-            front_center_image_token = front_center_image_token.flatten(2).permute(2, 0, 1)
-            front_center_image_token_global = front_center_image_token_global + self.view_embed[:, :, 3, :] + self.global_embed[:, :, 3:4]
-            front_center_image_token_global = front_center_image_token_global.permute(2, 0, 1)
-            features.extend([front_center_image_token, front_center_image_token_global])
+            views.append((3, front_center_image))
+        if len(views):
+            embeds = self.patch_embed_views([image for _, image in views])
+            for (view, _), (image_token, image_token_global) in zip(views, embeds):
+                features.extend(self.view_tokens(image_token, image_token_global, view))
 
         if self.with_lidar:
-            lidar_token, lidar_token_global = self.lidar_patch_embed(lidar)
-            if self.use_view_embed:
-                lidar_token = lidar_token + self.view_embed[:, :, 4:5, :] + self.position_encoding(lidar_token)
-            else:
-                lidar_token = lidar_token + self.position_encoding(lidar_token)
-            lidar_token = lidar_token.flatten(2).permute(2, 0, 1)
-            lidar_token_global = lidar_token_global + self.view_embed[:, :, 4, :] + self.global_embed[:, :, 4:5]
-            lidar_token_global = lidar_token_global.permute(2, 0, 1)
-            features.extend([lidar_token, lidar_token_global])
+            features.extend(self.view_tokens(*self.lidar_patch_embed(lidar), 4))
 
         features = torch.cat(features, 0)
         return features
 
     def forward(self, x):
-        front_image = x["rgb"] 
-        left_image = x["rgb_left"]
-        right_image = x["rgb_right"]
-        front_center_image = x["rgb_center"]
-        measurements = x["measurements"] 
-        lidar = x["lidar"]
+        # the views not in self.input_keys may be missing from x
+        front_image = x["rgb"]
+        left_image = x.get("rgb_left")
+        right_image = x.get("rgb_right")
+        front_center_image = x.get("rgb_center")
+        measurements = x["measurements"]
+        lidar = x.get("lidar")
 
         if self.direct_concat:
             img_size = front_image.shape[-1]
@@ -817,14 +820,23 @@ class Lambda(nn.Module):
 
 
 
+# input_keys: sensor fields the datasets have to load for the model (see DriveTask.build_datasets)
+default_cfgs = {
+    "bevdriver_encoder": {"input_keys": interfuser_input_keys()},
+}
+
+
 @register_model
-def bevdriver_encoder(**kwargs):
+def bevdriver_encoder(pretrained_backbone=True, **kwargs):
+    # pretrained_backbone=False skips the ImageNet weights of the rgb backbone, e.g. when a checkpoint
+    # replaces all weights anyway
     model = Interfuser(
         enc_depth=6,
         embed_dim=256,
         rgb_backbone_name="r50",
         lidar_backbone_name="r18",
         use_different_backbone=True,
+        pretrained_backbone=pretrained_backbone,
     )
     return model
 
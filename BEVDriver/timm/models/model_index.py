@@ -0,0 +1,425 @@
+""" Model Index
+
+The models each module of timm.models registers and the other names it exports with `__all__`, so that
+`import timm.models` registers the models lazily (see registry.register_lazy_models) and imports a model
+module only when one of its models or names is used.
+
+Regenerate after adding a model module (add it to MODULE_MODELS with no models first) or a model:
+
+python -m timm.models.model_index
+"""
+
+import importlib
+import os
+import textwrap
+
+MODULE_MODELS = {
+    "byoanet": (
+        "botnet26t_256", "botnet50ts_256", "eca_botnext26ts_256", "eca_halonext26ts",
+        "eca_lambda_resnext26ts", "eca_swinnext26ts_256", "halonet26t", "halonet50ts", "halonet_h1",
+        "halonet_h1_c4c5", "lambda_resnet26t", "lambda_resnet50t", "rednet26t", "rednet50ts",
+        "swinnet26t_256", "swinnet50ts_256",
+    ),
+    "byobnet": (
+        "bat_resnext26ts", "gcresnet26ts", "gcresnet50t", "gcresnext26ts", "geresnet50t", "gernet_l",
+        "gernet_m", "gernet_s", "repvgg_a2", "repvgg_b0", "repvgg_b1", "repvgg_b1g4", "repvgg_b2",
+        "repvgg_b2g4", "repvgg_b3", "repvgg_b3g4", "resnet51q", "resnet61q",
+    ),
+    "cait": (
+        "cait_m36_384", "cait_m48_448", "cait_s24_224", "cait_s24_384", "cait_s36_384", "cait_xs24_384",
+        "cait_xxs24_224", "cait_xxs24_384", "cait_xxs36_224", "cait_xxs36_384",
+    ),
+    "coat": (
+        "coat_lite_mini", "coat_lite_small", "coat_lite_tiny", "coat_mini", "coat_tiny",
+    ),
+    "convit": (
+        "convit_base", "convit_small", "convit_tiny",
+    ),
+    "cspnet": (
+        "cspdarknet53", "cspdarknet53_iabn", "cspresnet50", "cspresnet50d", "cspresnet50w", "cspresnext50",
+        "cspresnext50_iabn", "darknet53",
+    ),
+    "densenet": (
+        "densenet121", "densenet121d", "densenet161", "densenet169", "densenet201", "densenet264",
+        "densenet264d_iabn", "densenetblur121d", "tv_densenet121",
+    ),
+    "dla": (
+        "dla102", "dla102x", "dla102x2", "dla169", "dla34", "dla46_c", "dla46x_c", "dla60", "dla60_res2net",
+        "dla60_res2next", "dla60x", "dla60x_c",
+    ),
+    "dpn": (
+        "dpn107", "dpn131", "dpn68", "dpn68b", "dpn92", "dpn98",
+    ),
+    "efficientnet": (
+        "efficientnet_b0", "efficientnet_b1", "efficientnet_b1_pruned", "efficientnet_b2",
+        "efficientnet_b2_pruned", "efficientnet_b2a", "efficientnet_b3", "efficientnet_b3_pruned",
+        "efficientnet_b3a", "efficientnet_b4", "efficientnet_b5", "efficientnet_b6", "efficientnet_b7",
+        "efficientnet_b8", "efficientnet_cc_b0_4e", "efficientnet_cc_b0_8e", "efficientnet_cc_b1_8e",
+        "efficientnet_el", "efficientnet_el_pruned", "efficientnet_em", "efficientnet_es",
+        "efficientnet_es_pruned", "efficientnet_l2", "efficientnet_lite0", "efficientnet_lite1",
+        "efficientnet_lite2", "efficientnet_lite3", "efficientnet_lite4", "efficientnetv2_l",
+        "efficientnetv2_m", "efficientnetv2_rw_m", "efficientnetv2_rw_s", "efficientnetv2_rw_t",
+        "efficientnetv2_s", "efficientnetv2_xl", "fbnetc_100", "gc_efficientnetv2_rw_t", "mixnet_l",
+        "mixnet_m", "mixnet_s", "mixnet_xl", "mixnet_xxl", "mnasnet_050", "mnasnet_075", "mnasnet_100",
+        "mnasnet_140", "mnasnet_a1", "mnasnet_b1", "mnasnet_small", "mobilenetv2_100", "mobilenetv2_110d",
+        "mobilenetv2_120d", "mobilenetv2_140", "semnasnet_050", "semnasnet_075", "semnasnet_100",
+        "semnasnet_140", "spnasnet_100", "tf_efficientnet_b0", "tf_efficientnet_b0_ap",
+        "tf_efficientnet_b0_ns", "tf_efficientnet_b1", "tf_efficientnet_b1_ap", "tf_efficientnet_b1_ns",
+        "tf_efficientnet_b2", "tf_efficientnet_b2_ap", "tf_efficientnet_b2_ns", "tf_efficientnet_b3",
+        "tf_efficientnet_b3_ap", "tf_efficientnet_b3_ns", "tf_efficientnet_b4", "tf_efficientnet_b4_ap",
+        "tf_efficientnet_b4_ns", "tf_efficientnet_b5", "tf_efficientnet_b5_ap", "tf_efficientnet_b5_ns",
+        "tf_efficientnet_b6", "tf_efficientnet_b6_ap", "tf_efficientnet_b6_ns", "tf_efficientnet_b7",
+        "tf_efficientnet_b7_ap", "tf_efficientnet_b7_ns", "tf_efficientnet_b8", "tf_efficientnet_b8_ap",
+        "tf_efficientnet_cc_b0_4e", "tf_efficientnet_cc_b0_8e", "tf_efficientnet_cc_b1_8e",
+        "tf_efficientnet_el", "tf_efficientnet_em", "tf_efficientnet_es", "tf_efficientnet_l2_ns",
+        "tf_efficientnet_l2_ns_475", "tf_efficientnet_lite0", "tf_efficientnet_lite1",
+        "tf_efficientnet_lite2", "tf_efficientnet_lite3", "tf_efficientnet_lite4", "tf_efficientnetv2_b0",
+        "tf_efficientnetv2_b1", "tf_efficientnetv2_b2", "tf_efficientnetv2_b3", "tf_efficientnetv2_l",
+        "tf_efficientnetv2_l_in21ft1k", "tf_efficientnetv2_l_in21k", "tf_efficientnetv2_m",
+        "tf_efficientnetv2_m_in21ft1k", "tf_efficientnetv2_m_in21k", "tf_efficientnetv2_s",
+        "tf_efficientnetv2_s_in21ft1k", "tf_efficientnetv2_s_in21k", "tf_efficientnetv2_xl_in21ft1k",
+        "tf_efficientnetv2_xl_in21k", "tf_mixnet_l", "tf_mixnet_m", "tf_mixnet_s",
+    ),
+    "ghostnet": (
+        "ghostnet_050", "ghostnet_100", "ghostnet_130",
+    ),
+    "gluon_resnet": (
+        "gluon_resnet101_v1b", "gluon_resnet101_v1c", "gluon_resnet101_v1d", "gluon_resnet101_v1s",
+        "gluon_resnet152_v1b", "gluon_resnet152_v1c", "gluon_resnet152_v1d", "gluon_resnet152_v1s",
+        "gluon_resnet18_v1b", "gluon_resnet34_v1b", "gluon_resnet50_v1b", "gluon_resnet50_v1c",
+        "gluon_resnet50_v1d", "gluon_resnet50_v1s", "gluon_resnext101_32x4d", "gluon_resnext101_64x4d",
+        "gluon_resnext50_32x4d", "gluon_senet154", "gluon_seresnext101_32x4d", "gluon_seresnext101_64x4d",
+        "gluon_seresnext50_32x4d",
+    ),
+    "gluon_xception": (
+        "gluon_xception65",
+    ),
+    "hardcorenas": (
+        "hardcorenas_a", "hardcorenas_b", "hardcorenas_c", "hardcorenas_d", "hardcorenas_e",
+        "hardcorenas_f",
+    ),
+    "hrnet": (
+        "hrnet_w18", "hrnet_w18_small", "hrnet_w18_small_v2", "hrnet_w30", "hrnet_w32", "hrnet_w40",
+        "hrnet_w44", "hrnet_w48", "hrnet_w64",
+    ),
+    "inception_resnet_v2": (
+        "ens_adv_inception_resnet_v2", "inception_resnet_v2",
+    ),
+    "inception_v3": (
+        "adv_inception_v3", "gluon_inception_v3", "inception_v3", "tf_inception_v3",
+    ),
+    "inception_v4": (
+        "inception_v4",
+    ),
+    "levit": (
+        "levit_128", "levit_128s", "levit_192", "levit_256", "levit_384",
+    ),
+    "mlp_mixer": (
+        "gmixer_12_224", "gmixer_24_224", "gmlp_b16_224", "gmlp_s16_224", "gmlp_ti16_224", "mixer_b16_224",
+        "mixer_b16_224_in21k", "mixer_b16_224_miil", "mixer_b16_224_miil_in21k", "mixer_b32_224",
+        "mixer_l16_224", "mixer_l16_224_in21k", "mixer_l32_224", "mixer_s16_224", "mixer_s32_224",
+        "resmlp_12_224", "resmlp_12_distilled_224", "resmlp_24_224", "resmlp_24_distilled_224",
+        "resmlp_36_224", "resmlp_36_distilled_224", "resmlp_big_24_224", "resmlp_big_24_224_in22ft1k",
+        "resmlp_big_24_distilled_224",
+    ),
+    "mobilenetv3": (
+        "fbnetv3_b", "fbnetv3_d", "fbnetv3_g", "mobilenetv3_large_075", "mobilenetv3_large_100",
+        "mobilenetv3_large_100_miil", "mobilenetv3_large_100_miil_in21k", "mobilenetv3_rw",
+        "mobilenetv3_small_075", "mobilenetv3_small_100", "tf_mobilenetv3_large_075",
+        "tf_mobilenetv3_large_100", "tf_mobilenetv3_large_minimal_100", "tf_mobilenetv3_small_075",
+        "tf_mobilenetv3_small_100", "tf_mobilenetv3_small_minimal_100",
+    ),
+    "nasnet": (
+        "nasnetalarge",
+    ),
+    "nest": (
+        "jx_nest_base", "jx_nest_small", "jx_nest_tiny", "nest_base", "nest_small", "nest_tiny",
+    ),
+    "nfnet": (
+        "dm_nfnet_f0", "dm_nfnet_f1", "dm_nfnet_f2", "dm_nfnet_f3", "dm_nfnet_f4", "dm_nfnet_f5",
+        "dm_nfnet_f6", "eca_nfnet_l0", "eca_nfnet_l1", "eca_nfnet_l2", "eca_nfnet_l3", "nf_ecaresnet101",
+        "nf_ecaresnet26", "nf_ecaresnet50", "nf_regnet_b0", "nf_regnet_b1", "nf_regnet_b2", "nf_regnet_b3",
+        "nf_regnet_b4", "nf_regnet_b5", "nf_resnet101", "nf_resnet26", "nf_resnet50", "nf_seresnet101",
+        "nf_seresnet26", "nf_seresnet50", "nfnet_f0", "nfnet_f0s", "nfnet_f1", "nfnet_f1s", "nfnet_f2",
+        "nfnet_f2s", "nfnet_f3", "nfnet_f3s", "nfnet_f4", "nfnet_f4s", "nfnet_f5", "nfnet_f5s", "nfnet_f6",
+        "nfnet_f6s", "nfnet_f7", "nfnet_f7s", "nfnet_l0",
+    ),
+    "pit": (
+        "pit_b_224", "pit_b_distilled_224", "pit_s_224", "pit_s_distilled_224", "pit_ti_224",
+        "pit_ti_distilled_224", "pit_xs_224", "pit_xs_distilled_224",
+    ),
+    "pnasnet": (
+        "pnasnet5large",
+    ),
+    "regnet": (
+        "regnetx_002", "regnetx_004", "regnetx_006", "regnetx_008", "regnetx_016", "regnetx_032",
+        "regnetx_040", "regnetx_064", "regnetx_080", "regnetx_120", "regnetx_160", "regnetx_320",
+        "regnety_002", "regnety_004", "regnety_006", "regnety_008", "regnety_016", "regnety_032",
+        "regnety_040", "regnety_064", "regnety_080", "regnety_120", "regnety_160", "regnety_320",
+    ),
+    "res2net": (
+        "res2net101_26w_4s", "res2net50_14w_8s", "res2net50_26w_4s", "res2net50_26w_6s", "res2net50_26w_8s",
+        "res2net50_48w_2s", "res2next50",
+    ),
+    "resnest": (
+        "resnest101e", "resnest14d", "resnest200e", "resnest269e", "resnest26d", "resnest50d",
+        "resnest50d_1s4x24d", "resnest50d_4s2x40d",
+    ),
+    "resnet": (
+        "ecaresnet101d", "ecaresnet101d_pruned", "ecaresnet200d", "ecaresnet269d", "ecaresnet26t",
+        "ecaresnet50d", "ecaresnet50d_pruned", "ecaresnet50t", "ecaresnetlight", "ecaresnext26t_32x4d",
+        "ecaresnext50t_32x4d", "ig_resnext101_32x16d", "ig_resnext101_32x32d", "ig_resnext101_32x48d",
+        "ig_resnext101_32x8d", "resnet101", "resnet101d", "resnet152", "resnet152d", "resnet18",
+        "resnet18d", "resnet200", "resnet200d", "resnet26", "resnet26d", "resnet26t", "resnet34",
+        "resnet34d", "resnet50", "resnet50d", "resnet50t", "resnetblur18", "resnetblur50", "resnetrs101",
+        "resnetrs152", "resnetrs200", "resnetrs270", "resnetrs350", "resnetrs420", "resnetrs50",
+        "resnext101_32x4d", "resnext101_32x8d", "resnext101_64x4d", "resnext50_32x4d", "resnext50d_32x4d",
+        "senet154", "seresnet101", "seresnet152", "seresnet152d", "seresnet18", "seresnet200d",
+        "seresnet269d", "seresnet34", "seresnet50", "seresnet50t", "seresnext101_32x4d",
+        "seresnext101_32x8d", "seresnext26d_32x4d", "seresnext26t_32x4d", "seresnext26tn_32x4d",
+        "seresnext50_32x4d", "ssl_resnet18", "ssl_resnet50", "ssl_resnext101_32x16d",
+        "ssl_resnext101_32x4d", "ssl_resnext101_32x8d", "ssl_resnext50_32x4d", "swsl_resnet18",
+        "swsl_resnet50", "swsl_resnext101_32x16d", "swsl_resnext101_32x4d", "swsl_resnext101_32x8d",
+        "swsl_resnext50_32x4d", "tv_resnet101", "tv_resnet152", "tv_resnet34", "tv_resnet50",
+        "tv_resnext50_32x4d", "wide_resnet101_2", "wide_resnet50_2",
+    ),
+    "resnetv2": (
+        "resnetv2_101", "resnetv2_101d", "resnetv2_101x1_bitm", "resnetv2_101x1_bitm_in21k",
+        "resnetv2_101x3_bitm", "resnetv2_101x3_bitm_in21k", "resnetv2_152", "resnetv2_152d",
+        "resnetv2_152x2_bit_teacher", "resnetv2_152x2_bit_teacher_384", "resnetv2_152x2_bitm",
+        "resnetv2_152x2_bitm_in21k", "resnetv2_152x4_bitm", "resnetv2_152x4_bitm_in21k", "resnetv2_50",
+        "resnetv2_50d", "resnetv2_50t", "resnetv2_50x1_bit_distilled", "resnetv2_50x1_bitm",
+        "resnetv2_50x1_bitm_in21k", "resnetv2_50x3_bitm", "resnetv2_50x3_bitm_in21k",
+    ),
+    "rexnet": (
+        "rexnet_100", "rexnet_130", "rexnet_150", "rexnet_200", "rexnetr_100", "rexnetr_130", "rexnetr_150",
+        "rexnetr_200",
+    ),
+    "selecsls": (
+        "selecsls42", "selecsls42b", "selecsls60", "selecsls60b", "selecsls84",
+    ),
+    "senet": (
+        "legacy_senet154", "legacy_seresnet101", "legacy_seresnet152", "legacy_seresnet18",
+        "legacy_seresnet34", "legacy_seresnet50", "legacy_seresnext101_32x4d", "legacy_seresnext26_32x4d",
+        "legacy_seresnext50_32x4d",
+    ),
+    "sknet": (
+        "skresnet18", "skresnet34", "skresnet50", "skresnet50d", "skresnext50_32x4d",
+    ),
+    "swin_transformer": (
+        "swin_base_patch4_window12_384", "swin_base_patch4_window12_384_in22k",
+        "swin_base_patch4_window7_224", "swin_base_patch4_window7_224_in22k",
+        "swin_large_patch4_window12_384", "swin_large_patch4_window12_384_in22k",
+        "swin_large_patch4_window7_224", "swin_large_patch4_window7_224_in22k",
+        "swin_small_patch4_window7_224", "swin_tiny_patch4_window7_224",
+    ),
+    "tnt": (
+        "tnt_b_patch16_224", "tnt_s_patch16_224",
+    ),
+    "tresnet": (
+        "tresnet_l", "tresnet_l_448", "tresnet_m", "tresnet_m_448", "tresnet_m_miil_in21k", "tresnet_xl",
+        "tresnet_xl_448",
+    ),
+    "vgg": (
+        "vgg11", "vgg11_bn", "vgg13", "vgg13_bn", "vgg16", "vgg16_bn", "vgg19", "vgg19_bn",
+    ),
+    "visformer": (
+        "visformer_small", "visformer_tiny",
+    ),
+    "vision_transformer": (
+        "deit_base_distilled_patch16_224", "deit_base_distilled_patch16_384", "deit_base_patch16_224",
+        "deit_base_patch16_384", "deit_small_distilled_patch16_224", "deit_small_patch16_224",
+        "deit_tiny_distilled_patch16_224", "deit_tiny_patch16_224", "vit_base_patch16_224",
+        "vit_base_patch16_224_in21k", "vit_base_patch16_224_miil", "vit_base_patch16_224_miil_in21k",
+        "vit_base_patch16_384", "vit_base_patch16_sam_224", "vit_base_patch32_224",
+        "vit_base_patch32_224_in21k", "vit_base_patch32_384", "vit_base_patch32_sam_224",
+        "vit_huge_patch14_224_in21k", "vit_large_patch16_224", "vit_large_patch16_224_in21k",
+        "vit_large_patch16_384", "vit_large_patch32_224", "vit_large_patch32_224_in21k",
+        "vit_large_patch32_384", "vit_small_patch16_224", "vit_small_patch16_224_in21k",
+        "vit_small_patch16_384", "vit_small_patch32_224", "vit_small_patch32_224_in21k",
+        "vit_small_patch32_384", "vit_tiny_patch16_224", "vit_tiny_patch16_224_in21k",
+        "vit_tiny_patch16_384",
+    ),
+    "vision_transformer_hybrid": (
+        "vit_base_r26_s32_224", "vit_base_r50_s16_224", "vit_base_r50_s16_224_in21k",
+        "vit_base_r50_s16_384", "vit_base_resnet26d_224", "vit_base_resnet50_224_in21k",
+        "vit_base_resnet50_384", "vit_base_resnet50d_224", "vit_large_r50_s32_224",
+        "vit_large_r50_s32_224_in21k", "vit_large_r50_s32_384", "vit_small_r26_s32_224",
+        "vit_small_r26_s32_224_in21k", "vit_small_r26_s32_384", "vit_small_resnet26d_224",
+        "vit_small_resnet50d_s16_224", "vit_tiny_r_s16_p8_224", "vit_tiny_r_s16_p8_224_in21k",
+        "vit_tiny_r_s16_p8_384",
+    ),
+    "vovnet": (
+        "eca_vovnet39b", "ese_vovnet19b_dw", "ese_vovnet19b_slim", "ese_vovnet19b_slim_dw", "ese_vovnet39b",
+        "ese_vovnet39b_evos", "ese_vovnet57b", "ese_vovnet99b", "ese_vovnet99b_iabn", "vovnet39a",
+        "vovnet57a",
+    ),
+    "xception": (
+        "xception",
+    ),
+    "xception_aligned": (
+        "xception41", "xception65", "xception71",
+    ),
+    "xcit": (
+        "xcit_large_24_p16_224", "xcit_large_24_p16_224_dist", "xcit_large_24_p16_384_dist",
+        "xcit_large_24_p8_224", "xcit_large_24_p8_224_dist", "xcit_large_24_p8_384_dist",
+        "xcit_medium_24_p16_224", "xcit_medium_24_p16_224_dist", "xcit_medium_24_p16_384_dist",
+        "xcit_medium_24_p8_224", "xcit_medium_24_p8_224_dist", "xcit_medium_24_p8_384_dist",
+        "xcit_nano_12_p16_224", "xcit_nano_12_p16_224_dist", "xcit_nano_12_p16_384_dist",
+        "xcit_nano_12_p8_224", "xcit_nano_12_p8_224_dist", "xcit_nano_12_p8_384_dist",
+        "xcit_small_12_p16_224", "xcit_small_12_p16_224_dist", "xcit_small_12_p16_384_dist",
+        "xcit_small_12_p8_224", "xcit_small_12_p8_224_dist", "xcit_small_12_p8_384_dist",
+        "xcit_small_24_p16_224", "xcit_small_24_p16_224_dist", "xcit_small_24_p16_384_dist",
+        "xcit_small_24_p8_224", "xcit_small_24_p8_224_dist", "xcit_small_24_p8_384_dist",
+        "xcit_tiny_12_p16_224", "xcit_tiny_12_p16_224_dist", "xcit_tiny_12_p16_384_dist",
+        "xcit_tiny_12_p8_224", "xcit_tiny_12_p8_224_dist", "xcit_tiny_12_p8_384_dist",
+        "xcit_tiny_24_p16_224", "xcit_tiny_24_p16_224_dist", "xcit_tiny_24_p16_384_dist",
+        "xcit_tiny_24_p8_224", "xcit_tiny_24_p8_224_dist", "xcit_tiny_24_p8_384_dist",
+    ),
+    "twins": (
+        "twins_pcpvt_base", "twins_pcpvt_large", "twins_pcpvt_small", "twins_svt_base", "twins_svt_large",
+        "twins_svt_small",
+    ),
+    "interfuser": (
+        "interfuser_baseline", "interfuser_baseline_seperate_all", "interfuser_baseline_seperate_view",
+        "interfuser_baseline_wolidar",
+    ),
+    "pointpillar": (
+        "pointpillar", "pointpillar_conv",
+    ),
+    "memfuser": (
+        "memfuser_baseline", "memfuser_baseline_e1d3", "memfuser_baseline_e1d3_r26",
+        "memfuser_baseline_e1d3_r26_return_feature", "memfuser_baseline_e1d3_return_feature",
+        "memfuser_baseline_e2d2", "memfuser_baseline_e3d3", "memfuser_baseline_return_feature",
+    ),
+    "bevdriver_encoder": (
+        "bevdriver_encoder",
+    ),
+    "bevdriver_encoder_train": (
+        "bevdriver_encoder_train",
+    ),
+}
+
+MODULE_EXPORTS = {
+    "byobnet": (
+        "ByobNet", "ByoModelCfg", "ByoBlockCfg", "create_byob_stem", "create_block",
+    ),
+    "cait": (
+        "Cait", "ClassAttn", "LayerScaleBlockClassAttn", "LayerScaleBlock", "TalkingHeadAttn",
+    ),
+    "cspnet": (
+        "CspNet",
+    ),
+    "densenet": (
+        "DenseNet",
+    ),
+    "dla": (
+        "DLA",
+    ),
+    "dpn": (
+        "DPN",
+    ),
+    "efficientnet": (
+        "EfficientNet", "EfficientNetFeatures",
+    ),
+    "ghostnet": (
+        "GhostNet",
+    ),
+    "gluon_xception": (
+        "Xception65",
+    ),
+    "inception_resnet_v2": (
+        "InceptionResnetV2",
+    ),
+    "inception_v4": (
+        "InceptionV4",
+    ),
+    "levit": (
+        "Levit",
+    ),
+    "mobilenetv3": (
+        "MobileNetV3", "MobileNetV3Features",
+    ),
+    "nasnet": (
+        "NASNetALarge",
+    ),
+    "pnasnet": (
+        "PNASNet5Large",
+    ),
+    "resnet": (
+        "ResNet", "BasicBlock", "Bottleneck",
+    ),
+    "selecsls": (
+        "SelecSLS",
+    ),
+    "senet": (
+        "SENet",
+    ),
+    "vgg": (
+        "VGG",
+    ),
+    "visformer": (
+        "Visformer",
+    ),
+    "xception": (
+        "Xception",
+    ),
+    "xception_aligned": (
+        "XceptionAligned",
+    ),
+}
+
+
+def build_index(modules):
+    """Import the modules (names in timm.models) and return their registered models and other exports, and
+    the modules that need a missing optional dependency with its name.
+    """
+    from .registry import _module_to_models
+
+    module_models, module_exports, missing = {}, {}, {}
+    for module in modules:
+        try:
+            exports = getattr(importlib.import_module("%s.%s" % (__package__, module)), "__all__", [])
+        except ImportError as e:
+            if e.name is None or e.name.split(".")[0] == __package__.split(".")[0]:
+                raise
+            missing[module] = e.name
+            continue
+        models = _module_to_models[module]
+        module_models[module] = sorted(models)
+        module_exports[module] = [name for name in dict.fromkeys(exports) if name not in models]
+    return module_models, {module: names for module, names in module_exports.items() if names}, missing
+
+
+def _format_mapping(name, mapping):
+    lines = ["%s = {" % name]
+    for module, names in mapping.items():
+        items = textwrap.wrap(" ".join('"%s",' % n for n in names), 100, break_on_hyphens=False)
+        lines.append('    "%s": (' % module)
+        lines.extend("        " + line for line in items)
+        lines.append("    ),")
+    return "\n".join(lines + ["}"])
+
+
+def main():
+    module_models, module_exports, missing = build_index(list(MODULE_MODELS))
+    # the modules that cannot be imported here keep their entries
+    for module, dependency in missing.items():
+        print("%s needs %s, its entries are kept as they are" % (module, dependency))
+        module_models[module] = MODULE_MODELS[module]
+        if module in MODULE_EXPORTS:
+            module_exports[module] = MODULE_EXPORTS[module]
+    module_models = {module: module_models[module] for module in MODULE_MODELS}
+    module_exports = {module: module_exports[module] for module in MODULE_MODELS if module in module_exports}
+    path = os.path.abspath(__file__)
+    source = open(path).read()
+    for name, mapping in [("MODULE_MODELS", module_models), ("MODULE_EXPORTS", module_exports)]:
+        start = source.index("\n%s = {" % name) + 1
+        end = source.index("}\n", start) + 2
+        source = source[:start] + _format_mapping(name, mapping) + "\n" + source[end:]
+    with open(path, "w") as f:
+        f.write(source)
+
+
+if __name__ == "__main__":
+    main()
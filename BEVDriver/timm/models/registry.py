@@ -5,6 +5,8 @@ Hacked together by / Copyright 2020 Ross Wightman
 import sys
 import re
 import fnmatch
+import logging
+import importlib
 from collections import defaultdict
 from copy import deepcopy
 
@@ -18,6 +20,7 @@ __all__ = [
     "has_model_default_key",
     "get_model_default_value",
     "is_model_pretrained",
+    "register_lazy_models",
 ]
 
 _module_to_models = defaultdict(
@@ -29,6 +32,10 @@ _model_has_pretrained = (
     set()
 )  # set of model names that have pretrained weight url present
 _model_default_cfgs = dict()  # central repo for model default_cfgs
+_lazy_model_modules = {}  # mapping of model names to the modules imported on their first lookup
+_unavailable_model_modules = {}  # mapping of modules that need a missing optional dependency to its name
+
+_logger = logging.getLogger(__name__)
 
 
 def register_model(fn):
@@ -64,6 +71,34 @@ def register_model(fn):
     return fn
 
 
+def register_lazy_models(module, model_names):
+    """Register models by name without importing their module (a full module path, e.g.
+    'timm.models.resnet'), which is imported and registers them with register_model on first lookup.
+    """
+    for model_name in model_names:
+        _lazy_model_modules[model_name] = module
+
+
+def _import_model(model_name):
+    if model_name not in _model_entrypoints and model_name in _lazy_model_modules:
+        importlib.import_module(_lazy_model_modules[model_name])
+
+
+def _import_all_models():
+    for module in sorted(set(_lazy_model_modules.values())):
+        if module in _unavailable_model_modules:
+            continue
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            # a model module of an optional dependency (e.g. pointpillar and torch_scatter) is left out of the
+            # listings, its models still raise on lookup
+            if e.name is None or e.name.split(".")[0] == __name__.split(".")[0]:
+                raise
+            _unavailable_model_modules[module] = e.name
+            _logger.warning("Models of %s are unavailable, it needs %s" % (module, e.name))
+
+
 def _natural_key(string_):
     return [int(s) if s.isdigit() else s for s in re.split(r"(\d+)", string_.lower())]
 
@@ -84,6 +119,7 @@ def list_models(
         model_list('gluon_resnet*') -- returns all models starting with 'gluon_resnet'
         model_list('*resnext*, 'resnet') -- returns all models with 'resnext' in 'resnet' module
     """
+    _import_all_models()
     if module:
         all_models = list(_module_to_models[module])
     else:
@@ -113,16 +149,19 @@ def list_models(
 
 def is_model(model_name):
     """Check if a model name exists"""
+    _import_model(model_name)
     return model_name in _model_entrypoints
 
 
 def model_entrypoint(model_name):
     """Fetch a model entrypoint for specified model name"""
+    _import_model(model_name)
     return _model_entrypoints[model_name]
 
 
 def list_modules():
     """Return list of module names that contain models / model entrypoints"""
+    _import_all_models()
     modules = _module_to_models.keys()
     return list(sorted(modules))
 
@@ -134,11 +173,13 @@ def is_model_in_modules(model_name, module_names):
         module_names (tuple, list, set) - names of modules to search in
     """
     assert isinstance(module_names, (tuple, list, set))
+    _import_model(model_name)
     return any(model_name in _module_to_models[n] for n in module_names)
 
 
 def has_model_default_key(model_name, cfg_key):
     """Query model default_cfgs for existence of a specific key."""
+    _import_model(model_name)
     if model_name in _model_default_cfgs and cfg_key in _model_default_cfgs[model_name]:
         return True
     return False
@@ -146,6 +187,7 @@ def has_model_default_key(model_name, cfg_key):
 
 def is_model_default_key(model_name, cfg_key):
     """Return truthy value for specified model default_cfg key, False if does not exist."""
+    _import_model(model_name)
     if model_name in _model_default_cfgs and _model_default_cfgs[model_name].get(
         cfg_key, False
     ):
@@ -155,6 +197,7 @@ def is_model_default_key(model_name, cfg_key):
 
 def get_model_default_value(model_name, cfg_key):
     """Get a specific model default_cfg value by key. None if it doesn't exist."""
+    _import_model(model_name)
     if model_name in _model_default_cfgs:
         return _model_default_cfgs[model_name].get(cfg_key, None)
     else:
@@ -162,4 +205,5 @@ def get_model_default_value(model_name, cfg_key):
 
 
 def is_model_pretrained(model_name):
+    _import_model(model_name)
     return model_name in _model_has_pretrained
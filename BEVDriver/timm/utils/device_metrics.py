@@ -0,0 +1,155 @@
+""" Training metrics that stay on the device
+
+The running sums of the meters, the confusion matrices behind the IoUs and the per-step scalars of
+the training loops are kept as tensors on the device of the model; reading them (.item(), float(),
+a comparison in an `if`) waits for all queued work. The training loops copy them to the host in one
+transfer per log interval instead of one per value and step.
+"""
+import torch
+
+
+class DeviceAverageMeter:
+    """
+    AverageMeter of tensor values whose running sums stay on the device of the values. update() does
+    not wait for the device; val, avg, sum and count are host values as of the last sync_meters().
+    The sums are kept in float64, as the Python floats of AverageMeter.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.val = 0
+        self.avg = 0
+        self.sum = 0
+        self.count = 0
+        # val, sum and count on the device
+        self._state = None
+
+    def update(self, val, n=1, valid=None):
+        """
+        Args:
+            val (torch.Tensor): value with one element.
+            n (int): weight of the value.
+            valid (torch.Tensor): bool with one element, the update is skipped where it is False (as an
+                update under `if valid:`, without reading valid on the host).
+        """
+        val = val.detach().reshape(()).double()
+        if self._state is None:
+            self._state = val.new_zeros(3)
+        state = torch.cat([val.view(1), self._state[1:] + torch.stack([val * n, val.new_full((), n)])])
+        if valid is not None:
+            state = torch.where(valid.reshape(()), state, self._state)
+        self._state = state
+
+
+def sync_meters(*meters):
+    """ copies the state of the DeviceAverageMeters to the host with one transfer"""
+    updated = [meter for meter in meters if meter._state is not None]
+    if not updated:
+        return
+    states = torch.stack([meter._state for meter in updated]).tolist()
+    for meter, (val, total, count) in zip(updated, states):
+        meter.val = val
+        meter.sum = total
+        meter.count = count
+        meter.avg = total / count if count else 0
+
+
+class DeviceScalars:
+    """
+    Scalars of every step of a training loop (e.g. the loss dict of the model), logged per step but read
+    only every log interval. The tensor values of a step are copied into one float64 tensor on their
+    device, flush() copies those of all pending steps to the host at once.
+    """
+
+    def __init__(self):
+        self._steps = []
+
+    def __len__(self):
+        return len(self._steps)
+
+    def append(self, step, values):
+        """
+        Args:
+            step (int): step of the values, returned by flush().
+            values (dict): name -> tensor with one element or Python number.
+        """
+        keys = [key for key, value in values.items() if isinstance(value, torch.Tensor)]
+        tensors = torch.stack([values[key].detach().reshape(()).double() for key in keys]) if keys else None
+        self._steps.append((step, dict(values), keys, tensors))
+
+    def flush(self):
+        """ (step, {name: float or number}) of the pending steps in order, the names in the order of the dict"""
+        tensors = [tensors for _, _, _, tensors in self._steps if tensors is not None]
+        host = iter(torch.cat(tensors).tolist()) if tensors else iter(())
+        steps = []
+        for step, values, keys, _ in self._steps:
+            for key in keys:
+                values[key] = next(host)
+            steps.append((step, values))
+        self._steps = []
+        return steps
+
+
+def confusion_matrix(target, pred, num_classes):
+    """
+    Confusion matrix [num_classes + 1, num_classes + 1] (rows target, columns prediction) of two label
+    tensors of the same number of elements. Labels outside [0, num_classes) (e.g. an ignore_index) are
+    counted in the last row and column. The counts are scattered into a tensor of fixed size since
+    torch.bincount reads the largest label back to the host on CUDA to size its output.
+    """
+    size = num_classes + 1
+    target = target.reshape(-1).long()
+    pred = pred.reshape(-1).long()
+    target = torch.where((target >= 0) & (target < num_classes), target, num_classes)
+    pred = torch.where((pred >= 0) & (pred < num_classes), pred, num_classes)
+    index = target * size + pred
+    counts = torch.zeros(size * size, dtype=torch.long, device=index.device)
+    counts.index_add_(0, index, torch.ones_like(index))
+    return counts.view(size, size)
+
+
+def binary_iou(output, target, threshold=0.5):
+    """ IoU of output > threshold and target > threshold, 0 if both are empty (float32 tensor)"""
+    prediction = output > threshold
+    target = target > threshold
+    intersection = (prediction & target).sum().float()
+    union = (prediction | target).sum().float()
+    return torch.where(union > 0, intersection / union, 0.0)
+
+
+def semantic_iou_stats(pred, target, num_classes):
+    """
+    IoUs of a semantic segmentation batch as logged by BEV_encoder/train.py, from a confusion matrix
+    instead of a loop over the classes.
+
+    The per-class IoUs are those of classes 1 to K, K the number of distinct labels in target (labels
+    outside [0, num_classes) counted as one), a class is 0 if neither pred nor target has it.
+
+    Args:
+        pred (torch.Tensor): predicted labels.
+        target (torch.Tensor): target labels, of the same number of elements.
+        num_classes (int): number of classes of the prediction.
+
+    Returns:
+        float32 tensor [3]: the mean of the K IoUs, the mean of those of the classes in target (0 if
+        none) and their mean weighted by the target pixels of the class (0 if none).
+    """
+    confusion = confusion_matrix(target, pred, num_classes)
+    intersection = confusion.diagonal()[:num_classes]
+    target_count = confusion.sum(1)[:num_classes]
+    union = target_count + confusion.sum(0)[:num_classes] - intersection
+    iou = torch.where(union > 0, intersection.float() / union.float(), 0.0)
+
+    num_labels = (confusion.sum(1) > 0).sum()
+    classes = torch.arange(num_classes, device=confusion.device)
+    counted = (classes >= 1) & (classes <= num_labels) & (union > 0)
+    iou = torch.where(counted, iou, 0.0).double()
+    weight = torch.where(counted, target_count, 0).double()
+
+    mean = iou.sum() / num_labels
+    valid = weight > 0
+    valid_mean = torch.where(valid.any(), (iou * valid).sum() / valid.sum(), 0.0)
+    weighted_mean = torch.where(weight.sum() > 0, (iou * weight).sum() / weight.sum(), 0.0)
+    return torch.stack([mean, valid_mean, weighted_mean]).float()
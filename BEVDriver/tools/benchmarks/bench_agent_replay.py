@@ -0,0 +1,49 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import torch
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS"))
+sys.path.insert(0, os.path.join(bevdriver_root, "leaderboard"))
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "leaderboard"))
+# ahead of tests/leaderboard, whose conftest is not the one the drive model helpers import
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "models"))
+from test_agent_replay import write_agent_config, write_synthetic_log
+from team_code.agent_replay import install_simulator_stubs, replay
+
+'''
+Replay of a synthetic log of --ticks steps (the sensors of BEVDriverAgent.sensors, random images and
+LiDAR points) through BEVDriverAgent with a tiny random model on the CPU, and the time of the stages of
+run_step on the steps the model runs. The model is too small for the encoder and llm stages to mean
+much, the other stages are those of the agent.
+
+python tools/benchmarks/bench_agent_replay.py --ticks 80
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ticks", type=int, default=80)
+    parser.add_argument("--save", action="store_true", help="save the display images as with SAVE_PATH")
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    print("stubbed %s" % ", ".join(install_simulator_stubs()))
+    with tempfile.TemporaryDirectory() as workdir:
+        config = write_agent_config(workdir)
+        write_synthetic_log(os.path.join(workdir, "log"), args.ticks)
+        os.environ.setdefault("ROUTES", "routes_replay.xml")
+        start = time.perf_counter()
+        agent, controls, _ = replay(config, os.path.join(workdir, "log"),
+                                    save_path=os.path.join(workdir, "save") if args.save else None)
+        print("replayed %d ticks in %.1f s" % (len(controls), time.perf_counter() - start))
+        print(agent.timer.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+import argparse
+
+import torch
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "models"))
+from timm.models.bevdriver_encoder import Interfuser
+from test_bevdriver_encoder import bevdriver_encoder, make_inputs, reference_forward, without_pretrained
+
+'''
+Frames/s of the bev encoder (the bevdriver_encoder configuration with random weights, eval mode) on
+the CPU for each --batch-sizes:
+
+    per view    one rgb backbone pass per camera view and the sine position tables computed on every
+                call, as Interfuser.forward did before
+    batched     Interfuser.forward: left, right and front center views in one backbone pass, cached
+                position tables
+
+python tools/benchmarks/bench_bevdriver_encoder.py --batch-sizes 1,8,40
+'''
+
+
+def frames_per_second(forward, inputs, repeats):
+    with torch.no_grad():
+        forward(inputs)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            output = forward(inputs)
+    return repeats * len(inputs["rgb"]) / (time.perf_counter() - start), output
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-sizes", default="1,8,40")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    for name in ["resnet50d", "resnet26d", "resnet18d"]:
+        setattr(bevdriver_encoder, name, without_pretrained(getattr(bevdriver_encoder, name)))
+    torch.manual_seed(0)
+    encoder = Interfuser(enc_depth=6, embed_dim=256, rgb_backbone_name="r50", lidar_backbone_name="r18",
+                         use_different_backbone=True).eval()
+
+    print("threads=%d" % torch.get_num_threads())
+    for bs in [int(x) for x in args.batch_sizes.split(",")]:
+        inputs = make_inputs(bs)
+        reference, expected = frames_per_second(lambda x: reference_forward(encoder, x), inputs, args.repeats)
+        batched, output = frames_per_second(encoder, inputs, args.repeats)
+        print("batch %2d: per view %6.1f frames/s  batched %6.1f frames/s  (x%.2f)  max |diff| %.1e" % (
+            bs, reference, batched, batched / reference, (output - expected).abs().max()
+        ))
+
+
+if __name__ == "__main__":
+    main()
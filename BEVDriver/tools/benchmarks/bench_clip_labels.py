@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "datasets"))
+from timm.data.carla_measurements import build_clip_labels
+from test_carla_clip_labels import TOKEN_MAX_LENGTH, make_route, reference_clip_labels
+
+'''
+Clips/s of the label construction in CarlaVoiceDataset.__getitem__ (positions, target points,
+future waypoints, controls and the measurement one-hot for every sampled frame of a clip):
+
+    loop         the previous per-frame python loop with one 2x2 rotation matrix per frame
+    vectorized   timm.data.carla_measurements.build_clip_labels
+
+python tools/benchmarks/bench_clip_labels.py --clips 2000 --sample-interval 2
+'''
+
+
+def run(fn, clips):
+    start = time.perf_counter()
+    for args in clips:
+        fn(*args)
+    return len(clips) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--route-frames", type=int, default=1000)
+    parser.add_argument("--clips", type=int, default=2000)
+    parser.add_argument("--sample-interval", type=int, default=2)
+    args = parser.parse_args()
+
+    route = make_route(args.route_frames)
+    rng = np.random.default_rng(0)
+    interval = args.sample_interval
+    loop_clips = []
+    vectorized_clips = []
+    for _ in range(args.clips):
+        start = int(rng.integers(0, args.route_frames - TOKEN_MAX_LENGTH * interval))
+        end = start + TOKEN_MAX_LENGTH * interval
+        loop_clips.append((route, start, end, interval, args.route_frames))
+        vectorized_clips.append((route, np.arange(start, end, interval), args.route_frames, TOKEN_MAX_LENGTH))
+
+    loop = run(reference_clip_labels, loop_clips)
+    vectorized = run(build_clip_labels, vectorized_clips)
+    print("clips=%d frames/clip=%d" % (args.clips, TOKEN_MAX_LENGTH))
+    print("%-12s %10.1f clips/s" % ("loop", loop))
+    print("%-12s %10.1f clips/s  (x%.1f)" % ("vectorized", vectorized, vectorized / loop))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import os
+import sys
+import argparse
+import tempfile
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS"))
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "models"))
+from test_drive_deploy import measure_startup, write_checkpoints
+
+'''
+Startup of Blip2VicunaDrive in a fresh process with a tiny LLaMA of --hidden-size and --layers
+(float32, random weights), the rest of the model as in the tests:
+
+    peft        LLM from_pretrained from its directory, PEFT LoRA wrapping and the BEVDriver checkpoint
+                with torch.load and load_state_dict(strict=False), as build_model does
+    deploy      load_deploy_model of the file written by export_deploy_model
+
+seconds exclude the imports, peak RSS is that of the whole process (about 1 GB of it are imports).
+
+python tools/benchmarks/bench_deploy_model.py --hidden-size 1024 --layers 8
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hidden-size", type=int, default=1024)
+    parser.add_argument("--layers", type=int, default=8)
+    args = parser.parse_args()
+
+    size = dict(hidden_size=args.hidden_size, num_layers=args.layers)
+    with tempfile.TemporaryDirectory() as workdir:
+        write_checkpoints(workdir, **size)
+        print("deploy file %.0f MB" % (os.path.getsize(os.path.join(workdir, "model.safetensors")) / 2 ** 20))
+        for mode in ["peft", "deploy"]:
+            startup = measure_startup(mode, workdir, **size)
+            print("%-7s %6.2f s  peak RSS %5.0f MB" % (mode, startup["seconds"], startup["max_rss_mb"]))
+
+
+if __name__ == "__main__":
+    main()
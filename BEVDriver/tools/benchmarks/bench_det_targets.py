@@ -0,0 +1,61 @@
+import os
+import sys
+import copy
+import time
+import argparse
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "datasets"))
+from timm.data.det_utils import generate_det_data
+from timm.data.heatmap_utils import ActorArrays, generate_heatmap
+from test_det_targets import make_frame, reference_generate_det_data, reference_generate_heatmap
+
+'''
+Per-frame time of the detection targets of CarlaMVDetDataset (heatmap + 20x20x7 det data):
+
+    reference    per-actor heatmap images and the per-cell nearest-actor loop, on deepcopies
+                 of measurements and actors_data (what _extract_data_item did)
+    vectorized   ActorArrays once, one canvas, array nearest-actor search
+
+python tools/benchmarks/bench_det_targets.py --actors 10 50 200 --frames 50
+'''
+
+
+def reference(frames):
+    for measurements, actors_data in frames:
+        heatmap = reference_generate_heatmap(copy.deepcopy(measurements), copy.deepcopy(actors_data))
+        reference_generate_det_data(heatmap, copy.deepcopy(measurements), copy.deepcopy(actors_data))
+
+
+def vectorized(frames):
+    for measurements, actors_data in frames:
+        actors = ActorArrays(actors_data)
+        heatmap = generate_heatmap(measurements, actors)
+        generate_det_data(heatmap, measurements, actors)
+
+
+def per_frame_ms(fn, frames):
+    start = time.perf_counter()
+    fn(frames)
+    return 1000 * (time.perf_counter() - start) / len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--actors", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--frames", type=int, default=50)
+    args = parser.parse_args()
+
+    for num_actors in args.actors:
+        frames = [make_frame(num_actors, seed) for seed in range(args.frames)]
+        vectorized(frames[:2])  # warm up
+        reference_ms = per_frame_ms(reference, frames)
+        vectorized_ms = per_frame_ms(vectorized, frames)
+        print("actors=%4d  reference %7.2f ms  vectorized %6.2f ms  (x%.1f)" % (
+            num_actors, reference_ms, vectorized_ms, reference_ms / vectorized_ms
+        ))
+
+
+if __name__ == "__main__":
+    main()
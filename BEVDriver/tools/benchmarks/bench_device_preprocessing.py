@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import tempfile
+
+import numpy as np
+import torch
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS"))
+from lavis.datasets.datasets.carla_dataset_llm import CarlaVoiceDataset
+from synthetic_routes import make_route_tree
+
+'''
+Camera preprocessing of CarlaVoiceDataset with PIL in the dataset workers (pil) against uint8 views
+that Blip2VicunaDrive.forward resizes and normalizes as one batch per view (device,
+device_preprocessing=True). Reported per sample (one clip of up to --token-max-length frames):
+
+    worker      CPU time of dataset[i] (decoding included, as in a dataloader worker)
+    views       bytes of the camera view tensors, i.e. what is copied to the GPU
+    batch       time of the device side preprocessing of a collated batch of --batch-size clips,
+                here on the CPU (--device cuda to time it on a GPU)
+
+python tools/benchmarks/bench_device_preprocessing.py --samples 20
+'''
+
+VIEW_KEYS = ["rgb", "rgb_left", "rgb_right", "rgb_rear", "rgb_center"]
+
+
+def load(dataset, indices):
+    random.seed(0)
+    np.random.seed(0)
+    start = time.process_time()
+    samples = [dataset[index] for index in indices]
+    return samples, (time.process_time() - start) / len(indices)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--token-max-length", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+    # the synthetic clips have no instruction_args for the [x] of their instructions
+    logging.disable(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as root:
+        make_route_tree(root, num_routes=2, frames=60, clips_per_route=args.samples, token_max_length=args.token_max_length,
+                        with_sensors=True)
+        results = {}
+        for name, device_preprocessing in [("pil", False), ("device", True)]:
+            dataset = CarlaVoiceDataset(root, token_max_length=args.token_max_length, device_preprocessing=device_preprocessing)
+            indices = list(range(0, len(dataset), max(1, len(dataset) // args.samples)))[:args.samples]
+            dataset[indices[0]] # page cache
+            samples, seconds = load(dataset, indices)
+            view_bytes = np.mean([sum(sample[key].nbytes for key in VIEW_KEYS) for sample in samples])
+
+            batch_seconds, views = 0.0, {key: [] for key in VIEW_KEYS}
+            for start in range(0, len(samples), args.batch_size):
+                batch = dataset.collater(samples[start:start + args.batch_size])
+                for key in VIEW_KEYS:
+                    batch[key] = batch[key].to(args.device).flatten(0, 1)
+                if args.device == "cuda":
+                    torch.cuda.synchronize()
+                tic = time.perf_counter()
+                for key, transform in batch.get("device_transforms", {}).items():
+                    batch[key] = transform.batch(batch[key])
+                if args.device == "cuda":
+                    torch.cuda.synchronize()
+                batch_seconds += time.perf_counter() - tic
+                valid = (torch.arange(batch["rgb"].size(0)) % batch["target_point"].size(1)).view(-1, batch["target_point"].size(1)) \
+                    < batch["valid_frames"][:, None]
+                for key in VIEW_KEYS:
+                    views[key].append(batch[key][valid.flatten().to(batch[key].device)].float().cpu())
+            results[name] = {key: torch.cat(value) for key, value in views.items()}
+            print("%-6s  worker %6.1f ms  views %7.1f KB  batch %6.1f ms  (per sample)" % (
+                name, 1000 * seconds, view_bytes / 1024, 1000 * batch_seconds / len(samples)
+            ))
+
+        for key in VIEW_KEYS:
+            difference = (results["device"][key] - results["pil"][key]).abs()
+            print("%-10s  |device - pil| mean %.4f  max %.4f" % (key, difference.mean(), difference.max()))
+
+
+if __name__ == "__main__":
+    main()
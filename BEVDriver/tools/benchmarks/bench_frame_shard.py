@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+from timm.data.base_io_dataset import BaseIODataset
+from timm.data.frame_shard import SHARD_FILE, open_frame_shard, write_frame_shard
+from synthetic_routes import make_route_tree
+
+'''
+Frames/s of loading rgb_full + lidar for a frame (what _extract_data_item does before any decoding
+or preprocessing) from
+
+    files    rgb_full/%04d.jpg + lidar/%04d.npy, one open per file
+    shard    frames.shard written by batch_merge_data.py --pack, memory-mapped
+
+with a cold page cache (every file of the tree dropped with posix_fadvise(DONTNEED) first, which
+works without root but only for files that are not mapped by another process) and a warm one.
+Images are decoded with PIL in both cases; --raw only reads the encoded bytes to isolate the I/O.
+Use --root to place the synthetic tree on the filesystem that should be measured.
+
+python tools/benchmarks/bench_frame_shard.py --routes 4 --frames 200 --samples 400
+'''
+
+
+def drop_page_cache(root):
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            fd = os.open(os.path.join(dirpath, name), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+
+
+def read_raw(dataset, route_path, frame_id):
+    shard = open_frame_shard(route_path)
+    if shard is not None:
+        shard.image_bytes(frame_id).tobytes()
+    else:
+        with open(os.path.join(route_path, "rgb_full", "%04d.jpg" % frame_id), "rb") as f:
+            f.read()
+    dataset._load_lidar(route_path, frame_id)
+
+
+def run(dataset, samples, raw):
+    start = time.perf_counter()
+    for route_path, frame_id in samples:
+        if raw:
+            read_raw(dataset, route_path, frame_id)
+        else:
+            dataset._load_rgb_full(route_path, frame_id).load()
+            dataset._load_lidar(route_path, frame_id)
+    return len(samples) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--routes", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--samples", type=int, default=400)
+    parser.add_argument("--lidar-dtype", default="float32", choices=["float32", "float16"])
+    parser.add_argument("--raw", action="store_true", help="read encoded images without decoding them")
+    parser.add_argument("--root", default=None, help="directory on the filesystem to measure (default: tmp)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    dataset = BaseIODataset()
+    with tempfile.TemporaryDirectory(dir=args.root) as root:
+        route_paths = make_route_tree(root, args.routes, args.frames, clips_per_route=1, with_sensors=True)
+        samples = [(route_paths[r], int(f)) for r, f in zip(
+            rng.integers(0, args.routes, args.samples), rng.integers(0, args.frames, args.samples)
+        )]
+
+        results = {}
+        for mode in ("files", "shard"):
+            if mode == "shard":
+                for route_path in route_paths:
+                    write_frame_shard(route_path, args.frames, args.lidar_dtype)
+            for cache in ("cold", "warm"):
+                open_frame_shard.cache_clear()
+                if cache == "cold":
+                    drop_page_cache(root)
+                results[(mode, cache)] = run(dataset, samples, args.raw)
+
+        files_size = sum(
+            os.path.getsize(os.path.join(p, sub, n))
+            for p in route_paths for sub in ("rgb_full", "lidar") for n in os.listdir(os.path.join(p, sub))
+        )
+        shard_size = sum(os.path.getsize(os.path.join(p, SHARD_FILE)) for p in route_paths)
+
+    print("routes=%d frames/route=%d samples=%d lidar=%s raw=%s" % (
+        args.routes, args.frames, args.samples, args.lidar_dtype, args.raw
+    ))
+    print("size: files %.1f MB, shards %.1f MB" % (files_size / 2 ** 20, shard_size / 2 ** 20))
+    for cache in ("cold", "warm"):
+        files, shard = results[("files", cache)], results[("shard", cache)]
+        print("%-5s files %8.1f frames/s   shard %8.1f frames/s  (x%.2f)" % (cache, files, shard, shard / files))
+
+
+if __name__ == "__main__":
+    main()
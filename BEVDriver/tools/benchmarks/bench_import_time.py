@@ -0,0 +1,90 @@
+import os
+import sys
+import argparse
+import subprocess
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+lavis_root = os.path.join(bevdriver_root, "LAVIS")
+leaderboard_root = os.path.join(bevdriver_root, "leaderboard")
+
+'''
+Import time of the entry points with python -X importtime, each in a fresh interpreter: the agent
+(team_code.bevdriver_agent, with the simulator modules stubbed as in agent_replay.py), the inference
+server, the training script (train.py --help, which imports everything train.py imports and exits),
+and `import lavis` and `import timm` alone. Prints the best total of --repeats runs, the number of
+modules imported, the time of the large packages it imports and which of the packages that the agent
+and the training of the drive model do not use (the other LAVIS models, spacy, the timm datasets and
+the other timm models) were imported.
+
+python tools/benchmarks/bench_import_time.py --repeats 3
+'''
+
+AGENT = (
+    "import sys; sys.path.insert(0, %r)\n"
+    "from team_code.agent_replay import install_simulator_stubs\n"
+    "install_simulator_stubs()\n"
+    "import team_code.bevdriver_agent" % leaderboard_root
+)
+INFERENCE_SERVER = "import sys; sys.path.insert(0, %r)\nimport team_code.inference_server" % leaderboard_root
+
+ENTRY_POINTS = {
+    "agent": ["-c", AGENT],
+    "inference_server": ["-c", INFERENCE_SERVER],
+    "train": [os.path.join(lavis_root, "train.py"), "--help"],
+    "lavis": ["-c", "import lavis"],
+    "timm": ["-c", "import timm"],
+}
+PACKAGES = ["torch", "torchvision", "transformers", "peft", "timm.models", "timm.data", "lavis.models",
+            "lavis.datasets.builders"]
+# packages that the agent and the training of the drive model do not need
+UNUSED = ["lavis.models.blip_models.blip", "lavis.models.img2prompt_models.img2prompt_vqa", "spacy",
+          "timm.data.carla_dataset", "timm.models.efficientnet"]
+
+
+def parse_importtime(stderr):
+    """ (name, cumulative us, depth) of the lines of python -X importtime"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(cumulative), depth))
+    return imports
+
+
+def measure(args):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([bevdriver_root, lavis_root, env.get("PYTHONPATH", "")])
+    result = subprocess.run([sys.executable, "-X", "importtime"] + args, cwd=lavis_root, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError([line for line in result.stderr.splitlines() if not line.startswith("import time:")][-1])
+    return parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--entry-points", nargs="+", default=list(ENTRY_POINTS), choices=list(ENTRY_POINTS))
+    args = parser.parse_args()
+
+    for name in args.entry_points:
+        try:
+            runs = [measure(ENTRY_POINTS[name]) for _ in range(args.repeats)]
+        except RuntimeError as e:
+            print("%-18s failed: %s" % (name, e))
+            continue
+        imports = min(runs, key=lambda run: sum(us for _, us, depth in run if depth == 0))
+        total = sum(us for _, us, depth in imports if depth == 0)
+        # the cumulative time is on the line of the import that loaded the module
+        cumulative = {module: us for module, us, _ in imports}
+        print("%-18s %6.2f s  %5d modules  unused imported: %s" % (
+            name, total / 1e6, len(cumulative), ", ".join(m for m in UNUSED if m in cumulative) or "-"))
+        print("    " + "  ".join("%s %.2f s" % (m, cumulative[m] / 1e6) for m in PACKAGES if m in cumulative))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import tempfile
+import argparse
+import multiprocessing
+
+import numpy as np
+import torch
+
+# the fake agents are forked after the server tokenized its first instructions
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+sys.path.insert(0, os.path.join(bevdriver_root, "leaderboard"))
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS"))
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "models"))
+from team_code.inference_server import InferenceClient, InferenceServer
+from conftest import build_tiny_drive_model
+from test_drive_bev_cache import TinyBevEncoder
+from test_drive_server import INSTRUCTIONS, make_inputs
+
+'''
+Fake multi-agent load on leaderboard/team_code/inference_server.py: every agent is a process with its
+own InferenceClient stepping as fast as the server answers (a new instruction every 40 steps, commits
+on every other frame as with sample_rate 2). Reports the steps/s over all agents, the p50/p99 latency of
+a step seen by an agent and the mean batch size, for each --max-batch (1 = no batching).
+
+The server runs a tiny random Blip2VicunaDrive on CPU (--hidden-size, --layers); pass --address to put
+the load on a running server instead.
+
+python tools/benchmarks/bench_inference_server.py --agents 8 --steps 100 --max-batch 1,8
+'''
+
+
+def fake_agent(index, address, steps, use_kv_cache, barrier, latencies):
+    rng = np.random.default_rng(index)
+    client = InferenceClient(address, use_kv_cache=use_kv_cache, sample_rate=2)
+    step_inputs = [make_inputs(rng, INSTRUCTIONS[(index + step // 40) % len(INSTRUCTIONS)]) for step in range(steps)]
+    barrier.wait()
+    seconds = []
+    for step, inputs in enumerate(step_inputs):
+        start = time.perf_counter()
+        client.step(inputs, commit=step % 2 == 0)
+        seconds.append(time.perf_counter() - start)
+    client.close()
+    latencies.put(seconds)
+
+
+def run_load(address, args):
+    barrier = multiprocessing.Barrier(args.agents + 1)
+    latencies = multiprocessing.Queue()
+    agents = [
+        multiprocessing.Process(target=fake_agent, args=(i, address, args.steps, not args.history, barrier, latencies))
+        for i in range(args.agents)
+    ]
+    for agent in agents:
+        agent.start()
+    barrier.wait()
+    start = time.perf_counter()
+    seconds = np.concatenate([latencies.get() for _ in agents])
+    wall = time.perf_counter() - start
+    for agent in agents:
+        agent.join()
+    return len(seconds) / wall, np.percentile(seconds, 50), np.percentile(seconds, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--agents", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--max-batch", default="1,8", help="comma separated, one run per value")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--history", action="store_true", help="agents without the kv cache (use_kv_cache=False)")
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--address", default=None, help="unix socket of a running server")
+    args = parser.parse_args()
+
+    print("agents=%d steps=%d %s" % (args.agents, args.steps, "history" if args.history else "kv cache"))
+    if args.address is not None:
+        throughput, p50, p99 = run_load(args.address, args)
+        print("server %s: %7.1f steps/s  p50 %6.1f ms  p99 %6.1f ms" % (args.address, throughput, 1000 * p50, 1000 * p99))
+        return
+
+    model = build_tiny_drive_model(hidden_size=args.hidden_size, num_layers=args.layers)
+    model.bev_encoder = TinyBevEncoder()
+    model.eval()
+    for max_batch in [int(x) for x in args.max_batch.split(",")]:
+        server = InferenceServer(model, max_batch=max_batch, max_wait=args.max_wait_ms / 1000)
+        with tempfile.TemporaryDirectory() as tmp:
+            address = server.start(os.path.join(tmp, "drive.sock"))
+            throughput, p50, p99 = run_load(address, args)
+            server.close()
+        print("max_batch %2d: %7.1f steps/s  p50 %6.1f ms  p99 %6.1f ms  mean batch %.1f" % (
+            max_batch, throughput, 1000 * p50, 1000 * p99, np.mean(server.batch_sizes)
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import os
+import sys
+import copy
+import time
+import zlib
+import random
+import argparse
+import importlib.util
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, os.path.join(bevdriver_root, "tools", "data_parsing"))
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "datasets"))
+from frame_table import FrameTable
+from parse_instruction import processing_rules, registered_class
+from test_instruction_rules import make_route
+
+'''
+Time of the instruction rules of parse_instruction.py on one synthetic route:
+
+    table       the rules on a FrameTable shared by all rules (as parse_route runs them)
+    baseline    the rule modules of another checkout, e.g. the per-frame implementation before the
+                FrameTable (git show <rev>:BEVDriver/tools/data_parsing/turn_rules.py > DIR/turn_rules.py, the
+                same for follow_rules.py and other_rules.py); their clips are checked against the table ones
+
+python tools/benchmarks/bench_instruction_rules.py --frames 5000 --town 5 --baseline /tmp/rules_baseline
+'''
+
+RULE_MODULES = ["turn_rules", "follow_rules", "other_rules"]
+
+
+def load_baseline(rules_dir):
+    modules = {}
+    for name in RULE_MODULES:
+        spec = importlib.util.spec_from_file_location("baseline_" + name, os.path.join(rules_dir, name + ".py"))
+        modules[name] = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(modules[name])
+    rules = {}
+    for rule_name, rule in registered_class.items():
+        cls = getattr(modules[type(rule).__module__], type(rule).__name__)
+        rules[rule_name] = cls.__new__(cls)
+        rules[rule_name].__dict__.update(copy.deepcopy(rule.__dict__))
+    return rules
+
+
+def run(rules, data, town_id):
+    clips, seconds = {}, {}
+    for rule in processing_rules:
+        random.seed(zlib.crc32(("%d/%s" % (town_id, rule)).encode()))
+        start = time.perf_counter()
+        results = rules[rule].process(data)
+        seconds[rule] = time.perf_counter() - start
+        clips[rule] = [(r["start_frame"], r["end_frame"], r["instruction_args"]) for r in results]
+    return clips, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=5000)
+    parser.add_argument("--town", type=int, default=5)
+    parser.add_argument("--baseline", default=None, help="directory with the rule modules to compare with")
+    args = parser.parse_args()
+
+    frames = make_route(args.town, frames=args.frames)
+    data = {"data": frames, "town_id": args.town, "weather_id": 1}
+
+    start = time.perf_counter()
+    table = FrameTable(frames)
+    table_seconds = time.perf_counter() - start
+    clips, seconds = run(registered_class, dict(data, table=table), args.town)
+    print("frames=%d town=%d: %d clips, FrameTable %.1f ms" % (
+        args.frames, args.town, sum(len(c) for c in clips.values()), 1000 * table_seconds
+    ))
+
+    baseline_seconds = None
+    if args.baseline is not None:
+        baseline_clips, baseline_seconds = run(load_baseline(args.baseline), data, args.town)
+        mismatches = [rule for rule in processing_rules if baseline_clips[rule] != clips[rule]]
+        print("clips %s the baseline" % ("match" if not mismatches else "DIFFER from (%s)" % ", ".join(mismatches)))
+
+    for group in ["Turn", "Follow", "Other"]:
+        rules = [rule for rule in processing_rules if rule.startswith(group)]
+        line = "%-6s  table %8.1f ms" % (group, 1000 * sum(seconds[rule] for rule in rules))
+        if baseline_seconds is not None:
+            baseline = sum(baseline_seconds[rule] for rule in rules)
+            line += "  baseline %8.1f ms  (x%.1f)" % (1000 * baseline, baseline / sum(seconds[rule] for rule in rules))
+        print(line)
+    total = sum(seconds.values()) + table_seconds
+    line = "all     table %8.1f ms" % (1000 * total)
+    if baseline_seconds is not None:
+        line += "  baseline %8.1f ms  (x%.1f)" % (1000 * sum(baseline_seconds.values()), sum(baseline_seconds.values()) / total)
+    print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import argparse
+
+import numpy as np
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS"))
+from lavis.datasets.datasets.carla_dataset_llm import CarlaVoiceDataset
+from lavis.datasets.datasets.dataloader_utils import LengthGroupedBatchSampler
+
+'''
+Bev encoder frames and LLM frame tokens of one training epoch over an instruction index
+(navigation_instruction_list.txt of --root, as written by tools/data_parsing/parse_instruction.py):
+
+    token_max_length   every clip padded to token_max_length (the previous pad_and_stack + default_collate)
+    longest            shuffled batches padded to their longest clip (CarlaVoiceDataset.collater)
+    grouped            LengthGroupedBatchSampler batches padded to their longest clip (run.group_by_length)
+
+Clip lengths are CarlaVoiceDataset.clip_lengths(), i.e. without the random start offsets of __getitem__.
+LLM tokens count the num_query_token tokens of every frame, the instruction tokens are the same for all.
+
+python tools/benchmarks/bench_length_grouping.py --root ../dataset --batch-size 4 --world-size 8
+'''
+
+
+def epoch_frames(batches, lengths, token_max_length=None):
+    return sum(len(batch) * (token_max_length or int(lengths[batch].max())) for batch in batches)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", required=True, help="dataset root with navigation_instruction_list.txt")
+    parser.add_argument("--batch-size", type=int, default=4, help="batch_size_train (per rank)")
+    parser.add_argument("--world-size", type=int, default=1)
+    parser.add_argument("--token-max-length", type=int, default=40)
+    parser.add_argument("--sample-interval", type=int, default=2)
+    parser.add_argument("--query-tokens", type=int, default=4, help="LLM tokens per frame (num_query_token)")
+    args = parser.parse_args()
+
+    dataset = CarlaVoiceDataset(args.root, token_max_length=args.token_max_length, sample_interval=args.sample_interval)
+    lengths = np.asarray(dataset.clip_lengths())
+    global_size = args.batch_size * args.world_size
+    shuffled = np.random.default_rng(0).permutation(len(lengths))
+    random_batches = [shuffled[i:i + args.batch_size] for i in range(0, len(shuffled) // global_size * global_size, args.batch_size)]
+    grouped_batches = []
+    for rank in range(args.world_size):
+        sampler = LengthGroupedBatchSampler(lengths, args.batch_size, num_replicas=args.world_size, rank=rank, drop_last=True)
+        grouped_batches += [np.asarray(batch) for batch in sampler]
+
+    print("%d clips, valid_frames mean %.1f (min %d, max %d), %d batches of %d" % (
+        len(lengths), lengths.mean(), lengths.min(), lengths.max(), len(random_batches), args.batch_size
+    ))
+    baseline = epoch_frames(random_batches, lengths, args.token_max_length)
+    for name, frames in [
+        ("token_max_length", baseline),
+        ("longest", epoch_frames(random_batches, lengths)),
+        ("grouped", epoch_frames(grouped_batches, lengths)),
+    ]:
+        print("%-16s  encoder frames %10d  LLM frame tokens %11d  (%.1f%% of token_max_length)" % (
+            name, frames, frames * args.query_tokens, 100 * frames / baseline
+        ))
+
+
+if __name__ == "__main__":
+    main()
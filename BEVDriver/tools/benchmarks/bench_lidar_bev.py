@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "datasets"))
+from timm.data.lidar_bev import (
+    lidar_to_histogram_features,
+    lidar_to_histogram_features_batch,
+    transform_2d_points,
+)
+from test_lidar_bev import make_lidar, reference_lidar_to_histogram_features, reference_transform_2d_points
+
+'''
+Per-frame time of the LiDAR preprocessing used by the datasets and the agent
+(transform_2d_points followed by lidar_to_histogram_features):
+
+    reference    np.matrix / np.linalg.inv transform and two np.histogramdd calls
+    bincount     timm.data.lidar_bev, one frame at a time
+    batched      timm.data.lidar_bev.lidar_to_histogram_features_batch over --batch frames
+
+python tools/benchmarks/bench_lidar_bev.py --points 40000 100000 --frames 50
+'''
+
+
+def per_frame_ms(fn, lidars, poses):
+    start = time.perf_counter()
+    fn(lidars, poses)
+    return 1000 * (time.perf_counter() - start) / len(lidars)
+
+
+def reference(lidars, poses):
+    for lidar, pose in zip(lidars, poses):
+        reference_lidar_to_histogram_features(reference_transform_2d_points(lidar, *pose, *pose))
+
+
+def bincount(lidars, poses):
+    for lidar, pose in zip(lidars, poses):
+        lidar_to_histogram_features(transform_2d_points(lidar, *pose, *pose))
+
+
+def batched(lidars, poses, batch):
+    for i in range(0, len(lidars), batch):
+        lidar_to_histogram_features_batch(
+            [transform_2d_points(lidar, *pose, *pose) for lidar, pose in zip(lidars[i:i + batch], poses[i:i + batch])]
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, nargs="+", default=[40000, 70000, 100000])
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=8)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print("%8s %14s %14s %14s" % ("points", "reference ms", "bincount ms", "batched ms"))
+    for points in args.points:
+        lidars = [make_lidar(rng, points) for _ in range(args.frames)]
+        poses = [tuple(p) for p in rng.uniform(-100, 100, size=(args.frames, 3))]
+        ref = per_frame_ms(reference, lidars, poses)
+        fast = per_frame_ms(bincount, lidars, poses)
+        batch = per_frame_ms(lambda l, p: batched(l, p, args.batch), lidars, poses)
+        print("%8d %14.2f %8.2f (x%.1f) %8.2f (x%.1f)" % (points, ref, fast, ref / fast, batch, ref / batch))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+
+import torch
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS"))
+from timm.data.carla_measurements import (
+    MEASUREMENTS_ARRAY,
+    MEASUREMENTS_JSON,
+    load_route_measurements,
+    save_measurements_array,
+)
+from lavis.datasets.datasets.carla_dataset_llm import CarlaVoiceDataset
+from synthetic_routes import make_route_tree
+
+'''
+Samples/s of CarlaVoiceDataset.__getitem__ in a single worker for the three ways the route
+measurements can be served:
+
+    json-per-sample   measurements_all.json decoded for every sample (the previous behaviour)
+    json-cached       measurements_all.json decoded once per route, then served from the LRU cache
+    npy-mmap          measurements_all.npy memory-mapped (written by batch_merge_measurements.py)
+
+Camera and LiDAR loading is replaced by tiny constant tensors so that only the measurement
+and label path is measured.
+
+python tools/benchmarks/bench_measurement_cache.py --routes 8 --frames 1000 --samples 500
+'''
+
+SENSOR_STUB = torch.zeros(3, 1, 1)
+
+
+def fake_sensor_data(route_path, frame_id, measurements):
+    return {
+        "lidar": SENSOR_STUB.numpy(),
+        "rgb": SENSOR_STUB,
+        "rgb_center": SENSOR_STUB,
+        "rgb_left": SENSOR_STUB,
+        "rgb_right": SENSOR_STUB,
+        "rgb_rear": SENSOR_STUB,
+    }
+
+
+def run(dataset, samples, clear_cache):
+    load_route_measurements.cache_clear()
+    start = time.perf_counter()
+    for i in range(samples):
+        if clear_cache:
+            load_route_measurements.cache_clear()
+        dataset[i % len(dataset)]
+    return samples / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--routes", type=int, default=8)
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--clips-per-route", type=int, default=60)
+    parser.add_argument("--samples", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        route_paths = make_route_tree(root, args.routes, args.frames, args.clips_per_route)
+        dataset = CarlaVoiceDataset(root, token_max_length=40)
+        dataset._extract_data_item = fake_sensor_data
+
+        results = {}
+        results["json-per-sample"] = run(dataset, args.samples, clear_cache=True)
+        results["json-cached"] = run(dataset, args.samples, clear_cache=False)
+        for route_path in route_paths:
+            with open(os.path.join(route_path, MEASUREMENTS_JSON)) as f:
+                save_measurements_array(route_path, json.load(f))
+        assert os.path.exists(os.path.join(route_paths[0], MEASUREMENTS_ARRAY))
+        results["npy-mmap"] = run(dataset, args.samples, clear_cache=False)
+
+    print("routes=%d frames/route=%d samples=%d" % (args.routes, args.frames, args.samples))
+    for name, rate in results.items():
+        print("%-16s %8.1f samples/s  (x%.1f)" % (name, rate, rate / results["json-per-sample"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "leaderboard"))
+from test_metrics_arrays import legacy_parse_recorder_info, legacy_state, metrics_log, metrics_modules, synthetic_recorder
+
+'''
+The metrics of a recorder dump of --frames frames and --vehicles vehicles made as in test_metrics_arrays.py:
+the dictionaries MetricsLog parsed the dump into before the arrays
+(legacy_parse_recorder_info) against the arrays of MetricsLog, parsed, loaded from the cache file, and
+the trajectories of all the vehicles read from the frames of the dictionaries, by get_all_actor_transforms
+and by get_actor_state_array. With --memory, the peak memory of both parsers.
+
+The getters of MetricsLog build the carla values of the frames they return, where the dictionaries hold the
+values built while parsing: without the CARLA PythonAPI they are the value classes of the test, slower to
+build than those of carla.
+
+python tools/benchmarks/bench_metrics_arrays.py --frames 2000 --vehicles 150
+'''
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def peak_memory(function, *args):
+    tracemalloc.start()
+    result = function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--vehicles", type=int, default=150)
+    parser.add_argument("--memory", action="store_true")
+    args = parser.parse_args()
+
+    recorder = synthetic_recorder(frames=args.frames, vehicles=args.vehicles)
+    frames, legacy_seconds = timed(lambda: legacy_parse_recorder_info(recorder)[2])
+    log, arrays_seconds = timed(metrics_log.MetricsLog, recorder)
+    with tempfile.TemporaryDirectory() as cache_dir, metrics_modules():
+        metrics_log.MetricsLog(recorder, cache_dir)
+        _, load_seconds = timed(metrics_log.MetricsLog, recorder, cache_dir)
+        size = sum(os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir))
+
+    vehicle_ids = list(range(100, 100 + args.vehicles))
+    _, loop_seconds = timed(lambda: [[legacy_state(frames, actor_id, "transform", frame)
+                                      for frame in range(1, len(frames) + 1)] for actor_id in vehicle_ids])
+    _, getter_seconds = timed(lambda: [log.get_all_actor_transforms(actor_id) for actor_id in vehicle_ids])
+    _, array_seconds = timed(lambda: [log.get_actor_state_array(actor_id, "transform") for actor_id in vehicle_ids])
+    assert np.allclose(log.get_actor_state_array(100, "transform")[-1, 0],
+                       legacy_state(frames, 100, "transform", len(frames)).location.x, atol=1e-2)
+
+    print("%d frames, %d vehicles, %.1f MB dump" % (args.frames, args.vehicles, len(recorder) / 2 ** 20))
+    print("parse   dictionaries             %7.2f s" % legacy_seconds)
+    print("parse   arrays                   %7.2f s" % arrays_seconds)
+    print("load    cache file (%5.1f MB)    %7.2f s" % (size / 2 ** 20, load_seconds))
+    print("query   frames dictionaries      %7.3f s" % loop_seconds)
+    print("query   get_all_actor_transforms %7.3f s" % getter_seconds)
+    print("query   get_actor_state_array    %7.3f s" % array_seconds)
+    if args.memory:
+        del frames, log
+        _, legacy_peak = peak_memory(legacy_parse_recorder_info, recorder)
+        _, arrays_peak = peak_memory(metrics_log.MetricsLog, recorder)
+        print("peak    dictionaries             %7.1f MB" % (legacy_peak / 2 ** 20))
+        print("peak    arrays                   %7.1f MB" % (arrays_peak / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import argparse
+
+import torch
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS"))
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "models"))
+from conftest import ENCODER_DIM
+from test_drive_deploy import build_lora_model
+from lavis.models.drive_models.quantize import LLMTimer, module_nbytes, quantize_llm
+
+'''
+Blip2VicunaDrive with a tiny LLaMA of --hidden-size and --layers (float32, random weights, LoRA merged)
+on the CPU, the LLM as is and with quantize_llm to int8 and int4 (group 128): bytes of the LLM,
+LLM tokens/s of the prefill of --frames frames (forward with inference_mode) and the largest waypoint
+difference to the float32 model.
+
+The quantized layers dequantize their weights in every forward: on the CPU this costs time, on a GPU
+(memory bound at the batch sizes of the agents) the smaller weights are what is read.
+
+python tools/benchmarks/bench_quantized_llm.py --hidden-size 1024 --layers 4
+'''
+
+
+def run(model, samples, embeds, repeats):
+    timer = LLMTimer(model.llm_model)
+    with torch.no_grad():
+        for _ in range(repeats):
+            waypoints, _ = model(dict(samples), inference_mode=True, input_embeds=embeds)
+    timer.remove()
+    return waypoints, timer.tokens / timer.seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hidden-size", type=int, default=1024)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    generator = torch.Generator().manual_seed(0)
+    embeds = torch.randn(1, args.frames, 6, ENCODER_DIM, generator=generator)
+    samples = {"text_input": ["turn left at the next intersection"], "valid_frames": [args.frames]}
+
+    reference = None
+    for weight_format in [None, "int8", "int4"]:
+        model = build_lora_model(hidden_size=args.hidden_size, num_layers=args.layers)
+        model.llm_model = model.llm_model.merge_and_unload()
+        if weight_format is not None:
+            quantize_llm(model, weight_format)
+        waypoints, tokens_per_second = run(model, samples, embeds, args.repeats)
+        reference = waypoints if reference is None else reference
+        print("%-8s LLM %7.1f MB  %8.1f tokens/s  waypoint difference %.4f" % (
+            weight_format or "float32", module_nbytes(model.llm_model) / 2 ** 20, tokens_per_second,
+            (waypoints - reference).abs().max()))
+
+
+if __name__ == "__main__":
+    main()
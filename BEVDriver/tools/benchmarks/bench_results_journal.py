@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, os.path.join(bevdriver_root, "leaderboard"))
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "leaderboard"))
+from test_results_journal import make_record, run_routes
+from leaderboard.utils.checkpoint_tools import compact_checkpoint, create_default_json_msg, fetch_dict, save_dict
+from leaderboard.utils.statistics_manager import StatisticsManager
+
+'''
+The time per route of the results journal of the leaderboard checkpoint for a run of --routes routes (a
+record, the entry status and the progress appended per route, as in test_results_journal.py) against
+StatisticsManager.save_record before the journal, which read and rewrote the whole checkpoint for every
+route, on a checkpoint of --routes routes.
+
+python tools/benchmarks/bench_results_journal.py --routes 2000
+'''
+
+
+def legacy_save_record(route_record, index, endpoint):
+    # StatisticsManager.save_record before the journal: the whole checkpoint read and rewritten
+    data = fetch_dict(endpoint) or create_default_json_msg()
+    records = data["_checkpoint"]["records"]
+    if index == len(records):
+        records.append(route_record.__dict__)
+    else:
+        records[index] = route_record.__dict__
+    save_dict(endpoint, data)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--routes", type=int, default=2000)
+    parser.add_argument("--legacy-routes", type=int, default=5, help="routes saved as before on the full checkpoint")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        endpoint = os.path.join(workdir, "results.json")
+        StatisticsManager.clear_record(endpoint)
+        start = time.perf_counter()
+        run_routes(endpoint, 0, args.routes, args.routes)
+        journal_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        data = compact_checkpoint(endpoint)
+        compact_seconds = time.perf_counter() - start
+
+        legacy = os.path.join(workdir, "legacy.json")
+        save_dict(legacy, data)
+        start = time.perf_counter()
+        for index in range(args.routes, args.routes + args.legacy_routes):
+            legacy_save_record(make_record(index), index, legacy)
+        legacy_seconds = (time.perf_counter() - start) / args.legacy_routes
+        size = os.path.getsize(legacy)
+
+    print("%d routes, checkpoint %.1f MB" % (args.routes, size / 2 ** 20))
+    print("journal              %8.3f ms/route" % (1e3 * journal_seconds / args.routes))
+    print("rewritten checkpoint %8.3f ms/route" % (1e3 * legacy_seconds))
+    print("compaction           %8.3f s" % compact_seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, os.path.join(bevdriver_root, "leaderboard"))
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "leaderboard"))
+from test_route_graph import lane_point, synthetic_town
+from leaderboard.utils.route_graph import RouteGraph, cache_path, interpolate_routes
+
+'''
+Interpolation of --routes routes of --keypoints keypoints on the synthetic town of test_route_graph.py
+(a --grid x --grid grid of two-way roads): the graph built for every route, as interpolate_trajectory set up a
+GlobalRoutePlanner for every route, against the graph built once, saved to its cache file and the routes
+interpolated by interpolate_routes in --processes worker processes that load it.
+
+On a CARLA map the setup of the planner queries the topology and the waypoints of the server and takes
+seconds per town, so the graph built for every route costs more than here.
+
+python tools/benchmarks/bench_route_graph.py --routes 300 --processes 4
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grid", type=int, default=8)
+    parser.add_argument("--routes", type=int, default=300)
+    parser.add_argument("--keypoints", type=int, default=3)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    topology, lanes = synthetic_town(args.grid)
+    rng = np.random.default_rng(0)
+    keys = sorted(lanes)
+    trajectories = [[lane_point(lanes, *keys[k], fraction=rng.uniform(0.2, 0.8))
+                     for k in rng.choice(len(keys), args.keypoints, replace=False)] for _ in range(args.routes)]
+
+    start = time.perf_counter()
+    graph = RouteGraph.from_topology(topology, 1.0)
+    setup_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    expected = [RouteGraph.from_topology(topology, 1.0).interpolate(trajectory) for trajectory in trajectories]
+    per_route_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        filename = cache_path("Town%02d" % args.grid, 1.0, cache_dir)
+        graph.save(filename)
+        start = time.perf_counter()
+        RouteGraph.load(filename)
+        load_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        routes = interpolate_routes(filename, trajectories, args.processes)
+        batch_seconds = time.perf_counter() - start
+        size = os.path.getsize(filename)
+
+    assert routes == expected
+    print("graph of %d nodes, %d edges: setup %.3f s, cache file %.1f MB loaded in %.3f s" % (
+        graph.graph.number_of_nodes(), graph.graph.number_of_edges(), setup_seconds, size / 2 ** 20, load_seconds))
+    print("%d routes, %d waypoints" % (len(routes), sum(len(route) for route in routes)))
+    print("graph per route         %7.2f s  %6.1f ms/route" % (per_route_seconds, 1e3 * per_route_seconds / len(routes)))
+    print("cached graph, %2d procs  %7.2f s  %6.1f ms/route" % (
+        args.processes or os.cpu_count(), batch_seconds, 1e3 * batch_seconds / len(routes)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import time
+import argparse
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, os.path.join(bevdriver_root, "leaderboard"))
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "leaderboard"))
+import test_route_parser
+from test_route_parser import RoadOption, dense_route, legacy_scan_route_for_scenarios, load_scenario_files, longest_routes
+from leaderboard.utils.route_parser import RouteParser
+
+'''
+RouteParser.scan_route_for_scenarios on the --routes longest shipped routes (over all the towns, or those of
+--towns) against the triggers of --scenarios: the waypoints of the route and the triggers in a LocationGrid
+against the scan of the whole route for every event and of all the triggers for every match, as before. The
+routes are the straight lines between their keypoints every meter, as in test_route_parser.py, and both give
+the same scenarios.
+
+python tools/benchmarks/bench_route_parser.py --routes 2 --towns Town04 Town06
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", default="merged_all_towns_scenarios.json")
+    parser.add_argument("--towns", nargs="+", default=None)
+    parser.add_argument("--routes", type=int, default=1)
+    args = parser.parse_args()
+
+    test_route_parser.route_parser.RoadOption = RoadOption
+    annotations = load_scenario_files()[args.scenarios]
+    routes = [(town, keypoints) for town in args.towns or annotations
+              for keypoints in longest_routes(town, args.routes)]
+    routes = sorted(routes, key=lambda route: len(dense_route(route[1])), reverse=True)[:args.routes]
+
+    for town, keypoints in routes:
+        route = dense_route(keypoints)
+        events = sum(len(scenario["available_event_configurations"]) for scenario in annotations[town])
+        start = time.perf_counter()
+        expected = legacy_scan_route_for_scenarios(town, route, annotations, memoize=False)
+        legacy_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        scenarios = RouteParser.scan_route_for_scenarios(town, route, annotations)
+        grid_seconds = time.perf_counter() - start
+        assert scenarios == expected
+        print("%-8s %5d waypoints %6d events %4d triggers: scan %7.2f s, grid %5.2f s" % (
+            town, len(route), events, len(scenarios[1]), legacy_seconds, grid_seconds))
+
+
+if __name__ == "__main__":
+    main()
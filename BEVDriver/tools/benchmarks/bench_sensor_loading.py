@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import tempfile
+
+import numpy as np
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS"))
+from timm.models import get_model_default_value
+from lavis.datasets.datasets.carla_dataset_llm import CarlaVoiceDataset
+from synthetic_routes import make_route_tree
+
+'''
+CPU time per CarlaVoiceDataset sample (one clip of up to --token-max-length frames, camera images
+and LiDAR from rgb_full/lidar files) for the sensors loaded:
+
+    all             every sensor field, as before input_keys
+    encoder         the input_keys of --encoder-model (bevdriver_encoder: all but rgb_rear, rgb_center
+                    needs the front view at full resolution)
+    no center       encoder without rgb_center, rgb_full is decoded at 1/2 size (DCT scaling)
+    left/right      only the side views, decoded at 1/4 size
+
+python tools/benchmarks/bench_sensor_loading.py --samples 20
+'''
+
+
+def run(dataset, indices):
+    random.seed(0)
+    np.random.seed(0)
+    start = time.process_time()
+    for index in indices:
+        dataset[index]
+    return (time.process_time() - start) / len(indices)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--token-max-length", type=int, default=10)
+    parser.add_argument("--encoder-model", default="bevdriver_encoder")
+    args = parser.parse_args()
+    # the synthetic clips have no instruction_args for the [x] of their instructions
+    logging.disable(logging.ERROR)
+
+    encoder_keys = get_model_default_value(args.encoder_model, "input_keys")
+    cases = [
+        ("all", None),
+        ("encoder", encoder_keys),
+        ("no center", [key for key in encoder_keys if key != "rgb_center"]),
+        ("left/right", ["rgb_left", "rgb_right"]),
+    ]
+    with tempfile.TemporaryDirectory() as root:
+        make_route_tree(root, num_routes=2, frames=60, clips_per_route=args.samples, token_max_length=args.token_max_length,
+                        with_sensors=True)
+        baseline = None
+        for name, input_keys in cases:
+            dataset = CarlaVoiceDataset(root, token_max_length=args.token_max_length, input_keys=input_keys)
+            indices = list(range(0, len(dataset), max(1, len(dataset) // args.samples)))[:args.samples]
+            dataset[indices[0]] # page cache
+            seconds = run(dataset, indices)
+            baseline = baseline or seconds
+            print("%-10s %7.1f ms/sample (x%.2f)  %s" % (
+                name, 1000 * seconds, baseline / seconds, ",".join(dataset.input_keys)
+            ))
+
+
+if __name__ == "__main__":
+    main()
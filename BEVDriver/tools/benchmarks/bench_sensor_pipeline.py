@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS"))
+sys.path.insert(0, os.path.join(bevdriver_root, "leaderboard"))
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "models"))
+from timm.models import get_model_default_value
+from team_code.sensor_pipeline import SensorPipeline, count_raw_points
+from test_sensor_pipeline import agent_transforms, make_frame, reference_step
+
+'''
+Sensor preprocessing of BEVDriverAgent per model step (two simulator steps, the model runs on every
+second one) on synthetic sensor frames of the agent's camera sizes:
+
+    tick        tick on both steps and the five camera transforms, as before the sensor pipeline
+    pipeline    SensorPipeline on the model step, the inputs of --encoder-model only, and the
+                num_points count on both steps
+    overlap     wall time per frame of a replay that submits the next frame before a stand-in model
+                call of --model-ms (a sleep, i.e. waiting for the GPU), against running them one
+                after the other
+
+python tools/benchmarks/bench_sensor_pipeline.py --frames 20
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--model-ms", type=float, default=100)
+    parser.add_argument("--encoder-model", default="bevdriver_encoder")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frames = [make_frame(rng, i) for i in range(args.frames)]
+    pose = (np.zeros(2), 0.0)
+    transforms = agent_transforms()
+
+    start = time.perf_counter()
+    prev_lidar = None
+    for frame in frames:
+        # the tick of the skipped step did the same work, without the camera transforms
+        for step_transforms in [{}, transforms]:
+            reference_step(frame, prev_lidar, *pose, step_transforms)
+            prev_lidar = frame["lidar"][1][..., :4]
+    tick = (time.perf_counter() - start) / len(frames)
+
+    input_keys = get_model_default_value(args.encoder_model, "input_keys")
+    pipeline = SensorPipeline({key: t for key, t in transforms.items() if key in input_keys}, "cpu",
+                              with_lidar="lidar" in input_keys)
+    start = time.perf_counter()
+    for frame in frames:
+        for _ in range(2):
+            count_raw_points(frame["lidar"][1])
+        pipeline(frame, *pose)
+    seconds = (time.perf_counter() - start) / len(frames)
+    print("tick      %7.1f ms/model step" % (1000 * tick))
+    print("pipeline  %7.1f ms/model step (x%.2f)  %s" % (1000 * seconds, tick / seconds, pipeline.summary()))
+
+    model = args.model_ms / 1000
+    start = time.perf_counter()
+    future = pipeline.submit(frames[0], *pose)
+    for i in range(len(frames)):
+        pipeline.result(future)
+        if i + 1 < len(frames):
+            future = pipeline.submit(frames[i + 1], *pose)
+        time.sleep(model)
+    overlapped = (time.perf_counter() - start) / len(frames)
+    print("overlap   %7.1f ms/frame, %.1f ms one after the other" % (1000 * overlapped, 1000 * (seconds + model)))
+    pipeline.close()
+
+
+if __name__ == "__main__":
+    main()
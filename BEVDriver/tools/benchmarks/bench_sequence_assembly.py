@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import argparse
+
+import torch
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS"))
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "models"))
+from conftest import build_tiny_drive_model
+from test_drive_sequence_assembly import (
+    INSTRUCTIONS,
+    NOTICES,
+    reference_concat_text_image_input,
+    reference_concat_text_image_input_with_notice,
+    reference_prompt_wrap,
+)
+
+'''
+Milliseconds per batch of the LLM sequence assembly of Blip2VicunaDrive.forward:
+
+    concat          concat_text_image_input (use_extra_prompt: False)
+    notice          concat_text_image_input_with_notice
+    prompt_wrap     prompt_wrap + concat_text_image_input (use_extra_prompt: True)
+
+for the batched implementations in drive.py and the per-sample loops they replaced (kept in
+LAVIS/tests/models/test_drive_sequence_assembly.py). The LLM is a random one with --hidden-size.
+
+python tools/benchmarks/bench_sequence_assembly.py --batch-size 4 --frames 40 --device cuda
+'''
+
+
+def timed(fn, repeat, device):
+    fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return 1000 * (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=40)
+    parser.add_argument("--query-tokens", type=int, default=4)
+    parser.add_argument("--hidden-size", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    model = build_tiny_drive_model(hidden_size=args.hidden_size, num_layers=1).to(device)
+    bs, t, n = args.batch_size, args.frames, args.query_tokens
+    instructions = [INSTRUCTIONS[i % len(INSTRUCTIONS)] for i in range(bs)]
+    notices = [NOTICES[i % len(NOTICES)] for i in range(bs)]
+    tokens = model.llm_tokenizer(instructions, return_tensors="pt", padding="longest").to(device)
+    with torch.no_grad():
+        input_embeds = model.llm_model.get_input_embeddings()(tokens.input_ids)
+    image_embeds = torch.randn(bs, t, n, args.hidden_size, device=device)
+    valid_frames = torch.tensor([t - 7 * (i % 4) for i in range(bs)])
+    end_flag_pos_list = [[n*(j+1)-1 for j in range(v)] for v in valid_frames.tolist()]
+    notice_frame_id = torch.tensor([[-1, 3, 10, 0][i % 4] for i in range(bs)])
+    text_before_img = ["|".join("<frame> %.1f , %.1f" % (j % 3 - 1, (i + j) % 3) for j in range(v))
+                       for i, v in enumerate(valid_frames.tolist())]
+    text_after_img = ["|".join(["</frame>"] * v) for v in valid_frames.tolist()]
+
+    def wrapped(wrap, concat):
+        def run():
+            embs, atts, end_flags = wrap(image_embeds, text_before_img, text_after_img, valid_frames)
+            concat(input_embeds, tokens.attention_mask, embs, valid_frames, end_flags, atts)
+        return run
+
+    cases = {
+        "concat": (
+            lambda: reference_concat_text_image_input(model, input_embeds, tokens.attention_mask, image_embeds, valid_frames, end_flag_pos_list),
+            lambda: model.concat_text_image_input(input_embeds, tokens.attention_mask, image_embeds, valid_frames, end_flag_pos_list),
+        ),
+        "notice": (
+            lambda: reference_concat_text_image_input_with_notice(model, input_embeds, tokens.attention_mask, image_embeds,
+                                                                  valid_frames, end_flag_pos_list, notice_frame_id, notices),
+            lambda: model.concat_text_image_input_with_notice(input_embeds, tokens.attention_mask, image_embeds,
+                                                              valid_frames, end_flag_pos_list, notice_frame_id, notices),
+        ),
+        "prompt_wrap": (
+            wrapped(lambda *a: reference_prompt_wrap(model, *a), lambda *a: reference_concat_text_image_input(model, *a)),
+            wrapped(model.prompt_wrap, model.concat_text_image_input),
+        ),
+    }
+    print("batch %d x %d frames, %d query tokens, hidden %d, %s" % (bs, t, n, args.hidden_size, device))
+    with torch.no_grad():
+        for name, (loop, batched) in cases.items():
+            loop_ms, batched_ms = timed(loop, args.repeat, device), timed(batched, args.repeat, device)
+            print("%-12s  loop %8.2f ms  batched %7.2f ms  (x%.1f)" % (name, loop_ms, batched_ms, loop_ms / batched_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import argparse
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+bevdriver_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, bevdriver_root)
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS"))
+sys.path.insert(0, os.path.join(bevdriver_root, "LAVIS", "tests", "models"))
+from timm.utils import AverageMeter, DeviceAverageMeter, binary_iou, semantic_iou_stats, sync_meters
+from test_device_metrics import NUM_CLASSES, reference_traffic_iou, reference_update
+
+'''
+Training step of a small segmentation model on the CPU (--batch-size views of --size px, semantic
+logits of 28 classes and a 20x20x7 traffic map, as the bev encoder training) with the metrics of
+BEV_encoder/train.py's train_one_epoch, logged every --log-interval steps:
+
+    item        .item() of the losses and the traffic IoU, semantic_iou's loop over the classes
+                (.item() per class) on every step
+    device      DeviceAverageMeters and semantic_iou_stats, one sync_meters per log interval
+
+On a GPU every .item() also waits for the queued kernels, which the CPU timing does not show.
+
+python tools/benchmarks/bench_train_metrics.py --steps 60
+'''
+
+
+class SmallSegmentationModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.backbone = nn.Sequential(nn.Conv2d(3, 16, 3, padding=1), nn.ReLU(), nn.Conv2d(16, 16, 3, padding=1), nn.ReLU())
+        self.semantic = nn.Conv2d(16, NUM_CLASSES, 1)
+        self.traffic = nn.Linear(16, 20 * 20 * 7)
+
+    def forward(self, x):
+        features = self.backbone(x)
+        return self.semantic(features), self.traffic(features.mean(dim=(2, 3)))
+
+
+def run(mode, batches, steps, log_interval):
+    torch.manual_seed(0)
+    model = SmallSegmentationModel()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+    meter_class = AverageMeter if mode == "item" else DeviceAverageMeter
+    losses_m, losses_traffic, traffic_iou_m = meter_class(), meter_class(), meter_class()
+    semantic_meters = [meter_class() for _ in range(3)]
+    meters = [losses_m, losses_traffic, traffic_iou_m] + semantic_meters
+    metric_seconds = 0.0
+    logged = []
+    start = time.perf_counter()
+    for step in range(steps):
+        image, semantic_target, traffic_target = batches[step % len(batches)]
+        semantic_logits, traffic = model(image)
+        loss_semantic = F.cross_entropy(semantic_logits, semantic_target, ignore_index=-100)
+        loss_traffic = F.l1_loss(traffic, traffic_target)
+        loss = loss_semantic * 0.6 + loss_traffic * 0.3
+        semantic_pred = semantic_logits.argmax(dim=1).view(-1)
+
+        metric_start = time.perf_counter()
+        traffic_pred = torch.clip(traffic[0], 0, 1).view(1, 20, 20, 7)[:, :, :, 0]
+        traffic_gt = traffic_target[0].view(1, 20, 20, 7)[:, :, :, 0]
+        batch_size = image.size(0)
+        if mode == "item":
+            traffic_iou_m.update(reference_traffic_iou(traffic_pred, traffic_gt), batch_size)
+            reference_update(semantic_meters, semantic_pred, semantic_target.view(-1), True, batch_size)
+            losses_traffic.update(loss_traffic.item(), batch_size)
+            losses_m.update(loss.item(), batch_size)
+        else:
+            traffic_iou_m.update(binary_iou(traffic_pred, traffic_gt), batch_size)
+            stats = semantic_iou_stats(semantic_pred, semantic_target.view(-1), semantic_logits.size(1))
+            for meter, value in zip(semantic_meters, stats):
+                meter.update(value, batch_size)
+            losses_traffic.update(loss_traffic, batch_size)
+            losses_m.update(loss, batch_size)
+        metric_seconds += time.perf_counter() - metric_start
+
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+        if step % log_interval == 0 or step == steps - 1:
+            metric_start = time.perf_counter()
+            if mode == "device":
+                sync_meters(*meters)
+            logged.append(["%.3f (%.3f)" % (meter.val, meter.avg) for meter in meters])
+            metric_seconds += time.perf_counter() - metric_start
+    return (time.perf_counter() - start) / steps, metric_seconds / steps, logged
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=60)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--size", type=int, default=112)
+    parser.add_argument("--log-interval", type=int, default=20)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    generator = torch.Generator().manual_seed(0)
+    batches = []
+    for _ in range(4):
+        semantic_target = torch.randint(0, NUM_CLASSES, (args.batch_size, args.size, args.size), generator=generator)
+        semantic_target[torch.rand(semantic_target.shape, generator=generator) < 0.05] = -100
+        batches.append((torch.randn(args.batch_size, 3, args.size, args.size, generator=generator), semantic_target,
+                        torch.rand(args.batch_size, 20 * 20 * 7, generator=generator) ** 3))
+
+    results = {mode: run(mode, batches, args.steps, args.log_interval) for mode in ["item", "device"]}
+    for mode, (step_seconds, metric_seconds, _) in results.items():
+        print("%-7s %7.2f ms/step  metrics %6.2f ms/step" % (mode, 1000 * step_seconds, 1000 * metric_seconds))
+    same = results["item"][2] == results["device"][2]
+    print("logged values %s" % ("identical" if same else "differ"))
+
+
+if __name__ == "__main__":
+    main()
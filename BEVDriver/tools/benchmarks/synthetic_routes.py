@@ -0,0 +1,133 @@
+import os
+import json
+
+import numpy as np
+from PIL import Image
+
+'''
+Synthetic dataset tree in the layout produced by the data collection and preprocessing tools,
+used by the benchmarks in this folder and the dataset tests:
+
+    <root>/navigation_instruction_list.txt
+    <root>/sub-0/data/routes_town01_<i>_w<weather>/measurements_all.json
+                                                 /rgb_full/%04d.jpg      (with_sensors)
+                                                 /lidar/%04d.npy         (with_sensors)
+'''
+
+
+def make_measurements(frames, rng):
+    theta = np.cumsum(rng.normal(0, 0.01, frames))
+    speed = np.abs(rng.normal(5, 1, frames))
+    gps_x = np.cumsum(np.cos(theta) * speed * 0.05)
+    gps_y = np.cumsum(np.sin(theta) * speed * 0.05)
+    measurements = []
+    for i in range(frames):
+        far = min(frames - 1, i + 40)
+        measurements.append({
+            "gps_x": float(gps_x[i]),
+            "gps_y": float(gps_y[i]),
+            "x": float(gps_y[i]),
+            "y": float(-gps_x[i]),
+            "theta": float(theta[i]),
+            "speed": float(speed[i]),
+            "target_speed": 6.0,
+            "x_command": float(gps_x[far]),
+            "y_command": float(gps_y[far]),
+            "command": int(rng.integers(1, 7)),
+            "gt_command": 4,
+            "steer": float(rng.normal(0, 0.1)),
+            "throttle": float(rng.uniform(0, 0.75)),
+            "brake": bool(rng.random() < 0.1),
+            "weather": [0.0] * 6,
+            "weather_id": 1,
+            "near_node_x": float(gps_x[far]),
+            "near_node_y": float(gps_y[far]),
+            "far_node_x": float(gps_x[far]),
+            "far_node_y": float(gps_y[far]),
+            "is_junction": False,
+            "is_vehicle_present": [],
+            "is_bike_present": [],
+            "is_lane_vehicle_present": [],
+            "is_junction_vehicle_present": [],
+            "is_pedestrian_present": [],
+            "is_red_light_present": [],
+            "is_stop_sign_present": [],
+            "should_slow": 0,
+            "should_brake": 0,
+            "future_waypoints": [[float(gps_y[j]), float(-gps_x[j])] for j in range(i, min(frames, i + 50))],
+            "affected_light_id": -1,
+        })
+    return measurements
+
+
+def make_lidar(rng, points=30000):
+    xyz = rng.uniform([-30, -30, -2.5], [30, 30, 2.0], size=(points, 3))
+    intensity = rng.uniform(0, 1, size=(points, 1))
+    return np.concatenate([xyz, intensity], axis=1).astype(np.float32)
+
+
+def make_sensor_frames(route_path, frames, rng, missing=(), lidar_points=30000, image_block=8):
+    # rgb_full/%04d.jpg (random image_block x image_block pixel blocks) and lidar/%04d.npy of the frames,
+    # without those in missing
+    os.makedirs(os.path.join(route_path, "rgb_full"), exist_ok=True)
+    os.makedirs(os.path.join(route_path, "lidar"), exist_ok=True)
+    for i in range(frames):
+        if i in missing:
+            continue
+        image = rng.integers(0, 255, size=(2400 // image_block, 800 // image_block, 3), dtype=np.uint8)
+        Image.fromarray(image).resize((800, 2400)).save(os.path.join(route_path, "rgb_full", "%04d.jpg" % i))
+        np.save(os.path.join(route_path, "lidar", "%04d.npy" % i), make_lidar(rng, lidar_points))
+
+
+def make_route(route_path, frames, missing=(), lidar_points=30000, image_block=8, seed=0):
+    # a single route with its measurements and sensor frames
+    rng = np.random.default_rng(seed)
+    os.makedirs(route_path, exist_ok=True)
+    with open(os.path.join(route_path, "measurements_all.json"), "w") as f:
+        json.dump(make_measurements(frames, rng), f)
+    make_sensor_frames(route_path, frames, rng, missing, lidar_points, image_block)
+    return route_path
+
+
+def instruction_line(route, start_frame, end_frame, route_frames, instruction_id=1):
+    # an entry of navigation_instruction_list.txt for a clip of the route (relative to the root)
+    return json.dumps({
+        "route_path": route,
+        "town_id": 1,
+        "weather_id": 1,
+        "start_frame": start_frame,
+        "end_frame": end_frame,
+        "instruction": "Follow-01" if instruction_id % 2 else "Turn-01-L",
+        "instruction_id": instruction_id,
+        "instruction_args": [],
+        "route_frames": route_frames,
+    })
+
+
+def write_instruction_list(root, lines):
+    with open(os.path.join(root, "navigation_instruction_list.txt"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def make_route_tree(root, num_routes=8, frames=400, clips_per_route=40, token_max_length=40,
+                    sample_interval=2, with_sensors=False, seed=0):
+    rng = np.random.default_rng(seed)
+    route_paths = []
+    lines = []
+    for r in range(num_routes):
+        route = os.path.join("sub-0", "data", "routes_town01_%d_w1" % r)
+        route_path = os.path.join(root, route)
+        os.makedirs(route_path, exist_ok=True)
+        with open(os.path.join(route_path, "measurements_all.json"), "w") as f:
+            json.dump(make_measurements(frames, rng), f)
+        if with_sensors:
+            make_sensor_frames(route_path, frames, rng)
+        route_paths.append(route_path)
+
+        for _ in range(clips_per_route):
+            length = int(rng.integers(4, token_max_length * sample_interval))
+            start = int(rng.integers(0, frames - length - sample_interval - 1))
+            instruction_id = int(rng.integers(0, 4))
+            lines.append(instruction_line(route, start, start + length, frames, instruction_id))
+    write_instruction_list(root, lines)
+    return route_paths
@@ -1,32 +1,23 @@
 import os
 import math
-import carla
 import random
+try:
+    import carla  # only needed for the OpenDRIVE lane queries of ChangeLaneFalse
+except ImportError:
+    carla = None
 from pathlib import Path
 random.seed(0)
 from abc import ABC, abstractmethod
 
+import numpy as np
+
+from frame_table import frame_table, next_index, first_index, travelled_until, closest_distance_start
+
 class Follow(ABC):
     @abstractmethod
     def choose_start(self, index, frames, distance):
         """ Choose start point of data clip that has instruction with distance"""
-        start = None
-        initial_frame = frames[index]
-        difference_min = float('inf')
-
-        for i in range(index):
-            frame = frames[index - i]
-            dist = math.sqrt(pow(initial_frame["x"]-frame["x"], 2)+pow(initial_frame["y"]-frame["y"], 2))
-            if abs(dist-distance) < difference_min:
-                difference_min = abs(dist-distance)
-                index_min = i
-            elif difference_min < 2:
-                break
-
-        if difference_min < 2:
-            start = index - index_min
-
-        return start
+        return closest_distance_start(frames, index, distance)
 
 class Follow01(Follow):
     def __init__(self, direction, dis=False):
@@ -41,28 +32,25 @@ class Follow01(Follow):
 
     def sample_frame(self, index, frames):
         start = index
-        frame_range = min(start+self.total_range, len(frames))
-        end = frame_range - 1
+        end = len(frames) - 1
         distance = 2 + 18*random.random()
         instruction_args = []
 
-        for i in range(start, frame_range):
-            frame = frames[i]
-            command = frame["command"]
-            # Endpoint of the sampling
-            if command == self.direction_command_mapping[self.direction]:
-                continue
-            if command != 3 and command != 4:
+        # Endpoint of the sampling: lane change over (another command) and heading back to the one at start,
+        # or a turn command, which discards the clip
+        command = self.direction_command_mapping[self.direction]
+        def lane_change_end(s):
+            other_command = frames.command[s] != command
+            follow = (frames.command[s] == 3) | (frames.command[s] == 4)
+            difference = np.abs(frames.theta[start] - frames.theta[s])
+            turned = (difference > 1/36*math.pi) & (2*math.pi - difference > 1/36*math.pi)
+            return other_command & (~follow | ~turned)
+        i = first_index(lane_change_end, start, len(frames))
+        if i is not None:
+            if frames.command[i] != 3 and frames.command[i] != 4:
                 end = None
                 return start, end, instruction_args
-            if abs(frames[start]["theta"]-frame["theta"]) > 1/36*math.pi and 2*math.pi - abs(frames[start]["theta"]-frame["theta"]) > 1/36*math.pi:
-                continue
             end = i
-            if self.dis == False:
-                return start, end, instruction_args
-            start = self.choose_start(index, frames, distance)
-            instruction_args.append(round(distance))
-            return start, end, instruction_args
 
         if self.dis == False:
             return start, end, instruction_args
@@ -96,12 +84,15 @@ class Follow01(Follow):
 
     def process(self, data):
         results = []
-        frames = data["data"]
-        frame_num = len(frames)
-        index = 15
-        while index < frame_num :
+        frames = frame_table(data)
+        command = self.direction_command_mapping[self.direction]
+        # add_result only samples a clip where a lane change command follows a follow-lane/straight command
+        previous_command = np.roll(frames.command, 1)
+        candidates = np.flatnonzero((frames.command == command) & ((previous_command == 3) | (previous_command == 4)))
+        index = next_index(candidates, 15)
+        while index is not None:
             index = self.add_result(results, index, frames)
-            index = index + 1
+            index = next_index(candidates, index + 1)
         return results
 
 class Follow02(Follow):
@@ -125,34 +116,25 @@ class Follow02(Follow):
 
     def sample_frame(self, index, frames):
         start = index
-        frame_range = min(start + self.total_range, len(frames))
-        end = frame_range - 1
+        end = len(frames) - 1
         distance = 2 + 18*random.random()
-        pass_distance = 0
         instruction_args = []
 
-        for i in range(start, frame_range):
-            frame = frames[i]
-            if self.dis == True:
-                last_frame = frames[i - 1]
-                step = math.sqrt(pow(frame["x"]-last_frame["x"], 2)+pow(frame["y"]-last_frame["y"], 2))
-                pass_distance = pass_distance + step
-                if pass_distance < distance:
-                    continue
+        if self.dis == True:
+            # Endpoint of the sampling: `distance` travelled
+            i, pass_distance = travelled_until(frames, start, lambda travelled, s: ~(travelled < distance))
+            if i is not None:
                 end = i
                 instruction_args.append(round(distance))
                 return start, end, instruction_args
-            command = frame["command"]
-            # Endpoint of the sampling
-            if command == 4 or command == 3:
-                continue
-            end = i
+            distance = pass_distance
+            instruction_args.append(round(distance))
             return start, end, instruction_args
 
-        if self.dis == False:
-            return start, end, instruction_args
-        distance = pass_distance
-        instruction_args.append(round(distance))
+        # Endpoint of the sampling: any command but follow lane/straight
+        i = next_index(frames.indices("not_follow", lambda: (frames.command != 4) & (frames.command != 3)), start)
+        if i is not None:
+            end = i
         return start, end, instruction_args
 
     def add_result(self, results, index, frames, town_id):
@@ -177,16 +159,24 @@ class Follow02(Follow):
 
     def process(self, data):
         results = []
-        frames = data["data"]
+        frames = frame_table(data)
         frame_num = len(frames)
         town_id = data["town_id"]
         if self.style == 2:
             if town_id < 4 or town_id > 6:
                 return results
-        index = 15
-        while index < frame_num :
+        # add_result only samples a clip at frames with the follow lane command (on a highway for style 2)
+        candidates = frames.command == 4
+        if self.style == 2:
+            highway = np.zeros(frame_num, dtype=bool)
+            for bounds in self.highway_range[str(town_id)]:
+                highway |= (frames.x > bounds[0]) & (frames.x < bounds[1]) & (frames.y > bounds[2]) & (frames.y < bounds[3])
+            candidates &= highway
+        candidates = np.flatnonzero(candidates)
+        index = next_index(candidates, 15)
+        while index is not None:
             index = self.add_result(results, index, frames, town_id)
-            index = index + 1
+            index = next_index(candidates, index + 1)
         return results
 
 class Follow03(Follow):
@@ -200,41 +190,33 @@ class Follow03(Follow):
 
     def sample_frame(self, index, frames):
         start = index
-        frame_range = min(start+self.total_range, len(frames))
-        end = frame_range - 1
+        end = len(frames) - 1
         distance = 4 + 36*random.random()
-        pass_distance = 0
         instruction_args = []
 
-        for i in range(start, frame_range):
-            frame = frames[i]
-            command = frame["command"]
-            if self.dis == True:
-                last_frame = frames[i - 1]
-                step = math.sqrt(pow(frame["x"]-last_frame["x"], 2)+pow(frame["y"]-last_frame["y"], 2))
-                pass_distance = pass_distance + step
-                if pass_distance >= distance:
-                    instruction_args.append(round(pass_distance))
-                    return start, end, instruction_args
-                if command == 4 :
-                    continue
-                if command == 3 and self.style == 1:
-                    continue
-                end = i
+        # Endpoint of the sampling: any command but follow lane (and straight for style 1)
+        if self.style == 1:
+            road_end = frames.indices("not_follow", lambda: (frames.command != 4) & (frames.command != 3))
+        else:
+            road_end = frames.indices("not_follow_lane", lambda: frames.command != 4)
+
+        if self.dis == True:
+            ended = np.zeros(len(frames), dtype=bool)
+            ended[road_end] = True
+            i, pass_distance = travelled_until(frames, start, lambda travelled, s: (travelled >= distance) | ended[s])
+            if i is not None:
+                # reaching `distance` keeps the last frame as the end
+                if not pass_distance >= distance:
+                    end = i
                 instruction_args.append(round(pass_distance))
                 return start, end, instruction_args
-
-            if command == 4 :
-                continue
-            if command == 3 and self.style == 1:
-                continue
-            end = i
+            distance = pass_distance
+            instruction_args.append(round(distance))
             return start, end, instruction_args
 
-        if self.dis == False:
-            return start, end, instruction_args
-        distance = pass_distance
-        instruction_args.append(round(distance))
+        i = next_index(road_end, start)
+        if i is not None:
+            end = i
         return start, end, instruction_args
 
     def add_result(self, results, index, frames):
@@ -259,12 +241,16 @@ class Follow03(Follow):
 
     def process(self, data):
         results = []
-        frames = data["data"]
-        frame_num = len(frames)
-        index = 15
-        while index < frame_num :
+        frames = frame_table(data)
+        # add_result only samples a clip at frames with the follow lane (or for style 1 straight) command
+        candidates = frames.command == 4
+        if self.style == 1:
+            candidates |= frames.command == 3
+        candidates = np.flatnonzero(candidates)
+        index = next_index(candidates, 15)
+        while index is not None:
             index = self.add_result(results, index, frames)
-            index = index + 1
+            index = next_index(candidates, index + 1)
         return results
 
 class Follow04(Follow):
@@ -284,21 +270,15 @@ class Follow04(Follow):
 
     def sample_frame(self, index, frames, des_loc):
         start = index
-        frame_range = min(start+self.total_range, len(frames))
-        end = frame_range - 1
+        end = len(frames) - 1
         distance = 2 + 18*random.random()
         instruction_args = []
 
-        for i in range(start, frame_range):
-            frame = frames[i]
-            if math.sqrt(pow(des_loc["out"][0]-frame["x"], 2)+pow(des_loc["out"][1]-frame["y"], 2))>10:
-                continue
+        # Endpoint of the sampling: within 10m of the exit
+        exits = frames.indices(("near", tuple(des_loc["out"]), 10), lambda: frames.near(des_loc["out"], 10))
+        i = next_index(exits, start)
+        if i is not None:
             end = i
-            if self.dis == False:
-                return start, end, instruction_args
-            start = self.choose_start(index, frames, distance)
-            instruction_args.append(round(distance))
-            return start, end, instruction_args
 
         if self.dis == False:
             return start, end, instruction_args
@@ -332,16 +312,19 @@ class Follow04(Follow):
 
     def process(self, data):
         results = []
-        frames = data["data"]
-        frame_num = len(frames)
+        frames = frame_table(data)
         town_id = data["town_id"]
         for direction in self.directions:
-            if self.townid_loc_mapping[direction][str(town_id)] == None:
+            town_loc = self.townid_loc_mapping[direction][str(town_id)]
+            if town_loc == None:
                 continue
-            index = 15
-            while index < frame_num :
+            # add_result only samples clips at frames with the direction's command near a highway entry
+            command = self.direction_command_mapping[direction]
+            candidates = np.flatnonzero((frames.command == command) & frames.near_any([loc["in"] for loc in town_loc], 10))
+            index = next_index(candidates, 15)
+            while index is not None:
                 index = self.add_result(results, index, frames, town_id, direction)
-                index = index + 1
+                index = next_index(candidates, index + 1)
         return results
 
 class ChangeLaneFalse():
@@ -0,0 +1,177 @@
+import math
+from functools import cached_property
+
+import numpy as np
+
+# Frames a forward scan looks at per numpy call, most scans stop within a few dozen frames
+SCAN_CHUNK = 256
+
+
+class FrameTable():
+    """
+    Columnar view of the measurements of a route for the instruction rules.
+
+    Indexing still returns the frame dicts, so scalar checks read as before; scans over frames use the
+    arrays. Every column is computed with the same float expressions as the per-frame rules, so masks
+    and distances (and the clips built from them) are identical.
+    """
+    def __init__(self, frames):
+        self.frames = frames
+        self.x = np.array([frame["x"] for frame in frames], dtype=np.float64)
+        self.y = np.array([frame["y"] for frame in frames], dtype=np.float64)
+        self.theta = np.array([frame["theta"] for frame in frames], dtype=np.float64)
+        self.command = np.array([frame["command"] for frame in frames], dtype=np.int64)
+        self._indices = {}
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def column(self, key):
+        return np.array([frame[key] for frame in self.frames], dtype=np.float64)
+
+    @cached_property
+    def speed(self):
+        return self.column("speed")
+
+    @cached_property
+    def brake(self):
+        return np.array([frame["brake"] == True for frame in self.frames])
+
+    @cached_property
+    def gps_x(self):
+        return self.column("gps_x")
+
+    @cached_property
+    def gps_y(self):
+        return self.column("gps_y")
+
+    @cached_property
+    def x_command(self):
+        return self.column("x_command")
+
+    @cached_property
+    def y_command(self):
+        return self.column("y_command")
+
+    @cached_property
+    def step(self):
+        """ Distance to the previous frame, frame 0 is compared to the last one (frames[-1])"""
+        return np.sqrt(pow(self.x - np.roll(self.x, 1), 2) + pow(self.y - np.roll(self.y, 1), 2))
+
+    @cached_property
+    def turn_end(self):
+        """ Heading more than 5 degrees away from all four axis directions (Turn.turn_end)"""
+        tolerance = 1/36 * math.pi
+        mask = np.ones(len(self), dtype=bool)
+        for angle in [0, math.pi*1/2, math.pi, math.pi*3/2]:
+            difference = np.abs(angle - self.theta)
+            mask &= (difference > tolerance) & (2*math.pi - difference > tolerance)
+        return mask
+
+    @cached_property
+    def light_distance(self):
+        """ Rounded distance to the traffic light affecting the vehicle, inf without one"""
+        distance = np.full(len(self), np.inf)
+        for i, frame in enumerate(self.frames):
+            light_id = str(frame["affected_light_id"])
+            if frame["affected_light_id"] == -1 or light_id not in frame["actors_data"]:
+                continue
+            light_loc = frame["actors_data"][light_id]["loc"]
+            distance[i] = round(math.sqrt(pow(light_loc[0]-frame["x"], 2)+pow(light_loc[1]-frame["y"], 2)))
+        return distance
+
+    def indices(self, key, mask):
+        """ Sorted indices of the frames where mask() is True, computed once per key and route"""
+        if key not in self._indices:
+            self._indices[key] = np.flatnonzero(mask())
+        return self._indices[key]
+
+    def distance(self, loc):
+        return np.sqrt(pow(loc[0] - self.x, 2) + pow(loc[1] - self.y, 2))
+
+    def near(self, loc, radius):
+        """ Frames not farther than radius from loc ([x, y, ...]), i.e. the rules' `not dist > radius`"""
+        return ~(self.distance(loc) > radius)
+
+    def near_any(self, locs, radius=None):
+        """ Frames near any of locs, radius None takes each loc's own radius loc[2]"""
+        mask = np.zeros(len(self), dtype=bool)
+        for loc in locs:
+            mask |= self.near(loc, loc[2] if radius is None else radius)
+        return mask
+
+
+def frame_table(data):
+    """ The FrameTable of a rule's data dict, shared through data["table"] when the caller built one"""
+    table = data.get("table")
+    if table is None:
+        table = FrameTable(data["data"])
+    return table
+
+
+def next_index(positions, index):
+    """ First entry of the sorted frame indices `positions` that is >= index, None if there is none"""
+    k = positions.searchsorted(index)
+    if k == len(positions):
+        return None
+    return int(positions[k])
+
+
+def travelled_until(table, start, predicate, chunk=SCAN_CHUNK):
+    """
+    Scan the distance travelled from frame start on (table.step summed up frame by frame, as the rules
+    do) for the first frame i where predicate(travelled, slice) holds. Returns (i, travelled at i), or
+    (None, total travelled distance).
+    """
+    carry = 0.0
+    for lo in range(start, len(table), chunk):
+        frames = slice(lo, min(lo + chunk, len(table)))
+        travelled = np.cumsum(np.concatenate([[carry], table.step[frames]]))[1:]
+        hits = np.flatnonzero(predicate(travelled, frames))
+        if len(hits):
+            return lo + int(hits[0]), travelled[hits[0]]
+        carry = travelled[-1]
+    return None, carry
+
+
+def first_index(predicate, start, stop, chunk=SCAN_CHUNK):
+    """ First i in [start, stop) where predicate(slice) is True, scanning chunk frames at a time"""
+    for lo in range(start, stop, chunk):
+        hits = np.flatnonzero(predicate(slice(lo, min(lo + chunk, stop))))
+        if len(hits):
+            return lo + int(hits[0])
+    return None
+
+
+def closest_distance_start(table, index, distance, max_range=None, chunk=SCAN_CHUNK):
+    """
+    Walk back from index to the frame whose straight-line distance to frames[index] is closest to
+    `distance`, stopping at the first frame that does not improve once the best one is within 2 m.
+    Returns index - offset of that frame, or None if no frame within 2 m of `distance` is found.
+    """
+    if index is None:
+        return None
+    scan_range = index if max_range is None else min(index, max_range)
+    difference_min, index_min = np.inf, None
+    for lo in range(0, scan_range, chunk):
+        offsets = np.arange(lo, min(lo + chunk, scan_range))
+        frames = index - offsets
+        dist = np.sqrt(pow(table.x[index] - table.x[frames], 2) + pow(table.y[index] - table.y[frames], 2))
+        difference = np.abs(dist - distance)
+        # best difference before each offset, NaN never improves it (as with `<` in the loop)
+        previous_min = np.fmin.accumulate(np.concatenate([[difference_min], difference]))[:-1]
+        improved = difference < previous_min
+        stops = np.flatnonzero(~improved & (previous_min < 2))
+        if len(stops):
+            improved = improved[:stops[0]]
+        if improved.any():
+            last = np.flatnonzero(improved)[-1]
+            difference_min, index_min = difference[last], int(offsets[last])
+        if len(stops):
+            break
+    if difference_min < 2:
+        return index - index_min
+    return None
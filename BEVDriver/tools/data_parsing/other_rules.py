@@ -2,6 +2,10 @@ import math
 import random
 random.seed(0)
 
+import numpy as np
+
+from frame_table import frame_table, next_index
+
 class Other01():
     def __init__(self):
         self.total_range = 128
@@ -40,17 +44,12 @@ class Other02():
 
     def sample_frame(self, index, frames):
         start = index
-        frame_range = min(start+self.total_range,len(frames))
-        end = frame_range - 1
+        end = len(frames) - 1
 
-        for i in range(start, frame_range):
-            frame = frames[i]
-            last_frame = frames[i - 1]
-            if math.sqrt(pow(frame["x"]-last_frame["x"], 2)+pow(frame["y"]-last_frame["y"], 2)) != 0 and frame["brake"] == True:
-                continue
+        # first frame that is not braking while moving
+        i = next_index(frames.indices("not_braking", lambda: ~((frames.step != 0) & frames.brake)), start)
+        if i is not None:
             end = i - 1
-            return start, end
-
         return start, end
 
     def add_result(self, results, index, frames):
@@ -75,14 +74,15 @@ class Other02():
 
     def process(self, data):
         results = []
-        frames = data["data"]
-        frame_num = len(frames)
-        index = 15
-        while index < frame_num :
+        frames = frame_table(data)
+        # add_result only samples a clip at frames braking while moving
+        candidates = frames.indices("braking", lambda: (frames.step != 0) & frames.brake)
+        index = next_index(candidates, 15)
+        while index is not None:
             index = self.add_result(results, index, frames)
-            index = index + 1
             if results:
                 return results
+            index = next_index(candidates, index + 1)
         return results
 
 class Other03():
@@ -91,19 +91,13 @@ class Other03():
 
     def sample_frame(self, index, frames):
         start = index
-        frame_range = min(start+self.total_range, len(frames))
         end = None
 
-        for i in range(start, frame_range):
-            frame = frames[i]
-            last_frame = frames[i - 1]
-            if frame["brake"]!=True:
-                return start, end
-            if math.sqrt(pow(frame["x"]-last_frame["x"], 2)+pow(frame["y"]-last_frame["y"], 2)) != 0:
-                continue
-            end = i
+        # first frame that stands still, or stopped braking before
+        i = next_index(frames.indices("stopped_or_released", lambda: ~frames.brake | ~(frames.step != 0)), start)
+        if i is None or not frames.brake[i]:
             return start, end
-
+        end = i
         return start, end
 
     def add_result(self, results, index, frames):
@@ -130,14 +124,15 @@ class Other03():
 
     def process(self, data):
         results = []
-        frames = data["data"]
-        frame_num = len(frames)
-        index = 15
-        while index < frame_num :
+        frames = frame_table(data)
+        # add_result only samples a clip at frames braking while moving
+        candidates = frames.indices("braking", lambda: (frames.step != 0) & frames.brake)
+        index = next_index(candidates, 15)
+        while index is not None:
             index = self.add_result(results, index, frames)
-            index = index + 1
             if results:
                 return results
+            index = next_index(candidates, index + 1)
         return results
 
 class Other04():
@@ -180,20 +175,16 @@ class Other05():
 
     def sample_frame(self, index, frames, des_loc):
         start = index
-        frame_range = min(start+self.total_range, len(frames))
         end = None
-        distance_min = float('inf')
-
-        for i in range(start, frame_range):
-            frame = frames[i]
-            eagle_loc = [frame["gps_y"],frame["gps_x"]]
-            distance = math.sqrt(pow(eagle_loc[0]-des_loc[0], 2)+pow(eagle_loc[1]-des_loc[1], 2))
-            if distance < distance_min:
-                distance_min = distance
-                i_min = i
 
-        if distance_min < 2:
-            end = i_min
+        # closest frame to des_loc from start on (the first one on ties, NaN never is)
+        distance = np.sqrt(pow(frames.gps_y[start:]-des_loc[0], 2)+pow(frames.gps_x[start:]-des_loc[1], 2))
+        distance[np.isnan(distance)] = np.inf
+        if len(distance) == 0:
+            return start, end
+        i_min = int(np.argmin(distance))
+        if distance[i_min] < 2:
+            end = start + i_min
 
         return start, end
 
@@ -236,7 +227,7 @@ class Other05():
 
     def process(self, data):
         results = []
-        frames = data["data"]
+        frames = frame_table(data)
         frame_num = len(frames)
         index = 15
         while index < frame_num :
@@ -2,11 +2,20 @@ import os
 import re
 import sys
 import json
+import time
+import zlib
+import random
+import hashlib
+import argparse
+import functools
+from multiprocessing import Pool
+
 from tqdm import tqdm
 
 from turn_rules import Turn01, Turn02, Turn03, Turn04, Turn05, Turn06
 from follow_rules import Follow01, Follow02, Follow03, Follow04
 from other_rules import Other01, Other02, Other03, Other04, Other05
+from frame_table import FrameTable
 
 registered_class = {
     'Turn-01-L': Turn01(direction='left'),
@@ -68,82 +77,202 @@ registered_class = {
 rule_id_mapping_dict = {k: i for i, k in enumerate(registered_class)}
 processing_rules = list(rule_id_mapping_dict.keys())
 
+# Per-route results of previous runs, reused while neither the route's frame files nor the rules change
+CACHE_DIR_NAME = '.instruction_cache'
+RULE_FILES = ['parse_instruction.py', 'frame_table.py', 'turn_rules.py', 'follow_rules.py', 'other_rules.py']
+
+
+def rules_version():
+    digest = hashlib.sha1()
+    rules_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in RULE_FILES:
+        with open(os.path.join(rules_dir, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def route_fingerprint(dir_path, frames):
+    """ Hash of the route length and the names, sizes and mtimes of its measurements and actors_data files"""
+    digest = hashlib.sha1(str(frames).encode())
+    for sub_dir in ['measurements', 'actors_data']:
+        sub_path = os.path.join(dir_path, sub_dir)
+        if not os.path.isdir(sub_path):
+            digest.update(b'missing')
+            continue
+        entries = []
+        for entry in os.scandir(sub_path):
+            stat = entry.stat()
+            entries.append((entry.name, stat.st_size, stat.st_mtime_ns))
+        digest.update(repr(sorted(entries)).encode())
+    return digest.hexdigest()
+
+
+def load_frames(dir_path, frames):
+    json_data = []
+    for frame_id in range(frames):
+        measurement_path = os.path.join(dir_path, 'measurements', f"{frame_id:04d}.json")
+        actor_path = os.path.join(dir_path, 'actors_data', f"{frame_id:04d}.json")
+        if not os.path.exists(measurement_path):
+            continue
+        with open(measurement_path, 'r') as f:
+            frame_data = json.load(f)
+        # the rules only look up the traffic light affecting the ego vehicle, skip the (large) actor
+        # files of frames without one and keep only that light
+        frame_data["actors_data"] = {}
+        light_id = str(frame_data.get("affected_light_id", -1))
+        if light_id != '-1' and os.path.exists(actor_path):
+            with open(actor_path, 'r') as fa:
+                actors_data = json.load(fa)
+            if light_id in actors_data:
+                frame_data["actors_data"][light_id] = actors_data[light_id]
+        json_data.append(frame_data)
+    return json_data
+
+
+def parse_route(path, frames, dataset_root):
+    processed_data = []
+    dir_path = os.path.join(dataset_root, path)
+
+    if not os.path.isdir(dir_path):
+        raise FileNotFoundError(f"Route path does not exist: {dir_path}")
+
+    town_id = int(re.findall(r'town(\d\d)', dir_path)[0])
+    weather_id = int(re.findall(r'_w(\d+)_', dir_path)[0]) if '_w' in dir_path else 0
+
+    json_data = load_frames(dir_path, frames)
+    if not json_data:
+        return []
+
+    # the rules share one columnar view of the frames
+    table = FrameTable(json_data)
+
+    # the rules sample distances with `random`; seeding per route makes the results independent of the
+    # order routes are processed in (and of the number of workers)
+    random.seed(zlib.crc32(path.encode()))
+    for rule in processing_rules:
+        results = registered_class[rule].process({
+            'data': json_data,
+            'table': table,
+            'town_id': town_id,
+            'weather_id': weather_id
+        })
+        rule_id = rule_id_mapping_dict[rule]
+        for result in results:
+            result.update({
+                'instruction': rule,
+                'instruction_id': rule_id,
+                'town_id': town_id,
+                'weather_id': weather_id,
+                'route_path': path,
+                'route_frames': frames,
+                'bad_case': 'False'
+            })
+            processed_data.append(result)
+
+    return processed_data
+
+
+def print_exception():
+    exc_type, exc_val, exc_tb = sys.exc_info()
+    while exc_tb.tb_next is not None:
+        exc_tb = exc_tb.tb_next
+    exc_file = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+    print({
+        "Error type: ": exc_type,
+        "Error information": exc_val,
+        "Error file": exc_file,
+        "Error line": exc_tb.tb_lineno
+    })
+
+
 def process(line, dataset_root):
     try:
-        processed_data = []
+        path, frames = line.split()
+        return parse_route(path, int(frames.strip()), dataset_root)
+    except Exception:
+        print_exception()
+        return []
+
+
+def process_cached(line, dataset_root, cache_dir=None, version=''):
+    """
+    process() with a per-route result cache in cache_dir (None disables it).
+
+    Returns (results, frames parsed, cached). Failed routes are not cached, so a rerun retries them.
+    """
+    try:
         path, frames = line.split()
         frames = int(frames.strip())
+        if cache_dir is None:
+            return parse_route(path, frames, dataset_root), frames, False
+
+        cache_path = os.path.join(cache_dir, path.strip(os.sep).replace(os.sep, '__') + '.json')
+        key = version + route_fingerprint(os.path.join(dataset_root, path), frames)
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r') as f:
+                cached = json.load(f)
+            if cached['route_path'] == path and cached['key'] == key:
+                return cached['results'], 0, True
+
+        results = parse_route(path, frames, dataset_root)
+        tmp_path = cache_path + '.tmp%d' % os.getpid()
+        with open(tmp_path, 'w') as f:
+            json.dump({'route_path': path, 'key': key, 'results': results}, f)
+        os.replace(tmp_path, cache_path)
+        return results, frames, False
+    except Exception:
+        print_exception()
+        return [], 0, False
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate navigation_instruction_list.txt from dataset_index.txt")
+    parser.add_argument('dataset_root')
+    parser.add_argument('--workers', type=int, default=min(8, os.cpu_count() or 1))
+    parser.add_argument('--cache-dir', default=None, help=f"per-route result cache (default: <dataset_root>/{CACHE_DIR_NAME})")
+    parser.add_argument('--no-cache', action='store_true', help="reparse every route and leave the cache untouched")
+    return parser.parse_args()
 
-        sub_dir = path.split(os.sep)[0]  
-        dir_path = os.path.join(dataset_root, path)
-
-        if not os.path.isdir(dir_path):
-            raise FileNotFoundError(f"Route path does not exist: {dir_path}")
-
-        town_id = int(re.findall(r'town(\d\d)', dir_path)[0])
-        weather_id = int(re.findall(r'_w(\d+)_', dir_path)[0]) if '_w' in dir_path else 0
-
-        json_data = []
-        for frame_id in range(frames):
-            measurement_path = os.path.join(dir_path, 'measurements', f"{frame_id:04d}.json")
-            actor_path = os.path.join(dir_path, 'actors_data', f"{frame_id:04d}.json")
-            if not os.path.exists(measurement_path):
-                continue
-            with open(measurement_path, 'r') as f:
-                frame_data = json.load(f)
-            if os.path.exists(actor_path):
-                with open(actor_path, 'r') as fa:
-                    frame_data["actors_data"] = json.load(fa)
-            json_data.append(frame_data)
-
-        if not json_data:
-            return []
-
-        for rule in processing_rules:
-            results = registered_class[rule].process({
-                'data': json_data,
-                'town_id': town_id,
-                'weather_id': weather_id
-            })
-            rule_id = rule_id_mapping_dict[rule]
-            for result in results:
-                result.update({
-                    'instruction': rule,
-                    'instruction_id': rule_id,
-                    'town_id': town_id,
-                    'weather_id': weather_id,
-                    'route_path': path,
-                    'route_frames': frames,
-                    'bad_case': 'False'
-                })
-                processed_data.append(result)
-
-        return processed_data
-
-    except Exception as e:
-        exc_type, exc_val, exc_tb = sys.exc_info()
-        exc_file = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-        print({
-            "Error type: ": exc_type,
-            "Error information": exc_val,
-            "Error file": exc_file,
-            "Error line": exc_tb.tb_lineno
-        })
-        return []
 
 if __name__ == '__main__':
-    dataset_root = sys.argv[1]
+    args = parse_args()
+    dataset_root = args.dataset_root
     list_file = os.path.join(dataset_root, 'dataset_index.txt')
-    lines = open(list_file, 'r').readlines()
-
-    results_per_line = []
-    for line in tqdm(lines):
-        result = process(line.strip(), dataset_root)
-        results_per_line.append(result)
-
-    with open(os.path.join(dataset_root, 'navigation_instruction_list.txt'), 'w') as f_write:
-        for results in results_per_line:
-            if not results:
-                continue
-            for result in results:
-                f_write.write(json.dumps(result) + '\n')
+    lines = [line.strip() for line in open(list_file, 'r').readlines() if line.strip()]
+
+    cache_dir = None
+    if not args.no_cache:
+        cache_dir = args.cache_dir or os.path.join(dataset_root, CACHE_DIR_NAME)
+        os.makedirs(cache_dir, exist_ok=True)
+    worker = functools.partial(process_cached, dataset_root=dataset_root, cache_dir=cache_dir, version=rules_version())
+
+    output_path = os.path.join(dataset_root, 'navigation_instruction_list.txt')
+    tmp_output_path = output_path + '.tmp'
+    start_time = time.time()
+    parsed_routes = cached_routes = parsed_frames = instructions = 0
+    pool = Pool(args.workers) if args.workers > 1 else None
+    try:
+        # imap keeps the order of dataset_index.txt, results are written as soon as they are in order
+        outputs = pool.imap(worker, lines) if pool is not None else map(worker, lines)
+        with open(tmp_output_path, 'w') as f_write:
+            progress = tqdm(outputs, total=len(lines))
+            for results, frames, cached in progress:
+                if cached:
+                    cached_routes += 1
+                else:
+                    parsed_routes += 1
+                    parsed_frames += frames
+                instructions += len(results)
+                for result in results:
+                    f_write.write(json.dumps(result) + '\n')
+                elapsed = time.time() - start_time
+                progress.set_postfix(cached=cached_routes, instructions=instructions, frames_per_s='%.0f' % (parsed_frames / max(elapsed, 1e-6)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    os.replace(tmp_output_path, output_path)
+
+    elapsed = time.time() - start_time
+    print(f"{len(lines)} routes ({parsed_routes} parsed, {cached_routes} from cache), {instructions} instructions in {elapsed:.1f}s"
+          + (f", {parsed_frames / elapsed:.0f} frames/s" if parsed_frames else ""))
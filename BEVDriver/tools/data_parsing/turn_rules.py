@@ -4,6 +4,10 @@ import random
 random.seed(0)
 from abc import ABC, abstractmethod
 
+import numpy as np
+
+from frame_table import frame_table, next_index, closest_distance_start
+
 class Turn(ABC):
     def __init__(self):
         self.max_range = 512  # Maximum frame length of turning instruction data clip
@@ -11,25 +15,7 @@ class Turn(ABC):
     @abstractmethod
     def choose_start(self, index, frames, distance):
         """ Choose start point of data clip that has instruction with distance"""
-        start = None
-        if index == None:
-            return start
-        initial_frame = frames[index]
-        difference_min = float('inf')
-
-        for i in range(min(index, self.max_range)):
-            frame = frames[index - i]
-            dist = math.sqrt(pow(initial_frame["x"]-frame["x"], 2) + pow(initial_frame["y"]-frame["y"], 2))
-            if abs(dist - distance) < difference_min:
-                difference_min = abs(dist-distance)
-                index_min = i
-            elif difference_min < 2:
-                break
-        
-        if difference_min < 2:
-            start = index - index_min
-
-        return start     
+        return closest_distance_start(frames, index, distance, max_range=self.max_range)
 
     @abstractmethod
     def turn_end(self, frame):
@@ -47,6 +33,14 @@ class Turn(ABC):
             start = None
         return start
 
+    def turn_exit(self, frames, index, command):
+        """ First frame from index on with another command than the turn's and not turn_end, else the last frame"""
+        exits = frames.indices(("turn_exit", command), lambda: (frames.command != command) & ~frames.turn_end)
+        end = next_index(exits, index)
+        if end is None:
+            end = len(frames) - 1
+        return end
+
 class Turn01(Turn):
     def __init__(self, direction, dis=False):
         super().__init__()
@@ -68,29 +62,12 @@ class Turn01(Turn):
 
     def sample_frame(self, index, frames):
         start = index
-        frame_range = min(start+self.total_range, len(frames))
-        end = frame_range - 1
         distance = 2 + 18*random.random()
         instruction_args = []
-        
-        for i in range(start, frame_range):
-            frame = frames[i]
-            command = frame["command"]
-            if command == self.direction_command_mapping[self.direction]:  # Endpoint of the sampling
-                continue
-            if self.turn_end(frame):
-                continue
-            end = i
-            if end - start > self.max_range:
-                start = self.skip_red_light(frames, start, end)
-            if self.dis == False:
-                return start, end, instruction_args
-            start = self.choose_start(start, frames, distance)
-            instruction_args.append(round(distance))
-            return start, end, instruction_args
-
+        # Endpoint of the sampling
+        end = self.turn_exit(frames, start, self.direction_command_mapping[self.direction])
         if end - start > self.max_range:
-            start = self.skip_red_light(frames, start, end)        
+            start = self.skip_red_light(frames, start, end)
         if self.dis == False:
             return start, end, instruction_args
         start = self.choose_start(start, frames, distance)
@@ -120,12 +97,14 @@ class Turn01(Turn):
 
     def process(self, data):
         results = []
-        frames = data["data"]
-        frame_num = len(frames)
-        index = 15
-        while index < frame_num :
+        frames = frame_table(data)
+        command = self.direction_command_mapping[self.direction]
+        # add_result only samples a clip at frames with the turn's command, jump from one to the next
+        candidates = frames.indices(("command", command), lambda: frames.command == command)
+        index = next_index(candidates, 15)
+        while index is not None:
             index = self.add_result(results, index, frames)
-            index = index + 1
+            index = next_index(candidates, index + 1)
         return results
 
 class Turn02(Turn):
@@ -150,29 +129,12 @@ class Turn02(Turn):
 
     def sample_frame(self, index, frames):
         start = index
-        frame_range = min(start+self.total_range, len(frames))
-        end = frame_range - 1
         distance = 2 + 18*random.random()
         instruction_args = []
-        
-        for i in range(start, frame_range):
-            frame = frames[i]
-            command = frame["command"]
-            if command == self.direction_command_mapping[self.direction]:  # Endpoint of the sampling
-                continue
-            if self.turn_end(frame):
-                continue
-            end = i
-            if end - start > self.max_range:
-                start = self.skip_red_light(frames, start, end)
-            if self.dis == False:
-                return start, end, instruction_args
-            start = self.choose_start(start, frames, distance)
-            instruction_args.append(round(distance))
-            return start, end, instruction_args
-
+        # Endpoint of the sampling
+        end = self.turn_exit(frames, start, self.direction_command_mapping[self.direction])
         if end - start > self.max_range:
-            start = self.skip_red_light(frames, start, end)        
+            start = self.skip_red_light(frames, start, end)
         if self.dis == False:
             return start, end, instruction_args
         start = self.choose_start(start, frames, distance)
@@ -209,15 +171,18 @@ class Turn02(Turn):
 
     def process(self, data):
         results = []
-        frames = data["data"]
         town_id = data["town_id"]
         if self.townid_loc_mapping[str(town_id)] == None:
             return results
-        frame_num = len(frames)
-        index = 15
-        while index < frame_num :
+        frames = frame_table(data)
+        command = self.direction_command_mapping[self.direction]
+        # add_result only samples a clip at frames with the turn's command within 35m of a junction
+        town_loc = self.townid_loc_mapping[str(town_id)]
+        candidates = np.flatnonzero((frames.command == command) & frames.near_any(town_loc, 35))
+        index = next_index(candidates, 15)
+        while index is not None:
             index = self.add_result(results, index, frames, town_id)
-            index = index + 1
+            index = next_index(candidates, index + 1)
         return results
 
 class Turn03(Turn):
@@ -241,31 +206,14 @@ class Turn03(Turn):
 
     def sample_frame(self, index, frames):
         start = index
-        frame_range = min(start+self.total_range, len(frames))
-        end = frame_range - 1
         distance = 2 + 18*random.random()
         instruction_args = []
-        
-        for i in range(start, frame_range):
-            frame = frames[i]
-            command = frame["command"]
-            if command == self.direction_command_mapping[self.direction]:  # Endpoint of the sampling
-                continue
-            if self.turn_end(frame):
-                continue
-            end = i
-            if end - start > self.max_range:
-                start = self.skip_red_light(frames, start, end)
-            if self.dis == False:
-                return start, end, instruction_args
-            start = self.choose_start(start, frames, distance)
-            instruction_args.append(round(distance))
-            return start, end, instruction_args
-
+        # Endpoint of the sampling
+        end = self.turn_exit(frames, start, self.direction_command_mapping[self.direction])
         if end - start > self.max_range:
             start = self.skip_red_light(frames, start, end)
         if self.dis == False:
-            return start, end, instruction_args        
+            return start, end, instruction_args
         start = self.choose_start(start, frames, distance)
         instruction_args.append(round(distance))
         return start, end, instruction_args
@@ -302,12 +250,14 @@ class Turn03(Turn):
 
     def process(self, data):
         results = []
-        frames = data["data"]
-        frame_num = len(frames)
-        index = 15
-        while index < frame_num :
+        frames = frame_table(data)
+        command = self.direction_command_mapping[self.direction]
+        # add_result only samples a clip at frames with the turn's command within 40m of the affecting light
+        candidates = np.flatnonzero((frames.command == command) & ~(frames.light_distance > 40))
+        index = next_index(candidates, 15)
+        while index is not None:
             index = self.add_result(results, index, frames)
-            index = index +1
+            index = next_index(candidates, index + 1)
         return results
 
 class Turn04(Turn):
@@ -340,32 +290,15 @@ class Turn04(Turn):
 
     def sample_frame(self, index, frames):
         start = index
-        frame_range = min(start+self.total_range, len(frames))
-        end = frame_range - 1
         distance = 2 + 18*random.random()
         instruction_args = []
-        
-        for i in range(start, frame_range):
-            frame = frames[i]
-            command = frame["command"]
-            if command == self.direction_command_mapping[self.direction]:  # Endpoint of the sampling
-                continue
-            if self.turn_end(frame):
-                continue
-            end = i
-            if end - start > self.max_range:
-                start = self.skip_red_light(frames, start, end)
-            if self.dis == False:
-                return start, end, instruction_args
-            start = self.choose_start(start, frames, distance)
-            instruction_args.append(round(distance))
-            return start, end, instruction_args
-
+        # Endpoint of the sampling
+        end = self.turn_exit(frames, start, self.direction_command_mapping[self.direction])
         if end - start > self.max_range:
             start = self.skip_red_light(frames, start, end)
         if self.dis == False:
-            return start, end, instruction_args        
-        start = self.choose_start(start, frames,distance)
+            return start, end, instruction_args
+        start = self.choose_start(start, frames, distance)
         instruction_args.append(round(distance))
         return start, end, instruction_args
 
@@ -399,13 +332,16 @@ class Turn04(Turn):
 
     def process(self, data):
         results = []
-        frames = data["data"]
+        frames = frame_table(data)
         town_id = data["town_id"]
-        frame_num = len(frames)
-        index = 15
-        while index < frame_num :
+        command = self.direction_command_mapping[self.direction]
+        # add_result only samples a clip at frames with the turn's command inside the range of an intersection
+        town_loc = self.townid_loc_mapping[str(town_id)]
+        candidates = np.flatnonzero((frames.command == command) & frames.near_any(town_loc))
+        index = next_index(candidates, 15)
+        while index is not None:
             index = self.add_result(results, index, frames, town_id)
-            index = index + 1
+            index = next_index(candidates, index + 1)
         return results
 
 class Turn05(Turn):
@@ -427,10 +363,12 @@ class Turn05(Turn):
 
     def sample_frame(self, index, frames, no_in):
         start = index
-        frame_range = min(start+self.total_range, len(frames))
         end = None
         instruction_args = []
-        for i in range(start, frame_range):
+        # the first frame near an exit decides which exit the vehicle took
+        exits = frames.indices("island_out", lambda: frames.near_any(self.island_out, 5))
+        i = next_index(exits, start)
+        if i is not None:
             frame = frames[i]
             for no_out in range(4):
                 if math.sqrt(pow(self.island_out[no_out][0]-frame["x"], 2)+pow(self.island_out[no_out][1]-frame["y"], 2))>5:
@@ -468,15 +406,16 @@ class Turn05(Turn):
 
     def process(self, data):
         results = []
-        frames = data["data"]
         town_id = data["town_id"]
         if town_id != 3:
             return results
-        frame_num = len(frames)
-        index = 15
-        while index < frame_num :
+        frames = frame_table(data)
+        # add_result only samples a clip at frames near an entry of the roundabout
+        candidates = frames.indices("island_in", lambda: frames.near_any(self.island_in, 5))
+        index = next_index(candidates, 15)
+        while index is not None:
             index = self.add_result(results, index, frames)
-            index = index + 1
+            index = next_index(candidates, index + 1)
         return results
 
 class Turn06(Turn):
@@ -498,42 +437,25 @@ class Turn06(Turn):
         return start
 
     def choose_end(self, index, frames):
-        frame_range = len(frames)
-        end = frame_range - 1
-
-        for i in range(index, frame_range):
-            frame = frames[i]
-            command = frame["command"]
-            if command == self.direction_command_mapping[self.second_direction]:
-                continue
-            if self.turn_end(frame):
-                continue
-            end = i
-            return end
-        
-        return end
+        return self.turn_exit(frames, index, self.direction_command_mapping[self.second_direction])
 
     def sample_frame(self, index, frames):
         start = index
-        frame_range = min(start+self.total_range, len(frames))
         end = None
         instruction_args = []
-        flag = False
-        
-        for i in range(start, frame_range):
-            frame = frames[i]
-            command = frame["command"]
-            if command != self.direction_command_mapping[self.first_direction]:  # First turn end
-                flag = True
-            if flag == False:
-                continue
-            if command < 1 or command > 3:
-                continue
-            if command != self.direction_command_mapping[self.second_direction]:
-                return start, end, instruction_args
-            end = self.choose_end(i, frames)
+        first_command = self.direction_command_mapping[self.first_direction]
+        # First turn end
+        first_end = next_index(frames.indices(("command!=", first_command), lambda: frames.command != first_command), start)
+        if first_end is None:
             return start, end, instruction_args
-        
+        # the next turn command (1-3) from there on
+        turns = frames.indices("turn_command", lambda: (frames.command >= 1) & (frames.command <= 3))
+        i = next_index(turns, first_end)
+        if i is None:
+            return start, end, instruction_args
+        if frames.command[i] != self.direction_command_mapping[self.second_direction]:
+            return start, end, instruction_args
+        end = self.choose_end(i, frames)
         return start, end, instruction_args
 
     def add_result(self, results, index, frames):
@@ -556,12 +478,14 @@ class Turn06(Turn):
 
     def process(self, data):
         results = []
-        frames = data["data"]
-        frame_num = len(frames)
-        index = 15
-        while index < frame_num :
+        frames = frame_table(data)
+        command = self.direction_command_mapping[self.first_direction]
+        # add_result only samples a clip at frames with the first turn's command
+        candidates = frames.indices(("command", command), lambda: frames.command == command)
+        index = next_index(candidates, 15)
+        while index is not None:
             index = self.add_result(results, index, frames)
-            index = index +1
+            index = next_index(candidates, index + 1)
         return results
 
 class TurnFalse(Turn):
@@ -1,12 +1,24 @@
 import os
 import sys
 import json
+import argparse
+from functools import partial
 from multiprocessing import Pool
 
 from tqdm import tqdm
 from PIL import Image
 import numpy as np
 
+timm_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, timm_path)
+from timm.data.frame_shard import write_frame_shard
+
+'''
+merge the camera views of every frame into rgb_full/%04d.jpg and the per-frame annotations into
+measurements_full/%04d.json. With --pack, rgb_full and lidar of every route are also packed into
+one memory-mappable frames.shard (see timm/data/frame_shard.py); --pack-only skips the merge.
+'''
+
 
 def process(route):
     try:
@@ -49,12 +61,42 @@ def process(route):
         os.system('rm -rf %s' % route)
 
 
+def pack(route, lidar_dtype="float32"):
+    try:
+        frames = len(os.listdir(os.path.join(route, "measurements")))
+        write_frame_shard(route, frames, lidar_dtype)
+    except Exception as e:
+        print(e)
+        print('The folder %s could not be packed' % route)
+
+
+def process_route(route, merge=True, pack_frames=False, lidar_dtype="float32"):
+    if merge:
+        process(route)
+    # process removes broken routes
+    if pack_frames and os.path.exists(route):
+        pack(route, lidar_dtype)
+
+
 if __name__ == "__main__":
-    dataset_root = sys.argv[1]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dataset_root")
+    parser.add_argument("--pack", action="store_true", help="also write frames.shard for every route")
+    parser.add_argument("--pack-only", action="store_true", help="only write frames.shard, rgb_full must exist")
+    parser.add_argument("--lidar-dtype", default="float32", choices=["float32", "float16"])
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    dataset_root = args.dataset_root
     list_file = os.path.join(dataset_root, 'dataset_index.txt')
     routes = []
     for line in open(list_file, "r").readlines():
         path = line.split()[0].strip()
         routes.append(os.path.join(dataset_root, path))
-    with Pool(8) as p:
-        r = list(tqdm(p.imap(process, routes), total=len(routes)))
+    worker = partial(
+        process_route,
+        merge=not args.pack_only,
+        pack_frames=args.pack or args.pack_only,
+        lidar_dtype=args.lidar_dtype,
+    )
+    with Pool(args.workers) as p:
+        r = list(tqdm(p.imap(worker, routes), total=len(routes)))
@@ -6,8 +6,13 @@ from tqdm import tqdm
 from multiprocessing import Pool
 import numpy as np
 
+timm_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, timm_path)
+from timm.data.carla_measurements import save_measurements_array
+
 '''
-merge measurements from all frames into one file
+merge measurements from all frames into one file (measurements_all.json), and write the
+columnar copy used by the datasets (measurements_all.npy)
 '''
 
 def process(route):
@@ -19,6 +24,7 @@ def process(route):
                 open(os.path.join(route, "measurements/%04d.json" % i), 'r')
             ))
         json.dump(measurements, open(os.path.join(route, "measurements_all.json"), 'w'))
+        save_measurements_array(route, measurements)
 
     except Exception as e:
         print(e)
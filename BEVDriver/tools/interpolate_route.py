@@ -8,8 +8,9 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 import carla
-from agents.navigation.global_route_planner import GlobalRoutePlanner
-from agents.navigation.global_route_planner_dao import GlobalRoutePlannerDAO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../leaderboard"))
+from leaderboard.utils.route_graph import interpolate_routes, load_route_graph, map_waypoints
 
 # navigational commands: RoadOption:LEFT and so on
 NV_DICT = {
@@ -22,36 +23,6 @@ NV_DICT = {
 }
 
 
-def interpolate_trajectory(world_map, waypoints_trajectory, hop_resolution=1.0):
-    """
-    Given some raw keypoints interpolate a full dense trajectory to be used by the user.
-    Args:
-        world: an reference to the CARLA world so we can use the planner
-        waypoints_trajectory: the current coarse trajectory
-        hop_resolution: is the resolution, how dense is the provided trajectory going to be made
-    Return:
-        route: full interpolated route both in GPS coordinates and also in its original form.
-    """
-
-    dao = GlobalRoutePlannerDAO(world_map, hop_resolution)
-    grp = GlobalRoutePlanner(dao)
-    grp.setup()
-    # Obtain route plan
-    route = []
-    for i in range(
-        len(waypoints_trajectory) - 1
-    ):  # Goes until the one before the last.
-
-        waypoint = waypoints_trajectory[i]
-        waypoint_next = waypoints_trajectory[i + 1]
-        interpolated_trace = grp.trace_route(waypoint, waypoint_next)
-        for wp_tuple in interpolated_trace:
-            route.append((wp_tuple[0].transform, wp_tuple[1]))
-            # print (wp_tuple[0].transform.location, wp_tuple[1])
-
-    return route
-
-
 def parse_routes_file(route_filename, single_route=None):
     """
     Returns a list of route elements that is where the challenge is going to happen.
@@ -99,22 +70,29 @@ def main(args):
     waypoint_threshold = args.wp_threshold
     nv_cnt = [0] * 7  # total 6 navigational commands [1,6]
 
-    for index, route in enumerate(routes_list):
-        if (
-            index == 0
-            or routes_list[index]["town_name"] != routes_list[index - 1]["town_name"]
-        ):
-            world = client.load_world(route["town_name"])
-            world_map = world.get_map()
-        interpolated_route = interpolate_trajectory(world_map, route["trajectory"])
-        # print ('interpolated route {} from {} waypoints to {} waypoints'.format(route['id'],
-        # 									len(route['trajectory']), len(interpolated_route)))
-        total_waypoints += len(interpolated_route)
-        if len(interpolated_route) >= waypoint_threshold:
-            anomaly.append(route["id"])
-            continue
-        for waypoint in interpolated_route:
-            nv_cnt[waypoint[1].value] += 1
+    routes_by_town = {}
+    for route in routes_list:
+        routes_by_town.setdefault(route["town_name"], []).append(route)
+
+    for town_name, routes in routes_by_town.items():
+        world = client.load_world(town_name)
+        # the route graph of the town, set up once, and the routes interpolated on it in worker processes
+        world_map = world.get_map()
+        graph = load_route_graph(world_map)
+        # the keypoints are looked up on the map here, the workers have the graph only
+        trajectories = [route["trajectory"] for route in routes]
+        interpolated_routes = interpolate_routes(
+            graph.filename, trajectories, args.processes, map_waypoints(world_map, trajectories)
+        )
+        for route, interpolated_route in zip(routes, interpolated_routes):
+            # print ('interpolated route {} from {} waypoints to {} waypoints'.format(route['id'],
+            # 									len(route['trajectory']), len(interpolated_route)))
+            total_waypoints += len(interpolated_route)
+            if len(interpolated_route) >= waypoint_threshold:
+                anomaly.append(route["id"])
+                continue
+            for waypoint in interpolated_route:
+                nv_cnt[waypoint[1].value] += 1
 
     print("found anomalies in routes ids: ", anomaly)
 
@@ -138,6 +116,13 @@ if __name__ == "__main__":
         help="file containing the route waypoints",
     )
     parser.add_argument("--wp_threshold", type=int, required=False, default=1e10)
+    parser.add_argument(
+        "--processes",
+        type=int,
+        required=False,
+        default=None,
+        help="worker processes interpolating the routes, all the CPUs by default",
+    )
 
     args = parser.parse_args()
 
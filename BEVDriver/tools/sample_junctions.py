@@ -3,45 +3,15 @@ import sys
 import json
 import time
 import argparse
-import multiprocessing
 import lxml.etree as ET
 
 import numpy as np
 import matplotlib.pyplot as plt
 
 import carla
-from agents.navigation.global_route_planner import GlobalRoutePlanner
-from agents.navigation.global_route_planner_dao import GlobalRoutePlannerDAO
-from agents.navigation.local_planner import RoadOption
 
-
-def interpolate_trajectory(world_map, waypoints_trajectory, hop_resolution=1.0):
-    """
-    Given some raw keypoints interpolate a full dense trajectory to be used by the user.
-    Args:
-        world: an reference to the CARLA world so we can use the planner
-        waypoints_trajectory: the current coarse trajectory
-        hop_resolution: is the resolution, how dense is the provided trajectory going to be made
-    Return:
-        route: full interpolated route both in GPS coordinates and also in its original form.
-    """
-
-    dao = GlobalRoutePlannerDAO(world_map, hop_resolution)
-    grp = GlobalRoutePlanner(dao)
-    grp.setup()
-    # Obtain route plan
-    route = []
-    for i in range(
-        len(waypoints_trajectory) - 1
-    ):  # Goes until the one before the last.
-
-        waypoint = waypoints_trajectory[i]
-        waypoint_next = waypoints_trajectory[i + 1]
-        interpolated_trace = grp.trace_route(waypoint, waypoint_next)
-        for wp_tuple in interpolated_trace:
-            route.append((wp_tuple[0].transform, wp_tuple[1]))
-
-    return route
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../leaderboard"))
+from leaderboard.utils.route_graph import RoadOption, interpolate_routes, load_route_graph, map_waypoints
 
 
 def parse_routes_file(route_filename, single_route=None):
@@ -81,11 +51,11 @@ def parse_routes_file(route_filename, single_route=None):
     return list_route_descriptions
 
 
-def sample_junctions(world_map, route):
+def sample_junctions(graph, route):
     """
     Sample individual junctions from the interpolated routes
     Args:
-        world_map: town map
+        graph: route graph of the town
         route: interpolated route
     Return:
         custom_routes: list of (start wp, end wp) each representing an individual junction
@@ -117,7 +87,7 @@ def sample_junctions(world_map, route):
                     z=route[end_id][0].location.z,
                 )
                 waypoint_list = [start_wp, end_wp]
-                extended_route = interpolate_trajectory(world_map, waypoint_list)
+                extended_route = graph.interpolate(waypoint_list)
                 if len(extended_route) >= 100 or len(extended_route) == 1:
                     start_id = -1
                     end_id = -1
@@ -143,9 +113,8 @@ def sample_junctions(world_map, route):
     return custom_routes
 
 
-def process_route(world_map, route, return_dict):
-    interpolated_route = interpolate_trajectory(world_map, route["trajectory"])
-    wp_list = sample_junctions(world_map, interpolated_route)
+def process_route(graph, route, interpolated_route, return_dict):
+    wp_list = sample_junctions(graph, interpolated_route)
     print(
         "got {} junctions in interpolated route {} from {} waypoints to {} waypoints".format(
             len(wp_list), route["id"], len(route["trajectory"]), len(interpolated_route)
@@ -166,26 +135,26 @@ def main(args):
 
     routes_list = parse_routes_file(args.routes_file)
 
-    manager = multiprocessing.Manager()
-    return_dict = manager.dict()
-    jobs = []
+    return_dict = {}
 
     st = time.time()
-    for index, route in enumerate(routes_list):
-        if (
-            index == 0
-            or routes_list[index]["town_name"] != routes_list[index - 1]["town_name"]
-        ):
-            world = client.load_world(route["town_name"])
-            world_map = world.get_map()
-        p = multiprocessing.Process(
-            target=process_route, args=(world_map, route, return_dict)
+    routes_by_town = {}
+    for route in routes_list:
+        routes_by_town.setdefault(route["town_name"], []).append(route)
+
+    for town_name, routes in routes_by_town.items():
+        world = client.load_world(town_name)
+        # the route graph of the town, set up once, and the routes interpolated on it in worker processes
+        world_map = world.get_map()
+        graph = load_route_graph(world_map)
+        # the keypoints are looked up on the map here, the workers have the graph only
+        trajectories = [route["trajectory"] for route in routes]
+        interpolated_routes = interpolate_routes(
+            graph.filename, trajectories, args.processes, map_waypoints(world_map, trajectories)
         )
-        jobs.append(p)
-        p.start()
+        for route, interpolated_route in zip(routes, interpolated_routes):
+            process_route(graph, route, interpolated_route, return_dict)
 
-    for process in jobs:
-        process.join()
     print(
         "{} routes processed in {} seconds".format(len(return_dict), time.time() - st)
     )
@@ -253,6 +222,13 @@ if __name__ == "__main__":
         default=None,
         help="xml file path to save the route waypoints",
     )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        required=False,
+        default=None,
+        help="worker processes interpolating the routes, all the CPUs by default",
+    )
 
     args = parser.parse_args()
 